@@ -0,0 +1,67 @@
+# Compare one frame per sample against batch frames.
+import benchutil  # also puts common/ on sys.path
+import psgframe
+from sampler import SampleBuffer
+
+SERIAL_RAW = b"\x34\xb7\xda\x59\xd6\x20"
+MACHINE_TYPE = "Generic ESP32S3 module with ESP32S3"
+RGB = (12, 200, 34)
+SAMPLES = 1200  # e.g. 20 minutes at one sample per second
+MACHINE_EXT = ((psgframe.T_MACHINE, MACHINE_TYPE),)
+
+
+def single_frames():
+    frames = []
+    for seq in range(SAMPLES):
+        ext = MACHINE_EXT if seq % 16 == 0 else None
+        frames.append(psgframe.encode_telemetry(seq, SERIAL_RAW, 1, 46.5, 99, RGB, ext))
+    return frames
+
+
+def batch_frames():
+    buf = SampleBuffer(None, 60000, len(psgframe.encode_tlv(*MACHINE_EXT[0])))
+    frames = []
+    for i in range(SAMPLES):
+        # simulated clock, one sample per second
+        if buf.add(46.5, 99, RGB, now=i * 1000):
+            seq = len(frames)
+            frames.append(buf.encode(seq, SERIAL_RAW, 1, MACHINE_EXT if seq % 16 == 0 else None,
+                                     now=i * 1000))
+    if len(buf):
+        frames.append(buf.encode(len(frames), SERIAL_RAW, 1, None, now=SAMPLES * 1000))
+    return frames
+
+
+def main():
+    single = single_frames()
+    batch = batch_frames()
+    print("capacity          {:3d} samples per frame".format(psgframe.batch_capacity()))
+    print("single  {:5d} frames {:7d} bytes".format(len(single), sum(map(len, single))))
+    print("batch   {:5d} frames {:7d} bytes".format(len(batch), sum(map(len, batch))))
+
+    # Every sample must come back out of the batches, oldest first
+    records = [r for frame in batch for r in psgframe.decode_records(frame)]
+    assert len(records) == SAMPLES
+    assert records[0]["rgb"] == RGB and records[0]["temp"] == 46.5
+    assert records[0]["age_ms"] > records[1]["age_ms"]
+
+    full = batch[1]
+    one = single[1]
+    n = len(psgframe.decode_records(full))
+    benchutil.bench("encode_telemetry (1 sample)", lambda: psgframe.encode_telemetry(
+        1, SERIAL_RAW, 1, 46.5, 99, RGB))
+    benchutil.bench("SampleBuffer fill + encode ({})".format(n), lambda: batch_fill(n), 1000)
+    benchutil.bench("decode_records single", lambda: psgframe.decode_records(one))
+    benchutil.bench("decode_records batch ({})".format(n), lambda: psgframe.decode_records(full), 1000)
+
+
+_buf = SampleBuffer()
+
+
+def batch_fill(n):
+    for i in range(n):
+        _buf.add(46.5, 99, RGB, now=i)
+    return _buf.encode(1, SERIAL_RAW, 1, None, now=n)
+
+
+main()
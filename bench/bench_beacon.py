@@ -0,0 +1,72 @@
+# Fixed 5 s beacons against the adaptive BeaconScheduler (common/beacon.py)
+# over a simulated hour: 20 transmitters boot in the first two minutes, then
+# one new transmitter every ten minutes. Transmitters listen passively and
+# pair on the first beacon they hear; the receiver kicks the scheduler when
+# it hears from a new one.
+import random
+
+import benchutil  # also puts common/ on sys.path
+from beacon import BeaconScheduler
+
+HOUR_MS = 3600 * 1000
+MAC = b"\x34\xb7\xda\x59\xd6\x20"
+
+
+class CountingESPNow:
+    def __init__(self):
+        self.frames = 0
+
+    def send(self, mac, msg, sync=True):
+        self.frames += 1
+        return True
+
+
+def arrivals(seed=1):
+    rnd = random.Random(seed)
+    times = [rnd.randrange(0, 120000) for _ in range(20)]
+    times += [600000 * i + rnd.randrange(0, 60000) for i in range(1, 6)]
+    return sorted(times)
+
+
+def simulate(min_ms, max_ms, kicks=True):
+    sched = BeaconScheduler(CountingESPNow(), MAC, "PsGadget-CT", None, min_ms, max_ms)
+    pending = arrivals()
+    listening = []
+    latencies = []
+    now = sched._next
+    start = now
+    while now - start < HOUR_MS:
+        sent = sched.sent
+        wait = sched.step(now)
+        if sched.sent > sent:
+            # Everyone listening hears this beacon and pairs
+            latencies += [now - t for t in listening]
+            if listening and kicks:
+                sched.kick(now)
+                wait = sched.step(now)
+            listening = []
+        if pending and pending[0] - start <= now - start + wait:
+            now = start + pending.pop(0)
+            listening.append(now)
+        else:
+            now += wait
+    return sched, latencies
+
+
+def report(name, sched, latencies):
+    print("{:<22} {:5d} beacons {:8.1f} ms airtime  pairing wait mean {:6.0f} ms, max {:6.0f} ms".format(
+        name, sched.sent, sched.airtime_us / 1000, sum(latencies) / len(latencies), max(latencies)))
+
+
+def main():
+    fixed, fixed_lat = simulate(5000, 5000, kicks=False)
+    adaptive, adaptive_lat = simulate(500, 15000)
+    report("fixed 5 s", fixed, fixed_lat)
+    report("adaptive 0.5-15 s", adaptive, adaptive_lat)
+    print("adaptive stats:", adaptive.stats())
+    assert adaptive.sent < fixed.sent
+
+    benchutil.bench("BeaconScheduler.send (cached bytes)", adaptive.send)
+
+
+main()
@@ -0,0 +1,167 @@
+# Clock sync (clocksync.py) and per hop latency tracing.
+#
+# 1. Estimator accuracy: a transmitter whose crystal runs off by some ppm
+#    hears the receiver's beacons (intervals doubling from 500 ms to 15 s,
+#    some lost, 1-3 ms on the way) and stamps frames with ClockEstimator's
+#    time. Prints the error of those stamps against the reference over an
+#    hour, with offset only (window 1) and with drift estimated, and after
+#    HOLDOVER_MS without a beacon (out of range, beacons lost).
+# 2. End to end: the bidirectional receiver and N transmitters on the
+#    simulated radio, the host sets the receiver's clock over the UART stub
+#    ("time"), transmitters pick it up from the beacons and the host side
+#    (psgadget_ingest.parse_record / PortStats) turns the t= and rx= fields
+#    of the lines into per hop latencies. The simulation has one clock for
+#    everything, so these are the true latencies plus the sync error.
+#
+#   python3 bench/bench_clocksync.py
+import random
+import sys
+
+import benchutil
+
+benchutil.use_stubs()
+sys.path.insert(0, "host")
+
+import uasyncio as asyncio  # noqa: E402
+from clocksync import ClockEstimator  # noqa: E402
+from simradio import Air  # noqa: E402
+from ticks import ticks_ms  # noqa: E402
+from psgadget_ingest import PortStats, parse_record  # noqa: E402
+
+RX_SCRIPT = "receiver/autoconnect_gadget_receiver_bidirectional_uart.py"
+TX_SCRIPT = "transmitter/autoconnect_gadget_transmitter.py"
+EPOCH_MS = 1760000000000   # reference time at the start of the runs
+HOUR_MS = 3600000
+HOLDOVER_MS = 600000
+BEACON_MIN_MS, BEACON_MAX_MS = 500, 15000
+BEACON_LOSS = 0.05
+DRIFTS_PPM = (0, 20, 100)
+WINDOWS = (1, 8)
+NODES = 10
+SEND_INTERVAL_MS = 500
+RUN_MS = 5000
+CHANNEL = 6
+LATENCY_MS = 2
+
+
+def quiet(*args, **kwargs):
+    pass
+
+
+def percentile(values, p):
+    return values[min(int(len(values) * p), len(values) - 1)] if values else None
+
+
+def estimator_errors(drift_ppm, window, seed=1):
+    """|stamp - reference| in ms, sampled every second after the first minute,
+    and HOLDOVER_MS after the last beacon."""
+    rng = random.Random(seed)
+    estimator = ClockEstimator(window)
+    local0 = rng.randrange(1 << 20)
+
+    def local(t):
+        return local0 + int(t * (1 + drift_ppm / 1000000))
+
+    beacons = []
+    t, interval = 0, BEACON_MIN_MS
+    while t < HOUR_MS:
+        if rng.random() >= BEACON_LOSS:
+            beacons.append((t + rng.uniform(1, 3), t))
+        t += interval
+        interval = min(interval * 2, BEACON_MAX_MS)
+    errors = []
+    i = 0
+    for t in range(0, HOUR_MS, 1000):
+        while i < len(beacons) and beacons[i][0] <= t:
+            arrived, sent = beacons[i]
+            estimator.add(EPOCH_MS + sent + estimator.delay_ms, local(arrived))
+            i += 1
+        if t >= 60000:
+            errors.append(abs(estimator.now(local(t)) - (EPOCH_MS + t)))
+    errors.sort()
+    t = beacons[-1][0] + HOLDOVER_MS
+    holdover = abs(estimator.now(local(t)) - (EPOCH_MS + int(t)))
+    return errors, holdover, estimator.drift_ppm()
+
+
+def accuracy():
+    print("send time stamps against the reference over an hour, beacons every {}..{} ms, "
+          "{:.0%} lost".format(BEACON_MIN_MS, BEACON_MAX_MS, BEACON_LOSS))
+    print("{:>9} {:>7} {:>7} {:>7} {:>7} {:>9} {:>10}".format(
+        "drift", "window", "p50", "p99", "max", "holdover", "estimated"))
+    for drift in DRIFTS_PPM:
+        for window in WINDOWS:
+            errors, holdover, estimated = estimator_errors(drift, window)
+            print("{:>5} ppm {:>7} {:>5}ms {:>5}ms {:>5}ms {:>7}ms {:>6} ppm".format(
+                drift, window, percentile(errors, 0.5), percentile(errors, 0.99), errors[-1],
+                holdover, estimated))
+
+
+def load(air, code, rx_node):
+    node = air.node(channel=CHANNEL)
+    tx = {"__name__": "simtx", "__file__": TX_SCRIPT, "print": quiet}
+    with air.attach(node):
+        exec(code, tx)
+    tx["pair"](rx_node.mac)
+    tx["esp_now"].add_peer(rx_node.mac)
+    tx["sequence"] = random.getrandbits(16)
+    return node, tx
+
+
+async def transmit(node, tx, stop):
+    """Send every SEND_INTERVAL_MS once the clock is synced, hear beacons in between."""
+    esp, listener = node.esp, tx["listener"]
+    next_send = ticks_ms() + random.randrange(SEND_INTERVAL_MS)
+    while ticks_ms() < stop:
+        while esp.any():
+            listener.handle(*esp.recv())
+        if ticks_ms() >= next_send and tx["clock"].synced:
+            tx["send_message"]()
+            next_send += SEND_INTERVAL_MS
+        await asyncio.sleep_ms(1)  # listen() on the board, beacons are taken as they arrive
+
+
+async def end_to_end(seed=1):
+    random.seed(seed)
+    air = Air(0.02, LATENCY_MS, seed=seed)
+    rx_node = air.node(channel=CHANNEL)
+    with air.attach(rx_node):
+        rx = benchutil.run_script(RX_SCRIPT, {"UART_BAUD": 115200},
+                                  name="simrx", scope={"print": quiet})
+    with open(TX_SCRIPT) as f:
+        code = compile(f.read(), TX_SCRIPT, "exec")
+    txs = [load(air, code, rx_node) for _ in range(NODES)]
+    tasks = [asyncio.create_task(rx["main"]()), asyncio.create_task(air.run())]
+    await asyncio.sleep_ms(20)
+    host_offset = EPOCH_MS - ticks_ms()  # the host's clock, ticks_ms() + host_offset
+    rx["uart"].feed("time {}\n".format(ticks_ms() + host_offset).encode())
+    stop = ticks_ms() + RUN_MS
+    await asyncio.gather(*(transmit(node, tx, stop) for node, tx in txs))
+    await asyncio.sleep_ms(200)
+    for task in tasks:
+        task.cancel()
+    stats = PortStats()
+    stamped = 0
+    for t, line in rx["uart"].lines:
+        record = parse_record(line.decode())
+        if record is not None and "sent_ms" in record:
+            stamped += 1
+            stats.observe(record, t + host_offset)
+    synced = sum(1 for _, tx in txs if tx["clock"].synced)
+    return stamped, synced, stats.latency_report(), rx["metrics"].dump()
+
+
+def main():
+    accuracy()
+    stamped, synced, report, dump = asyncio.run(end_to_end())
+    print("\n{} transmitters ({} synced from beacons), {} stamped lines on the UART".format(
+        NODES, synced, stamped))
+    print("{:<11} {:>6} {:>6} {:>6} {:>6}".format("hop", "count", "p50", "p95", "p99"))
+    for hop, row in report.items():
+        print("{:<11} {:>6} {:>4}ms {:>4}ms {:>4}ms".format(hop, row["count"], row["p50"], row["p95"], row["p99"]))
+    air = [part for part in dump.split() if part.startswith("rx.air_ms=")]
+    print("receiver's own", air[0] if air else "rx.air_ms histogram: none")
+    assert synced == NODES and stamped > 0
+
+
+main()
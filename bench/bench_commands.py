@@ -0,0 +1,106 @@
+# Host command round trip on autoconnect_gadget_receiver_bidirectional_uart.py
+# (UART stub): the host sends "ping <n>" at random moments and waits for
+# "pong <n>". Compares the old reader, which polled the UART every 100 ms,
+# with the link's reader task that sleeps until bytes arrive, and counts
+# how often each wakes up while the host is quiet.
+#
+# The stub's StreamReader checks the UART every millisecond; on the board
+# the reader task sleeps in the scheduler's poll until the UART has data.
+import random
+
+import benchutil
+
+benchutil.use_stubs()
+
+import uasyncio as asyncio  # noqa: E402
+from ticks import ticks_ms, ticks_diff  # noqa: E402
+
+RX_SCRIPT = "receiver/autoconnect_gadget_receiver_bidirectional_uart.py"
+PINGS = 50
+IDLE_MS = 2000
+
+
+def quiet(*args, **kwargs):
+    pass
+
+
+def load_receiver():
+    return benchutil.run_script(RX_SCRIPT, name="simrx", scope={"print": quiet})
+
+
+async def polling_reader(rx, wakeups):
+    """The reader before: poll the link every 100 ms."""
+    while True:
+        wakeups[0] += 1
+        for message in rx["link"].poll(ticks_ms()):
+            rx["on_command"](message)
+        await asyncio.sleep(0.1)
+
+
+async def host(uart, rtts):
+    """Send pings at random moments, time until each pong is on the UART."""
+    for n in range(PINGS):
+        await asyncio.sleep_ms(random.randrange(20, 120))
+        expect = "pong {}".format(n).encode()
+        sent = ticks_ms()
+        seen = len(uart.lines)
+        uart.feed("ping {}\n".format(n).encode())
+        while True:
+            for t, line in uart.lines[seen:]:
+                if line == expect:
+                    rtts.append(ticks_diff(t, sent))
+                    break
+            else:
+                seen = len(uart.lines)
+                await asyncio.sleep_ms(1)
+                continue
+            break
+
+
+async def run(rx, event_driven):
+    rtts = []
+    wakeups = [0]
+    link = rx["link"]
+    if event_driven:
+        reader = asyncio.create_task(link.run(rx["on_command"]))
+    else:
+        reader = asyncio.create_task(polling_reader(rx, wakeups))
+    writer = asyncio.create_task(rx["egress"].run(link.send, link.flush, wait=link.drain))
+    await host(rx["uart"], rtts)
+    if event_driven:
+        await asyncio.sleep_ms(50)
+        wakeups[0] = -link.reader.wakeups
+    else:
+        wakeups[0] = 0
+    await asyncio.sleep_ms(IDLE_MS)
+    if event_driven:
+        wakeups[0] += link.reader.wakeups
+    reader.cancel()
+    writer.cancel()
+    return sorted(rtts), wakeups[0] * 1000 / IDLE_MS
+
+
+def main():
+    random.seed(1)
+    for title, event_driven in (("poll every 100 ms", False), ("stream reader", True)):
+        rx = load_receiver()
+        rtts, idle = asyncio.run(run(rx, event_driven))
+        print("{:<18} round trip p50 {:>4} ms  p99 {:>4} ms  max {:>4} ms  idle wakeups {:>4.1f}/s".format(
+            title, rtts[len(rtts) // 2], rtts[int(len(rtts) * 0.99)], rtts[-1], idle))
+        assert len(rtts) == PINGS
+
+    rx = load_receiver()
+    replies = []
+    table = rx["commands"]
+    table.reply = replies.append
+    for line in ("help", "config", "config rate_limit 5", "config queue_policy nope",
+                 "send 34:b7:da:59:d6:20 ping", "send all ping", "nope"):
+        del replies[:]
+        table.dispatch(line)
+        print("> {:<32} {}".format(line, replies[0] if len(replies) == 1 else "{} lines".format(len(replies))))
+    assert rx["limiter"].rate == 5 and table.stats()["unknown"] == 1 and table.stats()["errors"] == 2
+    benchutil.bench("CommandTable.dispatch status", lambda: table.dispatch("status"), 20000)
+    benchutil.bench("UartLink.feed one command line", lambda: rx["link"].feed(b"status\n", 0), 20000)
+
+
+main()
@@ -0,0 +1,224 @@
+# Deadband (report-by-exception) mode of autoconnect_gadget_transmitter.py
+#
+# 1. Traffic and accuracy: the transmitter script in deadband mode reads a
+#    simulated temperature every DEADBAND_SAMPLE_MS for an hour (steady with
+#    sensor noise, slow drift, short spikes) and its frames are compared
+#    with interval mode (one reading sent every INTERVAL_MS): frames and
+#    airtime per hour, how far the last value the host has is off the true
+#    temperature, and how many spikes show up in the values or the T_AGG
+#    min/max sent along.
+# 2. Liveness: N transmitters with nothing to report (heartbeats only) go
+#    through the bidirectional receiver's handle_frame with frames lost on
+#    the way, some stop at half time. Counts the gone events for
+#    transmitters that were fine (false alarms) and how long after the stop
+#    the real ones were reported, on the receiver ("gone <mac>" lines) and
+#    on the host (psgadget_ingest, by serial), for a few loss rates and
+#    heartbeat miss counts.
+#
+#   python3 bench/bench_deadband.py
+import random
+import sys
+
+import benchutil
+
+benchutil.use_stubs()
+sys.path.insert(0, "host")
+
+import psgframe  # noqa: E402
+from beacon import airtime_us  # noqa: E402
+from liveness import Liveness  # noqa: E402
+from psgadget_ingest import parse_liveness, parse_record  # noqa: E402
+
+TX_SCRIPT = "transmitter/autoconnect_gadget_transmitter.py"
+RX_SCRIPT = "receiver/autoconnect_gadget_receiver_bidirectional_uart.py"
+HOUR_MS = 3600000
+SAMPLE_MS = 200          # DEADBAND_SAMPLE_MS
+INTERVAL_MS = 5000       # MESSAGE_SEND_INTERVAL in interval mode
+SPIKE_MS = 2000          # spikes shorter than the send interval
+SPIKE_C = 3.0
+NODES = 100
+RUN_S = 86400            # liveness run
+HEARTBEAT_S = 60
+STOPPED = 10             # transmitters that stop at half time
+LOSSES = (0.01, 0.05)
+MISSES = (2, 3)
+
+
+def quiet(*args, **kwargs):
+    pass
+
+
+class Reading:
+    """Stands in for the esp32 module, mcu_temperature() is the simulated value."""
+
+    def __init__(self):
+        self.value = 0.0
+
+    def mcu_temperature(self):
+        return self.value
+
+
+def traces(seed=1):
+    """name -> (temperature at t ms, spike start times)."""
+    rng = random.Random(seed)
+    noise = [rng.gauss(0, 0.1) for _ in range(HOUR_MS // SAMPLE_MS + 1)]
+    spikes = sorted(rng.randrange(HOUR_MS - SPIKE_MS) for _ in range(20))
+
+    def steady(t):
+        return round(36.0 + noise[t // SAMPLE_MS], 2)
+
+    def drift(t):
+        return round(36.0 + 3 * ((t % HOUR_MS) / HOUR_MS * 2 - 1) ** 2 + noise[t // SAMPLE_MS], 2)
+
+    def spiky(t):
+        spike = any(s <= t < s + SPIKE_MS for s in spikes)
+        return round(36.0 + noise[t // SAMPLE_MS] + (SPIKE_C if spike else 0), 2)
+
+    return {"steady": (steady, []), "drift": (drift, []), "spiky": (spiky, spikes)}
+
+
+def load_transmitter():
+    tx = benchutil.run_script(TX_SCRIPT, {"DEADBAND_MODE": True}, name="simtx", scope={"print": quiet})
+    now = [0]
+    sys.modules["deadband"].ticks_ms = lambda: now[0]  # simulated time for the deadband
+    reading = Reading()
+    tx["esp32"] = reading
+    sent = []
+
+    def radio_send(message):
+        sent.append((now[0], message))
+        tx["sequence"] = (tx["sequence"] + 1) & 0xFFFF
+        return True
+    tx["radio_send"] = radio_send
+    return tx, now, reading, sent
+
+
+def host_view(sent, truth, end_ms):
+    """Errors of the last value received against the truth at every reading."""
+    errors = []
+    i, value = 0, None
+    for t in range(0, end_ms, SAMPLE_MS):
+        while i < len(sent) and sent[i][0] <= t:
+            value = psgframe.decode(sent[i][1])["temp"]
+            i += 1
+        if value is not None:
+            errors.append(abs(truth(t) - value))
+    errors.sort()
+    return errors
+
+
+def spikes_seen(sent, spikes, base=36.0):
+    """Spikes with a received value or aggregate max above half their height."""
+    seen = 0
+    for start in spikes:
+        for t, frame in sent:
+            if start <= t <= start + SPIKE_MS + HEARTBEAT_S * 1000:
+                record = psgframe.decode(frame)
+                high = record["agg"][2] if record["agg"] else record["temp"]
+                if max(high, record["temp"]) > base + SPIKE_C / 2 and t >= start:
+                    seen += 1
+                    break
+    return seen
+
+
+def traffic():
+    tx, now, reading, sent = load_transmitter()
+    print("one transmitter for an hour, readings every {} ms, deadband {} C, heartbeat {} s".format(
+        SAMPLE_MS, tx["DEADBAND_TEMP"], tx["HEARTBEAT_S"]))
+    print("{:<7} {:<9} {:>7} {:>8} {:>9} {:>8} {:>8} {:>7}".format(
+        "trace", "mode", "frames", "bytes", "airtime", "err p50", "err max", "spikes"))
+    for name, (truth, spikes) in traces().items():
+        tx["deadband"] = tx["Deadband"](tx["DEADBAND_TEMP"], tx["DEADBAND_BATTERY"], tx["HEARTBEAT_S"] * 1000)
+        del sent[:]
+        for t in range(0, HOUR_MS, SAMPLE_MS):
+            now[0] = t
+            reading.value = truth(t)
+            tx["watch_reading"]()
+        deadband = list(sent)
+        del sent[:]
+        for t in range(0, HOUR_MS, INTERVAL_MS):
+            now[0] = t
+            reading.value = truth(t)
+            tx["send_message"]((reading.value, "99"))
+        interval = list(sent)
+        for mode, frames in (("interval", interval), ("deadband", deadband)):
+            errors = host_view(frames, truth, HOUR_MS)
+            print("{:<7} {:<9} {:>7} {:>8} {:>7}ms {:>7.2f}C {:>7.2f}C {:>7}".format(
+                name, mode, len(frames), sum(len(f) for _, f in frames),
+                sum(airtime_us(len(f)) for _, f in frames) // 1000,
+                errors[len(errors) // 2], errors[-1],
+                "{}/{}".format(spikes_seen(frames, spikes), len(spikes)) if spikes else "-"))
+    stats = tx["deadband"].stats()
+    assert stats["suppressed"] > 0 and stats["heartbeats"] >= 0, stats
+    return tx
+
+
+def liveness(loss, misses, seed=1):
+    """(false gone events, detection delays ms) for the receiver and the host."""
+    rng = random.Random(seed)
+    rx = benchutil.run_script(RX_SCRIPT, {"HEARTBEAT_MISSES": misses},
+                              name="simrx", scope={"print": quiet})
+    rx["egress"].budget = None
+    host = Liveness(misses)
+    macs = [bytes((0x34, 0xb7, 0xda, 0x59, n >> 8, n & 0xFF)) for n in range(NODES)]
+    serials = [bytes((0x48, 0x27, 0xe2, 0x10, n >> 8, n & 0xFF)) for n in range(NODES)]
+    stopped = set(range(STOPPED))
+    stop_ms = RUN_S * 1000 // 2
+    # Heartbeat frames per second of the run
+    due = {}
+    for n in range(NODES):
+        t = rng.randrange(HEARTBEAT_S * 1000)
+        while t < RUN_S * 1000:
+            if not (n in stopped and t >= stop_ms) and rng.random() >= loss:
+                due.setdefault(t // 1000, []).append((t, n))
+            t += HEARTBEAT_S * 1000
+    seqs = [0] * NODES
+    gone = {"receiver": [], "host": []}  # (t, key)
+
+    def sink(line, kind=None):
+        text = bytes(line).decode()
+        event = parse_liveness(text)
+        if event is not None:
+            return
+        record = parse_record(text)
+        if record is not None:
+            host.heard(record["serial"], record["heartbeat_s"] * 1000, now_ms)
+
+    for second in range(RUN_S):
+        now_ms = second * 1000
+        for t, n in due.get(second, ()):
+            seqs[n] += 1
+            frame = psgframe.encode_telemetry(seqs[n], serials[n], 1, 36.0, 99, None,
+                                              [psgframe.heartbeat_tlv(HEARTBEAT_S)], psgframe.F_HEARTBEAT)
+            rx["pipeline"].frame_ms = t
+            rx["handle_frame"](macs[n], frame)
+        rx["egress"].drain(sink, now_ms, limit=1000)
+        for mac, _ in rx["alive"].expired(now_ms):
+            gone["receiver"].append((now_ms, macs.index(mac)))
+        for serial, _ in host.expired(now_ms):
+            gone["host"].append((now_ms, int(serial[-4:], 16)))
+    out = {}
+    for side, events in gone.items():
+        false = sum(1 for t, n in events if n not in stopped)
+        delays = sorted(t - stop_ms for t, n in events if n in stopped and t >= stop_ms)
+        out[side] = (false, delays, len({n for t, n in events if n in stopped}))
+    return out
+
+
+def main():
+    traffic()
+    print("\n{} transmitters heartbeating every {} s for {} h, {} stop half way".format(
+        NODES, HEARTBEAT_S, RUN_S // 3600, STOPPED))
+    print("{:>5} {:>7} {:<9} {:>12} {:>9} {:>11} {:>11}".format(
+        "loss", "misses", "side", "false gone", "detected", "delay p50", "delay max"))
+    for loss in LOSSES:
+        for misses in MISSES:
+            for side, (false, delays, detected) in liveness(loss, misses).items():
+                print("{:>4.0%} {:>7} {:<9} {:>12} {:>6}/{:<2} {:>10}s {:>10}s".format(
+                    loss, misses, side, false, detected, STOPPED,
+                    delays[len(delays) // 2] // 1000 if delays else "-",
+                    delays[-1] // 1000 if delays else "-"))
+                assert detected == STOPPED
+
+
+main()
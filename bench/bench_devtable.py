@@ -0,0 +1,74 @@
+# Known-device bookkeeping: full file rewrite per packet vs DeviceTable.
+import benchutil
+from devtable import DeviceTable
+
+try:
+    import uos as os
+except ImportError:
+    import os
+
+PATH = "bench_known_devices.txt"
+DEVICES = 50
+PACKETS = 2000
+MACS = [bytes((0x34, 0xb7, 0xda, 0, i >> 8, i & 0xFF)) for i in range(DEVICES)]
+STAMP = "20241109T123924"
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def legacy_update(mac_str, written):
+    # read_known_devices() + write_known_devices() from the old receiver
+    devices = {}
+    try:
+        with open(PATH, "r") as f:
+            for line in f:
+                parts = line.strip().split("|")
+                if len(parts) == 2:
+                    devices[parts[0]] = parts[1]
+    except OSError:
+        pass
+    devices[mac_str] = STAMP
+    with open(PATH, "w") as f:
+        for mac, timestamp in devices.items():
+            written[0] += f.write("{}|{}\n".format(mac, timestamp))
+
+
+def main():
+    remove(PATH)
+    written = [0]
+    mac_strs = ["{:02x}:{:02x}:{:02x}:{:02x}:{:02x}:{:02x}".format(*mac) for mac in MACS]
+    i = [0]
+
+    def legacy():
+        legacy_update(mac_strs[i[0] % DEVICES], written)
+        i[0] += 1
+
+    benchutil.bench("legacy read + rewrite per packet", legacy, PACKETS)
+    legacy_bytes = written[0]
+
+    remove(PATH)
+    table = DeviceTable(PATH, flush_interval_ms=1000, max_dirty=16)
+    i[0] = 0
+
+    def resident():
+        table.touch(MACS[i[0] % DEVICES], STAMP)
+        table.maybe_flush()
+        i[0] += 1
+
+    benchutil.bench("DeviceTable touch + maybe_flush", resident, PACKETS)
+    table.flush()
+    print("flash bytes written, legacy   ", legacy_bytes)
+    print("flash bytes written, devtable ", table.bytes_written, table.stats())
+
+    # The journal must reload to the same table
+    reloaded = DeviceTable(PATH)
+    assert len(reloaded) == DEVICES
+    remove(PATH)
+
+
+main()
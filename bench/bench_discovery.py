@@ -0,0 +1,113 @@
+# Pairing latency of the probe/offer discovery (common/discovery.py) against
+# a simulated radio: receivers on different channels, with and without the
+# receiver cached in flash, compared to waiting for the old 5 s text beacon.
+import os
+import random
+import tempfile
+
+import benchutil
+
+benchutil.use_stubs()
+
+import discovery  # noqa: E402
+import espnow  # noqa: E402  (stubs)
+import network  # noqa: E402
+import psgframe  # noqa: E402
+
+SERIAL_RAW = b"\x01\x02\x03\x04\x05\x06"
+RUNS = 5
+
+
+class SimReceiver:
+    def __init__(self, mac, channel, load=0, reply_ms=3):
+        self.mac = mac
+        self.channel = channel
+        self.load = load
+        self.reply_ms = reply_ms
+
+
+class SimRadio:
+    """Answers probes on the transmitter's current channel like OfferResponder would."""
+
+    def __init__(self, receivers):
+        self.receivers = receivers
+        espnow.on_send = self.on_send
+
+    def on_send(self, esp, mac, msg):
+        probe = psgframe.decode_probe(msg)
+        heard = [r for r in self.receivers if r.channel == network.channel
+                 and (mac == discovery.BROADCAST_MAC or mac == r.mac)]
+        if probe is not None:
+            for r in heard:
+                esp.deliver(r.mac, psgframe.encode_offer(probe[0], r.mac, r.channel, r.load),
+                            r.reply_ms / 1000)
+        # unicast frames are acknowledged only if the receiver is there
+        return bool(heard) or mac == discovery.BROADCAST_MAC
+
+
+def pair(receivers, cache, runs=RUNS, keep_cache=False):
+    """Mean pairing ms over runs, and the last result."""
+    SimRadio(receivers)
+    total = 0
+    for _ in range(runs):
+        if not keep_cache and os.path.exists(cache):
+            os.remove(cache)
+        prober = discovery.Prober(espnow.ESPNow(), network.WLAN(), SERIAL_RAW, 1, cache=cache)
+        result = prober.find()
+        total += prober.last_pairing_ms
+    return total / runs, result, prober
+
+
+def passive_model(runs=10000, beacon_ms=5000, poll_ms=1000):
+    """Expected wait for the old beacon listener: beacon phase plus polling delay."""
+    total = 0
+    for _ in range(runs):
+        heard = random.uniform(0, beacon_ms)
+        total += (heard // poll_ms + 1) * poll_ms
+    return total / runs
+
+
+def main():
+    cache = os.path.join(tempfile.mkdtemp(), "receiver.txt")
+    rx1 = SimReceiver(b"\x34\xb7\xda\x59\xd6\x01", 1)
+    rx11 = SimReceiver(b"\x34\xb7\xda\x59\xd6\x0b", 11)
+
+    print("{:<40} {:>8.0f} ms".format("passive beacon listen (model)", passive_model()))
+
+    ms, result, _ = pair([rx1], cache)
+    assert result == (rx1.mac, 1, 0)
+    print("{:<40} {:>8.1f} ms".format("probe, receiver on channel 1", ms))
+
+    ms, result, _ = pair([rx11], cache)
+    assert result[:2] == (rx11.mac, 11)
+    print("{:<40} {:>8.1f} ms".format("probe, receiver on channel 11", ms))
+
+    ms, result, prober = pair([rx11], cache, keep_cache=True)
+    assert result == (rx11.mac, 11, None) and prober.cache_hits == 1
+    print("{:<40} {:>8.1f} ms".format("cached receiver", ms))
+
+    # Cached receiver gone, the scan finds the other one
+    ms, result, _ = pair([rx1], cache, runs=1, keep_cache=True)
+    assert result[0] == rx1.mac
+    print("{:<40} {:>8.1f} ms".format("stale cache, rescan", ms))
+
+    # Least loaded receiver wins
+    busy = SimReceiver(b"\x34\xb7\xda\x59\xd6\x02", 6, load=40)
+    idle = SimReceiver(b"\x34\xb7\xda\x59\xd6\x03", 6, load=5, reply_ms=8)
+    ms, result, _ = pair([busy, idle], cache, runs=1)
+    assert result[0] == idle.mac
+
+    # No receiver at first: scans back off until one shows up
+    late = SimReceiver(b"\x34\xb7\xda\x59\xd6\x04", 3)
+    receivers = []
+    SimRadio(receivers)
+    os.remove(cache)
+    prober = discovery.Prober(espnow.ESPNow(), network.WLAN(), SERIAL_RAW, 1, cache=cache,
+                              channels=(1, 3, 6, 11), backoff_ms=100)
+    assert prober.find(max_scans=2) is None
+    receivers.append(late)
+    assert prober.find()[0] == late.mac
+    print("{:<40} {:>8d} scans, {} probes".format("late receiver, backoff", prober.scans, prober.probes))
+
+
+main()
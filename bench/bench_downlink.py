@@ -0,0 +1,132 @@
+# Host-to-transmitter commands (downlink.py) on the real
+# autoconnect_gadget_receiver_bidirectional_uart.py and N
+# autoconnect_gadget_transmitter.py instances over the simulated radio
+# (simradio.py). The host writes one "send" command to the UART stub and
+# waits for the "downlink <id> done" summary. Compares:
+#   per device   one "send <mac> ..." command per transmitter, one after the
+#                other (a command and its replies per device, as before)
+#   unicast      one command, unicast fan-out (broadcast_min out of reach)
+#   broadcast    one command to "all": a broadcast, unicast resends to the
+#                transmitters that didn't answer
+# Prints the time to the last summary, frames put on the air, transmitters
+# that ran the command and UART lines sent to the host.
+#
+#   python3 bench/bench_downlink.py           # default node counts
+#   python3 bench/bench_downlink.py 20 400    # these node counts
+import random
+import sys
+
+import benchutil
+
+benchutil.use_stubs()
+
+import uasyncio as asyncio  # noqa: E402  (asyncio + sleep_ms)
+from downlink import mac_str  # noqa: E402
+from simradio import Air  # noqa: E402
+from ticks import ticks_ms, ticks_diff  # noqa: E402
+
+RX_SCRIPT = "receiver/autoconnect_gadget_receiver_bidirectional_uart.py"
+TX_SCRIPT = "transmitter/autoconnect_gadget_transmitter.py"
+NODE_COUNTS = (10, 50, 100, 200)
+COMMAND = "led 0 0 64"
+CHANNEL = 6
+LOSS = 0.05
+LATENCY_MS = 2
+TX_POLL_MS = 5  # transmitters look at their radio this often (listen() on the board)
+TIMEOUT_MS = 10000
+
+
+def quiet(*args, **kwargs):
+    pass
+
+
+def load_receiver(air):
+    node = air.node(channel=CHANNEL)
+    with air.attach(node):
+        rx = benchutil.run_script(RX_SCRIPT, {"UART_BAUD": 115200},
+                                  name="simrx", scope={"print": quiet})
+    return node, rx
+
+
+def load_transmitter(air, rx_node, code):
+    node = air.node(channel=CHANNEL)
+    tx = {"__name__": "simtx", "__file__": TX_SCRIPT, "print": quiet}
+    with air.attach(node):
+        exec(code, tx)
+    tx["pair"](rx_node.mac)
+    tx["esp_now"].add_peer(rx_node.mac)
+    return node, tx
+
+
+async def listen(node, tx):
+    """The transmitter's listen(): run the commands that arrived."""
+    esp, listener = node.esp, tx["listener"]
+    while True:
+        while esp.any():
+            listener.handle(*esp.recv())
+        await asyncio.sleep_ms(TX_POLL_MS)
+
+
+async def command(uart, line):
+    """Send a command, return its "downlink <id> done" line and the UART lines it took."""
+    seen = len(uart.lines)
+    uart.feed(line.encode() + b"\n")
+    prefix = None
+    deadline = ticks_ms() + TIMEOUT_MS
+    while ticks_diff(deadline, ticks_ms()) > 0:
+        for _, reply in uart.lines[seen:]:
+            if reply.startswith(b"error"):
+                raise RuntimeError(reply.decode())
+            if prefix is None and reply.startswith(b"downlink "):
+                prefix = b" ".join(reply.split()[:2]) + b" done"
+            elif prefix is not None and reply.startswith(prefix):
+                return reply.decode(), len(uart.lines) - seen
+        await asyncio.sleep_ms(1)
+    raise RuntimeError("no summary for " + line)
+
+
+async def run(nodes, strategy, seed=1):
+    random.seed(seed)
+    air = Air(LOSS, LATENCY_MS, seed=seed)
+    rx_node, rx = load_receiver(air)
+    with open(TX_SCRIPT) as f:
+        code = compile(f.read(), TX_SCRIPT, "exec")
+    txs = [load_transmitter(air, rx_node, code) for _ in range(nodes)]
+    rx["transmitters"].update(node.mac for node, _ in txs)  # as if heard
+    downlink = rx["downlink"]
+    if strategy == "unicast":
+        downlink.broadcast_min = nodes + 1
+    tasks = [asyncio.create_task(rx["main"]()), asyncio.create_task(air.run())]
+    tasks += [asyncio.create_task(listen(node, tx)) for node, tx in txs]
+    await asyncio.sleep_ms(50)
+    sent, start = air.sent, ticks_ms()
+    if strategy == "per device":
+        lines = 0
+        for node, _ in txs:
+            summary, n = await command(rx["uart"], "send {} {}".format(mac_str(node.mac), COMMAND))
+            lines += n
+    else:
+        summary, lines = await command(rx["uart"], "send all " + COMMAND)
+    elapsed = ticks_diff(ticks_ms(), start)
+    frames = air.sent - sent
+    for task in tasks:
+        task.cancel()
+    ran = sum(1 for _, tx in txs if tx["listener"].applied)
+    return elapsed, frames, ran, lines, summary, downlink.stats()
+
+
+def main():
+    counts = [int(n) for n in sys.argv[1:]] or NODE_COUNTS
+    print("'{}' to every transmitter, {:.0%} radio loss, {} ms latency".format(COMMAND, LOSS, LATENCY_MS))
+    print("{:>5} {:<11} {:>7} {:>7} {:>6} {:>6} {:>7} {:>7}".format(
+        "nodes", "strategy", "ms", "frames", "ran", "lines", "resends", "missing"))
+    for nodes in counts:
+        for strategy in ("per device", "unicast", "broadcast"):
+            elapsed, frames, ran, lines, summary, stats = asyncio.run(run(nodes, strategy))
+            print("{:>5} {:<11} {:>7} {:>7} {:>6} {:>6} {:>7} {:>7}".format(
+                nodes, strategy, elapsed, frames, ran, lines, stats["resends"], stats["missing"]))
+            assert ran <= nodes and stats["acked"] + stats["failed"] + stats["missing"] == nodes
+        print("  last summary:", summary)
+
+
+main()
@@ -0,0 +1,67 @@
+# Egress queue overflow policies (common/egress.py) over a simulated minute:
+# 10 transmitters send two lines a second each, a command reply goes out
+# every second, and the host stops reading for 20 s in the middle (the UART
+# budget stops refilling). Shows what each policy keeps, how deep the queue
+# gets and how long lines and replies wait.
+import benchutil  # also puts common/ on sys.path
+from ratelimit import TokenBucket
+from egress import EgressQueue, POLICIES, P_CONTROL, P_DATA
+
+RUN_MS = 60000
+STALL_MS = (20000, 40000)
+TICK_MS = 10
+UART_BYTES_PER_S = 960
+DEVICES = [bytes([0x34, 0xb7, 0, 0, 0, i]) for i in range(10)]
+LINE = b"PsGadget-IO|34b7da59d621|ESP32S3|21.5|99|rgb(1, 2, 3)"
+
+
+def run(policy):
+    budget = TokenBucket(UART_BYTES_PER_S, 256, now=0)
+    queue = EgressQueue(64, policy, budget)
+    reply_waits = []
+    sent = []
+    for now in range(0, RUN_MS + 10000, TICK_MS):
+        if now < RUN_MS:
+            for i, mac in enumerate(DEVICES):
+                if (now + i * 50) % 500 == 0:
+                    queue.put(LINE, mac, P_DATA, now=now)
+            if now % 1000 == 0:
+                queue.put(b"%d" % now, prio=P_CONTROL, kind=1, now=now)
+        if STALL_MS[0] <= now < STALL_MS[1]:
+            budget.consume(budget.available(now))  # host not reading
+        queue.drain(lambda line, kind=None: sent.append((line, kind)), now, 1000)
+        for line, kind in sent:
+            if kind is not None:
+                reply_waits.append(now - int(line))
+        del sent[:]
+    return queue.stats(), max(reply_waits)
+
+
+def main():
+    print("10 devices x 2 lines/s, host stalls {}-{} s, queue of 64 lines".format(
+        STALL_MS[0] // 1000, STALL_MS[1] // 1000))
+    print("{:<12} {:>6} {:>8} {:>8} {:>9} {:>10} {:>9} {:>10}".format(
+        "policy", "sent", "dropped", "coalesc", "high wtr", "wait mean", "wait max", "reply max"))
+    for policy in POLICIES:
+        stats, reply_max = run(policy)
+        print("{:<12} {:>6} {:>8} {:>8} {:>9} {:>8}ms {:>7}ms {:>8}ms".format(
+            policy, stats["sent"], stats["dropped_oldest"] + stats["dropped_newest"],
+            stats["coalesced"], stats["high_water"], stats["wait_ms_mean"], stats["wait_ms_max"],
+            reply_max))
+        assert stats["high_water"] <= 64
+        assert reply_max <= 20000  # replies overtake queued telemetry once the host reads again
+
+    for policy in POLICIES:
+        queue = EgressQueue(64, policy)
+        for i in range(64):
+            queue.put(LINE, DEVICES[i % 10])
+        it = iter(range(10 ** 7))
+        benchutil.bench("put into a full queue ({})".format(policy),
+                        lambda: queue.put(LINE, DEVICES[next(it) % 10]), 20000)
+    queue = EgressQueue(100000)
+    for i in range(60000):
+        queue.put(LINE, DEVICES[i % 10])
+    benchutil.bench("drain 16 lines", lambda: queue.drain(len), 2000)
+
+
+main()
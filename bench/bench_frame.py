@@ -0,0 +1,49 @@
+# Compare the binary frame format against the legacy pipe text path.
+import benchutil
+import psgframe
+
+SERIAL_RAW = b"\x34\xb7\xda\x59\xd6\x20"
+SERIAL_NUMBER = "34b7da59d620"
+MACHINE_TYPE = "Generic ESP32S3 module with ESP32S3"
+PSGADGET_TYPE = "PsGadget-IO"
+RGB = (12, 200, 34)
+
+
+def legacy_encode():
+    return f"{PSGADGET_TYPE}|{SERIAL_NUMBER}|{MACHINE_TYPE}|{46}|{'99'}|rgb{RGB}".encode("utf-8")
+
+
+def legacy_decode(msg):
+    parts = msg.decode("utf-8").split("|")
+    gadget_type, serial_number, machine_type, cpu_temperature, battery_status, message = parts
+    return tuple(map(int, message[3:].strip("()").split(",")))
+
+
+def binary_encode(seq=5):
+    return psgframe.encode_telemetry(seq, SERIAL_RAW, 1, 46, 99, RGB)
+
+
+def main():
+    legacy = legacy_encode()
+    binary = binary_encode()
+    with_machine = psgframe.encode_telemetry(0, SERIAL_RAW, 1, 46, 99, RGB,
+                                             ((psgframe.T_MACHINE, MACHINE_TYPE),))
+    print("legacy frame      {:3d} bytes".format(len(legacy)))
+    print("binary frame      {:3d} bytes".format(len(binary)))
+    print("binary + machine  {:3d} bytes".format(len(with_machine)))
+
+    # Both formats must decode to the same record
+    assert psgframe.decode(binary)["rgb"] == RGB
+    assert psgframe.decode(legacy)["rgb"] == RGB
+    assert psgframe.decode(with_machine)["machine"] == MACHINE_TYPE
+
+    benchutil.bench("legacy encode", legacy_encode)
+    benchutil.bench("binary encode", binary_encode)
+    benchutil.bench("legacy decode (split + map)", lambda: legacy_decode(legacy))
+    benchutil.bench("psgframe.decode legacy", lambda: psgframe.decode(legacy))
+    benchutil.bench("psgframe.decode binary", lambda: psgframe.decode(binary))
+    benchutil.bench("psgframe.decode binary + to_text",
+                    lambda: psgframe.to_text(psgframe.decode(binary), MACHINE_TYPE))
+
+
+main()
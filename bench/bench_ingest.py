@@ -0,0 +1,81 @@
+# Ingest daemon throughput against pty-backed fake receivers (POSIX only).
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import benchutil  # also puts common/ on sys.path
+
+sys.path.append("host")
+from psgadget_ingest import IngestDaemon  # noqa: E402
+from serialport import PosixSerial  # noqa: E402
+
+PORTS = 4
+RECORDS = 10000
+LINE = b"PsGadget-IO|34b7da59d620|Generic ESP32S3 module with ESP32S3|46|99|rgb(12, 200, 34)\n"
+
+
+def fake_receiver(fd, count, chunk=32):
+    """Write count record lines to the pty master, a few per write."""
+    sent = 0
+    while sent < count:
+        n = min(chunk, count - sent)
+        data = memoryview(LINE * n)
+        while data:
+            try:
+                data = data[os.write(fd, data):]
+            except BlockingIOError:
+                time.sleep(0.0005)
+        sent += n
+
+
+async def run():
+    ptys = [os.openpty() for _ in range(PORTS)]
+    names = [os.ttyname(slave) for _, slave in ptys]
+    log_dir = tempfile.mkdtemp()
+    daemon = IngestDaemon(names, log_dir, opener=PosixSerial)
+    seen = {name: 0 for name in names}
+    first = {}
+    last = {}
+
+    def count(record):
+        port = record["port"]
+        seen[port] += 1
+        first.setdefault(port, time.monotonic())
+        last[port] = time.monotonic()
+        if all(n == RECORDS for n in seen.values()):
+            daemon.stop()
+
+    daemon.subscribe(count)
+    task = asyncio.ensure_future(daemon.run())
+    await asyncio.sleep(0.2)  # let the readers open their ports
+    for master, _ in ptys:
+        os.set_blocking(master, False)
+    writers = [threading.Thread(target=fake_receiver, args=(master, RECORDS)) for master, _ in ptys]
+    start = time.monotonic()
+    for t in writers:
+        t.start()
+    await asyncio.wait_for(task, 120)
+    elapsed = time.monotonic() - start
+    for t in writers:
+        t.join()
+
+    for name in names:
+        print("{:<14} {:>8.0f} records/s".format(name, RECORDS / (last[name] - first[name])))
+    print("aggregate      {:>8.0f} records/s over {} ports".format(PORTS * RECORDS / elapsed, PORTS))
+    logged = 0
+    for path in os.listdir(log_dir):
+        with open(os.path.join(log_dir, path)) as f:
+            logged += sum(1 for _ in f)
+    assert logged == PORTS * RECORDS, logged
+    print("summary", daemon.summary()[names[0]])
+    shutil.rmtree(log_dir)
+    for master, slave in ptys:
+        os.close(master)
+        os.close(slave)
+
+
+asyncio.run(run())
@@ -0,0 +1,59 @@
+# format_jsonmessage(): original str.format version vs JsonEnvelope.
+import json
+import time
+
+import benchutil  # also puts common/ on sys.path
+from jsonenv import JsonEnvelope
+
+try:
+    import ubinascii
+except ImportError:
+    import binascii as ubinascii
+
+MACRAW = b"4\xb7\xdaY\xd6 "
+TX_MAC = b"\x34\xb7\xda\x11\x22\x33"
+MACHINETYPE = "Generic ESP32S3 module with ESP32S3"
+MESSAGE = b'PsGadget-IO|34b7da112233|Generic ESP32S3 module with ESP32S3|46|99|rgb(12, 200, 34)'
+NASTY = b'quote " backslash \\ newline \n tab \t bytes \x00\xff\xb7'
+
+
+def legacy_format_jsonmessage(mac, message):
+    # Body of the original function; uname()/wlan.config()/mcu_temperature()
+    # calls replaced by constants, so this flatters the old path.
+    dt = time.localtime()
+    cdt = "{:04d}{:02d}{:02d}T{:02d}{:02d}{:02d}".format(dt[0], dt[1], dt[2], dt[3], dt[4], dt[5])
+    machinetype = MACHINETYPE
+    macraw = MACRAW
+    mac = ubinascii.hexlify(MACRAW, ":").decode()
+    cputemp = 46
+    accessoryJson = '{{"macraw":"{}","mac":"{}","type":"{}","cputemp":{}}}'.format(macraw, mac, machinetype, cputemp)
+    transmitterJson = '{{"mac":"{}","message":"{}"}}'.format(mac, message)
+    return '{{"datetime":"{}, "accessory":{}, "transmitter":{}}}'.format(cdt, accessoryJson, transmitterJson)
+
+
+def main():
+    try:
+        json.loads(legacy_format_jsonmessage(TX_MAC, bytearray(MESSAGE)))
+        print("legacy output parses")
+    except ValueError as e:
+        print("legacy output is invalid JSON:", e)
+
+    for compact in (False, True):
+        env = JsonEnvelope(MACRAW, MACHINETYPE, compact)
+        env.set_temperature(46)
+        for message in (MESSAGE, NASTY, b""):
+            doc = json.loads(bytes(env.build(TX_MAC, message)))
+            tx = doc["x" if compact else "transmitter"]
+            assert tx["msg" if compact else "message"].encode("latin-1") == message
+            assert tx["m" if compact else "mac"] == "34:b7:da:11:22:33"
+        print("compact" if compact else "full   ", bytes(env.build(TX_MAC, MESSAGE)))
+
+    env = JsonEnvelope(MACRAW, MACHINETYPE)
+    env.set_temperature(46)
+    compact = JsonEnvelope(MACRAW, MACHINETYPE, True)
+    benchutil.bench("legacy format_jsonmessage", lambda: legacy_format_jsonmessage(TX_MAC, MESSAGE))
+    benchutil.bench("JsonEnvelope.build", lambda: env.build(TX_MAC, MESSAGE))
+    benchutil.bench("JsonEnvelope.build compact", lambda: compact.build(TX_MAC, MESSAGE))
+
+
+main()
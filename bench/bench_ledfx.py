@@ -0,0 +1,36 @@
+# LED effects: request cost and NeoPixel writes under bursts of requests.
+import benchutil  # also puts common/ on sys.path
+from ledfx import LedFx, COALESCE, DROP
+
+
+class FakeNeoPixel:
+    def __init__(self):
+        self.pixels = [(0, 0, 0)]
+        self.writes = 0
+
+    def __setitem__(self, index, color):
+        self.pixels[index] = color
+
+    def write(self):
+        self.writes += 1
+
+
+def main():
+    np = FakeNeoPixel()
+    fx = LedFx(np)
+    # Old blink_led() cost a full second of sleep per message
+    benchutil.bench("LedFx.flash request", lambda: fx.flash((0, 0, 20), 1000))
+
+    # A burst of 1000 messages, each asking for a one second flash
+    for policy, name in ((COALESCE, "coalesce"), (DROP, "drop")):
+        np = FakeNeoPixel()
+        fx = LedFx(np, policy=policy)
+        for i in range(1000):
+            fx.flash((0, 0, 20), 1000)
+            fx.step()
+        fx.clear()
+        fx.step()
+        print("{:<9} requests={} coalesced={} dropped={} neopixel writes={}".format(
+            name, fx.requests, fx.coalesced, fx.dropped, np.writes))
+
+main()
@@ -0,0 +1,88 @@
+# Boot-to-first-send time of autoconnect_gadget_transmitter.py in low power
+# mode, cold boot (receiver discovery) against waking from deepsleep with the
+# receiver cached in RTC memory. Runs the real script against the stand-in
+# hardware modules in bench/stubs/.
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+import benchutil
+
+benchutil.use_stubs()
+
+import psgframe  # noqa: E402
+import espnow  # noqa: E402  (stubs)
+import machine  # noqa: E402
+
+SCRIPT = "transmitter/autoconnect_gadget_transmitter.py"
+RECEIVER_MAC = b"\x34\xb7\xda\x59\xd6\x20"
+WAKES = 10
+CACHE = os.path.join(tempfile.mkdtemp(), "receiver.txt")
+
+
+def telemetry():
+    """Sent telemetry frames, without discovery probes."""
+    return [(t, msg) for t, mac, msg in espnow.sent
+            if psgframe.msgtype(msg) in (psgframe.MT_TELEMETRY, psgframe.MT_BATCH)]
+
+
+def boot(settings):
+    """Run the script until it sleeps, returns ms to the first send and the output."""
+    del espnow.sent[:]
+    out = io.StringIO()
+    start = time.monotonic()
+    try:
+        with contextlib.redirect_stdout(out):
+            benchutil.run_script(SCRIPT, settings)
+    except (machine.DeepSleepReset, KeyboardInterrupt):
+        pass
+    sent = telemetry()
+    first = (sent[0][0] - start) * 1000 if sent else None
+    return first, out.getvalue()
+
+
+def main():
+    espnow.beacons[:] = [(RECEIVER_MAC, b"34:b7:da:59:d6:20:PsGadget-CT")]
+    espnow.beacon_delay = 0.5  # receiver broadcasts arrive at some point in its 5 s period
+    deep = {"LOW_POWER_MODE": True, "DEEP_SLEEP": True, "RECEIVER_CACHE": CACHE}
+
+    # Cold boot: nothing in RTC memory or flash, the receiver is found
+    # through its text beacon
+    machine.power_on()
+    cold, _ = boot(deep)
+    warm = [boot(deep)[0] for _ in range(WAKES)]
+    print("cold boot, discovery      {:8.1f} ms to first send".format(cold))
+    print("deepsleep wake, cached    {:8.1f} ms to first send (mean of {})".format(sum(warm) / WAKES, WAKES))
+    assert machine.reset_cause() == machine.DEEPSLEEP_RESET
+    assert all(kind == "deep" for kind, _ in machine.sleeps)
+    assert len(machine.sleeps) == WAKES + 1
+
+    # Sequence numbers carry on across deepsleep
+    seqs = []
+    for _ in range(3):
+        boot(deep)
+        seqs.append(psgframe.decode(telemetry()[-1][1])["seq"])
+    assert seqs[1] == seqs[0] + 1 and seqs[2] == seqs[1] + 1
+
+    # Receiver gone: after PAIRING_MAX_MISSES unacknowledged wakes the
+    # transmitter looks for a receiver again
+    espnow.ack = False
+    outputs = [boot(deep)[1] for _ in range(3)]
+    espnow.ack = True
+    assert "from RTC memory" in outputs[2]
+    assert "looking for a receiver again" in outputs[2]
+    print("receiver gone             rediscovered after 3 unacknowledged wakes")
+
+    # Lightsleep keeps running in the same boot
+    machine.power_on()
+    machine.sleep_budget = 5
+    boot({"LOW_POWER_MODE": True, "DEEP_SLEEP": False, "RECEIVER_CACHE": CACHE})
+    machine.sleep_budget = None
+    sends = len(telemetry())
+    assert sends == 5 and all(kind == "light" for kind, _ in machine.sleeps)
+    print("lightsleep                {} sends, {} sleeps in one boot".format(sends, len(machine.sleeps)))
+
+
+main()
@@ -0,0 +1,175 @@
+# End-to-end scaling: N virtual transmitters (autoconnect_gadget_transmitter.py,
+# one script instance each) against the real autoconnect_gadget_receiver.py
+# over the simulated radio (simradio.py) and the UART stub, which timestamps lines.
+# Each message carries an id in its LED colour, so a line on the UART can be
+# traced back to when it was sent. Prints throughput, drop rate and
+# radio-to-UART latency as the node count grows, and where frames were lost.
+#
+#   python3 bench/bench_mesh.py              # default node counts
+#   python3 bench/bench_mesh.py 20 400       # these node counts
+#
+# Transmitters are paired with the receiver directly (as when waking with the
+# receiver in RTC memory): discovery waits on the radio, which can't work on
+# one thread.
+import os
+import random
+import sys
+import tempfile
+
+import benchutil
+
+benchutil.use_stubs()
+
+import uasyncio as asyncio  # noqa: E402  (asyncio + sleep_ms)
+from simradio import Air  # noqa: E402
+from ticks import ticks_ms, ticks_diff  # noqa: E402
+
+RX_SCRIPT = "receiver/autoconnect_gadget_receiver.py"
+TX_SCRIPT = "transmitter/autoconnect_gadget_transmitter.py"
+NODE_COUNTS = (10, 50, 100, 200)
+SEND_INTERVAL_MS = 2000  # per transmitter, the script default is 5 s
+RUN_MS = 10000
+DRAIN_MS = 2000          # after the last send, for frames still on their way
+CHANNEL = 6
+LOSS = 0.02
+LATENCY_MS = 2
+SCENARIOS = (            # (title, UART baud, reliable delivery)
+    ("9600 baud UART", 9600, False),
+    ("115200 baud UART", 115200, False),
+    ("115200 baud UART, reliable delivery", 115200, True),
+)
+
+
+def quiet(*args, **kwargs):
+    pass
+
+
+class Tags:
+    """Message ids in the LED colour: rgb(id >> 16, id >> 8 & 255, id & 255)."""
+
+    def __init__(self):
+        self.sent = {}  # id -> ticks_ms() when it was sent
+
+    def color(self):
+        tag = len(self.sent) + 1
+        self.sent[tag] = ticks_ms()
+        return (tag >> 16, (tag >> 8) & 0xFF, tag & 0xFF)
+
+    @staticmethod
+    def parse(line):
+        start = line.rfind(b"rgb(")
+        if start < 0:
+            return None
+        r, g, b = (int(v) for v in line[start + 4:-1].split(b","))
+        return r << 16 | g << 8 | b
+
+
+def percentile(values, p):
+    return values[min(int(len(values) * p), len(values) - 1)] if values else None
+
+
+def load_receiver(air, macfile, baud):
+    node = air.node(channel=CHANNEL)
+    with air.attach(node):
+        rx = benchutil.run_script(RX_SCRIPT, {"MACFILE": macfile, "UART_BAUD": baud},
+                                  name="simrx", scope={"print": quiet})
+    return node, rx
+
+
+def load_transmitter(air, rx_node, tags, code):
+    node = air.node(channel=CHANNEL)
+    tx = {"__name__": "simtx", "__file__": TX_SCRIPT, "print": quiet}
+    with air.attach(node):
+        exec(code, tx)
+    tx["receiver_mac"] = rx_node.mac
+    tx["esp_now"].add_peer(rx_node.mac)
+    tx["sequence"] = random.getrandbits(16)
+    tx["random_neopixel_color"] = tags.color
+    return tx
+
+
+async def transmit(tx, stop):
+    await asyncio.sleep_ms(random.randrange(SEND_INTERVAL_MS))
+    sender = tx["sender"]
+    while ticks_diff(stop, ticks_ms()) > 0:
+        tx["send_message"]()
+        next_send = ticks_ms() + SEND_INTERVAL_MS
+        while ticks_diff(next_send, ticks_ms()) > 0:
+            if sender is not None:
+                sender.poll(ticks_ms())
+            await asyncio.sleep_ms(20 if sender is not None else SEND_INTERVAL_MS)
+    if sender is not None:
+        stop = ticks_ms() + DRAIN_MS // 2
+        while len(sender) and ticks_diff(stop, ticks_ms()) > 0:
+            sender.poll(ticks_ms())
+            await asyncio.sleep_ms(20)
+
+
+def compile_transmitter(reliable):
+    """Compiled once, each node runs it in its own globals."""
+    with open(TX_SCRIPT) as f:
+        source = f.read()
+    source = source.replace("RELIABLE_DELIVERY = False", "RELIABLE_DELIVERY = {}".format(reliable), 1)
+    return compile(source, TX_SCRIPT, "exec")
+
+
+async def run(nodes, baud, reliable, seed=1):
+    random.seed(seed)
+    air = Air(LOSS, LATENCY_MS, seed=seed)
+    tags = Tags()
+    with tempfile.TemporaryDirectory() as tmp:
+        macfile = os.path.join(tmp, "known_devices.txt")
+        open(macfile, "w").close()
+        rx_node, rx = load_receiver(air, macfile, baud)
+        code = compile_transmitter(reliable)
+        txs = [load_transmitter(air, rx_node, tags, code) for _ in range(nodes)]
+        receiver = asyncio.create_task(rx["main"]())
+        radio = asyncio.create_task(air.run())
+        start = ticks_ms()
+        await asyncio.gather(*(transmit(tx, start + RUN_MS) for tx in txs))
+        await asyncio.sleep_ms(DRAIN_MS)
+        receiver.cancel()
+        radio.cancel()
+
+    latencies = []
+    seen = set()
+    for t, line in rx["uart"].lines:
+        tag = Tags.parse(line)
+        if tag in tags.sent and tag not in seen:
+            seen.add(tag)
+            latencies.append(ticks_diff(t, tags.sent[tag]))
+    latencies.sort()
+    sent = len(tags.sent)
+    pipeline, egress = rx["pipeline"].stats(), rx["egress"].stats()
+    retransmits = sum(tx["sender"].stats()["retransmits"] for tx in txs if tx["sender"] is not None)
+    return {
+        "sent": sent, "forwarded": len(seen),
+        "p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "lost": rx_node.lost, "rx_dropped": rx_node.esp.stats()[4],
+        "ring": pipeline["dropped"],
+        "shed": pipeline["shed"], "uart_dropped": egress["dropped_oldest"] + egress["dropped_newest"],
+        "queued": egress["depth"], "retransmits": retransmits,
+    }
+
+
+def main():
+    counts = [int(n) for n in sys.argv[1:]] or NODE_COUNTS
+    print("{} s of sends every {} ms per node, {:.0%} radio loss, {} ms latency".format(
+        RUN_MS // 1000, SEND_INTERVAL_MS, LOSS, LATENCY_MS))
+    for title, baud, reliable in SCENARIOS:
+        print("\n" + title)
+        print("{:>5} {:>8} {:>9} {:>6} {:>6} {:>6} {:>6}   {:>5} {:>5} {:>5} {:>5} {:>6} {:>6} {:>5}".format(
+            "nodes", "offered", "forwarded", "drop", "p50", "p95", "p99",
+            "lost", "rxbuf", "ring", "shed", "uart", "queued", "retx"))
+        for nodes in counts:
+            r = asyncio.run(run(nodes, baud, reliable))
+            drop = 1 - r["forwarded"] / r["sent"] if r["sent"] else 0
+            print("{:>5} {:>6.1f}/s {:>7.1f}/s {:>6.1%} {:>4}ms {:>4}ms {:>4}ms   {:>5} {:>5} {:>5} {:>5} {:>6} {:>6} {:>5}".format(
+                nodes, r["sent"] * 1000 / RUN_MS, r["forwarded"] * 1000 / RUN_MS, drop,
+                r["p50"], r["p95"], r["p99"], r["lost"], r["rx_dropped"], r["ring"], r["shed"],
+                r["uart_dropped"], r["queued"], r["retransmits"]))
+            assert r["forwarded"] <= r["sent"]
+
+
+main()
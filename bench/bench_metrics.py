@@ -0,0 +1,55 @@
+# Cost of the metrics registry (common/metrics.py) on the receive path,
+# enabled against disabled, and a dump/parse round trip with the host
+# helper (host/psgadget_stats.py).
+import sys
+
+import benchutil  # also puts common/ on sys.path
+from metrics import Registry, DURATION_US_BOUNDS, NULL
+
+sys.path.insert(0, "host")
+from psgadget_stats import parse_stats  # noqa: E402
+
+
+def instrumented(metrics):
+    frames = metrics.counter("rx.frames")
+    records = metrics.counter("rx.records")
+    latency = metrics.histogram("uart.latency_ms")
+
+    def handle(n=[0]):
+        n[0] += 1
+        frames.inc()
+        records.inc(3)
+        latency.observe(n[0] % 700)
+    return handle
+
+
+def main():
+    def bare(n=[0]):
+        n[0] += 1
+    benchutil.bench("frame, no metrics", bare, 200000)
+    benchutil.bench("frame, metrics disabled", instrumented(Registry(False)), 200000)
+    benchutil.bench("frame, metrics enabled", instrumented(Registry(True)), 200000)
+
+    metrics = Registry()
+    handle = instrumented(metrics)
+    metrics.gauge("heap.free", lambda: 48112)
+    metrics.gauge("uart.depth").set(3)
+    metrics.histogram("rx.handle_us", DURATION_US_BOUNDS).observe(180)
+    for _ in range(1000):
+        handle()
+    line = metrics.dump(now=81234)
+    print(line)
+    stats = parse_stats(line)
+    assert stats["rx.frames"] == 1000 and stats["rx.records"] == 3000 and stats["heap.free"] == 48112
+    assert stats["uart.latency_ms"].count == 1000
+    assert stats["uart.latency_ms"].sum == sum(n % 700 for n in range(1, 1001))
+    print("latency p50 <= {} ms, p99 <= {} ms".format(stats["uart.latency_ms"].percentile(0.5),
+                                                     stats["uart.latency_ms"].percentile(0.99)))
+    benchutil.bench("Registry.dump ({} chars)".format(len(line)), metrics.dump, 2000)
+    metrics.reset()
+    stats = parse_stats(metrics.dump())
+    assert stats["rx.frames"] == 0 and stats["uart.latency_ms"].count == 0 and stats["heap.free"] == 48112
+    assert not Registry(False).counter("x") and Registry(False).counter("x") is NULL
+
+
+main()
@@ -0,0 +1,63 @@
+# PeerTable (common/peers.py) under a simulated fleet: 500 transmitters with
+# skewed traffic (a few chatty ones, many quiet ones), each frame answered
+# with a unicast reply, against the stub driver's 20 peer limit.
+import random
+
+import benchutil
+
+benchutil.use_stubs()
+
+import espnow  # noqa: E402  (stubs)
+from peers import PeerTable, BROADCAST_MAC  # noqa: E402
+
+TRANSMITTERS = 500
+FRAMES = 50000
+
+
+def fleet(n, seed=1):
+    rnd = random.Random(seed)
+    macs = [bytes([0x34, 0xb7] + [rnd.randrange(256) for _ in range(4)]) for _ in range(n)]
+    weights = [1 / (i + 1) for i in range(n)]  # Zipf-like
+    return macs, weights, rnd
+
+
+def main():
+    macs, weights, rnd = fleet(TRANSMITTERS)
+    traffic = rnd.choices(macs, weights, k=FRAMES)
+    esp = espnow.ESPNow()
+    table = PeerTable(esp)
+    replies = 0
+    for mac in traffic:
+        if table.send(mac, b"ack"):
+            replies += 1
+        assert len(esp.get_peers()) <= espnow.MAX_PEERS
+    stats = table.stats()
+    print("{} frames from {} transmitters, {} replies".format(FRAMES, TRANSMITTERS, replies))
+    print("hit rate {:.1%}  {}".format(stats["hits"] / FRAMES, stats))
+    assert replies == FRAMES and stats["send_errors"] == 0
+    assert BROADCAST_MAC in table and esp.send(BROADCAST_MAC, b"beacon")
+
+    # A peer deleted behind the table's back is re-added on send
+    mac = traffic[-1]
+    esp.del_peer(mac)
+    assert table.send(mac, b"ack") and table.readds == 1
+
+    # Peers added by other code fill the driver: the table evicts its own
+    esp = espnow.ESPNow()
+    table = PeerTable(esp)
+    for mac in macs[:15]:
+        esp.add_peer(mac)
+    for mac in macs[100:140]:
+        assert table.send(mac, b"ack")
+    print("15 foreign peers in the driver: {}".format(table.stats()))
+    assert len(table) == espnow.MAX_PEERS - 16
+
+    esp = espnow.ESPNow()
+    table = PeerTable(esp)
+    it = iter(traffic * 4)
+    benchutil.bench("PeerTable.send (skewed, 500 macs)", lambda: table.send(next(it), b"ack"), FRAMES)
+    hot = macs[0]
+    benchutil.bench("PeerTable.ensure hit", lambda: table.ensure(hot), FRAMES)
+
+
+main()
@@ -0,0 +1,104 @@
+# Receiver flood protection (common/ratelimit.py and the round-robin egress
+# queue, common/egress.py) over a simulated minute:
+# 9 well-behaved transmitters send one frame a second, one broken one sends
+# 200 a second, and the 9600 baud UART drains ~960 bytes a second. Compares a
+# plain FIFO (what the receivers did before, new lines dropped when full)
+# with per-MAC token buckets plus round-robin forwarding, by how many of the
+# well-behaved lines reach the host and how long they wait.
+import random
+
+import benchutil  # also puts common/ on sys.path
+from ratelimit import RateLimiter, TokenBucket
+from egress import EgressQueue
+
+RUN_MS = 60000
+TICK_MS = 10
+UART_BYTES_PER_S = 960
+QUEUE_LINES = 64
+LINE = b"PsGadget-IO|34b7da59d621|ESP32S3|21.5|99|rgb(1, 2, 3)"
+TAIL = LINE[13:]
+GOOD = [bytes([0x34, 0xb7, 0, 0, 0, i]) for i in range(9)]
+FLOODER = b"\x34\xb7\xff\xff\xff\xff"
+FLOOD_PER_S = 200
+
+
+def traffic(seed=1):
+    """(ms, mac) arrivals, sorted."""
+    rnd = random.Random(seed)
+    frames = []
+    for mac in GOOD:
+        start = rnd.randrange(1000)
+        frames += [(t, mac) for t in range(start, RUN_MS, 1000)]
+    frames += [(rnd.randrange(RUN_MS), FLOODER) for _ in range(FLOOD_PER_S * RUN_MS // 1000)]
+    return sorted(frames)
+
+
+def line(t, mac):
+    """A line as long as LINE that says when and from whom it was received."""
+    return b"%02x%010d" % (mac[-1], t) + TAIL
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)] if values else None
+
+
+def run(fair):
+    frames = traffic()
+    limiter = RateLimiter(10, 20)
+    budget = TokenBucket(UART_BYTES_PER_S, 256, now=0)
+    queue = EgressQueue(QUEUE_LINES, budget=budget, limiter=limiter)
+    fifo = []
+    waits = []
+    good_sent = 0
+    i = 0
+    for now in range(0, RUN_MS + 20000, TICK_MS):
+        while i < len(frames) and frames[i][0] <= now:
+            t, mac = frames[i]
+            i += 1
+            if fair:
+                if limiter.allow(mac, now):
+                    queue.put(line(t, mac), mac, now=now)
+            elif len(fifo) < QUEUE_LINES:
+                fifo.append(line(t, mac))
+        sent = []
+        if fair:
+            queue.drain(sent.append, now, limit=1000)
+        else:
+            used = 0
+            avail = budget.available(now)
+            while fifo and used < avail:
+                sent.append(fifo.pop(0))
+                used += len(sent[-1]) + 1
+            budget.consume(used)
+        for sent_line in sent:
+            if sent_line[:2] != b"ff":
+                good_sent += 1
+                waits.append(now - int(sent_line[2:12]))
+    good_total = sum(1 for _, mac in frames if mac != FLOODER)
+    return good_sent / good_total, percentile(waits, 0.5), percentile(waits, 0.99), limiter
+
+
+def main():
+    print("{} transmitters at 1 frame/s, 1 at {} frames/s, UART {} bytes/s".format(
+        len(GOOD), FLOOD_PER_S, UART_BYTES_PER_S))
+    delivered, p50, p99, _ = run(False)
+    print("fifo:        good frames forwarded {:6.1%}  wait p50 {:>5} ms  p99 {:>5} ms".format(
+        delivered, p50, p99))
+    fifo_delivered = delivered
+    delivered, p50, p99, limiter = run(True)
+    print("rate+fair:   good frames forwarded {:6.1%}  wait p50 {:>5} ms  p99 {:>5} ms".format(
+        delivered, p50, p99))
+    print("flooder:", limiter.stats(FLOODER), " good:", limiter.stats(GOOD[0]))
+    assert delivered > 0.99 and delivered > fifo_delivered
+    assert p99 < 2000
+
+    limiter = RateLimiter(10, 20)
+    macs = GOOD + [FLOODER]
+    it = iter(range(10 ** 7))
+    benchutil.bench("RateLimiter.allow (10 macs)", lambda: limiter.allow(macs[next(it) % len(macs)], 0), 50000)
+    queue = EgressQueue(QUEUE_LINES)
+    benchutil.bench("EgressQueue.put + drain one", lambda: (queue.put(LINE, GOOD[0]), queue.drain(len, 0, 1)), 50000)
+
+
+main()
@@ -0,0 +1,134 @@
+# Fire-and-forget against windowed delivery (common/reliable.py) over a
+# simulated lossy link: one transmitter sends a telemetry frame every 50 ms
+# for a simulated minute, frames and acks are each lost with probability
+# `loss` and arrive after a few ms. Counts what reaches the host, duplicates
+# the receiver had to drop and frames on air, then times the receive path.
+import random
+
+import benchutil  # also puts common/ on sys.path
+import psgframe
+from beacon import airtime_us
+from reliable import ReliableSender, ReliableReceiver
+
+TX_MAC = b"\x34\xb7\xda\x59\xd6\x21"
+RX_MAC = b"\x34\xb7\xda\x59\xd6\x20"
+SERIAL = b"\x34\xb7\xda\x59\xd6\x21"
+RUN_MS = 60000
+SEND_EVERY_MS = 50
+TICK_MS = 5
+LATENCY_MS = (2, 8)
+
+
+class LossyLink:
+    """Both directions of the radio link, frames delivered in time order."""
+
+    def __init__(self, loss, seed=1):
+        self.loss = loss
+        self.rnd = random.Random(seed)
+        self.now = 0
+        self.to_rx = []
+        self.to_tx = []
+        self.frames = 0
+        self.airtime_us = 0
+
+    def _queue(self, queue, mac, msg):
+        self.frames += 1
+        self.airtime_us += airtime_us(len(msg))
+        if self.rnd.random() >= self.loss:
+            queue.append((self.now + self.rnd.randint(*LATENCY_MS), mac, bytes(msg)))
+
+    def _due(self, queue):
+        due = [item for item in queue if item[0] <= self.now]
+        queue[:] = [item for item in queue if item[0] > self.now]
+        return sorted(due)
+
+
+class TxRadio:
+    """The transmitter's ESPNow: send goes to the receiver, recv reads acks."""
+
+    def __init__(self, link):
+        self.link = link
+        self.acks = []
+
+    def send(self, mac, msg, sync=True):
+        self.link._queue(self.link.to_rx, TX_MAC, msg)
+        return True
+
+    def recv(self, timeout_ms=None):
+        if not self.acks:
+            self.acks = [(mac, msg) for _, mac, msg in self.link._due(self.link.to_tx)]
+        if self.acks:
+            return self.acks.pop(0)
+        return None, None
+
+
+def run(loss, reliable, window=8):
+    link = LossyLink(loss)
+    radio = TxRadio(link)
+    sender = ReliableSender(radio, window, timeout_ms=60, retries=3) if reliable else None
+    receiver = ReliableReceiver(lambda mac, msg, sync: link._queue(link.to_tx, RX_MAC, msg))
+    forwarded = set()
+    duplicates = 0
+    seq = 0
+    for now in range(0, RUN_MS + 1000, TICK_MS):
+        link.now = now
+        if now < RUN_MS and now % SEND_EVERY_MS == 0:
+            frame = psgframe.encode_telemetry(seq, SERIAL, 1, 21.5, 99, None)
+            if sender is None:
+                radio.send(RX_MAC, frame)
+            else:
+                sender.send(RX_MAC, seq, frame, now)
+            seq += 1
+        elif sender is not None:
+            sender.poll(now)
+        for _, mac, msg in link._due(link.to_rx):
+            if receiver.accept(mac, msg):
+                n = psgframe.frame_seq(msg)[0]
+                if n in forwarded:
+                    duplicates += 1  # would reach the host twice
+                forwarded.add(n)
+    stats = receiver.stats(TX_MAC)
+    return {
+        "delivered": len(forwarded) / seq,
+        "duplicates": duplicates,
+        "dropped": stats["duplicates"],
+        "lost_reported": stats["lost"],
+        "frames": link.frames,
+        "airtime_ms": link.airtime_us // 1000,
+        "sender": sender.stats() if sender else None,
+    }
+
+
+def main():
+    frames = RUN_MS // SEND_EVERY_MS
+    print("{} frames over {} s, latency {}-{} ms".format(frames, RUN_MS // 1000, *LATENCY_MS))
+    print("{:>5} {:<17} {:>9} {:>10} {:>8} {:>8} {:>9}".format(
+        "loss", "mode", "delivered", "goodput/s", "on air", "dups", "lost seen"))
+    for loss in (0.0, 0.05, 0.2, 0.4):
+        for name, reliable, window in (("fire-and-forget", False, 0), ("window 8", True, 8),
+                                       ("window 2", True, 2)):
+            r = run(loss, reliable, window)
+            print("{:>5.0%} {:<17} {:>9.1%} {:>10.1f} {:>8} {:>8} {:>9}".format(
+                loss, name, r["delivered"], r["delivered"] * frames * 1000 / RUN_MS,
+                r["frames"], r["dropped"], r["lost_reported"]))
+            assert r["duplicates"] == 0  # the receiver never forwards a frame twice
+            if not reliable:
+                # Gaps in the sequence numbers are what the receiver reports as lost
+                assert abs(frames * (1 - r["delivered"]) - r["lost_reported"]) <= 32
+            elif loss <= 0.2 and window == 8:
+                assert r["delivered"] > 0.99
+
+    # Receive path cost: new frames, and a retransmit of a frame already seen
+    receiver = ReliableReceiver(lambda mac, msg, sync: True)
+    frames = [psgframe.with_flags(psgframe.encode_telemetry(n & 0xFFFF, SERIAL, 1, 21.5, 99, None),
+                                  psgframe.F_ACKREQ) for n in range(100000)]
+    it = iter(frames)
+    benchutil.bench("ReliableReceiver.accept (new, acked)", lambda: receiver.accept(TX_MAC, next(it)), 50000)
+    old = frames[49990]
+    benchutil.bench("ReliableReceiver.accept (duplicate)", lambda: receiver.accept(TX_MAC, old), 50000)
+    plain = ReliableReceiver()
+    text = b"PsGadget-IO|34b7da59d621|ESP32S3|21.5|99|rgb(1, 2, 3)"
+    benchutil.bench("ReliableReceiver.accept (legacy text)", lambda: plain.accept(TX_MAC, text), 50000)
+
+
+main()
@@ -0,0 +1,183 @@
+# Receive hot path of autoconnect_gadget_receiver_bidirectional_uart.py,
+# from the frame in the receive ring to the line in the UART queue.
+# Compares the handler before the zero-allocation rework (records and
+# strings built per frame, MAC copied per frame, prints formatted even when
+# nobody reads them) with the current one (interned MAC, lines rendered
+# from the frame bytes into one reused buffer, prints compiled out).
+#
+# Prints bytes allocated and time per frame, then what that means for the
+# garbage collector: frames between collections with FREE_HEAP bytes free
+# and collections per minute at FRAME_RATE frames per second. Under
+# MicroPython the bytes are heap taken with the collector off (the real
+# number); under CPython they are the tracemalloc peak, so the collection
+# figures are only an estimate there.
+#
+#   python3 bench/bench_rxpath.py
+#   micropython bench/bench_rxpath.py
+
+import benchutil
+
+benchutil.use_stubs()
+
+import psgframe  # noqa: E402
+import ubinascii  # noqa: E402
+
+RX_SCRIPT = "receiver/autoconnect_gadget_receiver_bidirectional_uart.py"
+SOURCES = 8          # transmitters the frames come from
+FRAMES = 2048        # per kind, sequence numbers increase so none is a duplicate
+FREE_HEAP = 100000   # bytes free on an ESP32-S3 once the receiver is running (about)
+FRAME_RATE = 200     # frames per second, e.g. 20 transmitters at the rate limit
+
+
+def quiet(*args, **kwargs):
+    pass
+
+
+def before(rx):
+    """The handler before: decode_records + to_text per frame, as it was."""
+    machine_types = {}
+    responder, downlink, delivery = rx["responder"], rx["downlink"], rx["delivery"]
+    egress, pipeline, transmitters, beacons = rx["egress"], rx["pipeline"], rx["transmitters"], rx["beacons"]
+    m_frames, m_probes, m_cmdacks = rx["m_frames"], rx["m_probes"], rx["m_cmdacks"]
+    m_duplicates, m_parse_errors, m_records = rx["m_duplicates"], rx["m_parse_errors"], rx["m_records"]
+    blink_led, P_DATA = rx["blink_led"], rx["P_DATA"]
+    print = quiet
+
+    def handle_frame(mac, espnowmsg):
+        try:
+            mac_str = ubinascii.hexlify(mac, ":").decode()
+            print(f"Received ESP-NOW message from {mac_str}: {bytes(espnowmsg)}")
+            m_frames.inc()
+            if responder.handle(mac, espnowmsg):
+                m_probes.inc()
+                print(f"Sent offer to {mac_str}")
+                return
+            if downlink.ack(mac, espnowmsg):
+                m_cmdacks.inc()
+                return
+            if not delivery.accept(mac, espnowmsg):
+                m_duplicates.inc()
+                print(f"Duplicate ESP-NOW frame from {mac_str}")
+                return
+            records = psgframe.decode_records(espnowmsg)
+            if not records:
+                m_parse_errors.inc()
+                print("Malformed ESP-NOW message received.")
+                return
+            m_records.inc(len(records))
+            if bytes(mac) not in transmitters:
+                transmitters.add(bytes(mac))
+                beacons.kick()
+            for record in records:
+                print(f"Decoded ESP-NOW message: {record}")
+                if record["machine"]:
+                    machine_types[record["serial"]] = record["machine"]
+                egress.put(psgframe.to_text(record, machine_types.get(record["serial"])), bytes(mac), P_DATA,
+                           now=pipeline.frame_ms)
+            if records[-1]["rgb"]:
+                blink_led(records[-1]["rgb"])
+        except Exception as e:
+            print("Failed to process ESP-NOW message:", e)
+
+    return handle_frame
+
+
+def frames(kind):
+    """(mac, frame) pairs from SOURCES transmitters."""
+    out = []
+    for seq in range(FRAMES):
+        source = seq % SOURCES
+        mac = bytes((0x34, 0xb7, 0xda, 0x59, 0xd6, source))
+        serial = bytes((0x48, 0x27, 0xe2, 0x10, 0x00, source))
+        # The machine type rides along on every 10th frame of a transmitter
+        ext = [(psgframe.T_MACHINE, b"ESP32S3 module with ESP32S3")] if seq // SOURCES % 10 == 0 else None
+        if kind == "telemetry":
+            frame = psgframe.encode_telemetry(seq // SOURCES, serial, 1, 36.5 + seq % 7, 99, (12, 200, 34), ext)
+        elif kind == "batch":
+            samples = [(100 * n, 36.25 + n, 99, (12, 200, 34)) for n in range(8)]
+            frame = psgframe.encode_batch(seq // SOURCES, serial, 1, samples, ext, rgb=True)
+        else:
+            frame = "PsGadget-IO|{}|ESP32S3 module|{}|99|rgb(12, 200, 34)".format(
+                ubinascii.hexlify(serial).decode(), 36 + seq % 7).encode()
+        out.append((mac, frame))
+    return out
+
+
+def feeder(rx, handler, pairs, intern):
+    """One call = one frame: out of a ring-like buffer into the handler, the queue drained."""
+    slot = bytearray(psgframe.MAX_FRAME)
+    view = memoryview(slot)
+    mac_buf = bytearray(6)  # irecv() reuses one buffer for the MAC
+    egress, macs = rx["egress"], rx["pipeline"].macs
+    i = [0]
+
+    def sink(line, kind=None):
+        pass
+
+    def feed():
+        mac, frame = pairs[i[0] % len(pairs)]
+        i[0] += 1
+        mac_buf[:] = mac
+        slot[:len(frame)] = frame
+        # Before, the ring kept a copy of the MAC per frame
+        handler(macs.intern(mac_buf) if intern else bytes(mac_buf), view[:len(frame)])
+        egress.drain(sink, limit=64)
+    return feed
+
+
+def load_receiver():
+    rx = benchutil.run_script(RX_SCRIPT, name="simrx", scope={"print": quiet})
+    rx["egress"].budget = None  # the UART isn't the point here
+    return rx
+
+
+def measure(handler_of, kind, intern):
+    rx = load_receiver()
+    pairs = frames(kind)
+    feed = feeder(rx, handler_of(rx), pairs, intern)
+    for _ in range(len(pairs)):
+        feed()  # warm up: caches filled, every frame after this is new to the dedup window
+    pairs[:] = [(mac, with_seq(frame, n)) for n, (mac, frame) in enumerate(pairs, FRAMES)]
+    n = len(pairs) // 2
+    start = benchutil.ticks_us()
+    for _ in range(n):
+        feed()
+    us = benchutil.ticks_diff(benchutil.ticks_us(), start) / n
+    alloc = benchutil.allocated(feed, 100)
+    assert rx["egress"].sent > 0, rx["egress"].stats()
+    return us, alloc
+
+
+def with_seq(frame, n):
+    """frame again with a later sequence number (legacy text has none)."""
+    if not psgframe.is_binary(frame):
+        return frame
+    frame = bytearray(frame)
+    seq = n // SOURCES
+    frame[4], frame[5] = seq & 0xFF, seq >> 8 & 0xFF
+    return bytes(frame)
+
+
+def gc_figures(alloc):
+    if not alloc:
+        return "-", "0"
+    per_gc = FREE_HEAP // alloc
+    return str(per_gc), "{:.0f}".format(60 * FRAME_RATE / per_gc)
+
+
+def main():
+    print("{:<10} {:<7} {:>9} {:>8} {:>13} {:>9}".format(
+        "frames", "handler", "us/frame", "B/frame", "frames per GC", "GCs/min"))
+    for kind in ("telemetry", "batch", "legacy"):
+        for name, handler_of, intern in (("before", before, False),
+                                         ("after", lambda rx: rx["handle_frame"], True)):
+            us, alloc = measure(handler_of, kind, intern)
+            per_gc, per_min = gc_figures(alloc)
+            print("{:<10} {:<7} {:>9.1f} {:>8} {:>13} {:>9}".format(
+                kind, name, us, "?" if alloc is None else alloc, per_gc, per_min))
+    print("GC figures: {} B free heap, {} frames/s{}".format(
+        FREE_HEAP, FRAME_RATE, "" if hasattr(__import__("gc"), "mem_alloc") else
+        " (estimated from the CPython peak, run under MicroPython for real numbers)"))
+
+
+main()
@@ -0,0 +1,58 @@
+# Burst test for the deferred receive pipeline: no frames may be lost.
+import benchutil  # also puts common/ on sys.path
+import psgframe
+from rxpipe import RxPipeline
+from ticks import ticks_us, ticks_diff
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+BURST = 2000
+SLOTS = 32
+BATCH = 8
+
+
+class BurstESPNow:
+    """Just enough of espnow.ESPNow: irq() and irecv() over a list of frames."""
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.pos = 0
+        self.cb = None
+
+    def irq(self, cb):
+        self.cb = cb
+
+    def irecv(self, timeout_ms=None):
+        if self.pos == len(self.frames):
+            return None, None
+        self.pos += 1
+        return self.frames[self.pos - 1]
+
+
+async def run_burst():
+    mac = b"\x34\xb7\xda\x59\xd6\x20"
+    frames = [(mac, psgframe.encode_telemetry(i, mac, 1, 46, 99, (i & 0xFF, 0, 0)))
+              for i in range(BURST)]
+    radio = BurstESPNow(frames)
+    seen = []
+    pipeline = RxPipeline(radio, lambda m, msg: seen.append(psgframe.decode(msg)["seq"]),
+                          SLOTS, BATCH)
+    task = asyncio.create_task(pipeline.start())
+    await asyncio.sleep(0)
+    start = ticks_us()
+    radio.cb(radio)  # one IRQ for the whole burst, like a backed-up driver buffer
+    while len(seen) < BURST and pipeline.ring.dropped == 0:
+        await asyncio.sleep(0)
+    elapsed = ticks_diff(ticks_us(), start) or 1
+    task.cancel()
+    stats = pipeline.stats()
+    print("burst of {} frames: {:.0f} frames/s".format(BURST, BURST * 1000000 / elapsed))
+    print("pipeline stats:", stats)
+    assert seen == list(range(BURST)), "frames lost or reordered"
+    assert stats["dropped"] == 0 and stats["high_water"] <= SLOTS
+
+
+asyncio.run(run_burst())
@@ -0,0 +1,80 @@
+# Hot paths of the gadget scripts themselves, imported with the hardware
+# stand-ins (their startup only runs as the main script): message build on
+# the transmitter, frame handling, known-device update, RGB parsing and
+# JSON formatting on the receivers. Prints from the scripts are silenced
+# while timing, on a board they go to the USB REPL.
+import sys
+
+import benchutil
+
+benchutil.use_stubs()
+sys.path.insert(0, "transmitter")
+sys.path.insert(0, "receiver")
+
+import psgframe  # noqa: E402
+import autoconnect_gadget_transmitter as transmitter  # noqa: E402
+import esp32_transmitter_main as json_transmitter  # noqa: E402
+import autoconnect_gadget_receiver as receiver  # noqa: E402
+import ftdi_esp32s3receiver_uart as ftdi_receiver  # noqa: E402
+
+MAC = b"\x34\xb7\xda\x59\xd6\x20"
+RGB = (12, 200, 34)
+
+
+def quiet(*args, **kwargs):
+    pass
+
+
+def frames(text=False, n=4096):
+    """Telemetry frames with increasing sequence numbers, so none is a duplicate."""
+    transmitter.BINARY_FRAMES = not text
+    out = []
+    for seq in range(n):
+        transmitter.sequence = seq
+        out.append(transmitter.build_message(46, "99", RGB))
+    transmitter.BINARY_FRAMES = True
+    return out
+
+
+def cycle(items):
+    i = [0]
+
+    def next_item():
+        i[0] += 1
+        return items[i[0] % len(items)]
+    return next_item
+
+
+def main():
+    for module in (transmitter, json_transmitter, receiver, ftdi_receiver):
+        module.print = quiet
+
+    transmitter.sequence = 1
+    benchutil.bench("transmitter build_message binary", lambda: transmitter.build_message(46, "99", RGB), 20000)
+    transmitter.sequence = 0
+    benchutil.bench("transmitter build_message + machine", lambda: transmitter.build_message(46, "99", RGB), 20000)
+    transmitter.BINARY_FRAMES = False
+    benchutil.bench("transmitter build_message text", lambda: transmitter.build_message(46, "99", RGB), 20000)
+    transmitter.BINARY_FRAMES = True
+    benchutil.bench("esp32_transmitter_main build_message", json_transmitter.build_message, 20000)
+
+    for name, text in (("binary", False), ("text", True)):
+        frame = cycle(frames(text))
+        benchutil.bench("receiver handle_frame " + name, lambda: receiver.handle_frame(MAC, frame()), 10000)
+    frame = cycle(frames())
+    benchutil.bench("receiver decode_records", lambda: psgframe.decode_records(frame()), 20000)
+    benchutil.bench("receiver update_known_device", lambda: receiver.update_known_device(MAC), 20000)
+    benchutil.bench("receiver blink_led", lambda: receiver.blink_led(RGB), 20000)
+    benchutil.bench("psgframe.parse_rgb", lambda: psgframe.parse_rgb("rgb(12, 200, 34)"), 20000)
+
+    line = psgframe.to_text(psgframe.decode_records(frames(n=1)[0])[0])
+    benchutil.bench("ftdi format_jsonmessage", lambda: ftdi_receiver.format_jsonmessage(MAC, line), 20000)
+    frame = cycle(frames())
+    benchutil.bench("ftdi handle_frame binary", lambda: ftdi_receiver.handle_frame(MAC, frame()), 10000)
+
+    stats = receiver.egress.stats()
+    assert stats["queued"] > 0 and stats["depth"] <= receiver.UART_QUEUE_LINES, stats
+    assert MAC in receiver.known_devices
+
+
+main()
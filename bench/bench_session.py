@@ -0,0 +1,213 @@
+# Sessions (session.py): serial, gadget and machine type registered once,
+# frames carry a 1-byte session id instead.
+#
+# 1. Frame sizes: bytes and airtime per frame with and without a session,
+#    for plain telemetry (machine type every MACHINE_TYPE_EVERY frames
+#    without one), telemetry with the send time and deadband extensions,
+#    and a full batch frame.
+# 2. Receiver cost: the bidirectional receiver's handle_frame on full
+#    frames and on session frames it rebuilds first, time and bytes
+#    allocated per frame.
+# 3. End to end on the simulated radio: N transmitters register with the
+#    bidirectional receiver, which "restarts" (loses its sessions) half way.
+#    Counts the lines on the UART against the frames sent, lines that came
+#    out different from what a full frame gives, and re-registrations; then
+#    again with fewer session slots than transmitters (S_FULL, the rest keep
+#    sending full frames); and the restart again with reliable delivery and
+#    frames lost on the way, so frames with the old id are still waiting for
+#    their ack when it is rejected. Frames given up on, and retransmits the
+#    restarted receiver takes for duplicates, are allowed to go missing.
+#
+#   python3 bench/bench_session.py
+import random
+
+import benchutil
+
+benchutil.use_stubs()
+
+import uasyncio as asyncio  # noqa: E402
+import psgframe  # noqa: E402
+from beacon import airtime_us  # noqa: E402
+from reliable import ReliableReceiver  # noqa: E402
+from session import SessionTable  # noqa: E402
+from simradio import Air  # noqa: E402
+from ticks import ticks_ms  # noqa: E402
+
+RX_SCRIPT = "receiver/autoconnect_gadget_receiver_bidirectional_uart.py"
+TX_SCRIPT = "transmitter/autoconnect_gadget_transmitter.py"
+SERIAL = b"\x48\x27\xe2\x10\x00\x01"
+MACHINE = "Generic ESP32S3 module with ESP32S3"
+MACHINE_TYPE_EVERY = 16
+NODES = 10
+SEND_INTERVAL_MS = 200
+RUN_MS = 4000
+CHANNEL = 6
+
+
+def quiet(*args, **kwargs):
+    pass
+
+
+def sizes():
+    """name -> (full bytes per frame, session bytes per frame), averaged over
+    MACHINE_TYPE_EVERY frames for the machine type."""
+    extras = {
+        "telemetry": [],
+        "+ time, deadband": [psgframe.time_tlv(1760000000000), psgframe.agg_tlv(25, 36.1, 36.9, 36.5),
+                             psgframe.heartbeat_tlv(60)],
+    }
+    out = {}
+    for name, ext in extras.items():
+        full = []
+        for seq in range(MACHINE_TYPE_EVERY):
+            machine = [(psgframe.T_MACHINE, MACHINE)] if seq == 0 else []
+            full.append(psgframe.encode_telemetry(seq, SERIAL, 1, 36.5, 99, (1, 2, 3), machine + ext))
+        session = psgframe.to_session(psgframe.encode_telemetry(1, SERIAL, 1, 36.5, 99, (1, 2, 3), ext), 5)
+        out[name] = ([len(f) for f in full], [len(session)] * MACHINE_TYPE_EVERY)
+    count = psgframe.batch_capacity(len(psgframe.encode_tlv(psgframe.T_MACHINE, MACHINE)))
+    samples = [(100 * n, 36.5, 99, (1, 2, 3)) for n in range(count)]
+    batch = psgframe.encode_batch(1, SERIAL, 1, samples, [(psgframe.T_MACHINE, MACHINE)], rgb=True)
+    out["batch ({} samples)".format(count)] = ([len(batch)], [len(psgframe.to_session(batch, 5)) - 2 - len(MACHINE)])
+    return out
+
+
+def print_sizes():
+    print("{:<24} {:>9} {:>9} {:>11} {:>11}".format("frame", "full B", "session B", "full us", "session us"))
+    for name, (full, session) in sizes().items():
+        print("{:<24} {:>9.1f} {:>9.1f} {:>11.0f} {:>11.0f}".format(
+            name, sum(full) / len(full), sum(session) / len(session),
+            sum(airtime_us(n) for n in full) / len(full), sum(airtime_us(n) for n in session) / len(session)))
+
+
+def receiver_cost():
+    rx = benchutil.run_script(RX_SCRIPT, name="simrx", scope={"print": quiet})
+    rx["egress"].budget = None
+    mac = rx["pipeline"].macs.intern(b"\x34\xb7\xda\x59\xd6\x01")
+    register = psgframe.encode_register(1, SERIAL, 1, MACHINE)
+    rx["handle_frame"](mac, register)
+    seq = [0]
+
+    def frame(session):
+        seq[0] += 1
+        machine = [(psgframe.T_MACHINE, MACHINE)] if seq[0] % MACHINE_TYPE_EVERY == 0 else None
+        full = psgframe.encode_telemetry(seq[0], SERIAL, 1, 36.5, 99, (1, 2, 3), None if session else machine)
+        return psgframe.to_session(full, 1) if session else full
+
+    def sink(line, kind=None):
+        pass
+
+    print("\n{:<10} {:>9} {:>8}".format("handler", "us/frame", "B/frame"))
+    for name, session in (("full", False), ("session", True)):
+        frames = [frame(session) for _ in range(4096)]
+        i = [0]
+
+        def feed():
+            msg = frames[i[0] % len(frames)]
+            i[0] += 1
+            rx["handle_frame"](mac, msg)
+            rx["egress"].drain(sink, limit=64)
+        start = benchutil.ticks_us()
+        for _ in range(2048):
+            feed()
+        us = benchutil.ticks_diff(benchutil.ticks_us(), start) / 2048
+        print("{:<10} {:>9.1f} {:>8}".format(name, us, benchutil.allocated(feed, 100)))
+    stats = rx["sessions"].stats()
+    assert stats["rehydrated"] > 0 and stats["unknown"] == 0, stats
+
+
+def load(air, code, rx_node):
+    node = air.node(channel=CHANNEL)
+    tx = {"__name__": "simtx", "__file__": TX_SCRIPT, "print": quiet}
+    with air.attach(node):
+        exec(code, tx)
+    tx["pair"](rx_node.mac)
+    tx["esp_now"].add_peer(rx_node.mac)
+    tx["sequence"] = random.getrandbits(16)
+    tx["session"].reset(rx_node.mac)
+    return node, tx
+
+
+async def transmit(node, tx, stop, sent):
+    esp, listener, sender = node.esp, tx["listener"], tx["sender"]
+    next_send = ticks_ms() + random.randrange(SEND_INTERVAL_MS)
+    while ticks_ms() < stop:
+        if sender is not None:
+            sender.poll()  # acks, retransmits, the rest goes to the listener
+        while esp.any():
+            listener.handle(*esp.recv())
+        if ticks_ms() >= next_send:
+            tx["send_message"]()
+            sent[0] += 1
+            next_send += SEND_INTERVAL_MS
+        await asyncio.sleep_ms(1)
+
+
+async def end_to_end(slots, restart, reliable=False, loss=0.0, seed=1):
+    random.seed(seed)
+    air = Air(loss, 2, seed=seed)
+    rx_node = air.node(channel=CHANNEL)
+    with air.attach(rx_node):
+        rx = benchutil.run_script(RX_SCRIPT, {"UART_BAUD": 921600, "SESSION_SLOTS": slots},
+                                  name="simrx", scope={"print": quiet})
+    with open(TX_SCRIPT) as f:
+        source = f.read()
+    if reliable:
+        source = source.replace("RELIABLE_DELIVERY = False", "RELIABLE_DELIVERY = True", 1)
+    code = compile(source, TX_SCRIPT, "exec")
+    txs = [load(air, code, rx_node) for _ in range(NODES)]
+    tasks = [asyncio.create_task(rx["main"]()), asyncio.create_task(air.run())]
+    sent = [0]
+    stop = ticks_ms() + RUN_MS
+    runs = [asyncio.create_task(transmit(node, tx, stop, sent)) for node, tx in txs]
+    if restart:
+        await asyncio.sleep_ms(RUN_MS // 2)
+        # What a reboot loses: the session table and dedup windows
+        rx["sessions"] = SessionTable(rx["peers"].send, slots)
+        rx["delivery"] = ReliableReceiver(rx["peers"].send)
+    await asyncio.gather(*runs)
+    for node, tx in txs:
+        if tx["sender"] is not None:
+            tx["sender"].flush(1000)
+    await asyncio.sleep_ms(200)
+    for task in tasks:
+        task.cancel()
+    serials = {tx["SERIAL_NUMBER"] for _, tx in txs}
+    lines = [line.decode() for _, line in rx["uart"].lines]
+    records = [line.split("|") for line in lines if line.startswith("PsGadget-IO|")]
+    # Lines before the first machine type (full frames carry it every few) have none
+    wrong = sum(1 for r in records if r[1] not in serials or r[2] not in ("", txs[0][1]["MACHINE_TYPE"]))
+    clients = [tx["session"].stats() for _, tx in txs]
+    return {
+        "sent": sent[0],
+        "lines": len(records),
+        "wrong": wrong,
+        "in_session": sum(1 for c in clients if c["sid"] is not None),
+        "registers": sum(c["registers"] for c in clients),
+        "rejects": sum(c["rejects"] for c in clients),
+        "resent": sum(c["resent"] for c in clients),
+        "lost": sum(tx["sender"].lost for _, tx in txs if tx["sender"] is not None),
+        # the restarted receiver takes anything below the first number it
+        # hears from a transmitter for a duplicate, acks it and drops it
+        "dropped": sum((rx["delivery"].stats(node.mac) or {"duplicates": 0})["duplicates"] for node, _ in txs),
+        "receiver": rx["sessions"].stats(),
+    }
+
+
+def main():
+    print_sizes()
+    receiver_cost()
+    print("\n{} transmitters, a frame every {} ms for {} ms".format(NODES, SEND_INTERVAL_MS, RUN_MS))
+    print("{:<38} {:>5} {:>6} {:>6} {:>11} {:>10} {:>8} {:>7} {:>5}".format(
+        "run", "sent", "lines", "wrong", "in session", "registers", "rejects", "resent", "lost"))
+    runs = (("receiver restart", 64, True, False, 0.0), ("4 slots", 4, False, False, 0.0),
+            ("receiver restart, reliable, 10% loss", 64, True, True, 0.1))
+    for name, slots, restart, reliable, loss in runs:
+        r = asyncio.run(end_to_end(slots, restart, reliable, loss))
+        print("{:<38} {:>5} {:>6} {:>6} {:>8}/{:<2} {:>10} {:>8} {:>7} {:>5}".format(
+            name, r["sent"], r["lines"], r["wrong"], r["in_session"], NODES, r["registers"], r["rejects"],
+            r["resent"], r["lost"]))
+        # a frame given up on may still have got through, only its acks lost
+        assert r["wrong"] == 0 and r["sent"] - r["lost"] - r["dropped"] <= r["lines"] <= r["sent"], r
+
+
+main()
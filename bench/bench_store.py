@@ -0,0 +1,183 @@
+# Columnar store (host/psgadget_store.py) on synthetic telemetry.
+#
+# 1. Ingest: RECORDS records (as psgadget_ingest.parse_record gives them)
+#    from DEVICES transmitters, one a minute each, a tenth of them in
+#    deadband mode (count/min/max/mean, heartbeat), written like the import
+#    command does (a flush every FLUSH_ROWS rows) and, on a slice of them,
+#    a flush every few hundred rows to show what per-batch flushes cost.
+#    Records/s and bytes on disk per record against the JSON lines log.
+# 2. Queries on a store opened fresh: range scans of one device over an
+#    hour, a day and a week, hourly and daily aggregates of one device and
+#    of all devices, median ms of a few runs. The first query after opening
+#    (mapping the files) is timed on its own. For comparison, the week of
+#    one device found by re-parsing the JSON lines log, timed on a slice of
+#    the log and scaled up.
+#
+# Results are checked against the generated records of one device.
+#
+#   python3 bench/bench_store.py [records]
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import benchutil  # noqa: F401 (common/ on sys.path)
+
+sys.path.append("host")
+from psgadget_store import FLUSH_ROWS, ColumnStore  # noqa: E402
+
+RECORDS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+DEVICES = 100
+INTERVAL_MS = 60000
+START_MS = 1760000000000
+SMALL_FLUSH = 512
+LOG_SLICE = 200000
+HOUR = 3600000
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+
+
+def serial(n):
+    return "4827e210{:04x}".format(n)
+
+
+def records(count, seed=1):
+    """count records, DEVICES interleaved a minute apart, a little out of order."""
+    rng = random.Random(seed)
+    phases = [rng.randrange(INTERVAL_MS) for _ in range(DEVICES)]
+    temps = [36.0 + rng.random() * 4 for _ in range(DEVICES)]
+    for i in range(count):
+        n = i % DEVICES
+        t = START_MS + (i // DEVICES) * INTERVAL_MS + phases[n] + rng.randrange(-500, 500)
+        temps[n] += rng.gauss(0, 0.05)
+        record = {"gadget": "PsGadget-IO", "serial": serial(n), "machine": "Generic ESP32S3 module with ESP32S3",
+                  "temp": round(temps[n], 2), "battery": 99 - (i // DEVICES) // 2000,
+                  "message": "rgb(12, 200, 34)", "sent_ms": t, "rx_ms": t + 5, "port": "COM5",
+                  "received": (t + 20) / 1000}
+        if n % 10 == 0:
+            record.update(count=5, temp_min=record["temp"] - 0.1, temp_max=record["temp"] + 0.1,
+                          temp_mean=record["temp"], heartbeat_s=60)
+        yield record
+
+
+def disk_bytes(path):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+
+def ingest(path, count, flush_rows):
+    store = ColumnStore(path)
+    start = time.perf_counter()
+    for record in records(count):
+        store.append(record)
+        if store.pending >= flush_rows:
+            store.flush()
+    store.close()
+    return count / (time.perf_counter() - start)
+
+
+def timed(fn, runs=5):
+    """(median ms, result)"""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return times[len(times) // 2], result
+
+
+def check(store, device):
+    """Aggregates and scans of one device against the generated records."""
+    mine = sorted((r["sent_ms"], r["temp"], r.get("count"))
+                  for r in records(RECORDS) if r["serial"] == serial(device))
+    end = mine[0][0] + WEEK
+    rows = list(store.scan(serial(device), None, end, ("temp", "count")))
+    expected = [(t, temp, math.nan if c is None else c) for t, temp, c in mine if t < end]
+    assert len(rows) == len(expected), (len(rows), len(expected))
+    for got, want in zip(rows, expected):
+        assert got[0] == want[0] and got[1] == want[1] and (got[2] == want[2] or want[2] != want[2]), (got, want)
+    buckets = {}
+    for t, temp, _ in mine:
+        buckets.setdefault(t // DAY * DAY, []).append(temp)
+    aggregate = store.aggregate(serial(device), "temp", None, None, DAY)
+    assert [a[0] for a in aggregate] == sorted(buckets)
+    for key, count, low, high, mean in aggregate:
+        values = buckets[key]
+        assert (count, low, high) == (len(values), min(values), max(values))
+        assert abs(mean - sum(values) / count) < 1e-9
+
+
+def log_baseline(tmp, device, end):
+    """ms to find one device's records before end by re-parsing a JSON lines
+    log of LOG_SLICE records, scaled to RECORDS."""
+    path = os.path.join(tmp, "log.jsonl")
+    with open(path, "w") as f:
+        for record in records(min(LOG_SLICE, RECORDS)):
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
+    size = os.path.getsize(path)
+
+    def scan():
+        found = []
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                if record["serial"] == serial(device) and record["sent_ms"] < end:
+                    found.append((record["sent_ms"], record["temp"]))
+        return found
+    ms, _ = timed(scan, 3)
+    scale = RECORDS / min(LOG_SLICE, RECORDS)
+    return ms * scale, size * scale
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, "store")
+        span = RECORDS // DEVICES * INTERVAL_MS
+        print("{} records from {} devices, {:.1f} days".format(RECORDS, DEVICES, span / DAY))
+        rate = ingest(path, RECORDS, FLUSH_ROWS)
+        small = os.path.join(tmp, "small")
+        small_rate = ingest(small, min(RECORDS, 100000), SMALL_FLUSH)
+        shutil.rmtree(small)
+        stored = disk_bytes(path)
+        log_ms, log_size = log_baseline(tmp, 1, START_MS + WEEK)
+        print("{:<34} {:>10} {:>9}".format("ingest", "records/s", "B/record"))
+        print("{:<34} {:>10.0f} {:>9.1f}".format("flush every {} rows".format(FLUSH_ROWS), rate, stored / RECORDS))
+        print("{:<34} {:>10.0f} {:>9}".format("flush every {} rows".format(SMALL_FLUSH), small_rate, "-"))
+        print("{:<34} {:>10} {:>9.1f}".format("JSON lines log", "-", log_size / RECORDS))
+
+        store = ColumnStore(path)
+        device = serial(1)
+        start = time.perf_counter()
+        first = store.aggregate(device, "temp", START_MS, START_MS + WEEK, HOUR)
+        open_ms = (time.perf_counter() - start) * 1000
+        queries = (
+            ("scan 1 hour", lambda: list(store.scan(device, START_MS + DAY, START_MS + DAY + HOUR))),
+            ("scan 1 day", lambda: list(store.scan(device, START_MS + DAY, START_MS + 2 * DAY))),
+            ("scan 1 week", lambda: list(store.scan(device, START_MS, START_MS + WEEK))),
+            ("columns 1 week, 2 fields", lambda: store.columns(device, START_MS, START_MS + WEEK,
+                                                               ("temp", "battery"))),
+            ("hourly 1 week", lambda: store.aggregate(device, "temp", START_MS, START_MS + WEEK, HOUR)),
+            ("daily, all time", lambda: store.aggregate(device, "temp", None, None, DAY)),
+            ("hourly 1 day, all devices", lambda: store.aggregate(None, "temp", START_MS + DAY, START_MS + 2 * DAY,
+                                                                  HOUR)),
+            ("daily, all time, all devices", lambda: store.aggregate(None, "temp", None, None, DAY)),
+        )
+        print("\n{:<34} {:>10} {:>9}".format("query (one device unless said)", "ms", "rows"))
+        print("{:<34} {:>10.2f} {:>9}".format("open + hourly 1 week", open_ms, len(first)))
+        for name, query in queries:
+            ms, result = timed(query)
+            rows = len(result["t"]) if isinstance(result, dict) else len(result)
+            print("{:<34} {:>10.2f} {:>9}".format(name, ms, rows))
+        print("{:<34} {:>10.0f} {:>9}".format("JSON lines log, 1 week (scaled)", log_ms, "-"))
+        check(store, 1)
+        store.close()
+    finally:
+        shutil.rmtree(tmp)
+
+
+main()
@@ -0,0 +1,101 @@
+# Sustained frames/sec through the UART link over a pty stand-in (POSIX only).
+import os
+import select
+import sys
+import threading
+import time
+
+import benchutil  # also puts common/ on sys.path
+import uartlink
+from ticks import ticks_ms
+
+sys.path.append("host")
+from serialport import PosixSerial  # noqa: E402
+from psgadget_link import HostLink  # noqa: E402
+
+RECORD = b"PsGadget-IO|34b7da59d620|Generic ESP32S3 module with ESP32S3|46|99|rgb(12, 200, 34)"
+COUNT = 20000
+
+
+class PtyUART:
+    """machine.UART stand-in on the master side of a pty."""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.baud = uartlink.DEFAULT_BAUD
+
+    def any(self):
+        return 1 if select.select([self.fd], [], [], 0)[0] else 0
+
+    def read(self):
+        return os.read(self.fd, 4096)
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            select.select([], [self.fd], [])
+            n = os.write(self.fd, view)
+            view = view[n:]
+        return len(data)
+
+    def init(self, baudrate):
+        self.baud = baudrate
+
+    def flush(self):
+        pass
+
+
+def receiver(link, stop, batch):
+    """Poll for the handshake, then stream COUNT records in batches."""
+    while not stop.is_set() and not link.confirmed:
+        link.poll(ticks_ms())
+        time.sleep(0.001)
+    for i in range(COUNT):
+        link.send(RECORD)
+        if i % batch == batch - 1:
+            link.flush()
+    link.flush()
+
+
+def run(framed, batch=8):
+    master, slave = os.openpty()
+    link = uartlink.UartLink(PtyUART(master))
+    host = HostLink(PosixSerial(os.ttyname(slave), uartlink.DEFAULT_BAUD))
+    stop = threading.Event()
+    if not framed:
+        link.confirmed = True  # nothing to wait for in text mode
+    t = threading.Thread(target=receiver, args=(link, stop, batch))
+    t.start()
+    if framed:
+        assert host.handshake(921600), "handshake failed"
+    start = time.monotonic()
+    got = 0
+    while got < COUNT:
+        select.select([host.port.fd], [], [], 1)
+        for kind, payload in host.read():
+            assert payload == RECORD
+            got += 1
+    elapsed = time.monotonic() - start
+    stop.set()
+    t.join()
+    per_frame = len(RECORD) + (uartlink.OVERHEAD if framed else 1)
+    print("{:<7} {:>8.0f} frames/s over pty, {} bytes/frame, {} uart writes; "
+          "wire limit {:.0f} frames/s at 9600, {:.0f} at 921600".format(
+              "framed" if framed else "text", got / elapsed, per_frame, link.writes,
+              960 / per_frame, 92160 / per_frame))
+    os.close(master)
+    host.port.close()
+    os.close(slave)
+
+
+run(False)
+run(True)
+
+# Decoder must skip garbage and corrupt frames
+decoder = uartlink.FrameDecoder()
+good = uartlink.encode_frame(uartlink.K_RECORD, RECORD)
+bad = bytearray(good)
+bad[10] ^= 0xFF
+frames = decoder.feed(b"noise" + bytes(bad) + good[:7]) + decoder.feed(good[7:])
+assert frames == [(uartlink.K_RECORD, RECORD)] and decoder.crc_errors == 1
+benchutil.bench("FrameDecoder.feed one frame", lambda: decoder.feed(good))
@@ -0,0 +1,116 @@
+# Timing helpers shared by the benchmark scripts.
+# Works under CPython and the MicroPython unix port.
+import gc
+import sys
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:
+    from time import perf_counter
+
+    def ticks_us():
+        return int(perf_counter() * 1000000)
+
+    def ticks_diff(a, b):
+        return a - b
+
+# Make common/ importable when run from the repository root
+for path in ("common", "../common"):
+    if path not in sys.path:
+        sys.path.append(path)
+
+
+def allocated(fn, n=100):
+    """Heap bytes allocated per fn() call, None where it can't be measured.
+
+    MicroPython: bytes taken from the heap with the collector off, the
+    number to keep at 0 on paths that run per frame. CPython: the most
+    memory one call held at once (tracemalloc), which moves the same way.
+    """
+    if hasattr(gc, "mem_alloc"):
+        gc.collect()
+        gc.disable()
+        try:
+            start = gc.mem_alloc()
+            for _ in range(n):
+                fn()
+            return (gc.mem_alloc() - start) // n
+        except MemoryError:
+            return None
+        finally:
+            gc.enable()
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        peak = 0
+        for _ in range(n):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            fn()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+        return peak
+    finally:
+        tracemalloc.stop()
+
+
+def bench(name, fn, n=10000):
+    """Call fn() n times and print ops/sec and bytes allocated per call, returns ops/sec."""
+    fn()  # warm up
+    start = ticks_us()
+    for _ in range(n):
+        fn()
+    elapsed = ticks_diff(ticks_us(), start) or 1
+    ops = n * 1000000 / elapsed
+    alloc = allocated(fn, min(n, 100))
+    print("{:<40} {:>12.0f} ops/s {:>8.2f} us/op {:>7} B/op".format(
+        name, ops, elapsed / n, "?" if alloc is None else alloc))
+    return ops
+
+
+def use_stubs():
+    """Put the hardware stand-ins in bench/stubs/ first on sys.path.
+
+    Also gives CPython's time module the MicroPython extras the scripts use.
+    """
+    import os
+    import time
+    stubs = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stubs")
+    if stubs not in sys.path:
+        sys.path.insert(0, stubs)
+    if not hasattr(time, "sleep_ms"):
+        import ticks
+        for name in ("ticks_ms", "ticks_us", "ticks_diff", "ticks_add", "sleep_ms"):
+            setattr(time, name, getattr(ticks, name))
+
+
+def run_script(path, settings=None, name="__main__", scope=None):
+    """Run a gadget script with some of its top-level constants replaced.
+
+    settings maps constant names to values, e.g. {"LOW_POWER_MODE": True}.
+    With a name other than "__main__" only the setup runs, not the main
+    loop, so several instances can be loaded side by side. scope gives
+    extra globals, e.g. {"print": quiet}. Returns the script globals; if
+    the script raises, they are attached to the exception as e.scope.
+    """
+    import re
+    with open(path) as f:
+        source = f.read()
+    for const, value in (settings or {}).items():
+        source, n = re.subn(r"(?m)^{} = .*?(\s*#.*)?$".format(const),
+                            lambda m: "{} = {!r}{}".format(const, value, m.group(1) or ""), source)
+        if not n:
+            raise ValueError("{} not found in {}".format(const, path))
+    scope = dict(scope or {})
+    scope.update({"__name__": name, "__file__": path})
+    try:
+        exec(compile(source, path, "exec"), scope)
+    except BaseException as e:
+        e.scope = scope
+        raise
+    return scope
@@ -0,0 +1,103 @@
+# Run every bench/bench_*.py and collect their ops/s and B/op lines, so a
+# change can be checked against the numbers from before it:
+#
+#   python3 bench/run_all.py --save before.json
+#   (change things)
+#   python3 bench/run_all.py --compare before.json
+#   python3 bench/run_all.py --python micropython bench_frame bench_scripts
+#
+# Each script runs in its own interpreter (CPython, or the MicroPython unix
+# port with --python). A benchmark more than --threshold slower, or that
+# allocates noticeably more per call, is reported and the exit status is 1.
+import argparse
+import glob
+import json
+import os
+import re
+import subprocess
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+RESULT = re.compile(r"^(.*?)\s+([\d.]+) ops/s\s+[\d.]+ us/op\s+(\S+) B/op$")
+
+
+def run(script, python, timeout):
+    """Run one benchmark script, returns ({name: (ops, bytes)}, error)."""
+    try:
+        proc = subprocess.run([python, script], cwd=ROOT, capture_output=True, text=True,
+                              timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {}, "timed out"
+    results = {}
+    for line in proc.stdout.splitlines():
+        m = RESULT.match(line.strip())
+        if m:
+            alloc = m.group(3)
+            results[m.group(1)] = (float(m.group(2)), int(alloc) if alloc.isdigit() else None)
+    if proc.returncode:
+        return results, (proc.stderr.strip().splitlines() or ["exit {}".format(proc.returncode)])[-1]
+    return results, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the benchmark scripts and compare results.")
+    parser.add_argument("names", nargs="*", help="scripts to run, e.g. bench_frame (default: all)")
+    parser.add_argument("--python", default=sys.executable, help="interpreter, e.g. micropython")
+    parser.add_argument("--skip", nargs="*", default=[], help="scripts not to run")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds per script")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare against results saved with --save")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="slowdown reported as a regression (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    scripts = sorted(glob.glob(os.path.join(BENCH_DIR, "bench_*.py")))
+    names = [os.path.basename(s)[:-3] for s in scripts]
+    wanted = [n[:-3] if n.endswith(".py") else n for n in args.names] or names
+    skip = [n[:-3] if n.endswith(".py") else n for n in args.skip]
+    results = {}
+    failed = []
+    for script, name in zip(scripts, names):
+        if name not in wanted or name in skip:
+            continue
+        found, error = run(os.path.relpath(script, ROOT), args.python, args.timeout)
+        print("{:<20} {:>3} results{}".format(name, len(found), "  FAILED: " + error if error else ""))
+        if error:
+            failed.append(name)
+        for bench, value in found.items():
+            results["{}: {}".format(name, bench)] = value
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print("\n{:<60} {:>12} {:>12} {:>7} {:>12}".format("benchmark", "before ops/s", "now ops/s",
+                                                         "change", "B/op"))
+        for key in sorted(results):
+            if key not in baseline:
+                continue
+            (ops, alloc), (old_ops, old_alloc) = results[key], baseline[key]
+            change = ops / old_ops - 1 if old_ops else 0
+            flag = ""
+            if change < -args.threshold:
+                flag = "  SLOWER"
+            # a few bytes either way come from variable length text
+            if alloc is not None and old_alloc is not None and alloc > old_alloc \
+                    and (old_alloc == 0 or alloc > old_alloc * 1.1):
+                flag += "  ALLOCATES MORE"
+            if flag:
+                regressions.append(key)
+            print("{:<60} {:>12.0f} {:>12.0f} {:>+6.0%} {:>5} -> {:<5}{}".format(
+                key[:60], old_ops, ops, change, "?" if old_alloc is None else old_alloc,
+                "?" if alloc is None else alloc, flag))
+    if failed or regressions:
+        print("\n{} failed, {} regressed".format(len(failed), len(regressions)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
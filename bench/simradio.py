@@ -0,0 +1,259 @@
+# In-process ESP-NOW radio simulator for running many gadget scripts in
+# one interpreter (off-device runs only).
+#
+#   air = Air(loss=0.02, latency_ms=2)
+#   rx = air.node(channel=6)
+#   with air.attach(rx):            # espnow.ESPNow(), network.WLAN() and
+#       scope = load the script     # machine.unique_id() give rx's radio
+#   asyncio.create_task(air.run())  # delivers frames when they are due
+#
+# Every node has its own MAC, channel and receive buffer. A frame reaches
+# the nodes on the sender's channel: one node for a unicast MAC, all others
+# for the broadcast address. Frames go out one at a time per channel, so
+# airtime (192 us + (43 + len) * 8 us) adds up under load, then take
+# latency_ms + up to jitter_ms to arrive, or are lost with probability
+# loss. A unicast send(sync=True) returns whether the frame arrived, like
+# the MAC-level ack. Frames that don't fit the receiver's buffer (rxbuf
+# bytes, as on the driver) are dropped and counted in its stats().
+#
+# recv() never blocks: everything runs on one thread, a script waiting on
+# the radio would stop the nodes it is waiting for.
+import heapq
+import random
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+import espnow
+import machine
+import network
+from ticks import ticks_ms, ticks_us, ticks_diff
+
+BROADCAST = b"\xff" * 6
+RXBUF = 526  # driver default receive buffer, bytes
+ESP_ERR_ESPNOW_NOT_FOUND = -12395
+ESP_ERR_ESPNOW_EXIST = -12397
+ESP_ERR_ESPNOW_FULL = -12394
+
+
+def airtime_us(n):
+    return 192 + (43 + n) * 8
+
+
+class SimWLAN:
+    def __init__(self, node):
+        self.node = node
+        self._active = False
+        self._config = {"essid": ""}
+
+    def active(self, flag=None):
+        if flag is not None:
+            self._active = bool(flag)
+        return self._active
+
+    def config(self, *args, **kwargs):
+        if args:
+            if args[0] == "mac":
+                return self.node.mac
+            if args[0] == "channel":
+                return self.node.channel
+            return self._config[args[0]]
+        self.node.channel = kwargs.pop("channel", self.node.channel)
+        self._config.update(kwargs)
+
+    def disconnect(self):
+        pass
+
+    def isconnected(self):
+        return False
+
+
+class SimESPNow:
+    def __init__(self, node):
+        self.node = node
+        self._active = False
+        self._irq = None
+        self._peers = {}
+        self._queue = []
+        self._queued = 0  # bytes in _queue
+        self.rxbuf = RXBUF
+        # tx_pkts, tx_responses, tx_failures, rx_packets, rx_dropped, like the driver
+        self._stats = [0, 0, 0, 0, 0]
+
+    def active(self, flag=None):
+        if flag is not None:
+            self._active = bool(flag)
+        return self._active
+
+    def config(self, rxbuf=None, **kwargs):
+        if rxbuf is not None:
+            self.rxbuf = rxbuf
+
+    def irq(self, callback):
+        self._irq = callback
+
+    def any(self):
+        return bool(self._queue)
+
+    def recv(self, timeout_ms=None):
+        if not self._queue:
+            return [None, None]
+        mac, msg = self._queue.pop(0)
+        self._queued -= len(msg)
+        return [mac, msg]
+
+    irecv = recv
+
+    def send(self, mac, msg=None, sync=True):
+        if msg is None:
+            mac, msg = None, mac
+        if mac is None:
+            acked = True
+            for peer in list(self._peers):
+                acked = self.send(peer, msg, sync) and acked
+            return acked
+        mac = bytes(mac)
+        if mac not in self._peers:
+            raise OSError(ESP_ERR_ESPNOW_NOT_FOUND, "ESP_ERR_ESPNOW_NOT_FOUND")
+        self._stats[0] += 1
+        acked = self.node.air.transmit(self.node, mac, bytes(msg))
+        if mac != BROADCAST:
+            if acked:
+                self._stats[1] += 1
+            else:
+                self._stats[2] += 1
+        return acked or not sync
+
+    def _receive(self, mac, msg):
+        if not self._active:
+            return
+        if self._queued + len(msg) > self.rxbuf:
+            self._stats[4] += 1
+            return
+        self._queue.append((mac, msg))
+        self._queued += len(msg)
+        self._stats[3] += 1
+        if self._irq is not None:
+            self._irq(self)
+
+    def add_peer(self, mac, *args, **kwargs):
+        mac = bytes(mac)
+        if mac in self._peers:
+            raise OSError(ESP_ERR_ESPNOW_EXIST, "ESP_ERR_ESPNOW_EXIST")
+        if len(self._peers) >= espnow.MAX_PEERS:
+            raise OSError(ESP_ERR_ESPNOW_FULL, "ESP_ERR_ESPNOW_FULL")
+        self._peers[mac] = args
+
+    def del_peer(self, mac):
+        if self._peers.pop(bytes(mac), None) is None:
+            raise OSError(ESP_ERR_ESPNOW_NOT_FOUND, "ESP_ERR_ESPNOW_NOT_FOUND")
+
+    def get_peers(self):
+        return tuple((mac,) + tuple(args) for mac, args in self._peers.items())
+
+    def stats(self):
+        return tuple(self._stats)
+
+
+class Node:
+    def __init__(self, air, mac, channel):
+        self.air = air
+        self.mac = mac
+        self.channel = channel
+        self.lost = 0  # frames to this node lost on the air
+        self.wlan = SimWLAN(self)
+        self.esp = SimESPNow(self)
+
+
+class Air:
+    def __init__(self, loss=0.0, latency_ms=2, jitter_ms=1, seed=1):
+        self.loss = loss
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.random = random.Random(seed)
+        self.nodes = {}      # mac -> Node
+        self._pending = []   # heap of (due_ms, n, node, src mac, frame)
+        self._n = 0
+        self._busy = {}      # channel -> ticks_us() the channel is free again
+        # Counters
+        self.sent = 0
+        self.lost = 0
+        self.delivered = 0
+
+    def node(self, mac=None, channel=1):
+        """A new radio, with a random locally administered MAC unless given."""
+        while mac is None or mac in self.nodes:
+            mac = bytes([0x36] + [self.random.getrandbits(8) for _ in range(5)])
+        node = self.nodes[mac] = Node(self, mac, channel)
+        return node
+
+    def attach(self, node):
+        """Context manager: scripts loaded inside it get node's radio."""
+        return _Attach(node)
+
+    def transmit(self, src, dst, msg):
+        """Put a frame on the air, returns True if a unicast frame will arrive."""
+        self.sent += 1
+        now_us = ticks_us()
+        start = self._busy.get(src.channel, now_us)
+        if ticks_diff(start, now_us) < 0:
+            start = now_us
+        end = start + airtime_us(len(msg))
+        self._busy[src.channel] = end
+        due = ticks_ms() + ticks_diff(end, now_us) // 1000 + self.latency_ms
+        if self.jitter_ms:
+            due += self.random.randrange(self.jitter_ms + 1)
+        if dst == BROADCAST:
+            targets = [n for n in self.nodes.values() if n is not src and n.channel == src.channel]
+        else:
+            node = self.nodes.get(dst)
+            targets = [node] if node is not None and node.channel == src.channel else []
+        arrived = False
+        for node in targets:
+            if self.random.random() < self.loss:
+                self.lost += 1
+                node.lost += 1
+                continue
+            self._n += 1
+            heapq.heappush(self._pending, (due, self._n, node, src.mac, msg))
+            arrived = True
+        return arrived
+
+    def deliver_due(self, now=None):
+        """Hand over the frames due by now, returns how many."""
+        now = ticks_ms() if now is None else now
+        n = 0
+        while self._pending and ticks_diff(self._pending[0][0], now) <= 0:
+            _, _, node, mac, msg = heapq.heappop(self._pending)
+            node.esp._receive(mac, msg)
+            n += 1
+        self.delivered += n
+        return n
+
+    async def run(self, tick_ms=1):
+        while True:
+            self.deliver_due()
+            await asyncio.sleep_ms(tick_ms)
+
+    def stats(self):
+        dropped = sum(n.esp._stats[4] for n in self.nodes.values())
+        return {"sent": self.sent, "lost": self.lost, "delivered": self.delivered,
+                "rx_dropped": dropped, "pending": len(self._pending)}
+
+
+class _Attach:
+    def __init__(self, node):
+        self.node = node
+
+    def __enter__(self):
+        self.saved = (espnow.ESPNow, network.WLAN, machine.unique_id)
+        node = self.node
+        espnow.ESPNow = lambda: node.esp
+        network.WLAN = lambda interface=network.STA_IF: node.wlan
+        machine.unique_id = lambda: node.mac
+        return node
+
+    def __exit__(self, *exc):
+        espnow.ESPNow, network.WLAN, machine.unique_id = self.saved
@@ -0,0 +1,9 @@
+# Stand-in for the MicroPython esp32 module (off-device runs only).
+
+
+def mcu_temperature():
+    return 46
+
+
+def raw_temperature():
+    return 115
@@ -0,0 +1,102 @@
+# Stand-in for the MicroPython espnow module (off-device runs only).
+# beacons are delivered to an ESPNow object beacon_delay seconds after it
+# is made active; sent frames are recorded in `sent` and acknowledged
+# unless ack is False. A simulated radio can set on_send(esp, mac, msg):
+# its return value (if not None) is the ack, and it answers through
+# esp.deliver(mac, msg, delay).
+import threading
+import time
+
+MAX_DATA_LEN = 250
+KEY_LEN = 16
+MAX_PEERS = 20
+
+beacons = []        # (mac, msg) the simulated receiver broadcasts
+beacon_delay = 0.5
+sent = []           # (time.monotonic(), mac, msg)
+ack = True
+on_send = None
+
+
+class ESPNow:
+    def __init__(self):
+        self._active = False
+        self._queue = []
+        self._irq = None
+        self._peers = {}
+        self._stats = [0, 0, 0, 0, 0]
+        self._ready = threading.Condition()
+
+    def active(self, flag=None):
+        if flag is not None:
+            if flag and not self._active and beacons:
+                timer = threading.Timer(beacon_delay, self._deliver, (list(beacons),))
+                timer.daemon = True
+                timer.start()
+            self._active = bool(flag)
+        return self._active
+
+    def irq(self, callback):
+        self._irq = callback
+
+    def _deliver(self, frames):
+        with self._ready:
+            self._queue.extend(frames)
+            self._stats[1] += len(frames)
+            self._ready.notify_all()
+        if self._irq is not None:
+            self._irq(self)
+
+    def deliver(self, mac, msg, delay=0):
+        """Queue a received frame, delay seconds from now."""
+        if delay <= 0:
+            self._deliver([(bytes(mac), bytes(msg))])
+            return
+        timer = threading.Timer(delay, self._deliver, ([(bytes(mac), bytes(msg))],))
+        timer.daemon = True
+        timer.start()
+
+    def any(self):
+        return bool(self._queue)
+
+    def recv(self, timeout_ms=None):
+        with self._ready:
+            if not self._queue and timeout_ms:
+                self._ready.wait_for(lambda: self._queue, timeout_ms / 1000)
+            if not self._queue:
+                return [None, None]
+            mac, msg = self._queue.pop(0)
+        return [mac, msg]
+
+    irecv = recv
+
+    def send(self, mac, msg=None, sync=True):
+        if msg is None:
+            mac, msg = None, mac
+        if mac is not None and bytes(mac) not in self._peers:
+            raise OSError(-12395, "ESP_ERR_ESPNOW_NOT_FOUND")
+        sent.append((time.monotonic(), mac, bytes(msg)))
+        self._stats[0] += 1
+        acked = on_send(self, mac, msg) if on_send is not None else None
+        if acked is None:
+            acked = ack
+        if not acked:
+            self._stats[2] += 1
+        return acked
+
+    def add_peer(self, mac, *args, **kwargs):
+        if bytes(mac) in self._peers:
+            raise OSError(-12397, "ESP_ERR_ESPNOW_EXIST")
+        if len(self._peers) >= MAX_PEERS:
+            raise OSError(-12394, "ESP_ERR_ESPNOW_FULL")
+        self._peers[bytes(mac)] = args
+
+    def del_peer(self, mac):
+        if self._peers.pop(bytes(mac), None) is None:
+            raise OSError(-12395, "ESP_ERR_ESPNOW_NOT_FOUND")
+
+    def get_peers(self):
+        return tuple((mac,) + tuple(args) for mac, args in self._peers.items())
+
+    def stats(self):
+        return tuple(self._stats)
@@ -0,0 +1,151 @@
+# Stand-in for the MicroPython machine module (off-device runs only).
+# RTC memory is kept at module level so it survives a simulated deepsleep.
+import os
+
+PWRON_RESET = 1
+HARD_RESET = 2
+WDT_RESET = 3
+DEEPSLEEP_RESET = 4
+SOFT_RESET = 5
+
+UNIQUE_ID = os.urandom(6)
+
+_rtc_memory = b""
+_reset_cause = PWRON_RESET
+sleeps = []         # (kind, ms) for every lightsleep/deepsleep call
+sleep_budget = None  # lightsleep raises KeyboardInterrupt once this many sleeps happened
+
+
+class DeepSleepReset(BaseException):
+    """Raised by deepsleep(), the board would reboot here."""
+
+
+def unique_id():
+    return UNIQUE_ID
+
+
+def reset_cause():
+    return _reset_cause
+
+
+def power_on():
+    """Simulate pulling the power: RTC memory is lost."""
+    global _rtc_memory, _reset_cause
+    _rtc_memory = b""
+    _reset_cause = PWRON_RESET
+    del sleeps[:]
+
+
+def lightsleep(ms=None):
+    sleeps.append(("light", ms))
+    if sleep_budget is not None and len(sleeps) >= sleep_budget:
+        raise KeyboardInterrupt
+
+
+def deepsleep(ms=None):
+    global _reset_cause
+    sleeps.append(("deep", ms))
+    _reset_cause = DEEPSLEEP_RESET
+    raise DeepSleepReset
+
+
+def reset():
+    global _reset_cause
+    _reset_cause = SOFT_RESET
+    raise DeepSleepReset
+
+
+class Pin:
+    IN = 1
+    OUT = 3
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self._value = value or 0
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        self._value = 1 if v else 0
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1):
+        self.id = id
+        self.callback = None
+
+    def init(self, mode=PERIODIC, period=-1, callback=None):
+        self.callback = callback
+
+    def deinit(self):
+        self.callback = None
+
+
+class RTC:
+    def memory(self, data=None):
+        global _rtc_memory
+        if data is None:
+            return _rtc_memory
+        _rtc_memory = bytes(data)
+
+    def datetime(self, dt=None):
+        import time
+        if dt is None:
+            t = time.localtime()
+            return (t[0], t[1], t[2], t[6], t[3], t[4], t[5], 0)
+
+
+class UART:
+    """Bytes written are kept in `written` and as (ticks_ms(), line) in
+    `lines`, `feed()` queues bytes to read."""
+
+    def __init__(self, id, baudrate=9600, **kwargs):
+        self.id = id
+        self.baudrate = baudrate
+        self.written = bytearray()
+        self.lines = []
+        self._line = bytearray()
+        self._rx = bytearray()
+
+    def init(self, baudrate=9600, **kwargs):
+        self.baudrate = baudrate
+
+    def feed(self, data):
+        self._rx.extend(data)
+
+    def any(self):
+        return len(self._rx)
+
+    def read(self, n=None):
+        if not self._rx:
+            return None
+        n = len(self._rx) if n is None else n
+        data = bytes(self._rx[:n])
+        del self._rx[:n]
+        return data
+
+    def write(self, data):
+        from ticks import ticks_ms
+        self.written.extend(data)
+        self._line.extend(data)
+        while True:
+            end = self._line.find(b"\n")
+            if end < 0:
+                break
+            self.lines.append((ticks_ms(), bytes(self._line[:end])))
+            del self._line[:end + 1]
+        return len(data)
+
+    def flush(self):
+        pass
@@ -0,0 +1,9 @@
+# Stand-in for the micropython module on CPython (off-device runs only).
+
+
+def const(value):
+    return value
+
+
+def native(f):
+    return f
@@ -0,0 +1,24 @@
+# Stand-in for the MicroPython neopixel module (off-device runs only).
+
+
+class NeoPixel:
+    def __init__(self, pin, n, bpp=3, timing=1):
+        self.pin = pin
+        self.n = n
+        self.pixels = [(0, 0, 0)] * n
+        self.writes = 0
+
+    def __len__(self):
+        return self.n
+
+    def __setitem__(self, index, color):
+        self.pixels[index] = color
+
+    def __getitem__(self, index):
+        return self.pixels[index]
+
+    def fill(self, color):
+        self.pixels = [color] * self.n
+
+    def write(self):
+        self.writes += 1
@@ -0,0 +1,33 @@
+# Stand-in for the MicroPython network module (off-device runs only).
+# There is one radio, so the channel is shared by all WLAN objects.
+import os
+
+channel = 1
+
+STA_IF = 0
+AP_IF = 1
+
+
+class WLAN:
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+        self._active = False
+        self._config = {"mac": os.urandom(6), "essid": ""}
+
+    def active(self, flag=None):
+        if flag is not None:
+            self._active = bool(flag)
+        return self._active
+
+    def config(self, *args, **kwargs):
+        global channel
+        if args:
+            return channel if args[0] == "channel" else self._config[args[0]]
+        channel = kwargs.pop("channel", channel)
+        self._config.update(kwargs)
+
+    def disconnect(self):
+        pass
+
+    def isconnected(self):
+        return False
@@ -0,0 +1,33 @@
+# Stand-in for uasyncio on CPython (off-device runs only), MicroPython
+# ports have it built in.
+from asyncio import *  # noqa: F401,F403
+import asyncio as _asyncio
+
+if not hasattr(_asyncio, "sleep_ms"):
+    async def sleep_ms(ms):
+        await _asyncio.sleep(ms / 1000)
+
+    class Stream:
+        """MicroPython's stream wrapper over a machine.UART stub.
+
+        read() checks any() every millisecond, on the board the task sleeps
+        until the UART has data.
+        """
+
+        def __init__(self, s, e=None):
+            self.s = s
+            self.wakeups = 0
+
+        async def read(self, n=-1):
+            while not self.s.any():
+                await _asyncio.sleep(0.001)
+            self.wakeups += 1
+            return self.s.read(n if n >= 0 else None)
+
+        def write(self, buf):
+            self.s.write(buf)
+
+        async def drain(self):
+            pass
+
+    StreamReader = StreamWriter = Stream
@@ -0,0 +1,2 @@
+# Stand-in for the MicroPython ubinascii module (off-device runs only).
+from binascii import *  # noqa: F401,F403
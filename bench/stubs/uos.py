@@ -0,0 +1,14 @@
+# Stand-in for the MicroPython uos module (off-device runs only).
+from os import *  # noqa: F401,F403
+
+
+class _Uname(tuple):
+    sysname = "esp32"
+    nodename = "esp32"
+    release = "1.24.0"
+    version = "v1.24.0 (stub)"
+    machine = "Generic ESP32S3 module with ESP32S3"
+
+
+def uname():
+    return _Uname(("esp32", "esp32", "1.24.0", "v1.24.0 (stub)", "Generic ESP32S3 module with ESP32S3"))
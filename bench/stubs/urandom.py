@@ -0,0 +1,2 @@
+# Stand-in for the MicroPython urandom module (off-device runs only).
+from random import *  # noqa: F401,F403
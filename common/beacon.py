@@ -0,0 +1,129 @@
+# Adaptive receiver beacon
+#
+# The beacon is the text "<mac>:<ssid>|<load>" broadcast over ESP-NOW. Old
+# transmitters only look for the ssid in it; load is a 0-255 hint (lower is
+# less busy). The bytes are built once and only rebuilt when load changes.
+# With a synced clock (clocksync.SyncClock) "|<reference ms>" is added,
+# taken just before sending.
+#
+# Beacons go out every min_ms after boot or kick() (call it when an unknown
+# transmitter shows up), and the interval doubles after every beacon up to
+# max_ms while nothing changes.
+#
+# Metrics: airtime is estimated for the 1 Mbps ESP-NOW rate, mean_latency_ms
+# is the mean wait for a transmitter that starts listening at a random time.
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+try:
+    import ubinascii as binascii
+except ImportError:
+    import binascii
+from ticks import ticks_ms, ticks_diff, ticks_add
+
+BROADCAST_MAC = b"\xff" * 6
+# 802.11 header, vendor action + ESP-NOW element and FCS around the payload
+FRAME_OVERHEAD = 43
+PREAMBLE_US = 192  # long preamble at 1 Mbps
+US_PER_BYTE = 8
+
+
+def airtime_us(payload_len):
+    """Estimated time on air for one ESP-NOW frame at 1 Mbps."""
+    return PREAMBLE_US + (FRAME_OVERHEAD + payload_len) * US_PER_BYTE
+
+
+class BeaconScheduler:
+    def __init__(self, esp_now, mac, ssid, load=None, min_ms=500, max_ms=15000, clock=None):
+        self.esp_now = esp_now
+        self.load = load
+        self.clock = clock
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.interval = min_ms
+        self._prefix = binascii.hexlify(mac, ":") + b":" + ssid.encode() + b"|"
+        self._load = None
+        self.payload = b""
+        self._build(0)
+        self._next = ticks_ms()  # first beacon right away
+        self._kick = None
+        # Metrics
+        self.sent = 0
+        self.errors = 0
+        self.kicks = 0
+        self.airtime_us = 0
+        self._interval_sum = 0
+        self._interval_sq_sum = 0
+
+    def _build(self, load):
+        load = min(max(load, 0), 255)
+        if load != self._load:
+            self._load = load
+            self.payload = self._prefix + str(load).encode()
+        return self.payload
+
+    def kick(self, now=None):
+        """Go back to fast beaconing, e.g. when an unknown transmitter appears."""
+        now = ticks_ms() if now is None else now
+        self.kicks += 1
+        self.interval = self.min_ms
+        if ticks_diff(self._next, ticks_add(now, self.min_ms)) > 0:
+            self._next = ticks_add(now, self.min_ms)
+        if self._kick is not None:
+            self._kick.set()
+
+    def send(self):
+        payload = self._build(self.load() if self.load is not None else 0)
+        now = self.clock.now() if self.clock is not None else None
+        if now is not None:
+            payload += b"|" + str(now).encode()
+        try:
+            self.esp_now.send(BROADCAST_MAC, payload, False)
+        except OSError as e:
+            self.errors += 1
+            print("Failed to send beacon:", e)
+            return
+        self.sent += 1
+        self.airtime_us += airtime_us(len(payload))
+
+    def step(self, now=None):
+        """Send a beacon if one is due, returns ms until the next one."""
+        now = ticks_ms() if now is None else now
+        wait = ticks_diff(self._next, now)
+        if wait > 0:
+            return wait
+        self.send()
+        interval = self.interval
+        self._interval_sum += interval
+        self._interval_sq_sum += interval * interval
+        self._next = ticks_add(now, interval)
+        self.interval = min(interval * 2, self.max_ms)
+        return interval
+
+    async def run(self):
+        self._kick = asyncio.Event()
+        while True:
+            wait = self.step()
+            try:
+                await asyncio.wait_for(self._kick.wait(), wait / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._kick.clear()
+
+    def mean_latency_ms(self):
+        if not self._interval_sum:
+            return 0
+        return self._interval_sq_sum / (2 * self._interval_sum)
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "errors": self.errors,
+            "kicks": self.kicks,
+            "interval_ms": self.interval,
+            "load": self._load,
+            "airtime_us": self.airtime_us,
+            "mean_latency_ms": int(self.mean_latency_ms()),
+        }
@@ -0,0 +1,182 @@
+# Clock synchronisation: host -> receiver -> transmitters
+#
+# The reference clock is Unix time in ms. The host sets it on the receiver
+# over UART ("time <ms>", see host/psgadget_link.py --sync), which also sets
+# the RTC so time.localtime() is right:
+#   clock = SyncClock(machine.RTC())
+#   clock.set(unix_ms)
+#   clock.now()                        # reference ms, None until set
+#   clock.now(pipeline.frame_ms)       # ...at an earlier ticks_ms()
+#
+# The receiver's beacons carry its reference time ("<mac>:<ssid>|<load>|<ms>",
+# see beacon.py). Transmitters fit offset and drift to the last few beacons
+# from their receiver and stamp frames with the send time (psgframe.T_TIME):
+#   estimator = ClockEstimator()
+#   estimator.beacon(msg)              # every frame from the receiver
+#   estimator.now()                    # reference ms, None until a beacon
+#
+# delay_ms is added to beacon times for the time on air (about 1 ms at
+# 1 Mbps); anything longer on the way makes stamps early by as much. A
+# jump of more than step_ms (the host set the receiver's clock) starts the
+# fit over.
+
+import time
+from ticks import ticks_ms, ticks_diff
+
+REBASE_MS = 3600000      # SyncClock moves its anchor this often, ticks_diff only spans a few days
+MAX_DRIFT = 0.0005       # 500 ppm, more is a bad fit rather than a bad crystal
+MIN_SPAN_MS = 10000      # beacons this far apart before drift is estimated
+# Seconds from 1970 to the port's epoch (2000 on the ESP32)
+EPOCH_OFFSET = 946684800 if time.gmtime(0)[0] == 2000 else 0
+
+
+def beacon_time(msg):
+    """Reference time in a beacon, None if it has none."""
+    msg = bytes(msg)
+    i = msg.rfind(b"|")
+    if i < 0 or msg.find(b"|") == i:
+        return None  # no time field (unsynced or older receiver)
+    try:
+        return int(msg[i + 1:])
+    except ValueError:
+        return None
+
+
+class SyncClock:
+    """Receiver side: reference time from the host, kept with ticks_ms()."""
+
+    def __init__(self, rtc=None):
+        self.rtc = rtc
+        self._ref = None
+        self._ticks = 0
+        # Counters
+        self.sets = 0
+        self.last_step_ms = 0  # how far the last set() moved the clock
+
+    @property
+    def synced(self):
+        return self._ref is not None
+
+    def set(self, ref_ms, now=None):
+        now = ticks_ms() if now is None else now
+        if self._ref is not None:
+            self.last_step_ms = ref_ms - self.now(now)
+        self._ref = ref_ms
+        self._ticks = now
+        self.sets += 1
+        if self.rtc is not None:
+            t = time.gmtime(ref_ms // 1000 - EPOCH_OFFSET)
+            self.rtc.datetime((t[0], t[1], t[2], t[6], t[3], t[4], t[5], 0))
+
+    def now(self, ticks=None):
+        """Reference ms at ticks (default now), None until set()."""
+        if self._ref is None:
+            return None
+        if ticks is None:
+            ticks = ticks_ms()
+            elapsed = ticks_diff(ticks, self._ticks)
+            if elapsed > REBASE_MS:
+                self._ref += elapsed
+                self._ticks = ticks
+                return self._ref
+            return self._ref + elapsed
+        return self._ref + ticks_diff(ticks, self._ticks)
+
+    def stats(self):
+        return {"synced": self.synced, "sets": self.sets, "last_step_ms": self.last_step_ms}
+
+
+class ClockEstimator:
+    """Transmitter side: offset and drift from (ticks_ms, reference) pairs."""
+
+    def __init__(self, window=8, step_ms=1000, stale_ms=3600000, delay_ms=1):
+        self.window = window
+        self.delay_ms = delay_ms
+        self.step_ms = step_ms
+        self.stale_ms = stale_ms  # no beacon for this long: unsynced again
+        self._samples = []  # (ticks_ms, reference ms)
+        # Fit, relative to the newest sample: ref = ref0 + dx + a + drift * dx
+        self._ticks0 = 0
+        self._ref0 = None
+        self._a = 0.0
+        self.drift = 0.0
+        # Counters
+        self.beacons = 0
+        self.steps = 0
+        self.last_error_ms = 0  # last beacon against the fit before it
+
+    @property
+    def synced(self):
+        return self._ref0 is not None
+
+    def drift_ppm(self):
+        """How fast ticks_ms() runs against the reference, + is fast."""
+        return -int(self.drift * 1000000)
+
+    def offset_ms(self):
+        """Reference minus ticks_ms() as of the last beacon, None until one."""
+        if self._ref0 is None:
+            return None
+        return self._ref0 + int(self._a) - self._ticks0
+
+    def add(self, ref_ms, now=None):
+        now = ticks_ms() if now is None else now
+        predicted = self.now(now)
+        if predicted is None:
+            self._samples = []  # first beacon, or none for stale_ms
+        else:
+            self.last_error_ms = ref_ms - predicted
+            if abs(self.last_error_ms) > self.step_ms:
+                self.steps += 1
+                self._samples = []
+        self.beacons += 1
+        self._samples.append((now, ref_ms))
+        if len(self._samples) > self.window:
+            self._samples.pop(0)
+        self._fit()
+
+    def beacon(self, msg, now=None):
+        """Take the time from a beacon, returns False if it has none."""
+        ref_ms = beacon_time(msg)
+        if ref_ms is None:
+            return False
+        self.add(ref_ms + self.delay_ms, now)
+        return True
+
+    def _fit(self):
+        # Least squares of y (reference minus local elapsed) on x (local ms
+        # before the newest sample), in small numbers for single precision floats
+        ticks0, ref0 = self._samples[-1]
+        n = len(self._samples)
+        xs = [ticks_diff(t, ticks0) for t, _ in self._samples]
+        ys = [ref - ref0 - x for (_, ref), x in zip(self._samples, xs)]
+        mx = sum(xs) / n
+        my = sum(ys) / n
+        sxx = sum((x - mx) * (x - mx) for x in xs)
+        drift = 0.0
+        if n > 1 and -xs[0] >= MIN_SPAN_MS and sxx:
+            drift = sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sxx
+            drift = max(-MAX_DRIFT, min(MAX_DRIFT, drift))
+        self._ticks0 = ticks0
+        self._ref0 = ref0
+        self._a = my - drift * mx
+        self.drift = drift
+
+    def now(self, ticks=None):
+        """Reference ms at ticks (default now), None without a recent beacon."""
+        if self._ref0 is None:
+            return None
+        dx = ticks_diff(ticks_ms() if ticks is None else ticks, self._ticks0)
+        if dx > self.stale_ms:
+            return None
+        return self._ref0 + dx + int(self._a + self.drift * dx)
+
+    def stats(self):
+        return {
+            "synced": self.synced,
+            "beacons": self.beacons,
+            "steps": self.steps,
+            "offset_ms": self.offset_ms(),
+            "drift_ppm": self.drift_ppm(),
+            "last_error_ms": self.last_error_ms,
+        }
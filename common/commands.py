@@ -0,0 +1,54 @@
+# Command dispatch table: UART commands from the host on receivers, commands
+# passed on over ESP-NOW (downlink.py) on transmitters
+#
+#   commands = CommandTable(reply)
+#   commands.add("status", lambda args: "ESP32 status: Active", "receiver status")
+#   commands.dispatch("status")   # -> reply("ESP32 status: Active")
+#
+# A command line is "<name> [args]". The handler gets the rest of the line
+# (stripped, "" if none) and returns a reply line, a list of lines or None.
+# Unknown commands and handlers that raise are answered with an "error ..."
+# line, so the host never waits for a reply that isn't coming. "help" lists
+# the registered commands.
+
+
+class CommandTable:
+    def __init__(self, reply):
+        self.reply = reply
+        self._handlers = {}  # name -> (handler, help text)
+        self.add("help", self._help, "list commands")
+        # Counters
+        self.handled = 0
+        self.unknown = 0
+        self.errors = 0
+
+    def add(self, name, handler, help=""):
+        self._handlers[name] = (handler, help)
+
+    def dispatch(self, line):
+        """Run the handler for a command line and send its reply, True if it ran."""
+        name, _, args = line.strip().partition(" ")
+        entry = self._handlers.get(name)
+        if entry is None:
+            self.unknown += 1
+            self.reply("error unknown command {}".format(name))
+            return False
+        try:
+            result = entry[0](args.strip())
+        except Exception as e:
+            self.errors += 1
+            self.reply("error {}: {}".format(name, e))
+            return False
+        self.handled += 1
+        if isinstance(result, str):
+            self.reply(result)
+        elif result is not None:
+            for reply_line in result:
+                self.reply(reply_line)
+        return True
+
+    def _help(self, args):
+        return ["{} - {}".format(name, self._handlers[name][1]) for name in sorted(self._handlers)]
+
+    def stats(self):
+        return {"handled": self.handled, "unknown": self.unknown, "errors": self.errors}
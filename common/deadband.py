@@ -0,0 +1,81 @@
+# Report-by-exception for transmitters
+#
+# Readings are taken often (every few hundred ms) but only sent when one
+# moves out of its deadband around the last value sent, or when nothing has
+# been sent for heartbeat_ms. The readings in between are summed up as
+# count/min/max/mean of the temperature, sent along in the next frame
+# (psgframe.T_AGG), so a spike that came and went still shows.
+#
+#   band = Deadband(temp=0.5, battery=2, heartbeat_ms=60000)
+#   why = band.add(temp, battery)     # None, CHANGE or HEARTBEAT
+#   if why:
+#       ext = [band.agg_tlv(), psgframe.heartbeat_tlv(band.heartbeat_ms // 1000)]
+#       ...send...
+#       band.sent(temp, battery)
+#
+# Frames carry the heartbeat so receivers and the host know how long a
+# silent transmitter is still fine (liveness.py).
+
+import psgframe
+from ticks import ticks_ms, ticks_diff
+
+CHANGE = 1     # a reading left the deadband (or nothing was sent yet)
+HEARTBEAT = 2  # nothing moved, but the heartbeat is due
+
+
+class Deadband:
+    def __init__(self, temp=0.5, battery=2, heartbeat_ms=60000):
+        self.temp = temp        # degrees C either way of the last temperature sent
+        self.battery = battery  # percent either way of the last battery level sent
+        self.heartbeat_ms = heartbeat_ms
+        self._temp = None  # last sent
+        self._battery = None
+        self._sent_at = 0
+        # Readings since the last send
+        self.count = 0
+        self.low = 0
+        self.high = 0
+        self.total = 0
+        # Counters
+        self.readings = 0
+        self.changes = 0
+        self.heartbeats = 0
+
+    def add(self, temp, battery, now=None):
+        """Take a reading, returns CHANGE or HEARTBEAT if it should be sent, else None."""
+        now = ticks_ms() if now is None else now
+        if self.count:
+            self.low = min(self.low, temp)
+            self.high = max(self.high, temp)
+            self.total += temp
+        else:
+            self.low = self.high = self.total = temp
+        self.count += 1
+        self.readings += 1
+        if (self._temp is None or abs(temp - self._temp) > self.temp
+                or abs(battery - self._battery) > self.battery):
+            self.changes += 1
+            return CHANGE
+        if ticks_diff(now, self._sent_at) >= self.heartbeat_ms:
+            self.heartbeats += 1
+            return HEARTBEAT
+        return None
+
+    def agg_tlv(self):
+        """T_AGG extension for the readings since the last send."""
+        return psgframe.agg_tlv(self.count, self.low, self.high, self.total / max(self.count, 1))
+
+    def sent(self, temp, battery, now=None):
+        """Note a frame with these values went out, starts a new window."""
+        self._temp = temp
+        self._battery = battery
+        self._sent_at = ticks_ms() if now is None else now
+        self.count = 0
+
+    def stats(self):
+        return {
+            "readings": self.readings,
+            "changes": self.changes,
+            "heartbeats": self.heartbeats,
+            "suppressed": self.readings - self.changes - self.heartbeats,
+        }
@@ -0,0 +1,160 @@
+# Resident known-device table with write-behind flash persistence
+#
+# The whole table lives in RAM, keyed on the raw 6-byte MAC. Updates only
+# touch RAM; maybe_flush() (called from the main loop, never the radio IRQ)
+# appends the changed entries to the known devices file, which doubles as an
+# append-only journal: later lines win when the file is loaded. Once the
+# journal holds COMPACT_FACTOR times more lines than devices it is rewritten
+# with one line per device: written to a .tmp file first, then renamed over
+# the journal (atomic on littlefs). On filesystems whose rename won't replace
+# a file (FAT) the journal is removed first, and load() picks the .tmp file
+# up if a reset came in between.
+
+try:
+    import uos as os
+except ImportError:
+    import os
+try:
+    import ubinascii as binascii
+except ImportError:
+    import binascii
+from ticks import ticks_ms, ticks_diff
+
+COMPACT_FACTOR = 4
+
+
+class DeviceTable:
+    def __init__(self, path, flush_interval_ms=60000, max_dirty=16):
+        self.path = path
+        self.flush_interval_ms = flush_interval_ms
+        self.max_dirty = max_dirty
+        self.devices = {}   # raw mac -> last seen
+        self._dirty = {}    # raw mac -> None, changed since last flush
+        self._last_flush = ticks_ms()
+        self.journal_lines = 0
+        # Counters
+        self.bytes_written = 0
+        self.flushes = 0
+        self.compactions = 0
+        self.load()
+
+    def __len__(self):
+        return len(self.devices)
+
+    def __contains__(self, mac):
+        return bytes(mac) in self.devices
+
+    def load(self):
+        """Read the journal into RAM, later lines override earlier ones."""
+        self.devices = {}
+        self.journal_lines = 0
+        try:
+            os.stat(self.path)
+        except OSError:
+            try:
+                # Reset during compact(), between remove and rename
+                os.rename(self.path + ".tmp", self.path)
+            except OSError:
+                pass
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    parts = line.strip().split("|")
+                    if len(parts) != 2:
+                        print("Skipping malformed line in {}: {}".format(self.path, line.strip()))
+                        continue
+                    try:
+                        mac = binascii.unhexlify(parts[0].replace(":", ""))
+                    except ValueError:
+                        print("Skipping malformed line in {}: {}".format(self.path, line.strip()))
+                        continue
+                    if len(mac) == 6:
+                        self.devices[mac] = parts[1]
+                    self.journal_lines += 1
+        except OSError:
+            print("Could not open {}. It may not exist yet.".format(self.path))
+
+    def touch(self, mac, seen):
+        """Record that mac was seen at seen, returns True for a new device.
+
+        Only updates RAM so it is safe to call from the ESP-NOW callback.
+        """
+        if not isinstance(mac, bytes):
+            mac = bytes(mac)
+        new_device = mac not in self.devices
+        self.devices[mac] = seen
+        self._dirty[mac] = None
+        return new_device
+
+    def last_seen(self, mac):
+        return self.devices.get(bytes(mac))
+
+    def dirty(self):
+        return len(self._dirty)
+
+    def maybe_flush(self, now=None):
+        """Flush if enough entries are dirty or the flush interval passed."""
+        if not self._dirty:
+            return False
+        if now is None:
+            now = ticks_ms()
+        if len(self._dirty) >= self.max_dirty or \
+                ticks_diff(now, self._last_flush) >= self.flush_interval_ms:
+            self.flush(now)
+            return True
+        return False
+
+    def flush(self, now=None):
+        """Append dirty entries to the journal, compacting when it grows."""
+        dirty, self._dirty = self._dirty, {}
+        self._last_flush = ticks_ms() if now is None else now
+        if not dirty:
+            return
+        if self.journal_lines + len(dirty) > COMPACT_FACTOR * max(len(self.devices), 1):
+            if not self.compact():
+                self._dirty.update(dirty)
+            return
+        try:
+            with open(self.path, "a") as f:
+                for mac in dirty:
+                    self.bytes_written += f.write(self._line(mac))
+            self.journal_lines += len(dirty)
+            self.flushes += 1
+        except OSError as e:
+            print("Failed to write {}: {}".format(self.path, e))
+            # Keep the entries so the next flush retries them
+            self._dirty.update(dirty)
+
+    def compact(self):
+        """Rewrite the journal with a single line per device."""
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                for mac in self.devices:
+                    self.bytes_written += f.write(self._line(mac))
+            try:
+                os.rename(tmp, self.path)
+            except OSError:
+                # FAT won't rename over an existing file
+                os.remove(self.path)
+                os.rename(tmp, self.path)
+            self.journal_lines = len(self.devices)
+            self.compactions += 1
+            self.flushes += 1
+            return True
+        except OSError as e:
+            print("Failed to compact {}: {}".format(self.path, e))
+            return False
+
+    def stats(self):
+        return {
+            "devices": len(self.devices),
+            "dirty": len(self._dirty),
+            "journal_lines": self.journal_lines,
+            "bytes_written": self.bytes_written,
+            "flushes": self.flushes,
+            "compactions": self.compactions,
+        }
+
+    def _line(self, mac):
+        return "{}|{}\n".format(binascii.hexlify(mac, ":").decode(), self.devices[mac])
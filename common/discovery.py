@@ -0,0 +1,242 @@
+# Active receiver discovery (probe / offer)
+#
+# Transmitter side (Prober): the receiver found last time is read from flash
+# and tried first with a single unicast probe, which the receiver's radio
+# acknowledges. Otherwise a probe is broadcast on each channel in turn and
+# offers are collected for window_ms; the least loaded receiver on the first
+# channel that answers wins and is written to flash. If no channel answers
+# the scan repeats with exponential backoff.
+#
+# Text beacons ("<mac>:PsGadget-CT|<load>[|<time>]", see beacon.py) are
+# accepted as well; old receivers leave out the load, which then counts as 255.
+#
+# Receiver side (OfferResponder): probes are answered with a unicast offer
+# carrying the receiver MAC, channel and a load hint. With a PeerTable
+# (peers.py) the transmitter stays a peer; without one it is added for the
+# offer and removed again. A probe from a MAC that is neither a peer nor
+# known(mac) calls on_unknown(), e.g. BeaconScheduler.kick (beacon.py), so
+# other transmitters that are looking hear a beacon soon as well.
+
+try:
+    import uos as os
+except ImportError:
+    import os
+import psgframe
+from ticks import ticks_ms, ticks_diff, ticks_add, sleep_ms
+
+BROADCAST_MAC = b"\xff" * 6
+CHANNELS = tuple(range(1, 14))
+CACHE_FILE = "receiver.txt"
+
+
+def add_peer(esp_now, mac):
+    """Add mac as a peer, returns False if it already was one."""
+    try:
+        esp_now.add_peer(mac)
+        return True
+    except OSError:
+        return False  # already a peer
+
+
+def beacon_load(msg):
+    """Load hint after the ssid of a text beacon, 255 if there is none."""
+    fields = bytes(msg).split(b"|")
+    try:
+        return min(int(fields[1]), 255) if len(fields) > 1 else 255
+    except ValueError:
+        return 255
+
+
+class Prober:
+    def __init__(self, esp_now, wlan, serial, gadget=0, channels=CHANNELS, window_ms=40,
+                 backoff_ms=250, max_backoff_ms=8000, cache=CACHE_FILE, beacon=b"PsGadget-CT"):
+        self.esp_now = esp_now
+        self.wlan = wlan
+        self.serial = serial
+        self.gadget = gadget
+        self.channels = channels
+        self.window_ms = window_ms
+        self.backoff_ms = backoff_ms
+        self.max_backoff_ms = max_backoff_ms
+        self.cache = cache
+        self.beacon = beacon
+        self.seq = 0
+        # Counters
+        self.probes = 0
+        self.offers = 0
+        self.scans = 0
+        self.cache_hits = 0
+        self.last_pairing_ms = None
+        add_peer(esp_now, BROADCAST_MAC)
+
+    def load_cache(self):
+        """Return the (mac, channel) written by the last pairing, or None."""
+        try:
+            with open(self.cache) as f:
+                mac, channel = f.read().strip().split("|")
+            return bytes(int(b, 16) for b in mac.split(":")), int(channel)
+        except (OSError, ValueError):
+            return None
+
+    def save_cache(self, mac, channel):
+        if self.load_cache() == (bytes(mac), channel):
+            return  # spare the flash
+        with open(self.cache, "w") as f:
+            f.write("{}|{}\n".format(":".join("{:02x}".format(b) for b in mac), channel))
+
+    def forget(self):
+        """Drop the cached receiver, the next find() scans."""
+        try:
+            os.remove(self.cache)
+        except OSError:
+            pass
+
+    def _set_channel(self, channel):
+        self.wlan.config(channel=channel)
+
+    def _probe(self, mac):
+        self.seq = (self.seq + 1) & 0xFFFF
+        self.probes += 1
+        return self.esp_now.send(mac, psgframe.encode_probe(self.seq, self.serial, self.gadget,
+                                                            self.wlan.config("channel")))
+
+    def try_cached(self):
+        """Probe the cached receiver, returns (mac, channel, None) if it acknowledged."""
+        cached = self.load_cache()
+        if cached is None:
+            return None
+        mac, channel = cached
+        self._set_channel(channel)
+        added = add_peer(self.esp_now, mac)
+        try:
+            if self._probe(mac):
+                self.cache_hits += 1
+                return mac, channel, None
+        except OSError:
+            pass
+        if added:
+            self.esp_now.del_peer(mac)
+        return None
+
+    def _collect(self):
+        """Offers heard within window_ms of the last probe, as (load, mac) tuples."""
+        found = []
+        deadline = ticks_add(ticks_ms(), self.window_ms)
+        while True:
+            left = ticks_diff(deadline, ticks_ms())
+            if left <= 0:
+                break
+            mac, msg = self.esp_now.recv(left)
+            if msg is None:
+                break
+            offer = psgframe.decode_offer(msg)
+            if offer is not None:
+                seq, _, _, load = offer
+                if seq == self.seq:
+                    self.offers += 1
+                    found.append((load, bytes(mac)))
+            elif self.beacon in bytes(msg):
+                found.append((beacon_load(msg), bytes(mac)))
+        return found
+
+    def scan_once(self):
+        """Probe every channel once, returns (mac, channel, load) or None."""
+        self.scans += 1
+        for channel in self.channels:
+            self._set_channel(channel)
+            try:
+                self._probe(BROADCAST_MAC)
+            except OSError:
+                continue
+            found = self._collect()
+            if found:
+                load, mac = min(found)
+                return mac, channel, load
+        return None
+
+    def find(self, max_scans=None):
+        """Find a receiver, cached one first; returns (mac, channel, load), load None if cached.
+
+        The receiver is added as a peer and written to flash. Returns None
+        only if max_scans scans found nothing.
+        """
+        start = ticks_ms()
+        result = self.try_cached()
+        delay = self.backoff_ms
+        scans = 0
+        while result is None:
+            result = self.scan_once()
+            scans += 1
+            if result is not None:
+                break
+            if max_scans is not None and scans >= max_scans:
+                return None
+            sleep_ms(delay)
+            delay = min(delay * 2, self.max_backoff_ms)
+        mac, channel, load = result
+        self._set_channel(channel)
+        add_peer(self.esp_now, mac)
+        self.save_cache(mac, channel)
+        self.last_pairing_ms = ticks_diff(ticks_ms(), start)
+        return result
+
+    def stats(self):
+        return {
+            "probes": self.probes,
+            "offers": self.offers,
+            "scans": self.scans,
+            "cache_hits": self.cache_hits,
+            "last_pairing_ms": self.last_pairing_ms,
+        }
+
+
+class OfferResponder:
+    """Answers probes; handle() is called from the receiver's frame handler."""
+
+    def __init__(self, esp_now, wlan, load=None, peers=None, known=None, on_unknown=None):
+        self.esp_now = esp_now
+        self.wlan = wlan
+        self.load = load
+        self.peers = peers
+        self.known = known
+        self.on_unknown = on_unknown
+        self.mac = wlan.config("mac")
+        # Counters
+        self.probes = 0
+        self.offers = 0
+        self.unknown = 0
+
+    def _is_known(self, mac):
+        if self.peers is not None and mac in self.peers:
+            return True
+        return self.known is not None and self.known(mac)
+
+    def handle(self, mac, msg):
+        """Answer msg if it is a probe, returns True if it was one."""
+        probe = psgframe.decode_probe(msg)
+        if probe is None:
+            return False
+        self.probes += 1
+        seq = probe[0]
+        mac = bytes(mac)
+        if self.on_unknown is not None and not self._is_known(mac):
+            self.unknown += 1
+            self.on_unknown()
+        load = self.load() if self.load is not None else 0
+        offer = psgframe.encode_offer(seq, self.mac, self.wlan.config("channel"), load)
+        if self.peers is not None:
+            try:
+                self.peers.send(mac, offer)
+                self.offers += 1
+            except OSError as e:
+                print("Failed to send offer:", e)
+            return True
+        added = add_peer(self.esp_now, mac)
+        try:
+            self.esp_now.send(mac, offer)
+            self.offers += 1
+        except OSError as e:
+            print("Failed to send offer:", e)
+        if added:
+            self.esp_now.del_peer(mac)  # keep the driver's peer table free
+        return True
@@ -0,0 +1,303 @@
+# Host-to-transmitter commands (downlink)
+#
+# Receiver side:
+#   downlink = Downlink(peers, reply, lambda: transmitters)
+#   downlink.command("@lab led 0 0 64")   # -> "downlink 7 sending targets=5 via=broadcast"
+#   asyncio.create_task(downlink.run())
+#   downlink.ack(mac, msg)                # in the receive path, True if msg was a command ack
+#
+# A target is one MAC, "@group" (see group()) or "all" (every transmitter
+# heard so far). Commands for at least broadcast_min transmitters go out as
+# one broadcast frame that lists them (or nobody, for "all"), smaller ones as
+# unicasts sent back to back without waiting for the MAC-level ack. Each
+# transmitter answers with an MT_CMDACK; the ones that haven't after
+# timeout_ms get the command again by unicast, up to retries times. Then one
+# line goes to the host, whatever the number of targets:
+#   downlink <id> done targets=N acked=N failed=N missing=N ms=N [mac,mac,...]
+# listing (the first few of) the MACs that failed or never answered.
+#
+# Transmitter side:
+#   listener = Listener(esp_now, wlan.config("mac"), commands.dispatch)
+#   listener.receivers = {receiver_mac}   # after pairing
+#   listener.listen(ms)                   # instead of time.sleep_ms(ms)
+#
+# Runs the command text of frames addressed to this radio and acks them.
+# Only commands from the MACs in receivers (the paired receiver) are run,
+# anyone in radio range can send one; the rest count as ignored. A
+# resend of the last command (ack lost on the way) is acked again without
+# running it twice. Other frames (e.g. beacons) go to other(mac, msg).
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+try:
+    import ubinascii as binascii
+except ImportError:
+    import binascii
+import psgframe
+from ticks import ticks_ms, ticks_diff, ticks_add
+
+BROADCAST_MAC = b"\xff" * 6
+BROADCAST_MIN = 4  # targets from which a command goes out as one broadcast
+SEND_BATCH = 8     # unicasts sent back to back before yielding to other tasks
+MAX_JOBS = 4       # commands in flight
+MISSING_LIST = 8   # MACs named in the summary line
+ESP_ERR_ESPNOW_NOT_FOUND = -12395
+
+
+def mac_str(mac):
+    return binascii.hexlify(mac, ":").decode()
+
+
+def parse_mac(text):
+    try:
+        mac = binascii.unhexlify(text.replace(":", ""))
+    except ValueError:
+        mac = b""
+    if len(mac) != 6:
+        raise ValueError("bad MAC {}".format(text))
+    return mac
+
+
+class _Job:
+    def __init__(self, cid, text, targets, now):
+        self.id = cid
+        self.text = text
+        self.targets = len(targets)
+        self.waiting = set(targets)  # no answer yet
+        self.to_send = []            # MACs the current frame still goes to
+        self.frame = None
+        self.failed = []
+        self.acked = 0
+        self.tries = 0
+        self.started_ms = now
+        self.sent_ms = now
+
+
+class Downlink:
+    def __init__(self, peers, reply, known, timeout_ms=300, retries=2, broadcast_min=BROADCAST_MIN):
+        self.peers = peers
+        self.reply = reply      # reply(line) sends a line to the host
+        self.known = known      # known() -> MACs of the transmitters heard
+        self.timeout_ms = timeout_ms
+        self.retries = retries
+        self.broadcast_min = broadcast_min
+        self.groups = {}        # name -> list of MACs
+        self._jobs = {}         # id -> _Job
+        self._id = 0
+        # Counters
+        self.commands = 0
+        self.frames = 0
+        self.broadcasts = 0
+        self.resends = 0
+        self.send_errors = 0
+        self.acked = 0
+        self.failed = 0
+        self.missing = 0
+
+    def resolve(self, target):
+        """MACs for a target: a MAC, "@group" or "all"."""
+        if target == "all":
+            return sorted(bytes(mac) for mac in self.known())
+        if target.startswith("@"):
+            if target[1:] not in self.groups:
+                raise ValueError("unknown group {}".format(target[1:]))
+            return list(self.groups[target[1:]])
+        return [parse_mac(target)]
+
+    def start(self, target, text, now=None):
+        """Queue a command for target, returns the "downlink <id> sending" line."""
+        if len(self._jobs) >= MAX_JOBS:
+            raise ValueError("{} commands in flight, try again".format(len(self._jobs)))
+        targets = self.resolve(target)
+        if not targets:
+            raise ValueError("no transmitters for {}".format(target))
+        text = text.encode("utf-8")
+        self._id = (self._id + 1) & 0xFFFF
+        job = _Job(self._id, text, targets, ticks_ms() if now is None else now)
+        listed = () if target == "all" else targets
+        if len(targets) >= self.broadcast_min and len(listed) <= psgframe.command_capacity(len(text)):
+            job.frame = psgframe.encode_command(job.id, text, listed)
+            job.to_send = [BROADCAST_MAC]
+            self.broadcasts += 1
+        else:
+            job.frame = psgframe.encode_command(job.id, text)
+            job.to_send = targets[::-1]  # sent from the end
+        self._jobs[job.id] = job
+        self.commands += 1
+        return "downlink {} sending targets={} via={}".format(
+            job.id, job.targets, "broadcast" if job.to_send[0] == BROADCAST_MAC else "unicast")
+
+    def command(self, args):
+        """The "send <target> <text>" UART command."""
+        target, _, text = args.partition(" ")
+        if not target or not text.strip():
+            raise ValueError("usage: send <mac|@group|all> <command>")
+        return self.start(target, text.strip())
+
+    def group(self, args):
+        """The "group [name [mac ...|-]]" UART command: list, show, set or delete groups."""
+        parts = args.split()
+        if not parts:
+            return ["group {} {}".format(name, len(macs)) for name, macs in sorted(self.groups.items())] \
+                or "group none"
+        name = parts[0]
+        if parts[1:] == ["-"]:
+            self.groups.pop(name, None)
+            return "group {} deleted".format(name)
+        if len(parts) > 1:
+            self.groups[name] = [parse_mac(mac) for mac in parts[1:]]
+        elif name not in self.groups:
+            raise ValueError("unknown group {}".format(name))
+        return "group {} {}".format(name, ",".join(mac_str(mac) for mac in self.groups[name]))
+
+    def ack(self, mac, msg):
+        """Count a transmitter's answer, returns False if msg isn't a command ack."""
+        answer = psgframe.decode_cmdack(msg)
+        if answer is None:
+            return False
+        job = self._jobs.get(answer[0])
+        mac = bytes(mac)
+        if job is None or mac not in job.waiting:
+            return True  # late or duplicate answer
+        job.waiting.discard(mac)
+        if mac in job.to_send:
+            job.to_send.remove(mac)
+        if answer[1] == psgframe.CMD_OK:
+            job.acked += 1
+        else:
+            job.failed.append(mac)
+        if not job.waiting:
+            self._finish(job)
+        return True
+
+    def _finish(self, job, now=None):
+        del self._jobs[job.id]
+        missing = sorted(job.waiting)
+        self.acked += job.acked
+        self.failed += len(job.failed)
+        self.missing += len(missing)
+        line = "downlink {} done targets={} acked={} failed={} missing={} ms={}".format(
+            job.id, job.targets, job.acked, len(job.failed), len(missing),
+            ticks_diff(ticks_ms() if now is None else now, job.started_ms))
+        macs = job.failed + missing
+        if macs:
+            line += " " + ",".join(mac_str(mac) for mac in macs[:MISSING_LIST])
+            if len(macs) > MISSING_LIST:
+                line += ",+{}".format(len(macs) - MISSING_LIST)
+        self.reply(line)
+
+    async def _send(self, job):
+        n = 0
+        while job.to_send:
+            mac = job.to_send.pop()
+            try:
+                self.peers.send(mac, job.frame, False)
+                self.frames += 1
+            except OSError:
+                self.send_errors += 1  # resent after the timeout like a lost frame
+            n += 1
+            if n % SEND_BATCH == 0:
+                await asyncio.sleep_ms(0)  # let the receive path take the first acks
+        job.sent_ms = ticks_ms()
+
+    async def run(self, tick_ms=10):
+        """Send queued commands, resend unanswered ones, report finished ones."""
+        while True:
+            for job in list(self._jobs.values()):
+                if job.to_send:
+                    await self._send(job)
+                    continue
+                if job.id not in self._jobs or ticks_diff(ticks_ms(), job.sent_ms) < self.timeout_ms:
+                    continue
+                if job.tries >= self.retries:
+                    self._finish(job)
+                    continue
+                job.tries += 1
+                job.frame = psgframe.encode_command(job.id, job.text, (), psgframe.F_RETX)
+                job.to_send = sorted(job.waiting, reverse=True)
+                self.resends += len(job.to_send)
+            await asyncio.sleep_ms(tick_ms)
+
+    def stats(self):
+        return {
+            "in_flight": len(self._jobs),
+            "commands": self.commands,
+            "frames": self.frames,
+            "broadcasts": self.broadcasts,
+            "resends": self.resends,
+            "send_errors": self.send_errors,
+            "acked": self.acked,
+            "failed": self.failed,
+            "missing": self.missing,
+        }
+
+
+class Listener:
+    """Transmitter side: runs the commands addressed to this radio and acks them."""
+
+    def __init__(self, esp_now, mac, dispatch, other=None, receivers=()):
+        self.esp_now = esp_now
+        self.mac = bytes(mac)
+        self.receivers = set(receivers)  # MACs whose commands are run
+        self.dispatch = dispatch  # dispatch(text) -> True if the command ran
+        self.other = other        # other(mac, msg) for frames that aren't commands
+        self._last = None         # (sender MAC, id, status) of the last command run
+        # Counters
+        self.applied = 0
+        self.duplicates = 0
+        self.ignored = 0
+        self.ack_errors = 0
+
+    def handle(self, mac, msg):
+        """Run a command frame, returns False if msg isn't one."""
+        command = psgframe.decode_command(msg)
+        if command is None:
+            if self.other is not None:
+                self.other(mac, msg)
+            return False
+        cid, flags, targets, text = command
+        mac = bytes(mac)
+        if mac not in self.receivers or targets and self.mac not in targets:
+            self.ignored += 1
+            return True
+        last = self._last
+        if flags & psgframe.F_RETX and last is not None and last[0] == mac and last[1] == cid:
+            status = last[2]  # our ack got lost, don't run it twice
+            self.duplicates += 1
+        else:
+            status = psgframe.CMD_OK if self.dispatch(text) else psgframe.CMD_FAILED
+            self._last = (mac, cid, status)
+            self.applied += 1
+        ack = psgframe.encode_cmdack(cid, status)
+        try:
+            try:
+                self.esp_now.send(mac, ack, False)
+            except OSError as e:
+                if not e.args or e.args[0] != ESP_ERR_ESPNOW_NOT_FOUND:
+                    raise
+                self.esp_now.add_peer(mac)
+                self.esp_now.send(mac, ack, False)
+        except OSError:
+            self.ack_errors += 1  # the receiver resends and we ack again
+        return True
+
+    def listen(self, ms):
+        """Wait ms, running the commands that arrive meanwhile."""
+        deadline = ticks_add(ticks_ms(), ms)
+        while True:
+            left = ticks_diff(deadline, ticks_ms())
+            if left <= 0:
+                return
+            mac, msg = self.esp_now.recv(left)
+            if msg is not None:
+                self.handle(mac, msg)
+
+    def stats(self):
+        return {
+            "applied": self.applied,
+            "duplicates": self.duplicates,
+            "ignored": self.ignored,
+            "ack_errors": self.ack_errors,
+        }
@@ -0,0 +1,240 @@
+# Bounded UART egress queue with one writer task
+#
+# Everything a receiver sends to the FT232H goes through one EgressQueue:
+# telemetry lines, command replies and periodic stats. One task writes them,
+# so nothing in the radio or command path ever waits on the UART.
+#
+# Priority classes: P_CONTROL (command replies) goes first, then P_DATA
+# (telemetry), then P_STATS (periodic counters). Within a class lines are
+# handed out round robin between devices (the key, usually the transmitter
+# MAC), so one chatty transmitter can't delay the others.
+#
+# The queue holds at most `capacity` lines. When it is full, room is made in
+# the lowest priority class that has lines (never a higher class than the new
+# line's), according to the policy:
+#   DROP_OLDEST  drop the oldest line of that class
+#   DROP_NEWEST  drop the new line (if it is in that class)
+#   COALESCE     a P_DATA line replaces the newest line queued for the same
+#                device, else the oldest line of the device with the most
+#                lines waiting is dropped; replies and stats (and lines
+#                without a device) are never replaced, the oldest goes
+# A line dropped or replaced either way counts as shed for its device on the
+# rate limiter, if there is one.
+#
+# The writer takes lines within a byte budget (a TokenBucket at the UART's
+# speed) and flushes after each batch, so the UART is never asked to take
+# more than it can send and uart.write() doesn't block. Each line is counted
+# with `overhead` bytes on top: 1 for the newline in text mode, set it to
+# UartLink.overhead() when the link switches to frames.
+#
+# Wait time is counted from put()'s now, so passing the frame's radio
+# receive time (RxPipeline.frame_ms) measures radio-to-UART latency. An
+# optional latency histogram (metrics.py) gets every line's wait.
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+try:
+    from ucollections import OrderedDict
+except ImportError:
+    from collections import OrderedDict
+from ticks import ticks_ms, ticks_diff
+
+# Priority classes
+P_CONTROL = 0
+P_DATA = 1
+P_STATS = 2
+CLASSES = 3
+
+# Overflow policies
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+COALESCE = "coalesce"
+POLICIES = (DROP_OLDEST, DROP_NEWEST, COALESCE)
+
+
+class EgressQueue:
+    def __init__(self, capacity=64, policy=DROP_OLDEST, budget=None, limiter=None, batch=16,
+                 latency=None, overhead=1):
+        if policy not in POLICIES:
+            raise ValueError("unknown policy: {}".format(policy))
+        self.capacity = capacity
+        self.policy = policy
+        self.budget = budget    # TokenBucket in bytes, None = no limit
+        self.limiter = limiter  # dropped lines are counted against their device there
+        self.batch = batch
+        self.latency = latency  # histogram of waits in ms, optional
+        self.overhead = overhead  # bytes added to each line on the wire
+        # Per class: key -> [[queued ms, line, kind], ...], next key to send first
+        self._classes = [OrderedDict() for _ in range(CLASSES)]
+        self._depths = [0] * CLASSES
+        self.pending = 0
+        self._ready = None
+        # Counters
+        self.queued = 0
+        self.sent = 0
+        self.bytes = 0
+        self.batches = 0
+        self.dropped_oldest = 0
+        self.dropped_newest = 0
+        self.coalesced = 0
+        self.high_water = 0
+        self.wait_ms_total = 0
+        self.wait_ms_max = 0
+
+    def __len__(self):
+        return self.pending
+
+    def put(self, line, key=None, prio=P_DATA, kind=None, now=None):
+        """Queue a line (bytes, no newline), returns False if it was dropped."""
+        now = ticks_ms() if now is None else now
+        if self.pending >= self.capacity:
+            coalesce = self.policy == COALESCE and prio == P_DATA and key is not None
+            if coalesce and self._coalesce(line, key, prio, kind, now):
+                return True
+            victim = self._victim_class(prio)
+            if victim is None or (self.policy == DROP_NEWEST and victim == prio):
+                self._dropped(key)
+                self.dropped_newest += 1
+                return False
+            if coalesce and victim == prio:
+                self._drop_longest(victim)
+            else:
+                self._drop_oldest(victim)
+        queues = self._classes[prio]
+        queue = queues.get(key)
+        if queue is None:
+            queue = queues[key] = []
+        queue.append([now, line, kind])
+        self._depths[prio] += 1
+        self.pending += 1
+        self.queued += 1
+        if self.pending > self.high_water:
+            self.high_water = self.pending
+        if self._ready is not None:
+            self._ready.set()
+        return True
+
+    def _victim_class(self, prio):
+        for victim in range(CLASSES - 1, prio - 1, -1):
+            if self._depths[victim]:
+                return victim
+        return None
+
+    def _coalesce(self, line, key, prio, kind, now):
+        queue = self._classes[prio].get(key)
+        if not queue:
+            return False
+        entry = queue[-1]
+        entry[1] = line  # keeps its queue time and place in the round
+        entry[2] = kind
+        self.coalesced += 1
+        self.queued += 1
+        self._dropped(key)  # the line it replaced is never sent
+        return True
+
+    def _remove(self, prio, key, queue):
+        queue.pop(0)
+        if not queue:
+            del self._classes[prio][key]
+        self._depths[prio] -= 1
+        self.pending -= 1
+        self._dropped(key)
+
+    def _drop_oldest(self, prio):
+        oldest = None
+        for key, queue in self._classes[prio].items():
+            if oldest is None or ticks_diff(queue[0][0], oldest[1][0][0]) < 0:
+                oldest = (key, queue)
+        self._remove(prio, oldest[0], oldest[1])
+        self.dropped_oldest += 1
+
+    def _drop_longest(self, prio):
+        longest = None
+        for key, queue in self._classes[prio].items():
+            if longest is None or len(queue) > len(longest[1]):
+                longest = (key, queue)
+        self._remove(prio, longest[0], longest[1])
+        self.dropped_oldest += 1
+
+    def _dropped(self, key):
+        if self.limiter is not None and key is not None:
+            self.limiter.shed(key)
+
+    def drain(self, send, now=None, limit=None):
+        """send(line) (or send(line, kind) if put with a kind) up to limit lines
+        (default batch) within the byte budget.
+
+        Returns the number of lines sent.
+        """
+        now = ticks_ms() if now is None else now
+        limit = self.batch if limit is None else limit
+        avail = self.budget.available(now) if self.budget is not None else None
+        overhead = self.overhead
+        used = 0
+        n = 0
+        prio = 0
+        while n < limit and self.pending and (avail is None or used < avail):
+            while not self._depths[prio]:
+                prio += 1
+            queues = self._classes[prio]
+            for key in queues:
+                break
+            queue = queues.pop(key)
+            queued, line, kind = queue.pop(0)
+            if queue:
+                queues[key] = queue  # back of the round
+            self._depths[prio] -= 1
+            self.pending -= 1
+            if kind is None:
+                send(line)
+            else:
+                send(line, kind)
+            used += len(line) + overhead
+            n += 1
+            wait = ticks_diff(now, queued)
+            self.wait_ms_total += wait
+            if wait > self.wait_ms_max:
+                self.wait_ms_max = wait
+            if self.latency:
+                self.latency.observe(wait)
+        if self.budget is not None:
+            self.budget.consume(used)
+        self.sent += n
+        self.bytes += used
+        return n
+
+    async def run(self, send, flush=None, retry_ms=20, wait=None):
+        """Writer task: send queued lines in batches (see drain), flush() after
+        each and await wait() (e.g. UartLink.drain) if given."""
+        self._ready = asyncio.Event()
+        while True:
+            if self.drain(send):
+                self.batches += 1
+                if flush is not None:
+                    flush()
+                if wait is not None:
+                    await wait()
+            if self.pending:
+                # Out of budget (or a full batch), let the UART catch up
+                await asyncio.sleep(retry_ms / 1000)
+            else:
+                await self._ready.wait()
+                self._ready.clear()
+
+    def stats(self):
+        return {
+            "depth": self.pending,
+            "depths": list(self._depths),
+            "high_water": self.high_water,
+            "queued": self.queued,
+            "sent": self.sent,
+            "bytes": self.bytes,
+            "batches": self.batches,
+            "dropped_oldest": self.dropped_oldest,
+            "dropped_newest": self.dropped_newest,
+            "coalesced": self.coalesced,
+            "wait_ms_mean": self.wait_ms_total // self.sent if self.sent else 0,
+            "wait_ms_max": self.wait_ms_max,
+        }
@@ -0,0 +1,234 @@
+# JSON envelope builder for the UART receiver (ftdi_esp32s3receiver_uart.py)
+#
+# Builds
+#   {"datetime":"20241109T123924","accessory":{"macraw":"34b7da59d620",
+#    "mac":"34:b7:da:59:d6:20","type":"...","cputemp":46},
+#    "transmitter":{"mac":"...","message":"..."}}
+# straight into a reusable bytearray. The accessory section only changes
+# when set_temperature() is called (from a timer, not per packet), and the
+# datetime string is only re-formatted when the second changes.
+#
+# Message bytes are JSON-escaped. Valid UTF-8 sequences are copied as they
+# are, so text comes out as text; other bytes outside printable ASCII are
+# written as \u00XX so binary payloads stay valid JSON (U+0080..U+00FF for
+# the bytes 80..FF). Messages up to psgframe.LINE_MAX bytes, the longest
+# line LineRenderer gives, fit; longer ones are cut and counted.
+
+import time
+
+from psgframe import LINE_MAX
+
+try:
+    import ubinascii as binascii
+except ImportError:
+    import binascii
+try:
+    from micropython import native
+except ImportError:
+    def native(f):
+        return f
+
+KEYS = (b"datetime", b"accessory", b"macraw", b"mac", b"type", b"cputemp",
+        b"transmitter", b"message")
+COMPACT_KEYS = (b"dt", b"a", b"r", b"m", b"t", b"c", b"x", b"msg")
+
+MAX_MESSAGE = LINE_MAX
+
+
+def _escape_table():
+    table = [None] * 256
+    for b in range(256):
+        if b < 0x20 or b >= 0x7F:
+            table[b] = "\\u{:04x}".format(b).encode()
+    table[0x22] = b'\\"'
+    table[0x5C] = b"\\\\"
+    table[0x08] = b"\\b"
+    table[0x0C] = b"\\f"
+    table[0x0A] = b"\\n"
+    table[0x0D] = b"\\r"
+    table[0x09] = b"\\t"
+    return table
+
+
+_ESC = _escape_table()
+
+
+def _utf8(data, i, end):
+    # Length of the valid UTF-8 sequence starting at data[i] (>= 0x80), or 0
+    b = data[i]
+    if 0xC2 <= b <= 0xDF:
+        n, low, high = 2, 0x80, 0xBF
+    elif 0xE0 <= b <= 0xEF:
+        n = 3
+        low = 0xA0 if b == 0xE0 else 0x80  # no overlong forms
+        high = 0x9F if b == 0xED else 0xBF  # no surrogates
+    elif 0xF0 <= b <= 0xF4:
+        n = 4
+        low = 0x90 if b == 0xF0 else 0x80
+        high = 0x8F if b == 0xF4 else 0xBF
+    else:
+        return 0
+    if i + n > end or not low <= data[i + 1] <= high:
+        return 0
+    for k in range(i + 2, i + n):
+        if data[k] & 0xC0 != 0x80:
+            return 0
+    return n
+
+
+def escape(data):
+    """Return data (bytes or str) JSON-escaped, without quotes."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    out = bytearray()
+    i = 0
+    end = len(data)
+    while i < end:
+        b = data[i]
+        n = _utf8(data, i, end) if b >= 0x80 else 0
+        if n:
+            out += data[i:i + n]
+            i += n
+            continue
+        e = _ESC[b]
+        if e is None:
+            out.append(b)
+        else:
+            out += e
+        i += 1
+    return bytes(out)
+
+
+class JsonEnvelope:
+    def __init__(self, macraw, machinetype, compact=False, newline=True):
+        k = COMPACT_KEYS if compact else KEYS
+        self.newline = newline
+        # Longest message escapes to 6 bytes per byte
+        self.buf = bytearray(512 + MAX_MESSAGE * 6)
+        self.view = memoryview(self.buf)
+        self.pos = 0
+        self._open = b'{"' + k[0] + b'":"'
+        self._accessory = (b'","' + k[1] + b'":{"' + k[2] + b'":"' + binascii.hexlify(macraw)
+                           + b'","' + k[3] + b'":"' + binascii.hexlify(macraw, ":")
+                           + b'","' + k[4] + b'":"' + escape(machinetype)
+                           + b'","' + k[5] + b'":')
+        self._transmitter = b'},"' + k[6] + b'":{"' + k[3] + b'":"'
+        self._message = b'","' + k[7] + b'":"'
+        self._close = b'"}}\n' if newline else b'"}}'
+        self._temperature = b"null"
+        self._second = None
+        self._datetime = b""
+        self._macs = {}
+        # Counters
+        self.built = 0
+        self.truncated = 0  # messages over MAX_MESSAGE, cut
+
+    def set_temperature(self, cputemp):
+        """Update the cached CPU temperature (call from a timer or task)."""
+        self._temperature = str(cputemp).encode()
+
+    def _datetime_bytes(self):
+        second = int(time.time())
+        if second != self._second:
+            dt = time.localtime(second)
+            self._datetime = "{:04d}{:02d}{:02d}T{:02d}{:02d}{:02d}".format(*dt[:6]).encode()
+            self._second = second
+        return self._datetime
+
+    def _mac_hex(self, mac):
+        if not isinstance(mac, bytes):
+            mac = bytes(mac)
+        s = self._macs.get(mac)
+        if s is None:
+            if len(self._macs) >= 32:
+                self._macs = {}
+            s = self._macs[mac] = binascii.hexlify(mac, ":")
+        return s
+
+    def _put(self, data):
+        n = len(data)
+        self.buf[self.pos:self.pos + n] = data
+        self.pos += n
+
+    @native
+    def _put_escaped(self, data):
+        # A UTF-8 sequence is copied as it comes; if it breaks off, the
+        # bytes copied so far (mark up to pos) are escaped after all
+        buf = self.buf
+        pos = self.pos
+        esc = _ESC
+        need = 0  # continuation bytes the sequence still needs
+        mark = low = high = 0
+        for b in data:
+            e = esc[b]
+            if e is None:
+                if need:
+                    pos = self._unwind(mark, pos)
+                    need = 0
+                buf[pos] = b
+                pos += 1
+                continue
+            if need:
+                if low <= b <= high:
+                    buf[pos] = b
+                    pos += 1
+                    need -= 1
+                    low = 0x80
+                    high = 0xBF
+                    continue
+                pos = self._unwind(mark, pos)
+                need = 0
+            if 0xC2 <= b <= 0xF4:
+                mark = pos
+                buf[pos] = b
+                pos += 1
+                low = 0x80
+                high = 0xBF
+                if b < 0xE0:
+                    need = 1
+                elif b < 0xF0:
+                    need = 2
+                    if b == 0xE0:
+                        low = 0xA0  # no overlong forms
+                    elif b == 0xED:
+                        high = 0x9F  # no surrogates
+                else:
+                    need = 3
+                    if b == 0xF0:
+                        low = 0x90
+                    elif b == 0xF4:
+                        high = 0x8F
+                continue
+            n = len(e)
+            buf[pos:pos + n] = e
+            pos += n
+        if need:
+            pos = self._unwind(mark, pos)
+        self.pos = pos
+
+    def _unwind(self, mark, pos):
+        # Escape the bytes of a broken UTF-8 sequence in place, from the back
+        # (every one is >= 0x80 and grows to 6 bytes), returns the new pos
+        buf = self.buf
+        for j in range(pos - mark - 1, -1, -1):
+            start = mark + 6 * j
+            buf[start:start + 6] = _ESC[buf[mark + j]]
+        return mark + 6 * (pos - mark)
+
+    def build(self, mac, message):
+        """Return a memoryview of the envelope, valid until the next build()."""
+        if len(message) > MAX_MESSAGE:
+            message = memoryview(message)[:MAX_MESSAGE]
+            self.truncated += 1
+        self.pos = 0
+        self._put(self._open)
+        self._put(self._datetime_bytes())
+        self._put(self._accessory)
+        self._put(self._temperature)
+        self._put(self._transmitter)
+        self._put(self._mac_hex(mac))
+        self._put(self._message)
+        self._put_escaped(message)
+        self._put(self._close)
+        self.built += 1
+        return self.view[:self.pos]
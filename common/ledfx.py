@@ -0,0 +1,144 @@
+# Non-blocking LED effects for the status NeoPixel (or a plain GPIO LED)
+#
+# Requests return immediately; the effect is rendered by a uasyncio task
+# (run()) or a periodic machine.Timer (start_timer()). Only one effect is
+# active at a time: a new request while a flash is running either replaces
+# it (COALESCE, the default) or is ignored (DROP). The LED is only written
+# when its colour actually changes.
+#
+#   fx = LedFx(np)
+#   asyncio.create_task(fx.run())
+#   fx.flash((0, 0, 20), 500)
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+from ticks import ticks_ms, ticks_diff
+
+OFF = (0, 0, 0)
+
+# Effect kinds
+SOLID = 0
+FLASH = 1
+PULSE = 2
+
+# Busy policies
+COALESCE = 0  # latest request wins
+DROP = 1      # keep the running flash, ignore the new one
+
+
+class PinLed:
+    """Adapt a single-colour machine.Pin LED to the NeoPixel interface."""
+
+    def __init__(self, pin):
+        self.pin = pin
+        self.color = OFF
+
+    def __setitem__(self, index, color):
+        self.color = color
+
+    def write(self):
+        self.pin.value(1 if any(self.color) else 0)
+
+
+class LedFx:
+    def __init__(self, np, index=0, policy=COALESCE):
+        self.np = np
+        self.index = index
+        self.policy = policy
+        self._effect = None  # (kind, color, ms, start)
+        self._shown = None
+        self._wake = asyncio.Event()
+        self._timer = None
+        # Counters
+        self.requests = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.writes = 0
+
+    def _request(self, kind, color, ms):
+        self.requests += 1
+        current = self._effect
+        if current is not None and current[0] == FLASH:
+            if self.policy == DROP and kind == FLASH:
+                self.dropped += 1
+                return
+            self.coalesced += 1
+        self._effect = (kind, color, ms, ticks_ms())
+        self._wake.set()
+
+    def flash(self, color, ms=500):
+        """Show color for ms milliseconds, then turn off."""
+        self._request(FLASH, color, ms)
+
+    def pulse(self, color, period_ms=1000):
+        """Blink color on/off every period_ms until cleared."""
+        self._request(PULSE, color, period_ms)
+
+    def set(self, color):
+        """Show color until the next request."""
+        self._request(SOLID, color, 0)
+
+    def clear(self):
+        """Stop any effect and turn the LED off."""
+        self._effect = None
+        self._wake.set()
+
+    def busy(self):
+        return self._effect is not None
+
+    def _show(self, color):
+        if color != self._shown:
+            self.np[self.index] = color
+            self.np.write()
+            self._shown = color
+            self.writes += 1
+
+    def step(self, now=None):
+        """Render the current effect, returns ms until the next change or None."""
+        effect = self._effect
+        if effect is None:
+            self._show(OFF)
+            return None
+        kind, color, ms, start = effect
+        if kind == SOLID:
+            self._show(color)
+            return None
+        elapsed = ticks_diff(ticks_ms() if now is None else now, start)
+        if kind == FLASH:
+            if elapsed >= ms:
+                if self._effect is effect:
+                    self._effect = None
+                self._show(OFF)
+                return None
+            self._show(color)
+            return ms - elapsed
+        half = max(ms // 2, 1)
+        self._show(OFF if (elapsed // half) & 1 else color)
+        return half - elapsed % half
+
+    async def run(self):
+        """Drive the effects from a uasyncio task."""
+        while True:
+            wait = self.step()
+            try:
+                if wait is None:
+                    await self._wake.wait()
+                else:
+                    await asyncio.wait_for(self._wake.wait(), wait / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def start_timer(self, timer_id=0, period_ms=20):
+        """Drive the effects from a periodic machine.Timer instead of a task."""
+        from machine import Timer
+        self._timer = Timer(timer_id)
+        self._timer.init(period=period_ms, mode=Timer.PERIODIC, callback=lambda t: self.step())
+
+    def stop_timer(self):
+        if self._timer is not None:
+            self._timer.deinit()
+            self._timer = None
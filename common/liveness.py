@@ -0,0 +1,84 @@
+# Liveness of transmitters that promise a heartbeat
+#
+# A transmitter in deadband mode (deadband.py) may stay silent for as long
+# as its heartbeat, so silence alone doesn't mean it is gone. Liveness
+# remembers when each one was last heard and its heartbeat, and calls it
+# gone once `misses` heartbeats in a row are missing (plus grace_ms for the
+# radio and queues). Transmitters that never sent a heartbeat aren't
+# tracked unless default_ms is set.
+#
+#   alive = Liveness()
+#   alive.heard(mac, heartbeat_ms)    # every frame, heartbeat_ms None if it had none
+#   for key, silent_ms in alive.expired():
+#       ...key is gone...
+#
+# heard() returns the silence for a transmitter that was gone and is back.
+# Used by the bidirectional receiver (keys are MACs) and the host ingest
+# (keys are serial numbers).
+
+from ticks import ticks_ms, ticks_diff
+
+
+class Liveness:
+    def __init__(self, misses=3, grace_ms=2000, default_ms=None, max_devices=256):
+        self.misses = misses
+        self.grace_ms = grace_ms
+        self.default_ms = default_ms
+        self.max_devices = max_devices
+        self._devices = {}  # key -> [last heard, allowed silence ms, gone]
+        # Counters
+        self.gone = 0
+        self.back = 0
+
+    def __len__(self):
+        return len(self._devices)
+
+    def heard(self, key, heartbeat_ms=None, now=None):
+        """Note a frame from key, returns how long it was silent if it was gone, else None."""
+        now = ticks_ms() if now is None else now
+        device = self._devices.get(key)
+        if device is None:
+            heartbeat_ms = heartbeat_ms or self.default_ms
+            if heartbeat_ms is None or len(self._devices) >= self.max_devices:
+                return None
+            self._devices[key] = [now, heartbeat_ms * self.misses + self.grace_ms, False]
+            return None
+        if heartbeat_ms:
+            device[1] = heartbeat_ms * self.misses + self.grace_ms
+        silent = None
+        if device[2]:
+            device[2] = False
+            self.back += 1
+            silent = ticks_diff(now, device[0])
+        device[0] = now
+        return silent
+
+    def expired(self, now=None):
+        """(key, silent ms) of transmitters that have just gone quiet for too long."""
+        now = ticks_ms() if now is None else now
+        out = []
+        for key, device in self._devices.items():
+            if not device[2]:
+                silent = ticks_diff(now, device[0])
+                if silent > device[1]:
+                    device[2] = True
+                    self.gone += 1
+                    out.append((key, silent))
+        return out
+
+    def forget(self, key):
+        self._devices.pop(key, None)
+
+    def state(self, key):
+        """"alive", "gone" or None if key isn't tracked."""
+        device = self._devices.get(key)
+        if device is None:
+            return None
+        return "gone" if device[2] else "alive"
+
+    def states(self):
+        return {key: "gone" if device[2] else "alive" for key, device in self._devices.items()}
+
+    def stats(self):
+        return {"devices": len(self._devices), "missing": sum(1 for d in self._devices.values() if d[2]),
+                "gone": self.gone, "back": self.back}
@@ -0,0 +1,68 @@
+# Low-power helpers for the transmitters
+#
+# RtcPairing keeps the receiver MAC, Wi-Fi channel, frame sequence number and
+# count of unacknowledged sends in RTC memory, which survives lightsleep and
+# deepsleep (but not power loss), so a transmitter waking from sleep can send
+# straight away instead of waiting for the next receiver broadcast.
+#
+# RTC memory layout (little endian):
+#   magic(4) = "PSGP" | version(1) | mac(6) | channel(1) | seq(2) | misses(1)
+
+try:
+    import ustruct as struct
+except ImportError:
+    import struct
+from ticks import ticks_ms, ticks_diff
+
+MAGIC = b"PSGP"
+VERSION = 1
+LAYOUT = "<4sB6sBHB"
+LAYOUT_SIZE = struct.calcsize(LAYOUT)
+
+
+class RtcPairing:
+    """Receiver pairing cached in machine.RTC().memory()."""
+
+    def __init__(self, rtc):
+        self.rtc = rtc
+
+    def load(self):
+        """Return (mac, channel, seq, misses), or None if nothing valid is cached."""
+        data = self.rtc.memory()
+        if len(data) < LAYOUT_SIZE:
+            return None
+        magic, version, mac, channel, seq, misses = struct.unpack_from(LAYOUT, data, 0)
+        if magic != MAGIC or version != VERSION:
+            return None
+        return mac, channel, seq, misses
+
+    def save(self, mac, channel, seq=0, misses=0):
+        self.rtc.memory(struct.pack(LAYOUT, MAGIC, VERSION, bytes(mac), channel,
+                                    seq & 0xFFFF, min(misses, 255)))
+
+    def clear(self):
+        self.rtc.memory(b"")
+
+
+class BootTimer:
+    """Milliseconds from start (boot, on the device) to named steps."""
+
+    def __init__(self, start=None):
+        # ticks_ms() counts from reset on the ESP32, so 0 is boot
+        self.start = 0 if start is None else start
+        self.marks = []
+
+    def mark(self, name, now=None):
+        """Record the time of a step, returns ms since start."""
+        ms = ticks_diff(ticks_ms() if now is None else now, self.start)
+        self.marks.append((name, ms))
+        return ms
+
+    def get(self, name):
+        for step, ms in self.marks:
+            if step == name:
+                return ms
+        return None
+
+    def report(self):
+        return ", ".join("{} {}ms".format(step, ms) for step, ms in self.marks)
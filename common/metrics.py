@@ -0,0 +1,165 @@
+# Runtime metrics: counters, gauges and fixed-bucket histograms
+#
+#   metrics = Registry(enabled=True)
+#   frames = metrics.counter("rx.frames")
+#   metrics.gauge("heap.free", gc.mem_free)     # read when dumped
+#   latency = metrics.histogram("uart.latency_ms", (5, 20, 100, 500))
+#   frames.inc(); latency.observe(12)
+#   metrics.dump()  ->  "stats t=81234 rx.frames=1 heap.free=48112 uart.latency_ms=5,20,100,500:0/1/0/0/0:12"
+#
+# A disabled registry hands out one shared no-op object, so instrumented
+# code costs a method call that does nothing. The no-op is falsy, so code
+# can skip expensive measurements with `if histogram:`.
+#
+# Dump format, one line, space separated name=value pairs after "stats":
+#   t=<ticks_ms>        when the snapshot was taken
+#   name=<int>          counter or gauge
+#   name=b1,b2,..:c0/c1/../cN:sum
+#                       histogram, bucket i counts values <= bi, the last
+#                       bucket everything above the last bound
+# "stats reset" zeroes counters and histograms, gauges are live values.
+
+try:
+    import gc
+except ImportError:
+    gc = None
+from ticks import ticks_ms, ticks_us, ticks_diff
+
+LATENCY_MS_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+DURATION_US_BOUNDS = (50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def reset(self):
+        self.value = 0
+
+    def format(self):
+        return str(self.value)
+
+
+class Gauge:
+    """A value set by the code, or read from fn() when dumped."""
+
+    def __init__(self, fn=None):
+        self.fn = fn
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def reset(self):
+        pass
+
+    def format(self):
+        return str(self.fn() if self.fn is not None else self.value)
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        i = 0
+        for bound in self.bounds:
+            if value <= bound:
+                break
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+
+    def count(self):
+        return sum(self.counts)
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.sum = 0
+
+    def format(self):
+        return "{}:{}:{}".format(",".join(str(b) for b in self.bounds),
+                                 "/".join(str(c) for c in self.counts), self.sum)
+
+
+class _Null:
+    """Stands in for every metric of a disabled registry."""
+
+    value = 0
+
+    def __bool__(self):
+        return False
+
+    def inc(self, n=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def reset(self):
+        pass
+
+
+NULL = _Null()
+
+
+class Registry:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = []  # (name, metric) in registration order
+
+    def _add(self, name, metric):
+        if not self.enabled:
+            return NULL
+        self._metrics.append((name, metric))
+        return metric
+
+    def counter(self, name):
+        return self._add(name, Counter())
+
+    def gauge(self, name, fn=None):
+        return self._add(name, Gauge(fn))
+
+    def histogram(self, name, bounds=LATENCY_MS_BOUNDS):
+        return self._add(name, Histogram(bounds))
+
+    def dump(self, now=None):
+        """One line snapshot of every metric, see the format above."""
+        parts = ["stats", "t={}".format(ticks_ms() if now is None else now)]
+        for name, metric in self._metrics:
+            try:
+                parts.append("{}={}".format(name, metric.format()))
+            except Exception as e:
+                print("Metric {} failed: {}".format(name, e))
+        return " ".join(parts)
+
+    def reset(self):
+        for _, metric in self._metrics:
+            metric.reset()
+
+
+def gc_collect(histogram=NULL):
+    """Run a collection, timing it in microseconds into histogram."""
+    if gc is None:
+        return
+    if not histogram:
+        gc.collect()
+        return
+    start = ticks_us()
+    gc.collect()
+    histogram.observe(ticks_diff(ticks_us(), start))
+
+
+def mem_free():
+    """Free heap in bytes, 0 where the port can't tell."""
+    fn = getattr(gc, "mem_free", None)
+    return fn() if fn is not None else 0
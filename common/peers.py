@@ -0,0 +1,121 @@
+# LRU-managed ESP-NOW peer table for receivers
+#
+# The ESP-NOW driver holds at most ~20 unencrypted peers and unicast sends
+# need the destination to be a peer. PeerTable adds peers on demand, evicts
+# the least recently used one when the driver table is full, and re-adds a
+# peer transparently if the driver lost it. Pinned peers (the broadcast
+# address) are never evicted.
+
+try:
+    from ucollections import OrderedDict
+except ImportError:
+    from collections import OrderedDict
+
+BROADCAST_MAC = b"\xff" * 6
+MAX_PEERS = 20
+
+# esp-idf error codes raised as OSError(code, name) by espnow
+ESP_ERR_ESPNOW_FULL = -12394
+ESP_ERR_ESPNOW_NOT_FOUND = -12395
+ESP_ERR_ESPNOW_EXIST = -12397
+
+
+def _code(e):
+    return e.args[0] if e.args else None
+
+
+class PeerTable:
+    def __init__(self, esp_now, limit=MAX_PEERS, pinned=(BROADCAST_MAC,)):
+        self.esp_now = esp_now
+        self.pinned = [bytes(mac) for mac in pinned]
+        self.limit = limit - len(self.pinned)
+        self._lru = OrderedDict()  # mac -> None, least recently used first
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.readds = 0
+        self.send_errors = 0
+        for mac in self.pinned:
+            self._add(mac)
+
+    def __len__(self):
+        return len(self._lru)
+
+    def __contains__(self, mac):
+        return bytes(mac) in self._lru or bytes(mac) in self.pinned
+
+    def _add(self, mac):
+        try:
+            self.esp_now.add_peer(mac)
+        except OSError as e:
+            if _code(e) != ESP_ERR_ESPNOW_EXIST:
+                raise
+
+    def _evict(self):
+        for mac in self._lru:
+            break
+        else:
+            return False
+        del self._lru[mac]
+        try:
+            self.esp_now.del_peer(mac)
+        except OSError:
+            pass  # already gone
+        self.evictions += 1
+        return True
+
+    def ensure(self, mac):
+        """Make mac a driver peer, evicting the least recently used if needed."""
+        mac = bytes(mac)
+        if mac in self.pinned:
+            return
+        if mac in self._lru:
+            self.hits += 1
+            del self._lru[mac]  # re-insert as most recently used
+            self._lru[mac] = None
+            return
+        self.misses += 1
+        while len(self._lru) >= self.limit:
+            self._evict()
+        try:
+            self._add(mac)
+        except OSError as e:
+            # Driver full with peers we don't know about
+            if _code(e) != ESP_ERR_ESPNOW_FULL or not self._evict():
+                raise
+            self._add(mac)
+        self._lru[mac] = None
+
+    def send(self, mac, msg, sync=True):
+        """Unicast msg to mac, adding it as a peer first if needed."""
+        self.ensure(mac)
+        try:
+            return self.esp_now.send(mac, msg, sync)
+        except OSError as e:
+            if _code(e) != ESP_ERR_ESPNOW_NOT_FOUND:
+                self.send_errors += 1
+                raise
+        # The driver lost the peer (e.g. deleted elsewhere), add it again
+        self.readds += 1
+        self._add(bytes(mac))
+        return self.esp_now.send(mac, msg, sync)
+
+    def remove(self, mac):
+        mac = bytes(mac)
+        if mac in self._lru:
+            del self._lru[mac]
+            try:
+                self.esp_now.del_peer(mac)
+            except OSError:
+                pass
+
+    def stats(self):
+        return {
+            "peers": len(self._lru),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "readds": self.readds,
+            "send_errors": self.send_errors,
+        }
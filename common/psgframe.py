@@ -0,0 +1,809 @@
+# PsGadget binary frame format for ESP-NOW telemetry
+# Copy this file to the board next to main.py (transmitters and receivers).
+#
+# Frame layout (little endian):
+#   header    magic(1) version(1) msgtype(1) flags(1) seq(2)
+#   telemetry serial(6) gadget(1) temp_centi(2, signed) battery(1) r(1) g(1) b(1)
+#   batch     serial(6) gadget(1) count(1), then count samples of
+#             age_ms(2) temp_centi(2, signed) battery(1) r(1) g(1) b(1)
+#   probe     serial(6) gadget(1) channel(1)          transmitter -> broadcast
+#   offer     mac(6) channel(1) load(1)               receiver -> transmitter,
+#             seq echoes the probe's seq
+#   ack       bitmap(4)                               receiver -> transmitter,
+#             bit i set = seq (header seq - i) was received
+#   command   count(1) count x mac(6) text            receiver -> transmitters,
+#             count 0 = every transmitter that hears it, seq is the command id
+#   cmdack    status(1)                               transmitter -> receiver,
+#             seq echoes the command's seq
+#   register  serial(6) gadget(1), T_MACHINE ext      transmitter -> receiver
+#   session   sid(1) status(1)                        receiver -> transmitter,
+#             seq echoes the register (or rejected) frame's seq
+#   stelemetry / sbatch: telemetry / batch with sid(1) in place of serial(6)
+#             gadget(1), see session.py
+#   ext       zero or more TLVs: tag(1) len(1) value(len)
+#
+# Times (T_TIME) are the low 32 bits of the sender's reference clock, Unix
+# time in ms as set by the host (see clocksync.py); unwrap_time() recovers
+# the full value near a clock that is within ~24 days of it.
+#
+# Transmitters in deadband mode (deadband.py) only send when a reading moves
+# or their heartbeat comes due. Their frames carry the heartbeat (T_HEARTBEAT,
+# uint16 seconds, the longest they stay silent while alive), F_HEARTBEAT
+# when nothing moved, and T_AGG with the temperature readings since the last
+# frame: count(2) min(2) max(2) mean(2), centi-degrees like temp_centi.
+#
+# Frames that don't start with MAGIC are treated as the legacy pipe text
+# format "type|serial|machine|temp|battery|message" so mixed fleets keep working.
+
+try:
+    import ustruct as struct
+except ImportError:
+    import struct
+try:
+    import ubinascii as binascii
+except ImportError:
+    import binascii
+
+MAGIC = 0xA7  # never a valid first byte of UTF-8 text
+VERSION = 1
+MAX_FRAME = 250  # ESP-NOW payload limit
+
+# Message types
+MT_TELEMETRY = 1
+MT_BATCH = 2      # several samples from one transmitter
+MT_PROBE = 3      # transmitter looking for a receiver
+MT_OFFER = 4      # receiver answering a probe
+MT_ACK = 5        # receiver acknowledging frames sent with F_ACKREQ
+MT_COMMAND = 6    # receiver passing a host command on to transmitters
+MT_CMDACK = 7     # transmitter answering a command
+MT_REGISTER = 8   # transmitter asking for a session id
+MT_SESSION = 9    # receiver answering a register, or rejecting a session id
+MT_STELEMETRY = 10  # telemetry from a registered transmitter
+MT_SBATCH = 11      # batch from a registered transmitter
+
+# Header flags
+F_RGB = 0x01     # rgb bytes are meaningful
+F_ACKREQ = 0x02  # sender wants an MT_ACK back
+F_RETX = 0x04    # retransmission of an earlier frame (same seq)
+F_HEARTBEAT = 0x08  # sent because the heartbeat came due, readings inside the deadband
+
+# Command ack status
+CMD_OK = 0
+CMD_FAILED = 1  # unknown command or the handler raised
+
+# Session status
+S_GRANTED = 0
+S_UNKNOWN = 1  # no such session (receiver restarted or evicted it), register again
+S_FULL = 2     # no free session, keep sending full frames and try later
+
+# TLV extension tags
+T_MACHINE = 1  # machine type string, e.g. uos.uname().machine
+T_TEXT = 2     # free-form message text
+T_TIME = 3     # send time, uint32 ms (low bits of Unix time in ms)
+T_AGG = 4      # readings since the last frame: count, min, max, mean temperature
+T_HEARTBEAT = 5  # heartbeat, uint16 seconds
+
+HEADER = "<BBBBH"
+HEADER_SIZE = struct.calcsize(HEADER)
+TELEMETRY = "<6sBhB3B"
+TELEMETRY_SIZE = struct.calcsize(TELEMETRY)
+BATCH = "<6sBB"
+BATCH_SIZE = struct.calcsize(BATCH)
+SAMPLE = "<HhB3B"
+SAMPLE_SIZE = struct.calcsize(SAMPLE)
+MAX_AGE_MS = 0xFFFF
+PROBE = "<6sBB"
+PROBE_SIZE = struct.calcsize(PROBE)
+OFFER = "<6sBB"
+OFFER_SIZE = struct.calcsize(OFFER)
+ACK = "<I"
+ACK_SIZE = struct.calcsize(ACK)
+AGG = "<Hhhh"
+AGG_SIZE = struct.calcsize(AGG)
+
+# Gadget type codes, index is the code sent on the wire
+GADGET_TYPES = ("", "PsGadget-IO")
+
+
+def gadget_code(name):
+    """Return the wire code for a gadget type name (0 if unknown)."""
+    try:
+        return GADGET_TYPES.index(name)
+    except ValueError:
+        return 0
+
+
+def encode_header(msgtype, seq, flags=0):
+    """Pack a frame header."""
+    return struct.pack(HEADER, MAGIC, VERSION, msgtype, flags, seq & 0xFFFF)
+
+
+def encode_tlv(tag, value):
+    """Pack a single TLV extension, value is bytes or str (cut to 255 bytes,
+    on a character boundary)."""
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    if len(value) > 255:
+        end = 255
+        while end and value[end] & 0xC0 == 0x80:  # don't split a UTF-8 sequence
+            end -= 1
+        value = value[:end]
+    return bytes((tag, len(value))) + value
+
+
+def time_tlv(ms):
+    """(tag, value) extension with the send time ms, for encode_telemetry/encode_batch."""
+    return (T_TIME, struct.pack("<I", ms & 0xFFFFFFFF))
+
+
+def agg_tlv(count, low, high, mean):
+    """(tag, value) extension with the temperature readings since the last frame."""
+    return (T_AGG, struct.pack(AGG, min(count, 0xFFFF), int(round(low * 100)),
+                               int(round(high * 100)), int(round(mean * 100))))
+
+
+def heartbeat_tlv(seconds):
+    """(tag, value) extension with the transmitter's heartbeat in seconds."""
+    return (T_HEARTBEAT, struct.pack("<H", min(seconds, 0xFFFF)))
+
+
+def unwrap_time(low, near):
+    """The time closest to near whose low 32 bits are low."""
+    diff = (low - near) & 0xFFFFFFFF
+    if diff & 0x80000000:
+        diff -= 0x100000000
+    return near + diff
+
+
+def encode_telemetry(seq, serial, gadget, temp, battery, rgb=None, ext=None, flags=0):
+    """Build a telemetry frame.
+
+    serial is the raw machine.unique_id() bytes, temp is in degrees C,
+    ext is an optional list of (tag, value) TLV extensions and flags are
+    extra header flags (F_HEARTBEAT).
+    """
+    r = g = b = 0
+    if rgb is not None:
+        flags |= F_RGB
+        r, g, b = rgb
+    frame = encode_header(MT_TELEMETRY, seq, flags) + struct.pack(
+        TELEMETRY, serial, gadget, int(round(temp * 100)), battery, r, g, b)
+    if ext:
+        for tag, value in ext:
+            frame += encode_tlv(tag, value)
+    if len(frame) > MAX_FRAME:
+        raise ValueError("frame too long")
+    return frame
+
+
+def batch_capacity(ext_len=0):
+    """Number of samples that fit in one batch frame next to ext_len TLV bytes."""
+    return (MAX_FRAME - HEADER_SIZE - BATCH_SIZE - ext_len) // SAMPLE_SIZE
+
+
+def encode_batch(seq, serial, gadget, samples, ext=None, rgb=False):
+    """Build a batch frame from (age_ms, temp, battery, rgb) samples.
+
+    age_ms is how long before sending the sample was taken. rgb=True marks
+    the samples' colours as meaningful.
+    """
+    tlvs = b""
+    if ext:
+        for tag, value in ext:
+            tlvs += encode_tlv(tag, value)
+    count = len(samples)
+    if count > batch_capacity(len(tlvs)) or count > 255:
+        raise ValueError("too many samples")
+    frame = bytearray(HEADER_SIZE + BATCH_SIZE + count * SAMPLE_SIZE)
+    struct.pack_into(HEADER, frame, 0, MAGIC, VERSION, MT_BATCH, F_RGB if rgb else 0, seq & 0xFFFF)
+    struct.pack_into(BATCH, frame, HEADER_SIZE, serial, gadget, count)
+    offset = HEADER_SIZE + BATCH_SIZE
+    for age, temp, battery, color in samples:
+        r, g, b = color or (0, 0, 0)
+        struct.pack_into(SAMPLE, frame, offset, min(age, MAX_AGE_MS),
+                         int(round(temp * 100)), battery, r, g, b)
+        offset += SAMPLE_SIZE
+    return bytes(frame) + tlvs
+
+
+def encode_probe(seq, serial, gadget, channel):
+    """Build a probe frame, broadcast by a transmitter on channel."""
+    return encode_header(MT_PROBE, seq) + struct.pack(PROBE, serial, gadget, channel)
+
+
+def encode_offer(seq, mac, channel, load):
+    """Build an offer frame answering the probe with sequence number seq.
+
+    load is a 0-255 hint, lower means the receiver is less busy.
+    """
+    return encode_header(MT_OFFER, seq) + struct.pack(OFFER, mac, channel, min(load, 255))
+
+
+def encode_ack(latest, bitmap):
+    """Build an ack frame for the 32 sequence numbers up to latest."""
+    return encode_header(MT_ACK, latest) + struct.pack(ACK, bitmap & 0xFFFFFFFF)
+
+
+def decode_ack(msg):
+    """Return (latest, bitmap) for an ack frame, or None."""
+    if msgtype(msg) != MT_ACK or len(msg) < HEADER_SIZE + ACK_SIZE:
+        return None
+    return msg[4] | msg[5] << 8, struct.unpack_from(ACK, msg, HEADER_SIZE)[0]
+
+
+def command_capacity(text_len):
+    """How many target MACs fit in a command frame next to text_len bytes of text."""
+    return max(0, min(255, (MAX_FRAME - HEADER_SIZE - 1 - text_len) // 6))
+
+
+def encode_command(seq, text, targets=(), flags=0):
+    """Build a command frame for the transmitters in targets (all if empty)."""
+    if isinstance(text, str):
+        text = text.encode("utf-8")
+    if len(targets) > command_capacity(len(text)):
+        raise ValueError("command frame too long")
+    return encode_header(MT_COMMAND, seq, flags) + bytes((len(targets),)) + b"".join(targets) + text
+
+
+def decode_command(msg):
+    """Return (seq, flags, targets, text) for a command frame, or None.
+
+    targets is a tuple of MACs, empty when the command is for everyone.
+    """
+    if msgtype(msg) != MT_COMMAND or len(msg) < HEADER_SIZE + 1:
+        return None
+    start = HEADER_SIZE + 1
+    end = start + 6 * msg[HEADER_SIZE]
+    if len(msg) < end:
+        return None
+    targets = tuple(bytes(msg[i:i + 6]) for i in range(start, end, 6))
+    try:
+        text = bytes(msg[end:]).decode("utf-8")
+    except UnicodeError:
+        return None
+    return msg[4] | msg[5] << 8, msg[3], targets, text
+
+
+def encode_cmdack(seq, status=CMD_OK):
+    """Build the answer to the command with id seq."""
+    return encode_header(MT_CMDACK, seq) + bytes((status,))
+
+
+def decode_cmdack(msg):
+    """Return (seq, status) for a command ack frame, or None."""
+    if msgtype(msg) != MT_CMDACK or len(msg) < HEADER_SIZE + 1:
+        return None
+    return msg[4] | msg[5] << 8, msg[HEADER_SIZE]
+
+
+def encode_register(seq, serial, gadget, machine=None):
+    """Build a register frame with the transmitter's static fields."""
+    frame = encode_header(MT_REGISTER, seq) + struct.pack("<6sB", serial, gadget)
+    return frame + encode_tlv(T_MACHINE, machine) if machine else frame
+
+
+def decode_register(msg):
+    """Return (seq, serial, gadget, machine TLV bytes or b"") for a register frame, or None."""
+    if msgtype(msg) != MT_REGISTER or len(msg) < HEADER_SIZE + 7:
+        return None
+    serial, gadget = struct.unpack_from("<6sB", msg, HEADER_SIZE)
+    tlv = b""
+    start = HEADER_SIZE + 7
+    if len(msg) >= start + 2 and msg[start] == T_MACHINE and len(msg) >= start + 2 + msg[start + 1]:
+        tlv = bytes(msg[start:start + 2 + msg[start + 1]])
+    return msg[4] | msg[5] << 8, serial, gadget, tlv
+
+
+def encode_session(seq, sid, status=S_GRANTED):
+    """Build the answer to a register (or the rejection of a frame) with sequence number seq."""
+    return encode_header(MT_SESSION, seq) + bytes((sid, status))
+
+
+def decode_session(msg):
+    """Return (seq, sid, status) for a session frame, or None."""
+    if msgtype(msg) != MT_SESSION or len(msg) < HEADER_SIZE + 2:
+        return None
+    return msg[4] | msg[5] << 8, msg[HEADER_SIZE], msg[HEADER_SIZE + 1]
+
+
+def to_session(frame, sid):
+    """Session form of a telemetry or batch frame: sid in place of serial and gadget."""
+    mt = MT_STELEMETRY if frame[2] == MT_TELEMETRY else MT_SBATCH
+    return frame[:2] + bytes((mt,)) + frame[3:HEADER_SIZE] + bytes((sid,)) + frame[HEADER_SIZE + 7:]
+
+
+def from_session(frame, serial, gadget):
+    """Full form of a session frame (see to_session), without the machine type."""
+    mt = MT_TELEMETRY if frame[2] == MT_STELEMETRY else MT_BATCH
+    return bytearray(frame[:2] + bytes((mt,)) + frame[3:HEADER_SIZE] + serial + bytes((gadget,))
+                     + frame[HEADER_SIZE + 1:])
+
+
+def with_flags(frame, flags):
+    """Copy of a binary frame with extra header flags set."""
+    frame = bytearray(frame)
+    frame[3] |= flags
+    return frame
+
+
+def frame_seq(msg):
+    """Return (seq, flags) of a binary frame, or None for legacy text."""
+    if len(msg) >= HEADER_SIZE and msg[0] == MAGIC and msg[1] == VERSION:
+        return msg[4] | msg[5] << 8, msg[3]
+    return None
+
+
+def msgtype(msg):
+    """Message type of a binary frame, or None for legacy text."""
+    if len(msg) >= HEADER_SIZE and msg[0] == MAGIC and msg[1] == VERSION:
+        return msg[2]
+    return None
+
+
+def decode_probe(msg):
+    """Return (seq, serial, gadget, channel) for a probe frame, or None."""
+    if msgtype(msg) != MT_PROBE or len(msg) < HEADER_SIZE + PROBE_SIZE:
+        return None
+    seq = struct.unpack_from("<H", msg, 4)[0]
+    return (seq,) + struct.unpack_from(PROBE, msg, HEADER_SIZE)
+
+
+def decode_offer(msg):
+    """Return (seq, mac, channel, load) for an offer frame, or None."""
+    if msgtype(msg) != MT_OFFER or len(msg) < HEADER_SIZE + OFFER_SIZE:
+        return None
+    seq = struct.unpack_from("<H", msg, 4)[0]
+    return (seq,) + struct.unpack_from(OFFER, msg, HEADER_SIZE)
+
+
+def decode_tlvs(msg, offset):
+    """Return a dict of tag -> bytes for the TLVs starting at offset."""
+    ext = {}
+    end = len(msg)
+    while offset + 2 <= end:
+        tag = msg[offset]
+        length = msg[offset + 1]
+        offset += 2
+        if offset + length > end:
+            break  # truncated extension, ignore the rest
+        ext[tag] = bytes(msg[offset:offset + length])
+        offset += length
+    return ext
+
+
+def is_binary(msg):
+    """True if msg looks like a binary PsGadget frame of this VERSION."""
+    return len(msg) >= HEADER_SIZE and msg[0] == MAGIC and msg[1] == VERSION
+
+
+def decode_records(msg):
+    """Decode a received frame into a list of record dicts (empty if malformed).
+
+    Batch frames give one record per sample, with an extra "age_ms" key.
+    """
+    if is_binary(msg) and msg[2] == MT_BATCH:
+        return decode_batch(msg)
+    record = decode(msg)
+    return [record] if record is not None else []
+
+
+def decode(msg):
+    """Decode a received frame into a record dict, or None if malformed.
+
+    Both binary frames and legacy pipe text frames are accepted. The record
+    keys are: gadget, serial, machine, temp, battery, message, rgb, seq, legacy.
+    """
+    if is_binary(msg):
+        return decode_binary(msg)
+    return decode_legacy(msg)
+
+
+def decode_binary(msg):
+    magic, version, msgtype, flags, seq = struct.unpack_from(HEADER, msg, 0)
+    if version != VERSION or msgtype != MT_TELEMETRY:
+        return None
+    if len(msg) < HEADER_SIZE + TELEMETRY_SIZE:
+        return None
+    serial, gadget, temp, battery, r, g, b = struct.unpack_from(TELEMETRY, msg, HEADER_SIZE)
+    ext = decode_tlvs(msg, HEADER_SIZE + TELEMETRY_SIZE)
+    rgb = (r, g, b) if flags & F_RGB else None
+    text = _text(ext.get(T_TEXT))
+    if text is not None:
+        message = text
+    elif rgb is not None:
+        message = "rgb({}, {}, {})".format(r, g, b)
+    else:
+        message = ""
+    machine = ext.get(T_MACHINE)
+    return {
+        "gadget": GADGET_TYPES[gadget] if gadget < len(GADGET_TYPES) else str(gadget),
+        "serial": binascii.hexlify(serial).decode(),
+        "machine": _text(machine),
+        "temp": _temp(temp),
+        "battery": battery,
+        "message": message,
+        "rgb": rgb,
+        "seq": seq,
+        "legacy": False,
+        "sent": _sent(ext),
+        "agg": _agg(ext),
+        "heartbeat": _heartbeat(ext),
+        "idle": bool(flags & F_HEARTBEAT),
+    }
+
+
+def _temp(centi):
+    return centi / 100 if centi % 100 else centi // 100
+
+
+def _text(value):
+    # T_TEXT/T_MACHINE as str, None if missing or not valid UTF-8
+    if value is None:
+        return None
+    try:
+        return value.decode("utf-8")
+    except UnicodeError:
+        return None
+
+
+def _sent(ext):
+    # T_TIME value, None if the frame has none
+    value = ext.get(T_TIME)
+    return struct.unpack("<I", value)[0] if value is not None and len(value) == 4 else None
+
+
+def _agg(ext):
+    # T_AGG as (count, min, max, mean), None if the frame has none
+    value = ext.get(T_AGG)
+    if value is None or len(value) != AGG_SIZE:
+        return None
+    count, low, high, mean = struct.unpack(AGG, value)
+    return count, _temp(low), _temp(high), _temp(mean)
+
+
+def _heartbeat(ext):
+    # T_HEARTBEAT seconds, None if the frame has none
+    value = ext.get(T_HEARTBEAT)
+    return struct.unpack("<H", value)[0] if value is not None and len(value) == 2 else None
+
+
+def decode_batch(msg):
+    magic, version, msgtype, flags, seq = struct.unpack_from(HEADER, msg, 0)
+    if version != VERSION or msgtype != MT_BATCH or len(msg) < HEADER_SIZE + BATCH_SIZE:
+        return []
+    serial, gadget, count = struct.unpack_from(BATCH, msg, HEADER_SIZE)
+    offset = HEADER_SIZE + BATCH_SIZE
+    end = offset + count * SAMPLE_SIZE
+    if len(msg) < end:
+        return []
+    ext = decode_tlvs(msg, end)
+    text = _text(ext.get(T_TEXT))
+    machine = _text(ext.get(T_MACHINE))
+    sent = _sent(ext)
+    agg = _agg(ext)
+    heartbeat = _heartbeat(ext)
+    gadget = GADGET_TYPES[gadget] if gadget < len(GADGET_TYPES) else str(gadget)
+    serial = binascii.hexlify(serial).decode()
+    records = []
+    for i in range(count):
+        age, temp, battery, r, g, b = struct.unpack_from(SAMPLE, msg, offset)
+        offset += SAMPLE_SIZE
+        rgb = (r, g, b) if flags & F_RGB else None
+        if text is not None:
+            message = text
+        elif rgb is not None:
+            message = "rgb({}, {}, {})".format(r, g, b)
+        else:
+            message = ""
+        records.append({
+            "gadget": gadget,
+            "serial": serial,
+            "machine": machine,
+            "temp": _temp(temp),
+            "battery": battery,
+            "message": message,
+            "rgb": rgb,
+            "seq": seq,
+            "legacy": False,
+            "sent": sent,
+            "agg": agg,
+            "heartbeat": heartbeat,
+            "idle": bool(flags & F_HEARTBEAT),
+            "age_ms": age,
+        })
+    return records
+
+
+def parse_rgb(message):
+    """Parse 'rgb(r, g, b)' into a tuple, or None."""
+    if not message.startswith("rgb"):
+        return None
+    try:
+        return tuple(int(v) for v in message[3:].strip("()").split(","))
+    except ValueError:
+        return None
+
+
+def decode_legacy(msg):
+    try:
+        parts = bytes(msg).decode("utf-8").split("|")
+    except UnicodeError:
+        return None
+    if len(parts) < 6:
+        return None
+    gadget, serial, machine, temp, battery, message = parts[:6]
+    return {
+        "gadget": gadget,
+        "serial": serial,
+        "machine": machine,
+        "temp": temp,
+        "battery": battery,
+        "message": message,
+        "rgb": parse_rgb(message),
+        "seq": None,
+        "legacy": True,
+    }
+
+
+def to_text(record, machine=None, rx_ms=None):
+    """Render a record as the pipe text line the FT232H host expects.
+
+    machine overrides a missing machine type (binary frames only carry it
+    in some frames, receivers cache it per serial). Samples from batch
+    frames get a seventh field with the sample age in ms. Records from
+    deadband transmitters get "|n=<count>|min=<temp>|max=<temp>|mean=<temp>"
+    for the readings since the last frame, "|hb=<heartbeat s>" and "|idle=1"
+    if nothing moved. With rx_ms, the receiver's reference time when the
+    frame came in, records with a send time end in "|t=<sent ms>|rx=<rx_ms>".
+    "|", CR and LF in the machine type and message become spaces, so they
+    can't split the line.
+    """
+    line = "{}|{}|{}|{}|{}|{}".format(
+        record["gadget"], record["serial"], _field(record["machine"] or machine or ""),
+        record["temp"], record["battery"], _field(record["message"]))
+    age = record.get("age_ms")
+    if age is not None:
+        line += "|{}".format(age)
+    agg = record.get("agg")
+    if agg is not None:
+        line += "|n={}|min={}|max={}|mean={}".format(*agg)
+    heartbeat = record.get("heartbeat")
+    if heartbeat is not None:
+        line += "|hb={}".format(heartbeat)
+        if record.get("idle"):
+            line += "|idle=1"
+    sent = record.get("sent")
+    if sent is not None and rx_ms is not None:
+        line += "|t={}|rx={}".format(unwrap_time(sent, rx_ms), rx_ms)
+    return line.encode("utf-8")
+
+
+def _field(text):
+    # Text for a pipe line field, see to_text()
+    if "|" in text or "\n" in text or "\r" in text:
+        text = text.replace("|", " ").replace("\n", " ").replace("\r", " ")
+    return text
+
+
+# Field offsets for LineRenderer, from the struct layouts above
+_SERIAL = HEADER_SIZE
+_GADGET = HEADER_SIZE + 6
+_TEMP = HEADER_SIZE + 7             # telemetry
+_COUNT = HEADER_SIZE + 7            # batch
+_SAMPLES = HEADER_SIZE + BATCH_SIZE
+LINE_MAX = 690  # longest line to_text can give for a frame (255 byte TLVs, aggregates, times)
+_AGG_FIELDS = ((b"|min=", 2), (b"|max=", 4), (b"|mean=", 6))
+
+
+class LineRenderer:
+    """to_text() lines for binary frames, rendered from the frame bytes into
+    one preallocated buffer without building records (no heap per frame).
+
+        lines = LineRenderer(pipeline.macs)
+        for i in range(lines.count(msg)):
+            line = lines.render(msg, i)   # memoryview, valid until the next render()
+
+    count() is 0 for anything but telemetry and batch frames (legacy text
+    included), those take the decode_records() path. names gives the
+    serial's hex (rxpipe.MacCache). The machine type of frames without one
+    comes from the last frame of the same serial that had it, kept for up
+    to max_machines serials (the oldest makes room). Machine types and
+    message text are copied with "|", CR and LF as spaces. A frame's
+    T_MACHINE is checked against the cache on its first line, so render a
+    frame's lines from 0 up. After
+    render(msg, i, rx_ms) sent is the frame's unwrapped send time and
+    heartbeat its heartbeat in seconds, or None.
+    """
+
+    def __init__(self, names, size=LINE_MAX, max_machines=256):
+        self.names = names
+        self.max_machines = max_machines
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.machines = {}  # serial (interned) -> machine type bytes
+        self._gadgets = [name.encode() for name in GADGET_TYPES]
+        self.sent = None
+        self.heartbeat = None
+
+    def count(self, msg):
+        """Number of lines in msg, 0 if it isn't a well-formed telemetry or batch frame."""
+        if len(msg) < HEADER_SIZE + TELEMETRY_SIZE or msg[0] != MAGIC or msg[1] != VERSION:
+            return 0
+        if msg[2] == MT_TELEMETRY:
+            return 1
+        if msg[2] == MT_BATCH and len(msg) >= _SAMPLES + msg[_COUNT] * SAMPLE_SIZE:
+            return msg[_COUNT]
+        return 0
+
+    def rgb(self, msg, i=0):
+        """Offset of line i's r, g, b bytes in msg, or -1 if the frame has no colour."""
+        if not msg[3] & F_RGB:
+            return -1
+        if msg[2] == MT_TELEMETRY:
+            return _TEMP + 3
+        return _SAMPLES + i * SAMPLE_SIZE + 5
+
+    def _tlv(self, msg, offset, tag):
+        # Offset of a TLV's value in msg, or -1
+        end = len(msg)
+        while offset + 2 <= end:
+            length = msg[offset + 1]
+            if offset + 2 + length > end:
+                return -1
+            if msg[offset] == tag:
+                return offset + 2
+            offset += 2 + length
+        return -1
+
+    def _put(self, pos, data):
+        self.buf[pos:pos + len(data)] = data
+        return pos + len(data)
+
+    def _copy(self, pos, msg, start, length):
+        # Byte by byte, a slice of msg would allocate. "|", LF and CR would
+        # split the line, they become spaces (like to_text)
+        buf = self.buf
+        for k in range(start, start + length):
+            b = msg[k]
+            buf[pos] = 32 if b == 124 or b == 10 or b == 13 else b
+            pos += 1
+        return pos
+
+    def _machine(self, msg, start, length):
+        # Cached machine type of msg's serial, replaced if msg's T_MACHINE
+        # differs from it (compared in place, no copy unless it changed)
+        serial = self.names.intern(msg, _SERIAL)
+        machines = self.machines
+        machine = machines.get(serial)
+        if machine is not None and len(machine) == length:
+            for k in range(length):
+                if machine[k] != msg[start + k]:
+                    break
+            else:
+                return machine
+        if machine is None and len(machines) >= self.max_machines:
+            for oldest in machines:
+                break
+            del machines[oldest]
+        machine = machines[serial] = bytes(msg[start:start + length])
+        return machine
+
+    def _int(self, pos, value):
+        buf = self.buf
+        if value < 0:
+            buf[pos] = 45  # -
+            pos += 1
+            value = -value
+        start = pos
+        while True:
+            buf[pos] = 48 + value % 10
+            pos += 1
+            value //= 10
+            if not value:
+                break
+        i = start
+        j = pos - 1
+        while i < j:
+            buf[i], buf[j] = buf[j], buf[i]
+            i += 1
+            j -= 1
+        return pos
+
+    def _temp(self, pos, centi):
+        # Same digits as str(centi / 100 if centi % 100 else centi // 100)
+        buf = self.buf
+        if centi < 0:
+            buf[pos] = 45
+            pos += 1
+            centi = -centi
+        pos = self._int(pos, centi // 100)
+        frac = centi % 100
+        if frac:
+            buf[pos] = 46  # .
+            buf[pos + 1] = 48 + frac // 10
+            pos += 2
+            if frac % 10:
+                buf[pos] = 48 + frac % 10
+                pos += 1
+        return pos
+
+    def render(self, msg, i=0, rx_ms=None):
+        """Line i of msg (see count()) as a memoryview into the buffer."""
+        buf = self.buf
+        batch = msg[2] == MT_BATCH
+        if batch:
+            sample = _SAMPLES + i * SAMPLE_SIZE
+            temp = sample + 2
+            tlvs = _SAMPLES + msg[_COUNT] * SAMPLE_SIZE
+        else:
+            temp = _TEMP
+            tlvs = HEADER_SIZE + TELEMETRY_SIZE
+        gadget = msg[_GADGET]
+        if gadget < len(self._gadgets):
+            name = self._gadgets[gadget]
+            pos = self._put(0, name)
+        else:
+            pos = self._int(0, gadget)
+        buf[pos] = 124  # |
+        pos = self._put(pos + 1, self.names.hex(msg, _SERIAL))
+        buf[pos] = 124
+        pos += 1
+        start = self._tlv(msg, tlvs, T_MACHINE)
+        machine = self.machines.get(self.names.intern(msg, _SERIAL))
+        if start >= 0 and msg[start - 1] and (machine is None or not i):
+            # Checked against the cache once per frame, on its first line
+            machine = self._machine(msg, start, msg[start - 1])
+        if machine is not None:
+            if 124 in machine or 10 in machine or 13 in machine:
+                pos = self._copy(pos, machine, 0, len(machine))
+            else:
+                pos = self._put(pos, machine)
+        buf[pos] = 124
+        centi = msg[temp] | msg[temp + 1] << 8
+        pos = self._temp(pos + 1, centi - 0x10000 if centi & 0x8000 else centi)
+        buf[pos] = 124
+        pos = self._int(pos + 1, msg[temp + 2])
+        buf[pos] = 124
+        pos += 1
+        start = self._tlv(msg, tlvs, T_TEXT)
+        if start >= 0:
+            pos = self._copy(pos, msg, start, msg[start - 1])
+        elif msg[3] & F_RGB:
+            pos = self._put(pos, b"rgb(")
+            pos = self._int(pos, msg[temp + 3])
+            pos = self._put(pos, b", ")
+            pos = self._int(pos, msg[temp + 4])
+            pos = self._put(pos, b", ")
+            pos = self._int(pos, msg[temp + 5])
+            buf[pos] = 41  # )
+            pos += 1
+        if batch:
+            buf[pos] = 124
+            pos = self._int(pos + 1, msg[sample] | msg[sample + 1] << 8)
+        start = self._tlv(msg, tlvs, T_AGG)
+        if start >= 0 and msg[start - 1] == AGG_SIZE:
+            pos = self._put(pos, b"|n=")
+            pos = self._int(pos, msg[start] | msg[start + 1] << 8)
+            for label, k in _AGG_FIELDS:
+                pos = self._put(pos, label)
+                centi = msg[start + k] | msg[start + k + 1] << 8
+                pos = self._temp(pos, centi - 0x10000 if centi & 0x8000 else centi)
+        self.heartbeat = None
+        start = self._tlv(msg, tlvs, T_HEARTBEAT)
+        if start >= 0 and msg[start - 1] == 2:
+            self.heartbeat = msg[start] | msg[start + 1] << 8
+            pos = self._put(pos, b"|hb=")
+            pos = self._int(pos, self.heartbeat)
+            if msg[3] & F_HEARTBEAT:
+                pos = self._put(pos, b"|idle=1")
+        self.sent = None
+        if rx_ms is not None:
+            start = self._tlv(msg, tlvs, T_TIME)
+            if start >= 0 and msg[start - 1] == 4:
+                self.sent = unwrap_time(msg[start] | msg[start + 1] << 8 | msg[start + 2] << 16
+                                        | msg[start + 3] << 24, rx_ms)
+                pos = self._put(pos, b"|t=")
+                pos = self._int(pos, self.sent)
+                pos = self._put(pos, b"|rx=")
+                pos = self._int(pos, rx_ms)
+        return self.view[:pos]
@@ -0,0 +1,126 @@
+# Per-transmitter rate limiting for the receivers
+#
+# RateLimiter keeps a token bucket per source MAC: `rate` frames per second
+# with bursts of up to `burst` frames. Frames over the limit are shed before
+# they reach the receive ring, so one chatty or broken transmitter (or a
+# fleet rebooting at once) can't starve the others.
+#
+# TokenBucket is the same bucket on its own, e.g. the UART byte budget of
+# the egress queue (egress.py).
+#
+# Per-MAC counters: accepted = frames let through by the bucket, shed =
+# frames dropped by the bucket or lines dropped later by the egress queue.
+#
+# Token counts are kept in thousandths to stay in small ints.
+
+try:
+    from ucollections import OrderedDict
+except ImportError:
+    from collections import OrderedDict
+from ticks import ticks_ms, ticks_diff
+
+
+def _mac_str(mac):
+    return ":".join("{:02x}".format(b) for b in mac)
+
+
+class TokenBucket:
+    """One bucket: rate units per second, at most burst units saved up."""
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst * 1000
+        self._last = ticks_ms() if now is None else now
+
+    def available(self, now=None):
+        now = ticks_ms() if now is None else now
+        elapsed = ticks_diff(now, self._last)
+        if elapsed > 0:
+            self._tokens = min(self._tokens + elapsed * self.rate, self.burst * 1000)
+            self._last = now
+        return self._tokens // 1000
+
+    def take(self, n=1, now=None):
+        """Take n units if there are enough, returns True if taken."""
+        if self.available(now) < n:
+            return False
+        self._tokens -= n * 1000
+        return True
+
+    def consume(self, n):
+        """Take n units even if that goes below zero (for sends already made)."""
+        self._tokens -= n * 1000
+
+
+class RateLimiter:
+    def __init__(self, rate=10, burst=20, max_sources=64):
+        self.rate = rate
+        self.burst = burst
+        self.max_sources = max_sources
+        # mac -> [tokens (thousandths), last ms, accepted, shed], least recently heard first
+        self._sources = OrderedDict()
+        # Counters
+        self.accepted = 0
+        self.shed_total = 0
+        self.forgotten = 0
+
+    def __len__(self):
+        return len(self._sources)
+
+    def _state(self, mac, now):
+        state = self._sources.pop(mac, None)
+        if state is None:
+            if len(self._sources) >= self.max_sources:
+                for oldest in self._sources:
+                    break
+                del self._sources[oldest]
+                self.forgotten += 1
+            state = [self.burst * 1000, now, 0, 0]
+        self._sources[mac] = state  # most recently heard last
+        return state
+
+    def allow(self, mac, now=None):
+        """Take a token for a frame from mac, returns False if it should be shed."""
+        now = ticks_ms() if now is None else now
+        if not isinstance(mac, bytes):
+            mac = bytes(mac)  # RxPipeline hands out interned MACs, no copy needed
+        state = self._state(mac, now)
+        elapsed = ticks_diff(now, state[1])
+        if elapsed > 0:
+            state[0] = min(state[0] + elapsed * self.rate, self.burst * 1000)
+            state[1] = now
+        if state[0] < 1000:
+            state[3] += 1
+            self.shed_total += 1
+            return False
+        state[0] -= 1000
+        state[2] += 1
+        self.accepted += 1
+        return True
+
+    def shed(self, mac):
+        """Count a frame from mac dropped further down the path."""
+        state = self._sources.get(bytes(mac))
+        if state is not None:
+            state[3] += 1
+        self.shed_total += 1
+
+    def stats(self, mac=None):
+        """Counters for one MAC ({"accepted", "shed"} or None), or totals."""
+        if mac is None:
+            return {
+                "sources": len(self._sources),
+                "accepted": self.accepted,
+                "shed": self.shed_total,
+                "forgotten": self.forgotten,
+            }
+        state = self._sources.get(bytes(mac))
+        if state is None:
+            return None
+        return {"accepted": state[2], "shed": state[3]}
+
+    def report(self):
+        """Lines "limit <mac> accepted=.. shed=.." for every source, for the host."""
+        return ["limit {} accepted={} shed={}".format(_mac_str(mac), state[2], state[3])
+                for mac, state in self._sources.items()]
@@ -0,0 +1,253 @@
+# Optional reliable delivery on top of psgframe sequence numbers
+#
+# Transmitter (ReliableSender): frames go out with F_ACKREQ and stay in a
+# sliding window until an MT_ACK covers them. Unacknowledged frames are
+# resent with F_RETX after timeout_ms, up to `retries` times, then counted as
+# lost. A full window drops its oldest frame, so the sender never blocks.
+#
+# Receiver (ReliableReceiver): keeps the highest sequence number and a 32 bit
+# bitmap of recently seen ones per transmitter MAC, so duplicates (e.g. a
+# retransmit whose ack was lost) are dropped. Frames asking for it are acked,
+# duplicates too. A sequence number falling out of the window without being
+# seen counts as lost; a jump of a whole window or more either way is taken
+# as a restarted transmitter and starts the window over. Sources are kept
+# most recently heard last, the quietest is dropped for a new one.
+
+try:
+    from ucollections import OrderedDict
+except ImportError:
+    from collections import OrderedDict
+import psgframe
+from ticks import ticks_ms, ticks_diff, ticks_add, sleep_ms
+
+WINDOW_BITS = 32
+MASK = 0xFFFFFFFF
+
+
+def _ones(x):
+    return bin(x).count("1")
+
+
+class ReliableSender:
+    def __init__(self, esp_now, window=8, timeout_ms=250, retries=3, on_frame=None):
+        self.esp_now = esp_now
+        self.on_frame = on_frame  # on_frame(mac, msg) gets the frames that aren't acks
+        self.window = min(window, WINDOW_BITS)
+        self.timeout_ms = timeout_ms
+        self.retries = retries
+        self._frames = OrderedDict()  # seq -> [mac, frame, sent_ms, tries], oldest first
+        # Counters
+        self.sent = 0
+        self.acked = 0
+        self.retransmits = 0
+        self.lost = 0
+        self.window_full = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def send(self, mac, seq, frame, now=None):
+        """Send a binary frame with sequence number seq, returns the radio's ack."""
+        now = ticks_ms() if now is None else now
+        self.poll(now)
+        return self.push(mac, seq, frame, now)
+
+    def push(self, mac, seq, frame, now=None):
+        """send() without reading acks first, for use from on_frame. A frame
+        already in the window with the same seq is replaced."""
+        now = ticks_ms() if now is None else now
+        if seq not in self._frames and len(self._frames) >= self.window:
+            self.window_full += 1
+            for oldest in self._frames:
+                break
+            del self._frames[oldest]
+            self.lost += 1
+        frame = psgframe.with_flags(frame, psgframe.F_ACKREQ)
+        self._frames[seq] = [mac, frame, now, 0]
+        self.sent += 1
+        return self.esp_now.send(mac, frame, False)
+
+    def rewrite(self, fn):
+        """Replace every frame in flight with fn(frame), e.g. when what they
+        refer to (a session id) is gone. Flags are kept."""
+        for entry in self._frames.values():
+            frame = fn(entry[1])
+            if frame is not entry[1]:
+                flags = entry[1][3]
+                entry[1] = frame = bytearray(frame)
+                frame[3] |= flags
+
+    def _ack(self, latest, bitmap):
+        for seq in list(self._frames):
+            age = (latest - seq) & 0xFFFF
+            if age < WINDOW_BITS and bitmap >> age & 1:
+                del self._frames[seq]
+                self.acked += 1
+
+    def poll(self, now=None):
+        """Read acks and resend frames that timed out, call this often."""
+        while True:
+            mac, msg = self.esp_now.recv(0)
+            if msg is None:
+                break
+            ack = psgframe.decode_ack(msg)
+            if ack is not None:
+                self._ack(*ack)
+            elif self.on_frame is not None:
+                self.on_frame(mac, msg)
+        now = ticks_ms() if now is None else now
+        for seq in list(self._frames):
+            entry = self._frames[seq]
+            if ticks_diff(now, entry[2]) < self.timeout_ms:
+                continue
+            if entry[3] >= self.retries:
+                del self._frames[seq]
+                self.lost += 1
+                continue
+            entry[1][3] |= psgframe.F_RETX
+            entry[2] = now
+            entry[3] += 1
+            self.retransmits += 1
+            try:
+                self.esp_now.send(entry[0], entry[1], False)
+            except OSError:
+                pass  # tried again on the next timeout
+
+    def wait(self, ms, poll_ms=20):
+        """Sleep ms while handling acks and retransmits."""
+        deadline = ticks_add(ticks_ms(), ms)
+        while True:
+            self.poll()
+            left = ticks_diff(deadline, ticks_ms())
+            if left <= 0:
+                return
+            sleep_ms(min(left, poll_ms))
+
+    def flush(self, timeout_ms=1000, poll_ms=10):
+        """Wait until every frame is acked or given up, at most timeout_ms.
+
+        Returns True if all frames in flight were acked.
+        """
+        lost = self.lost
+        deadline = ticks_add(ticks_ms(), timeout_ms)
+        while self._frames and ticks_diff(deadline, ticks_ms()) > 0:
+            self.poll()
+            sleep_ms(poll_ms)
+        return not self._frames and self.lost == lost
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "acked": self.acked,
+            "retransmits": self.retransmits,
+            "lost": self.lost,
+            "window_full": self.window_full,
+            "in_flight": len(self._frames),
+        }
+
+
+class ReliableReceiver:
+    """Per-MAC dedup window; send(mac, frame, sync) is used for acks (e.g.
+    PeerTable.send), with sync False so the receive path doesn't wait for
+    the radio's own ack."""
+
+    def __init__(self, send=None, max_sources=64):
+        self.send = send
+        self.max_sources = max_sources
+        # mac -> [highest, bitmap, received, duplicates, lost, retransmits, changed]
+        self._sources = OrderedDict()
+        # Counters
+        self.acks = 0
+        self.ack_errors = 0
+
+    def accept(self, mac, msg):
+        """Returns False if msg is a duplicate that shouldn't be forwarded."""
+        if not psgframe.is_binary(msg) or msg[1] != psgframe.VERSION:
+            return True  # legacy text, no sequence number
+        seq = msg[4] | msg[5] << 8
+        flags = msg[3]
+        if not isinstance(mac, bytes):
+            mac = bytes(mac)  # RxPipeline hands out interned MACs, no copy needed
+        state = self._sources.get(mac)
+        if state is None:
+            if len(self._sources) >= self.max_sources:
+                for oldest in self._sources:
+                    break
+                del self._sources[oldest]
+            # Nothing before the first frame is expected
+            state = self._sources[mac] = [seq, MASK, 0, 0, 0, 0, True]
+            new = True
+        else:
+            # Most recently heard last, so the sources evicted are the quiet ones
+            del self._sources[mac]
+            self._sources[mac] = state
+            new = self._update(state, seq)
+        state[6] = True
+        if new:
+            state[2] += 1
+            if flags & psgframe.F_RETX:
+                state[5] += 1
+        else:
+            state[3] += 1
+        if flags & psgframe.F_ACKREQ and self.send is not None:
+            try:
+                self.send(mac, psgframe.encode_ack(state[0], state[1]), False)
+                self.acks += 1
+            except OSError:
+                self.ack_errors += 1
+        return new
+
+    def _update(self, state, seq):
+        highest, bitmap = state[0], state[1]
+        ahead = (seq - highest) & 0xFFFF
+        if ahead == 0:
+            return False
+        if ahead < 0x8000:
+            # Slide the window forward, unseen numbers leaving it are lost
+            if ahead >= WINDOW_BITS:
+                # A window or more ahead: most likely the transmitter
+                # restarted (at a random sequence number), so start over
+                # like for a new source. Only the unseen numbers of the old
+                # window count as lost, not the whole jump.
+                state[4] += WINDOW_BITS - _ones(bitmap)
+                bitmap = MASK
+            else:
+                dropped = bitmap >> (WINDOW_BITS - ahead)
+                state[4] += ahead - _ones(dropped)
+                bitmap = (bitmap << ahead | 1) & MASK
+            state[0] = seq
+            state[1] = bitmap
+            return True
+        behind = 0x10000 - ahead
+        if behind >= WINDOW_BITS:
+            # Far behind: the transmitter restarted its sequence numbers
+            state[0] = seq
+            state[1] = MASK
+            return True
+        bit = 1 << behind
+        if bitmap & bit:
+            return False
+        state[1] = bitmap | bit
+        return True
+
+    def stats(self, mac):
+        state = self._sources.get(bytes(mac))
+        if state is None:
+            return None
+        return {
+            "received": state[2],
+            "duplicates": state[3],
+            "lost": state[4],
+            "retransmits": state[5],
+        }
+
+    def report(self, changed_only=True):
+        """Lines "delivery <mac> received=.. duplicates=.. lost=.. retransmits=.." for the host."""
+        lines = []
+        for mac, state in self._sources.items():
+            if changed_only and not state[6]:
+                continue
+            state[6] = False
+            lines.append("delivery {} received={} duplicates={} lost={} retransmits={}".format(
+                ":".join("{:02x}".format(b) for b in mac), state[2], state[3], state[4], state[5]))
+        return lines
@@ -0,0 +1,268 @@
+# Deferred-processing ESP-NOW receive pipeline
+#
+# The ESP-NOW IRQ callback only sets a flag. A uasyncio task drains the
+# driver with irecv() in batches into a preallocated ring buffer, and a
+# second task hands each frame to the handler (parse, UART forward,
+# bookkeeping) outside of the radio callback.
+#
+# An optional admit(mac) hook (e.g. RateLimiter.allow) is asked before a
+# frame takes a ring slot; frames it refuses are shed straight away.
+#
+# MACs are interned (MacCache): the handler and admit() get the same bytes
+# object for every frame from a transmitter, so they can key dicts on it
+# without copying. The cache holds mac_cache addresses (radio MACs and the
+# serials LineRenderer looks up, two per transmitter); size it for the
+# fleet, a cache smaller than that misses on nearly every frame.
+#
+# frame_ms is the ticks_ms() at which the frame being handled came off the
+# radio, so handlers can measure radio-to-UART latency. An optional
+# handle_us histogram (metrics.py) times each handler call.
+#
+#   pipeline = RxPipeline(esp_now, handle_frame)
+#   asyncio.create_task(pipeline.start())  # registers the IRQ
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+try:
+    import ubinascii as binascii
+except ImportError:
+    import binascii
+
+from psgframe import MAX_FRAME
+from ticks import ticks_ms, ticks_us, ticks_diff
+
+try:
+    ThreadSafeFlag = asyncio.ThreadSafeFlag
+except AttributeError:  # CPython, everything runs on one thread there
+    class ThreadSafeFlag(asyncio.Event):
+        async def wait(self):
+            await super().wait()
+            self.clear()  # uasyncio's flag resets itself on wait()
+
+
+class MacCache:
+    """Interned MAC bytes and their hex, looked up without allocating.
+
+    Entries are keyed on the last three bytes (a small int; the whole
+    address would be a heap-allocated long on MicroPython), so a hit needs
+    no heap; a miss copies the MAC once. MACs sharing the last three bytes
+    are chained on the entry, so neither pushes the other out. mac can be
+    any buffer, with the address at offset (e.g. the serial inside a
+    frame). When full, the oldest key (with its chain) makes room.
+    """
+
+    def __init__(self, size=512):
+        self.size = size
+        self._macs = {}  # low 24 bits -> [mac bytes, hex, hex with ":", next entry or None]
+        self._count = 0
+        # Counters
+        self.misses = 0
+        self.evictions = 0
+        self.collisions = 0
+
+    def __len__(self):
+        return self._count
+
+    def _entry(self, mac, offset):
+        key = mac[offset + 3] << 16 | mac[offset + 4] << 8 | mac[offset + 5]
+        first = entry = self._macs.get(key)
+        while entry is not None:
+            known = entry[0]
+            if known[0] == mac[offset] and known[1] == mac[offset + 1] and known[2] == mac[offset + 2]:
+                return entry
+            entry = entry[3]
+        if self._count >= self.size:
+            for oldest in self._macs:
+                break
+            entry = self._macs.pop(oldest)
+            while entry is not None:
+                self._count -= 1
+                self.evictions += 1
+                entry = entry[3]
+            if oldest == key:
+                first = None
+        known = bytes(mac[offset:offset + 6])
+        entry = [known, binascii.hexlify(known), binascii.hexlify(known, ":"), None]
+        if first is None:
+            self._macs[key] = entry
+        else:
+            entry[3] = first[3]  # after the first one, it keeps the key's place
+            first[3] = entry
+            self.collisions += 1
+        self._count += 1
+        self.misses += 1
+        return entry
+
+    def intern(self, mac, offset=0):
+        """The cached bytes object equal to the 6 bytes at mac[offset:]."""
+        return self._entry(mac, offset)[0]
+
+    def hex(self, mac, offset=0):
+        """b"34b7da59d620" style hex bytes."""
+        return self._entry(mac, offset)[1]
+
+    def name(self, mac, offset=0):
+        """b"34:b7:da:59:d6:20" style hex bytes."""
+        return self._entry(mac, offset)[2]
+
+
+class RxRing:
+    """Fixed-size ring of (mac, frame) slots, allocated once.
+
+    MACs are kept by reference (bytes are immutable), frames are copied.
+    """
+
+    def __init__(self, slots=32, size=MAX_FRAME):
+        self.slots = slots
+        self.macs = [None] * slots
+        self.bufs = [bytearray(size) for _ in range(slots)]
+        self.lens = [0] * slots
+        self.times = [0] * slots  # ticks_ms() when the frame was pushed
+        self.size = size
+        self.head = 0  # next slot to read
+        self.count = 0
+        # Counters
+        self.pushed = 0
+        self.dropped = 0
+        self.high_water = 0
+
+    def __len__(self):
+        return self.count
+
+    def push(self, mac, msg, now=0):
+        """Copy a frame into the next free slot, returns False when full."""
+        if self.count == self.slots:
+            self.dropped += 1
+            return False
+        i = (self.head + self.count) % self.slots
+        n = len(msg)
+        if n > self.size:
+            n = self.size
+            msg = memoryview(msg)[:n]
+        self.macs[i] = mac if isinstance(mac, bytes) else bytes(mac)
+        self.bufs[i][:n] = msg
+        self.lens[i] = n
+        self.times[i] = now
+        self.count += 1
+        self.pushed += 1
+        if self.count > self.high_water:
+            self.high_water = self.count
+        return True
+
+    def peek(self):
+        """Return the slot index of the oldest frame (caller must pop it)."""
+        return self.head
+
+    def pop(self):
+        self.head = (self.head + 1) % self.slots
+        self.count -= 1
+
+
+class RxPipeline:
+    def __init__(self, esp_now, handler, slots=32, batch=8, on_batch=None, admit=None,
+                 handle_us=None, mac_cache=512):
+        self.esp_now = esp_now
+        self.handler = handler  # handler(mac, msg), mac interned bytes, msg a memoryview into the ring
+        self.on_batch = on_batch  # called after each processed batch, e.g. to flush UART
+        self.admit = admit  # admit(mac) -> False to shed the frame before it is queued
+        self.handle_us = handle_us  # histogram of handler call times, optional
+        self.batch = batch
+        self.ring = RxRing(slots)
+        self.macs = MacCache(mac_cache)
+        self.frame_ms = 0
+        self.received = 0
+        self.handler_errors = 0
+        self.shed = 0
+        self._rx_flag = ThreadSafeFlag()
+        self._ready = asyncio.Event()
+        self._views = [memoryview(self.ring.bufs[i]) for i in range(slots)]
+
+    def irq(self, _):
+        """ESP-NOW IRQ callback: O(1), just wakes the drain task."""
+        self._rx_flag.set()
+
+    def start(self):
+        """Register the IRQ and return the pipeline tasks' coroutine."""
+        self.esp_now.irq(self.irq)
+        return self.run()
+
+    async def run(self):
+        await asyncio.gather(self.drain_task(), self.process_task())
+
+    async def drain_task(self):
+        ring = self.ring
+        while True:
+            await self._rx_flag.wait()
+            while True:
+                n = 0
+                while n < self.batch:
+                    mac, msg = self.esp_now.irecv(0)
+                    if mac is None:
+                        break
+                    n += 1
+                    mac = self.macs.intern(mac)
+                    if self.admit is not None and not self.admit(mac):
+                        self.shed += 1
+                        continue
+                    ring.push(mac, msg, ticks_ms())
+                if n:
+                    self.received += n
+                    self._ready.set()
+                if n < self.batch:
+                    break
+                # Full batch, let the processing stage run before draining more
+                await asyncio.sleep(0)
+
+    async def process_task(self):
+        ring = self.ring
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            n = 0
+            while ring.count:
+                i = ring.peek()
+                self.frame_ms = ring.times[i]
+                start = ticks_us() if self.handle_us else 0
+                try:
+                    # The slice is a new memoryview object (a few words of
+                    # heap, the frame itself isn't copied)
+                    self.handler(ring.macs[i], self._views[i][:ring.lens[i]])
+                except Exception as e:
+                    self.handler_errors += 1
+                    print("Failed to process message:", e)
+                if self.handle_us:
+                    self.handle_us.observe(ticks_diff(ticks_us(), start))
+                ring.pop()
+                n += 1
+                if n == self.batch:
+                    n = 0
+                    self._batch_done()
+                    await asyncio.sleep(0)
+            if n:
+                self._batch_done()
+
+    def _batch_done(self):
+        if self.on_batch is not None:
+            try:
+                self.on_batch()
+            except Exception as e:
+                print("Batch callback failed:", e)
+
+    def stats(self):
+        stats = {
+            "received": self.received,
+            "queued": len(self.ring),
+            "dropped": self.ring.dropped,
+            "shed": self.shed,
+            "high_water": self.ring.high_water,
+            "handler_errors": self.handler_errors,
+        }
+        try:
+            # (tx_pkts, tx_responses, tx_failures, rx_packets, rx_dropped_packets)
+            stats["driver_dropped"] = self.esp_now.stats()[4]
+        except (AttributeError, IndexError):
+            pass
+        return stats
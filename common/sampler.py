@@ -0,0 +1,60 @@
+# In-RAM sample buffer for transmitter batching mode
+#
+# Samples are taken at a fixed rate into preallocated slots and packed into
+# a single psgframe batch frame once the buffer is full, the oldest sample
+# reaches max_age_ms, or the transmitter shuts down.
+
+import psgframe
+from ticks import ticks_ms, ticks_diff
+
+
+class SampleBuffer:
+    def __init__(self, capacity=None, max_age_ms=5000, ext_len=0):
+        fits = psgframe.batch_capacity(ext_len)
+        self.capacity = min(capacity or fits, fits)
+        self.max_age_ms = min(max_age_ms, psgframe.MAX_AGE_MS)
+        self.taken = [0] * self.capacity
+        self.temps = [0] * self.capacity
+        self.batteries = [0] * self.capacity
+        self.colors = [None] * self.capacity
+        self.count = 0
+        # Counters
+        self.samples = 0
+        self.frames = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, temp, battery, rgb=None, now=None):
+        """Store a sample, returns True once the buffer is due to be sent."""
+        now = ticks_ms() if now is None else now
+        if self.count == self.capacity:
+            return True  # caller didn't flush, keep the older samples
+        i = self.count
+        self.taken[i] = now
+        self.temps[i] = temp
+        self.batteries[i] = battery
+        self.colors[i] = rgb
+        self.count += 1
+        self.samples += 1
+        return self.due(now)
+
+    def due(self, now=None):
+        """True if the buffer is full or its oldest sample is max_age_ms old."""
+        if not self.count:
+            return False
+        if self.count == self.capacity:
+            return True
+        now = ticks_ms() if now is None else now
+        return ticks_diff(now, self.taken[0]) >= self.max_age_ms
+
+    def encode(self, seq, serial, gadget, ext=None, now=None):
+        """Pack the buffered samples into a batch frame and empty the buffer."""
+        now = ticks_ms() if now is None else now
+        samples = [(ticks_diff(now, self.taken[i]), self.temps[i], self.batteries[i], self.colors[i])
+                   for i in range(self.count)]
+        frame = psgframe.encode_batch(seq, serial, gadget, samples, ext,
+                                      rgb=self.colors[0] is not None)
+        self.count = 0
+        self.frames += 1
+        return frame
@@ -0,0 +1,269 @@
+# Sessions: static fields sent once instead of in every frame
+#
+# A transmitter's serial, gadget type and machine type never change, so it
+# registers them once (MT_REGISTER) and the receiver answers with a 1-byte
+# session id (MT_SESSION). Telemetry and batch frames then carry the id in
+# place of serial and gadget (MT_STELEMETRY / MT_SBATCH) and no machine type.
+#
+# Receiver side (SessionTable): the session frame is rebuilt into the full
+# frame, machine type included, in one reused buffer before anything else
+# looks at it, so the renderer and the host see the same lines as before:
+#   sessions = SessionTable(peers.send)
+#   sessions.handle(mac, msg)          # True if msg was a register
+#   msg = sessions.rehydrate(mac, msg) # full frame, None if the id is unknown
+#
+# A session belongs to the MAC that registered it. Ids nobody used for
+# idle_ms are given to new transmitters when the table is full; with none
+# idle the register is answered S_FULL and the transmitter keeps sending
+# full frames. A frame with an unknown id (receiver restarted, session
+# evicted) isn't forwarded but answered S_UNKNOWN.
+#
+# Transmitter side (SessionClient): full frames until a session is granted,
+# then compact() turns them into session frames. On S_UNKNOWN it sends that
+# frame again in full and registers again; the last `history` frames
+# compacted are kept for this, an older one counts as unrecoverable. With
+# reliable delivery (sender, a ReliableSender) the frame goes out again
+# through the sender's window so it is acked, and the other frames still in
+# the window with the rejected id are turned back into full frames before
+# they are retransmitted.
+#   session = SessionClient(esp_now, serial, gadget, machine)
+#   session.reset(receiver_mac)        # after (re)pairing
+#   session.poll()                     # before each send, registers if needed
+#   frame = session.compact(frame)
+#   session.handle(mac, msg)           # frames from the receiver
+
+import psgframe
+from ticks import ticks_ms, ticks_diff
+
+IDENT = 7  # serial(6) gadget(1)
+
+
+class SessionTable:
+    def __init__(self, send, slots=64, idle_ms=600000):
+        self.send = send  # send(mac, frame), e.g. PeerTable.send
+        self.slots = min(slots, 255)
+        self.idle_ms = idle_ms
+        # Indexed by session id, 0 isn't used
+        self._macs = [None] * (self.slots + 1)
+        self._idents = [None] * (self.slots + 1)    # serial + gadget bytes
+        self._machines = [None] * (self.slots + 1)  # T_MACHINE TLV bytes, b"" if none
+        self._used = [0] * (self.slots + 1)         # ticks_ms() of the last frame
+        self._by_mac = {}
+        self.buf = bytearray(psgframe.MAX_FRAME + IDENT + 2 + 255)
+        self.view = memoryview(self.buf)
+        # Counters
+        self.registrations = 0
+        self.evictions = 0
+        self.full = 0
+        self.rehydrated = 0
+        self.unknown = 0
+        self.send_errors = 0
+
+    def __len__(self):
+        return len(self._by_mac)
+
+    def _reply(self, mac, seq, sid, status):
+        try:
+            self.send(mac, psgframe.encode_session(seq, sid, status))
+        except OSError:
+            self.send_errors += 1  # the transmitter asks again
+
+    def _free(self, now):
+        # A free id, or the one idle longest if that is over idle_ms, else 0
+        oldest = 0
+        for sid in range(1, self.slots + 1):
+            if self._macs[sid] is None:
+                return sid
+            if not oldest or ticks_diff(self._used[sid], self._used[oldest]) < 0:
+                oldest = sid
+        if oldest and ticks_diff(now, self._used[oldest]) >= self.idle_ms:
+            del self._by_mac[self._macs[oldest]]
+            self._macs[oldest] = None
+            self.evictions += 1
+            return oldest
+        return 0
+
+    def handle(self, mac, msg, now=None):
+        """Answer a register frame, returns False if msg isn't one."""
+        register = psgframe.decode_register(msg)
+        if register is None:
+            return False
+        now = ticks_ms() if now is None else now
+        seq, serial, gadget, machine = register
+        mac = bytes(mac)
+        sid = self._by_mac.get(mac)  # registering again, e.g. after a reboot
+        if sid is None:
+            sid = self._free(now)
+            if not sid:
+                self.full += 1
+                self._reply(mac, seq, 0, psgframe.S_FULL)
+                return True
+            self._macs[sid] = mac
+            self._by_mac[mac] = sid
+        self._idents[sid] = serial + bytes((gadget,))
+        self._machines[sid] = machine
+        self._used[sid] = now
+        self.registrations += 1
+        self._reply(mac, seq, sid, psgframe.S_GRANTED)
+        return True
+
+    def rehydrate(self, mac, msg, now=None):
+        """msg as a full frame: msg itself if it isn't a session frame, a view of
+        the rebuilt frame (valid until the next call) if it is, None if its
+        session is unknown (the transmitter is told to register again)."""
+        if len(msg) <= psgframe.HEADER_SIZE or msg[0] != psgframe.MAGIC:
+            return msg
+        mt = msg[2]
+        if mt != psgframe.MT_STELEMETRY and mt != psgframe.MT_SBATCH:
+            return msg
+        sid = msg[psgframe.HEADER_SIZE]
+        if not 0 < sid <= self.slots or self._macs[sid] != mac:
+            self.unknown += 1
+            self._reply(mac, msg[4] | msg[5] << 8, sid, psgframe.S_UNKNOWN)
+            return None
+        self._used[sid] = ticks_ms() if now is None else now
+        buf = self.buf
+        for k in range(psgframe.HEADER_SIZE):
+            buf[k] = msg[k]
+        buf[2] = psgframe.MT_TELEMETRY if mt == psgframe.MT_STELEMETRY else psgframe.MT_BATCH
+        pos = psgframe.HEADER_SIZE
+        buf[pos:pos + IDENT] = self._idents[sid]
+        pos += IDENT
+        for k in range(psgframe.HEADER_SIZE + 1, len(msg)):
+            buf[pos] = msg[k]
+            pos += 1
+        machine = self._machines[sid]
+        buf[pos:pos + len(machine)] = machine
+        pos += len(machine)
+        self.rehydrated += 1
+        return self.view[:pos]
+
+    def stats(self):
+        return {
+            "sessions": len(self._by_mac),
+            "registrations": self.registrations,
+            "evictions": self.evictions,
+            "full": self.full,
+            "rehydrated": self.rehydrated,
+            "unknown": self.unknown,
+        }
+
+
+class SessionClient:
+    def __init__(self, esp_now, serial, gadget, machine=None, retry_ms=10000, sender=None, history=4):
+        self.esp_now = esp_now
+        self.sender = sender  # ReliableSender the frames go through, if any
+        self.serial = serial
+        self.gadget = gadget
+        self.machine = machine
+        self.retry_ms = retry_ms
+        self.peer = None
+        self.sid = None
+        self._seq = 0
+        self._asked = None  # ticks_ms() of the last register
+        self._recent = [None] * history  # ring of (seq, full frame) of the last frames compacted
+        self._next = 0
+        # Counters
+        self.registers = 0
+        self.grants = 0
+        self.rejects = 0
+        self.resent = 0
+        self.unrecoverable = 0
+
+    def reset(self, peer=None):
+        """Forget the session (new receiver), register with peer on the next poll()."""
+        self.peer = bytes(peer) if peer is not None else None
+        self.sid = None
+        self._asked = None
+        for i in range(len(self._recent)):
+            self._recent[i] = None
+
+    def register(self, now=None):
+        if self.peer is None:
+            return
+        self._seq = (self._seq + 1) & 0xFFFF
+        self._asked = ticks_ms() if now is None else now
+        self.registers += 1
+        try:
+            self.esp_now.send(self.peer, psgframe.encode_register(self._seq, self.serial, self.gadget,
+                                                                  self.machine), False)
+        except OSError:
+            pass  # tried again after retry_ms
+
+    def poll(self, now=None):
+        """Register if there is no session and the last try is retry_ms old."""
+        if self.sid is not None or self.peer is None:
+            return
+        now = ticks_ms() if now is None else now
+        if self._asked is None or ticks_diff(now, self._asked) >= self.retry_ms:
+            self.register(now)
+
+    def compact(self, frame):
+        """Session form of a telemetry or batch frame, frame itself without a session."""
+        if self.sid is None:
+            return frame
+        if self._recent:
+            self._recent[self._next] = (frame[4] | frame[5] << 8, frame)
+            self._next = (self._next + 1) % len(self._recent)
+        return psgframe.to_session(frame, self.sid)
+
+    def _take(self, seq):
+        # The full frame compacted with sequence number seq, once, None if it's gone
+        recent = self._recent
+        for i in range(len(recent)):
+            entry = recent[i]
+            if entry is not None and entry[0] == seq:
+                recent[i] = None
+                return entry[1]
+        return None
+
+    def handle(self, mac, msg):
+        """Take a session frame from the receiver, returns False if msg isn't one."""
+        answer = psgframe.decode_session(msg)
+        if answer is None or bytes(mac) != self.peer:
+            return False
+        seq, sid, status = answer
+        if status == psgframe.S_GRANTED:
+            if seq == self._seq:
+                self.sid = sid
+                self.grants += 1
+        elif status == psgframe.S_UNKNOWN:
+            self.rejects += 1
+            if self.sender is not None:
+                self.sender.rewrite(lambda frame: self._full(frame, sid))
+            frame = self._take(seq)
+            if frame is None:
+                if self.sender is None:
+                    self.unrecoverable += 1  # with a sender it is resent from the window
+            else:
+                # The receiver dropped it, send it again in full
+                self.resent += 1
+                frame = psgframe.with_flags(frame, psgframe.F_RETX)
+                try:
+                    if self.sender is not None:
+                        self.sender.push(self.peer, seq, frame)  # acked like the rest
+                    else:
+                        self.esp_now.send(self.peer, frame, False)
+                except OSError:
+                    pass
+            if sid == self.sid:
+                self.sid = None
+                self.register()
+        return True
+
+    def _full(self, frame, sid):
+        # frame in full if it carries session id sid, else frame itself
+        mt = frame[2]
+        if (mt == psgframe.MT_STELEMETRY or mt == psgframe.MT_SBATCH) and frame[psgframe.HEADER_SIZE] == sid:
+            return psgframe.from_session(frame, self.serial, self.gadget)
+        return frame
+
+    def stats(self):
+        return {
+            "sid": self.sid,
+            "registers": self.registers,
+            "grants": self.grants,
+            "rejects": self.rejects,
+            "resent": self.resent,
+            "unrecoverable": self.unrecoverable,
+        }
@@ -0,0 +1,25 @@
+# Millisecond tick helpers.
+# MicroPython has time.ticks_ms/ticks_diff, CPython (benchmarks) gets stand-ins
+# that count from import, like the device counts from boot.
+
+try:
+    from time import ticks_ms, ticks_us, ticks_diff, ticks_add, sleep_ms
+except ImportError:
+    from time import monotonic, sleep
+
+    _start = monotonic()
+
+    def ticks_ms():
+        return int((monotonic() - _start) * 1000)
+
+    def ticks_us():
+        return int((monotonic() - _start) * 1000000)
+
+    def ticks_diff(a, b):
+        return a - b
+
+    def ticks_add(a, b):
+        return a + b
+
+    def sleep_ms(ms):
+        sleep(ms / 1000)
@@ -0,0 +1,328 @@
+# Framed, checksummed UART link between a receiver and the FT232H host
+#
+# The link starts in text mode (newline terminated lines at 9600 baud) so
+# hosts that just read lines keep working. The host switches it to framed
+# mode with a handshake:
+#
+#   host -> "link 921600\n"              (text, old baud)
+#   recv -> "link ok 921600\n"           (text, old baud), then switches baud
+#   host -> PING frame                   (new baud)
+#   recv -> PONG frame                   link confirmed
+#
+# If no PING arrives within CONFIRM_MS the receiver falls back to text mode
+# at the old baud rate.
+#
+# Frame layout (little endian):
+#   sync(2) = A5 5A | length(2) | kind(1) | payload(length) | crc32(4)
+# The CRC covers length, kind and payload. Several frames are batched into
+# one uart.write().
+#
+# On the receiver, run() is the UART reader task: it sleeps on a
+# uasyncio StreamReader until bytes arrive (no polling), splits them into
+# command lines or frames and hands each command to a dispatch function.
+# Writes then go through a StreamWriter, drain() waits for the UART to take
+# them. poll() reads whatever is pending for callers without a task.
+
+try:
+    import ustruct as struct
+except ImportError:
+    import struct
+try:
+    from ubinascii import crc32
+except ImportError:
+    from binascii import crc32
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+from ticks import ticks_ms, ticks_diff, ticks_add
+
+SYNC = b"\xa5\x5a"
+HEADER = "<2sHB"
+HEADER_SIZE = 5
+CRC_SIZE = 4
+OVERHEAD = HEADER_SIZE + CRC_SIZE
+MAX_PAYLOAD = 1024
+
+# Frame kinds
+K_RECORD = 1   # telemetry record line, receiver -> host
+K_REPLY = 2    # command reply, receiver -> host
+K_COMMAND = 3  # command line, host -> receiver
+K_PING = 4
+K_PONG = 5
+
+DEFAULT_BAUD = 9600
+CONFIRM_MS = 2000
+BAUD_RATES = (9600, 115200, 230400, 460800, 921600)
+READ_SIZE = 256  # bytes taken from the UART per wakeup
+MAX_LINE = MAX_PAYLOAD  # longer text mode command lines are dropped
+
+
+def encode_frame(kind, payload):
+    """Return a single frame as bytes."""
+    buf = bytearray(len(payload) + OVERHEAD)
+    pack_frame(buf, 0, kind, payload)
+    return bytes(buf)
+
+
+def pack_frame(buf, offset, kind, payload):
+    """Pack a frame into buf at offset, returns the offset after it."""
+    n = len(payload)
+    struct.pack_into(HEADER, buf, offset, SYNC, n, kind)
+    end = offset + HEADER_SIZE + n
+    buf[offset + HEADER_SIZE:end] = payload
+    crc = crc32(memoryview(buf)[offset + 2:end]) & 0xFFFFFFFF
+    struct.pack_into("<I", buf, end, crc)
+    return end + CRC_SIZE
+
+
+class FrameDecoder:
+    """Incremental decoder, feed() bytes as they arrive."""
+
+    def __init__(self, max_payload=MAX_PAYLOAD):
+        self.max_payload = max_payload
+        self.buf = b""
+        # Counters
+        self.frames = 0
+        self.crc_errors = 0
+        self.resyncs = 0
+
+    def feed(self, data):
+        """Return a list of (kind, payload) for the complete frames in data."""
+        buf = self.buf + data if self.buf else bytes(data)
+        frames = []
+        pos = 0
+        end = len(buf)
+        while True:
+            i = buf.find(SYNC, pos)
+            if i < 0:
+                # Keep a trailing half sync byte
+                pos = end - 1 if end and buf[end - 1] == SYNC[0] else end
+                break
+            if i != pos:
+                self.resyncs += 1
+            pos = i
+            if end - pos < HEADER_SIZE:
+                break
+            _, n, kind = struct.unpack_from(HEADER, buf, pos)
+            if n > self.max_payload:
+                self.resyncs += 1
+                pos += 1
+                continue
+            stop = pos + HEADER_SIZE + n
+            if end < stop + CRC_SIZE:
+                break
+            crc = struct.unpack_from("<I", buf, stop)[0]
+            if crc32(memoryview(buf)[pos + 2:stop]) & 0xFFFFFFFF != crc:
+                self.crc_errors += 1
+                pos += 1
+                continue
+            frames.append((kind, buf[pos + HEADER_SIZE:stop]))
+            self.frames += 1
+            pos = stop + CRC_SIZE
+        self.buf = buf[pos:]
+        return frames
+
+
+class UartLink:
+    """Receiver side of the link, wraps a machine.UART."""
+
+    def __init__(self, uart, baud=DEFAULT_BAUD, batch_size=1024):
+        self.uart = uart
+        self.base_baud = baud
+        self.baud = baud
+        self.framed = False
+        self.confirmed = False
+        self._deadline = None
+        self._buf = bytearray(batch_size)
+        self._pos = 0
+        self._line = b""
+        self._skip_line = False  # rest of a line over MAX_LINE still to come
+        self.decoder = FrameDecoder()
+        self.reader = None
+        self.writer = None  # set by run(), writes go through it from then on
+        self.on_baud = None  # on_baud(baud) after the baud rate changed
+        # Counters
+        self.frames_sent = 0
+        self.bytes_written = 0
+        self.writes = 0
+        self.write_errors = 0
+        self.bad_commands = 0  # not UTF-8, or over MAX_LINE
+
+    def send(self, data, kind=K_RECORD):
+        """Queue a record (bytes, no newline); written on flush() or when the batch is full."""
+        if self.framed:
+            need = len(data) + OVERHEAD
+            if self._pos + need > len(self._buf):
+                self.flush()
+                if need > len(self._buf):
+                    self._write(encode_frame(kind, data))
+                    self.frames_sent += 1
+                    return
+            self._pos = pack_frame(self._buf, self._pos, kind, data)
+        else:
+            need = len(data) + 1
+            if self._pos + need > len(self._buf):
+                self.flush()
+                if need > len(self._buf):
+                    self._write(data + b"\n")
+                    self.frames_sent += 1
+                    return
+            self._buf[self._pos:self._pos + need - 1] = data
+            self._buf[self._pos + need - 1] = 10
+            self._pos += need
+        self.frames_sent += 1
+
+    def overhead(self):
+        """Bytes the link adds to each record on the wire."""
+        return OVERHEAD if self.framed else 1
+
+    def reply(self, text):
+        """Send a command reply and flush it right away."""
+        if isinstance(text, str):
+            text = text.encode("utf-8")
+        self.send(text, K_REPLY)
+        self.flush()
+
+    def flush(self):
+        if self._pos:
+            self._write(memoryview(self._buf)[:self._pos])
+            self._pos = 0
+
+    async def drain(self):
+        """Wait until the UART has taken everything written."""
+        if self.writer is not None:
+            await self.writer.drain()
+
+    def _write(self, data):
+        try:
+            if self.writer is not None:
+                self.writer.write(data)  # buffers what the UART can't take yet
+                n = len(data)
+            else:
+                n = self.uart.write(data)
+            self.bytes_written += n or 0
+            self.writes += 1
+        except Exception as e:
+            self.write_errors += 1
+            print("UART write failed:", e)
+
+    def _set_baud(self, baud, framed):
+        self.flush()
+        try:
+            self.uart.flush()  # wait for the last byte at the old rate
+        except AttributeError:
+            pass
+        self.uart.init(baudrate=baud)
+        self.baud = baud
+        self.framed = framed
+        self.decoder = FrameDecoder()
+        self._line = b""
+        self._skip_line = False
+        if self.on_baud is not None:
+            self.on_baud(baud)
+
+    def _handshake(self, line, now):
+        """Handle 'link <baud>', returns True if line was a link command."""
+        parts = line.split()
+        if not parts or parts[0] != "link":
+            return False
+        try:
+            baud = int(parts[1])
+        except (IndexError, ValueError):
+            baud = 0
+        if baud not in BAUD_RATES:
+            self.reply("link error {}".format(" ".join(parts[1:])))
+            return True
+        self.reply("link ok {}".format(baud))
+        self._set_baud(baud, True)
+        self.confirmed = False
+        self._deadline = ticks_add(now, CONFIRM_MS)
+        return True
+
+    def poll(self, now):
+        """Read pending UART input, returns a list of command strings (see feed)."""
+        return self.feed(self.uart.read() if self.uart.any() else None, now)
+
+    async def run(self, dispatch):
+        """Reader task: dispatch(command) for every command line from the host.
+
+        Sleeps until UART bytes arrive, or until the handshake times out
+        while a new baud rate waits for its PING.
+        """
+        self.reader = asyncio.StreamReader(self.uart)
+        self.writer = asyncio.StreamWriter(self.uart, {})
+        while True:
+            data = None
+            if self._deadline is None:
+                data = await self.reader.read(READ_SIZE)
+            else:
+                left = max(ticks_diff(self._deadline, ticks_ms()), 0) + 1
+                try:
+                    data = await asyncio.wait_for(self.reader.read(READ_SIZE), left / 1000)
+                except asyncio.TimeoutError:
+                    pass
+            for command in self.feed(data, ticks_ms()):
+                dispatch(command)
+
+    def feed(self, data, now):
+        """Split UART input into command strings, returns a list of them.
+
+        Link handshake traffic is handled here and not returned. now is a
+        ticks_ms() value used for the handshake timeout.
+        """
+        if self.framed and not self.confirmed and self._deadline is not None \
+                and ticks_diff(now, self._deadline) > 0:
+            print("UART link not confirmed, back to text mode")
+            self._deadline = None
+            self._set_baud(self.base_baud, False)
+        commands = []
+        if not data:
+            return commands
+        if self.framed:
+            for kind, payload in self.decoder.feed(data):
+                if kind == K_PING:
+                    self.confirmed = True
+                    self._deadline = None
+                    self.send(payload, K_PONG)
+                    self.flush()
+                elif kind == K_COMMAND:
+                    try:
+                        line = payload.decode("utf-8").strip()
+                    except UnicodeError:
+                        self.bad_commands += 1
+                        continue
+                    if not self._handshake(line, now):
+                        commands.append(line)
+            return commands
+        self._line += data
+        while b"\n" in self._line:
+            raw, self._line = self._line.split(b"\n", 1)
+            if self._skip_line:
+                self._skip_line = False
+                continue
+            try:
+                line = raw.decode("utf-8").strip()
+            except UnicodeError:
+                self.bad_commands += 1
+                continue
+            if line and not self._handshake(line, now):
+                commands.append(line)
+        if len(self._line) > MAX_LINE:
+            # No newline in sight, drop the line up to the next one
+            self._line = b""
+            self._skip_line = True
+            self.bad_commands += 1
+        return commands
+
+    def stats(self):
+        return {
+            "framed": self.framed,
+            "baud": self.baud,
+            "frames_sent": self.frames_sent,
+            "bytes_written": self.bytes_written,
+            "writes": self.writes,
+            "write_errors": self.write_errors,
+            "crc_errors": self.decoder.crc_errors,
+            "bad_commands": self.bad_commands,
+        }
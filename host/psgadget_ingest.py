@@ -0,0 +1,449 @@
+"""Ingest daemon for several PsGadget receivers (FT232H controller ports).
+
+Reads every port concurrently with asyncio, parses each receiver's output
+(pipe text records, JSON lines from ftdi_esp32s3receiver_uart.py, or framed
+records once the fast link is negotiated) and writes the records as JSON
+lines to rotating log files in batches. Consumers can subscribe to the
+record stream.
+
+With --sync the receivers' clocks are set to this host's (the "time"
+command, passed on to the transmitters in the beacons) at startup and
+every --sync-interval seconds. Records of frames that carry a send time
+then get sent_ms and rx_ms, and the summary has latency percentiles per
+hop: transmitter to receiver radio (air), receiver radio to this host
+(to_host) and both (end_to_end).
+
+Transmitters in deadband mode only send when a reading moves or their
+heartbeat is due; their records have heartbeat_s, idle (nothing moved) and
+count/temp_min/temp_max/temp_mean for the readings in between. A serial
+that misses HEARTBEAT_MISSES heartbeats in a row is reported gone, as are
+the transmitters the receiver itself reports ("gone <mac>"): events
+{"event": "gone" or "back", ...} go to the log and to subscribe_events()
+callbacks.
+
+With --store the records also go to a columnar store (psgadget_store.py)
+for range and aggregate queries. Its column files are appended to every
+--store-interval seconds rather than with each log batch, which would be
+a few rows per device.
+
+    python host/psgadget_ingest.py /dev/ttyUSB0 /dev/ttyUSB1 --log-dir logs
+    python host/psgadget_ingest.py COM5 COM7 --baud 921600 --sync
+    python host/psgadget_ingest.py COM5 --store store
+
+    daemon = IngestDaemon(["/dev/ttyUSB0"], "logs")
+    daemon.subscribe(lambda record: print(record["serial"], record["temp"]))
+    asyncio.run(daemon.run())
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+import uartlink  # noqa: E402
+from liveness import Liveness  # noqa: E402
+from metrics import Histogram, LATENCY_MS_BOUNDS  # noqa: E402
+from psgadget_link import HostLink, clock_ms, sync_clock  # noqa: E402
+from psgadget_stats import Histogram as Snapshot  # noqa: E402
+from serialport import open_serial  # noqa: E402
+
+PIPE_FIELDS = ("gadget", "serial", "machine", "temp", "battery", "message")
+# Trailing "key=value" fields of a pipe line -> record keys (see psgframe.to_text)
+EXTRA_FIELDS = {"t": "sent_ms", "rx": "rx_ms", "n": "count", "min": "temp_min", "max": "temp_max",
+                "mean": "temp_mean", "hb": "heartbeat_s", "idle": "idle"}
+HEARTBEAT_MISSES = 3
+HOPS = ("air", "to_host", "end_to_end")
+
+
+def _number(value):
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+
+def parse_record(line):
+    """Parse one receiver output line into a dict, or None if it isn't a record."""
+    line = line.strip()
+    if not line:
+        return None
+    if line[:1] == "{":
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return None
+        return record if isinstance(record, dict) else None
+    parts = line.split("|")
+    if len(parts) < len(PIPE_FIELDS):
+        return None
+    record = dict(zip(PIPE_FIELDS, parts))
+    record["temp"] = _number(record["temp"])
+    record["battery"] = _number(record["battery"])
+    for part in parts[len(PIPE_FIELDS):]:
+        key, eq, value = part.partition("=")
+        if eq:
+            if key in EXTRA_FIELDS:
+                value = _number(value)
+                if not isinstance(value, str):
+                    record[EXTRA_FIELDS[key]] = value
+            continue
+        # Sample from a batch frame, taken age_ms before it was sent
+        age = _number(part)
+        if isinstance(age, int):
+            record["age_ms"] = age
+    if "sent_ms" in record and "age_ms" in record:
+        record["taken_ms"] = record["sent_ms"] - record["age_ms"]
+    if "idle" in record:
+        record["idle"] = bool(record["idle"])
+    return record
+
+
+COUNTER_LINES = ("delivery", "limit")
+LIVENESS_LINES = ("gone", "back")
+
+
+def parse_liveness(line):
+    """Parse "gone <mac> silent_ms=N" or "back <mac> silent_ms=N" into
+    (event, mac, silent_ms), or None."""
+    parts = line.split()
+    if len(parts) != 3 or parts[0] not in LIVENESS_LINES or not parts[2].startswith("silent_ms="):
+        return None
+    silent = _number(parts[2][len("silent_ms="):])
+    return (parts[0], parts[1], silent) if isinstance(silent, int) else None
+
+
+def parse_counters(line):
+    """Parse "delivery <mac> received=.. lost=.." or "limit <mac> accepted=.. shed=.."
+    into (kind, mac, counts), or None."""
+    parts = line.split()
+    if len(parts) < 2 or parts[0] not in COUNTER_LINES:
+        return None
+    counts = {}
+    for part in parts[2:]:
+        key, _, value = part.partition("=")
+        try:
+            counts[key] = int(value)
+        except ValueError:
+            return None
+    return parts[0], parts[1], counts
+
+
+class RotatingLog:
+    """Daily JSON lines log that also rolls over at max_bytes.
+
+    Files are named <dir>/<yyyyMMdd>_<name>_<n>.jsonl and kept open between
+    batches.
+    """
+
+    def __init__(self, directory, name="PsGadgets", max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.name = name
+        self.max_bytes = max_bytes
+        self._file = None
+        self._day = None
+        self._index = 0
+        self._size = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self):
+        return os.path.join(self.directory, "{}_{}_{}.jsonl".format(self._day, self.name, self._index))
+
+    def _open(self, day):
+        if self._file is not None:
+            self._file.close()
+        if day != self._day:
+            self._day = day
+            self._index = 0
+            # Continue after files from an earlier run today
+            while os.path.exists(self._path()) and os.path.getsize(self._path()) >= self.max_bytes:
+                self._index += 1
+        else:
+            self._index += 1
+        self._file = open(self._path(), "a", encoding="utf-8")
+        self._size = self._file.tell()
+
+    def write_batch(self, lines):
+        day = time.strftime("%Y%m%d")
+        if self._file is None or day != self._day or self._size >= self.max_bytes:
+            self._open(day)
+        data = "".join(lines)
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class PortStats:
+    def __init__(self):
+        self.records = 0
+        self.unparsed = 0
+        self.bytes = 0
+        # Transmitter mac -> latest received/duplicates/lost/retransmits counts
+        self.delivery = {}
+        # Transmitter mac -> latest accepted/shed counts from the rate limiter
+        self.limit = {}
+        # (offset_ms, rtt_ms, adjust_ms) of the clock sync, per hop latencies
+        self.clock = None
+        self.latency = {hop: Histogram(LATENCY_MS_BOUNDS) for hop in HOPS}
+        # Serials with a heartbeat, and transmitter mac -> "gone"/"back" as
+        # the receiver last reported it
+        self.alive = Liveness(HEARTBEAT_MISSES)
+        self.reported = {}
+
+    def observe(self, record, received_ms):
+        """Per hop latencies of a record with sent_ms and rx_ms."""
+        sent, rx = record.get("sent_ms"), record.get("rx_ms")
+        if sent is None or rx is None:
+            return
+        self.latency["air"].observe(rx - sent)
+        self.latency["to_host"].observe(received_ms - rx)
+        self.latency["end_to_end"].observe(received_ms - sent)
+
+    def latency_report(self):
+        """hop -> {count, p50, p95, p99} in ms (bucket upper bounds)."""
+        report = {}
+        for hop, histogram in self.latency.items():
+            snapshot = Snapshot(list(histogram.bounds), histogram.counts, histogram.sum)
+            if snapshot.count:
+                report[hop] = {"count": snapshot.count, "p50": snapshot.percentile(0.5),
+                               "p95": snapshot.percentile(0.95), "p99": snapshot.percentile(0.99)}
+        return report
+
+
+class IngestDaemon:
+    def __init__(self, ports, log_dir=None, baud=uartlink.DEFAULT_BAUD,
+                 batch_size=256, flush_interval=1.0, opener=open_serial, sync_interval=None,
+                 liveness_interval=1.0, store_dir=None, store_interval=10.0):
+        self.ports = list(ports)
+        self.sync_interval = sync_interval  # seconds between clock syncs, None = don't
+        self.liveness_interval = liveness_interval  # seconds between heartbeat checks
+        self.log = RotatingLog(log_dir) if log_dir else None
+        self.store = None
+        self.store_interval = store_interval  # seconds between store flushes
+        self._store_flushed = time.monotonic()
+        if store_dir:
+            from psgadget_store import ColumnStore  # imports this module
+            self.store = ColumnStore(store_dir)
+        self.baud = baud
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.opener = opener
+        self.stats = {port: PortStats() for port in self.ports}
+        self._subscribers = []
+        self._event_subscribers = []
+        self._batch = []
+        self._batch_ready = None
+        self._stopping = None
+
+    def subscribe(self, callback):
+        """Call callback(record) for every record; coroutine functions are awaited."""
+        self._subscribers.append(callback)
+
+    def subscribe_events(self, callback):
+        """Call callback(event) for every gone/back event; coroutine functions are awaited."""
+        self._event_subscribers.append(callback)
+
+    async def _event(self, name, event, **fields):
+        fields.update(event=event, port=name, received=time.time())
+        if self.log or self.store:
+            self._batch.append(fields)
+        for callback in self._event_subscribers:
+            result = callback(fields)
+            if asyncio.iscoroutine(result):
+                await result
+
+    async def liveness_task(self):
+        """Report serials that missed their heartbeat."""
+        while True:
+            await asyncio.sleep(self.liveness_interval)
+            for name, stats in self.stats.items():
+                for serial, silent in stats.alive.expired():
+                    await self._event(name, "gone", serial=serial, silent_ms=silent, by="host")
+
+    def stop(self):
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def run(self):
+        self._batch_ready = asyncio.Event()
+        self._stopping = asyncio.Event()
+        readers = [asyncio.ensure_future(self.read_port(port)) for port in self.ports]
+        writer = asyncio.ensure_future(self.write_task())
+        readers.append(asyncio.ensure_future(self.liveness_task()))
+        await self._stopping.wait()
+        for task in readers:
+            task.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+        self._batch_ready.set()
+        await writer
+        if self.log:
+            self.log.close()
+        if self.store:
+            self.store.close()
+
+    async def read_port(self, name):
+        loop = asyncio.get_running_loop()
+        port = await loop.run_in_executor(None, self.opener, name, uartlink.DEFAULT_BAUD)
+        link = HostLink(port)
+        if self.baud != uartlink.DEFAULT_BAUD:
+            framed = await loop.run_in_executor(None, link.handshake, self.baud)
+            print("{}: {} link at {} baud".format(
+                name, "framed" if framed else "text",
+                self.baud if framed else uartlink.DEFAULT_BAUD))
+        stats = self.stats[name]
+        next_sync = None
+        if self.sync_interval is not None:
+            stats.clock = await loop.run_in_executor(None, sync_clock, link)
+            print("{}: clock {}".format(name, "offset {} ms, round trip {} ms".format(*stats.clock[:2])
+                                        if stats.clock else "not synced (receiver without the time command?)"))
+            if stats.clock:
+                next_sync = time.monotonic() + self.sync_interval
+        # Records read while syncing
+        if link.pending:
+            await self._ingest(name, link.read(), 0)
+        data_ready = asyncio.Event()
+        use_reader = os.name == "posix"
+        if use_reader:
+            loop.add_reader(port.fileno(), data_ready.set)
+        try:
+            while True:
+                if use_reader:
+                    await data_ready.wait()
+                    data_ready.clear()
+                else:
+                    await asyncio.sleep(0.01)
+                if next_sync is not None and time.monotonic() >= next_sync:
+                    # Keeps the receiver's clock from drifting, corrected
+                    # like the sets at startup
+                    link.send_command("time {}".format(clock_ms() + stats.clock[1] // 2 + stats.clock[2]))
+                    next_sync += self.sync_interval
+                data = port.read()
+                if data:
+                    await self._ingest(name, link.feed(data), len(data))
+        finally:
+            if use_reader:
+                loop.remove_reader(port.fileno())
+            port.close()
+
+    async def _ingest(self, name, frames, nbytes):
+        stats = self.stats[name]
+        stats.bytes += nbytes
+        received = time.time()
+        received_ms = int(received * 1000)
+        for kind, payload in frames:
+            if kind not in (uartlink.K_RECORD, uartlink.K_REPLY):
+                continue
+            line = payload.decode("utf-8", "replace")
+            counters = parse_counters(line)
+            if counters is not None:
+                kind, mac, counts = counters
+                getattr(stats, kind)[mac] = counts
+                continue
+            if line.startswith("time "):
+                continue  # answer to a clock sync
+            liveness = parse_liveness(line)
+            if liveness is not None:
+                event, mac, silent = liveness
+                stats.reported[mac] = event
+                await self._event(name, event, mac=mac, silent_ms=silent, by="receiver")
+                continue
+            if kind != uartlink.K_RECORD:
+                continue
+            record = parse_record(line)
+            if record is None:
+                stats.unparsed += 1
+                continue
+            stats.records += 1
+            stats.observe(record, received_ms)
+            heartbeat = record.get("heartbeat_s")
+            serial = record.get("serial")
+            silent = stats.alive.heard(serial, heartbeat * 1000 if heartbeat else None) if serial else None
+            if silent is not None:
+                await self._event(name, "back", serial=serial, silent_ms=silent, by="host")
+            record["port"] = name
+            record["received"] = received
+            if self.log or self.store:
+                self._batch.append(record)
+            for callback in self._subscribers:
+                result = callback(record)
+                if asyncio.iscoroutine(result):
+                    await result
+        if len(self._batch) >= self.batch_size:
+            self._batch_ready.set()
+
+    async def write_task(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        if self.log:
+            self.log.write_batch([json.dumps(record, separators=(",", ":")) + "\n" for record in batch])
+        if self.store:
+            self.store.extend(record for record in batch if "event" not in record)
+            if time.monotonic() - self._store_flushed >= self.store_interval:
+                self.store.flush()
+                self._store_flushed = time.monotonic()
+
+    def summary(self):
+        summary = {}
+        for port, stats in self.stats.items():
+            summary[port] = dict(vars(stats), latency=stats.latency_report(), alive=stats.alive.stats())
+        if self.store:
+            summary["store"] = self.store.stats()
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("ports", nargs="+")
+    parser.add_argument("--log-dir", default=os.path.join(os.path.expanduser("~"), "PsGadgetLogs"))
+    parser.add_argument("--baud", type=int, default=uartlink.DEFAULT_BAUD,
+                        help="negotiate a framed link at this baud rate")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    parser.add_argument("--quiet", action="store_true", help="don't print records")
+    parser.add_argument("--sync", action="store_true",
+                        help="set the receivers' clocks to this host's, for per hop latencies")
+    parser.add_argument("--sync-interval", type=float, default=600.0,
+                        help="seconds between clock syncs with --sync (default 600)")
+    parser.add_argument("--store", help="also write records to a columnar store in this directory")
+    parser.add_argument("--store-interval", type=float, default=10.0,
+                        help="seconds between writes to the store (default 10)")
+    args = parser.parse_args()
+
+    daemon = IngestDaemon(args.ports, args.log_dir, args.baud, args.batch_size, args.flush_interval,
+                          sync_interval=args.sync_interval if args.sync else None, store_dir=args.store,
+                          store_interval=args.store_interval)
+    if not args.quiet:
+        daemon.subscribe(lambda record: print(record["port"], json.dumps(record)))
+        daemon.subscribe_events(lambda event: print(event["port"], json.dumps(event)))
+    try:
+        asyncio.run(daemon.run())
+    except KeyboardInterrupt:
+        daemon.flush()
+        if daemon.store:
+            daemon.store.close()
+        print(daemon.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""Host side of the framed receiver <-> FT232H UART link.
+
+Negotiates a higher baud rate with a receiver running common/uartlink.py and
+decodes its frames, falling back to plain text lines when the receiver does
+not answer the handshake (older receiver scripts).
+
+    python host/psgadget_link.py COM5 --baud 921600
+    python host/psgadget_link.py /dev/ttyUSB0
+    python host/psgadget_link.py COM5 --rtt 100      # time 100 "ping" commands
+    python host/psgadget_link.py COM5 --send all "led 0 0 64"   # command for transmitters
+    python host/psgadget_link.py COM5 --sync         # set the receiver's clock to this host's
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+import uartlink  # noqa: E402
+from serialport import open_serial  # noqa: E402
+
+
+class HostLink:
+    """Reads records from a receiver, in text or framed mode."""
+
+    def __init__(self, port):
+        self.port = port
+        self.framed = False
+        self.decoder = uartlink.FrameDecoder()
+        self._line = b""
+        self.pending = []
+
+    def handshake(self, baud, timeout=2.0):
+        """Ask the receiver to switch to framed mode at baud, True on success."""
+        self.port.write("link {}\n".format(baud).encode())
+        reply = "link ok {}".format(baud).encode()
+        deadline = time.monotonic() + timeout
+        buf = b""
+        while time.monotonic() < deadline:
+            buf += self.port.read()
+            if reply in buf:
+                break
+            time.sleep(0.01)
+        else:
+            return False
+        # Anything before the reply was still text mode records
+        self.pending += self.feed(buf[:buf.index(reply)])
+        self._line = b""
+        self.port.set_baud(baud)
+        self.framed = True
+        self.decoder = uartlink.FrameDecoder()
+        token = os.urandom(4)
+        self.port.write(uartlink.encode_frame(uartlink.K_PING, token))
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            for kind, payload in self.decoder.feed(self.port.read()):
+                if kind == uartlink.K_PONG and payload == token:
+                    return True
+            time.sleep(0.01)
+        # The receiver reverts to text mode on its own
+        self.port.set_baud(uartlink.DEFAULT_BAUD)
+        self.framed = False
+        return False
+
+    def send_command(self, command):
+        if self.framed:
+            self.port.write(uartlink.encode_frame(uartlink.K_COMMAND, command.encode()))
+        else:
+            self.port.write(command.encode() + b"\n")
+
+    def command(self, command, prefix, timeout=2.0):
+        """Send a command, return the first reply line starting with prefix, or None.
+
+        Other records read while waiting are dropped.
+        """
+        self.send_command(command)
+        return self.wait_for(prefix, timeout)
+
+    def wait_for(self, prefix, timeout=2.0):
+        """Return the first line starting with prefix (or a tuple of them) within timeout, or None.
+
+        Records before it are dropped, the ones read after it are kept for read().
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            records = self.read()
+            for i, (kind, payload) in enumerate(records):
+                line = payload.decode("utf-8", "replace")
+                if line.startswith(prefix):
+                    self.pending = records[i + 1:] + self.pending
+                    return line
+            time.sleep(0.001)
+        return None
+
+    def feed(self, data):
+        """Return a list of (kind, bytes) for the complete records in data."""
+        if self.framed:
+            return self.decoder.feed(data)
+        self._line += data
+        lines = self._line.split(b"\n")
+        self._line = lines.pop()
+        return [(uartlink.K_RECORD, line.rstrip(b"\r")) for line in lines if line.strip()]
+
+    def read(self):
+        records = self.feed(self.port.read())
+        if self.pending:
+            records = self.pending + records
+            self.pending = []
+        return records
+
+
+def round_trips(link, count, timeout=2.0):
+    """Time count "ping" commands, returns the round trips in ms (None if unanswered)."""
+    rtts = []
+    for n in range(count):
+        start = time.monotonic()
+        reply = link.command("ping {}".format(n), "pong {}".format(n), timeout)
+        rtts.append((time.monotonic() - start) * 1000 if reply is not None else None)
+    return rtts
+
+
+def clock_ms():
+    """This host's time, the reference clock, in Unix ms."""
+    return int(time.time() * 1000)
+
+
+def clock_offset(link, rounds=5, timeout=2.0):
+    """Query the receiver's clock ("time"), returns (offset_ms, rtt_ms) or None.
+
+    offset is receiver minus host, None while the receiver is unsynced. The
+    reply is taken to be from halfway through the round trip, the fastest
+    of rounds queries is used.
+    """
+    best = None
+    for _ in range(rounds):
+        start = clock_ms()
+        reply = link.command("time", "time ", timeout)
+        end = clock_ms()
+        if reply is None:
+            return None  # receiver without the time command
+        value = reply.split()[1]
+        offset = int(value) - (start + end) // 2 if value.isdigit() else None
+        if best is None or end - start < best[1]:
+            best = (offset, end - start)
+    return best
+
+
+def sync_clock(link, tolerance_ms=2, attempts=3, timeout=2.0):
+    """Set the receiver's reference clock to this host's, returns (offset_ms, rtt_ms, adjust_ms) or None.
+
+    The command takes a while to cross the UART, whatever offset is left
+    after a set is subtracted from the next one. Later sets of the value
+    clock_ms() + rtt_ms // 2 + adjust_ms land as close.
+    """
+    measured = clock_offset(link, timeout=timeout)
+    if measured is None:
+        return None
+    adjust = 0
+    for _ in range(attempts):
+        link.command("time {}".format(clock_ms() + measured[1] // 2 + adjust), "time ", timeout)
+        measured = clock_offset(link, timeout=timeout)
+        if measured is None or measured[0] is None:
+            return None
+        if abs(measured[0]) <= tolerance_ms:
+            break
+        adjust -= measured[0]
+    return measured + (adjust,)
+
+
+def downlink(link, target, text, timeout=10.0):
+    """Run a command on transmitters ("send" on the receiver), returns the summary line or None.
+
+    target is a MAC, "@group" or "all". The receiver answers with one
+    "downlink <id> done ..." line however many transmitters it went to.
+    """
+    link.send_command("send {} {}".format(target, text))
+    while True:
+        line = link.wait_for(("downlink ", "error send"), timeout)
+        if line is None or line.startswith("error"):
+            return line
+        if " sending " in line:  # not the summary of an earlier command
+            return link.wait_for("downlink {} done".format(line.split()[1]), timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("port")
+    parser.add_argument("--baud", type=int, default=921600,
+                        help="baud rate to negotiate (default 921600)")
+    parser.add_argument("--rtt", type=int, metavar="N",
+                        help="measure the command round trip with N pings and exit")
+    parser.add_argument("--send", nargs=2, metavar=("TARGET", "COMMAND"),
+                        help="run COMMAND on transmitters (a MAC, @group or all) and exit")
+    parser.add_argument("--sync", action="store_true",
+                        help="set the receiver's reference clock to this host's and exit")
+    args = parser.parse_args()
+
+    link = HostLink(open_serial(args.port, uartlink.DEFAULT_BAUD))
+    if args.baud != uartlink.DEFAULT_BAUD and link.handshake(args.baud):
+        print("framed link at {} baud".format(args.baud))
+    else:
+        print("text link at {} baud".format(uartlink.DEFAULT_BAUD))
+    if args.send:
+        print(downlink(link, *args.send) or "no reply (receiver without the send command?)")
+        return
+    if args.sync:
+        before = clock_offset(link)
+        if before is None:
+            print("no reply (receiver without the time command?)")
+            return
+        after = sync_clock(link)
+        print("receiver clock offset before: {}, after: {} ms, round trip {} ms".format(
+            "unsynced" if before[0] is None else "{} ms".format(before[0]),
+            after[0] if after else "?", after[1] if after else before[1]))
+        return
+    if args.rtt:
+        rtts = round_trips(link, args.rtt)
+        answered = sorted(r for r in rtts if r is not None)
+        if not answered:
+            print("no pong replies (receiver without the ping command?)")
+            return
+        print("round trip over {} pings: min {:.1f} ms, p50 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms, "
+              "{} unanswered".format(len(rtts), answered[0], answered[len(answered) // 2],
+                                     answered[int(len(answered) * 0.99)], answered[-1],
+                                     len(rtts) - len(answered)))
+        return
+    try:
+        while True:
+            for kind, payload in link.read():
+                print(payload.decode("utf-8", "replace"))
+            time.sleep(0.01)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
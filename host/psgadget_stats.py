@@ -0,0 +1,156 @@
+"""Poll a receiver's runtime metrics and chart them in the terminal.
+
+Sends the "stats" UART command every few seconds (see common/metrics.py for
+the reply format) and prints per-second rates for counters, current values
+for gauges and percentiles for histograms, with a sparkline of the recent
+history of the metrics given with --chart.
+
+    python host/psgadget_stats.py /dev/ttyUSB0
+    python host/psgadget_stats.py COM5 --baud 921600 --interval 2 --chart rx.frames uart.latency_ms
+    python host/psgadget_stats.py COM5 --reset
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+import uartlink  # noqa: E402
+from psgadget_link import HostLink  # noqa: E402
+from serialport import open_serial  # noqa: E402
+
+SPARKS = " ▁▂▃▄▅▆▇█"
+
+
+class Histogram:
+    def __init__(self, bounds, counts, total):
+        self.bounds = bounds
+        self.counts = counts
+        self.sum = total
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th value, inf past the last bound."""
+        if not self.count:
+            return None
+        rank = p * self.count
+        seen = 0
+        for bound, n in zip(self.bounds + [float("inf")], self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def minus(self, other):
+        """Observations since the other (earlier) snapshot."""
+        if other is None or other.bounds != self.bounds or other.count > self.count:
+            return self
+        return Histogram(self.bounds, [a - b for a, b in zip(self.counts, other.counts)],
+                         self.sum - other.sum)
+
+
+def parse_stats(line):
+    """Parse a "stats name=value ..." reply into a dict, or None."""
+    parts = line.split()
+    if not parts or parts[0] != "stats" or len(parts) < 2 or "=" not in parts[1]:
+        return None
+    stats = {}
+    for part in parts[1:]:
+        name, _, value = part.partition("=")
+        if ":" in value:
+            bounds, counts, total = value.split(":")
+            stats[name] = Histogram([int(b) for b in bounds.split(",")],
+                                    [int(c) for c in counts.split("/")], int(total))
+        else:
+            try:
+                stats[name] = int(value)
+            except ValueError:
+                stats[name] = value
+    return stats
+
+
+def sparkline(values, width=40):
+    values = [v for v in values[-width:] if v is not None]
+    if not values:
+        return ""
+    top = max(values) or 1
+    return "".join(SPARKS[int(v / top * (len(SPARKS) - 1))] for v in values)
+
+
+class StatsPoller:
+    def __init__(self, link, timeout=2.0):
+        self.link = link
+        self.timeout = timeout
+        self.history = {}  # name -> [value per poll]
+        self.previous = None
+
+    def command(self, command, prefix):
+        """Send a command, return the first reply line starting with prefix."""
+        return self.link.command(command, prefix, self.timeout)
+
+    def poll(self):
+        """Fetch a snapshot, returns {name: (display value, chart value)} or None."""
+        line = self.command("stats", "stats t=")
+        stats = parse_stats(line) if line else None
+        if stats is None:
+            return None
+        previous, self.previous = self.previous, stats
+        elapsed = (stats["t"] - previous["t"]) / 1000 if previous else 0
+        rows = {}
+        for name, value in stats.items():
+            if name == "t":
+                continue
+            if isinstance(value, Histogram):
+                recent = value.minus(previous.get(name) if previous else None)
+                p50, p99 = recent.percentile(0.5), recent.percentile(0.99)
+                rows[name] = ("n={} p50<={} p99<={}".format(recent.count, p50, p99),
+                              p99 if p99 != float("inf") else None)
+            elif isinstance(value, int) and previous and isinstance(previous.get(name), int) \
+                    and elapsed > 0 and value >= previous[name]:
+                rate = (value - previous[name]) / elapsed
+                rows[name] = ("{} ({:.1f}/s)".format(value, rate), rate)
+            else:
+                rows[name] = (str(value), value if isinstance(value, int) else None)
+            self.history.setdefault(name, []).append(rows[name][1])
+        return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("port")
+    parser.add_argument("--baud", type=int, default=uartlink.DEFAULT_BAUD,
+                        help="negotiate a framed link at this baud rate")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between polls")
+    parser.add_argument("--chart", nargs="*", default=["rx.frames", "uart.latency_ms"],
+                        help="metrics to draw sparklines for")
+    parser.add_argument("--reset", action="store_true", help="send 'stats reset' and exit")
+    args = parser.parse_args()
+
+    link = HostLink(open_serial(args.port, uartlink.DEFAULT_BAUD))
+    if args.baud != uartlink.DEFAULT_BAUD:
+        link.handshake(args.baud)
+    poller = StatsPoller(link)
+    if args.reset:
+        print(poller.command("stats reset", "stats reset") or "no reply")
+        return
+    try:
+        while True:
+            rows = poller.poll()
+            if rows is None:
+                print("no stats reply (receiver without METRICS_ENABLED?)")
+            else:
+                print(time.strftime("%H:%M:%S"))
+                for name, (text, _) in rows.items():
+                    chart = sparkline(poller.history[name]) if name in args.chart else ""
+                    print("  {:<20} {:<32} {}".format(name, text, chart))
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
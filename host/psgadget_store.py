@@ -0,0 +1,522 @@
+"""Columnar time-series store for ingested PsGadget telemetry.
+
+Records (as parsed by psgadget_ingest.parse_record) are kept per device
+(serial number) in segments of at most SEGMENT_ROWS rows. A segment is a
+directory with one file per field: t.q holds the record times (ms since
+the epoch, int64), <field>.d the values (float64, NaN where a record had
+none). Files are only ever appended to; a field no record of a segment
+had has no file. index.json lists every device's segments with their row
+count, first/last time and missing values per field, and is replaced
+after the column files are written, so readers only see complete rows.
+
+Reads memory-map the column files. Segments outside the asked time range
+are skipped using the index; inside a segment the rows are found by
+bisecting the mapped time column. Rows are written in time order per
+flush; a segment that got older rows after newer ones is marked unsorted
+and scanned instead.
+
+A record is filed under taken_ms (batch samples), else sent_ms, else the
+time the host received it. One process writes at a time (the ingest
+daemon with --store, or the import command), any number can read.
+
+    python host/psgadget_store.py store import logs/*.jsonl SerialPortLog.txt
+    python host/psgadget_store.py store devices
+    python host/psgadget_store.py store scan 4827e2100001 --from -1d --fields temp,battery
+    python host/psgadget_store.py store agg 4827e2100001 --from -7d --every 3600
+
+    store = ColumnStore("store")
+    store.extend(records)
+    store.flush()
+    for t, temp in store.scan("4827e2100001", start_ms, end_ms, ("temp",)):
+        ...
+    for bucket_ms, count, low, high, mean in store.aggregate("4827e2100001", "temp", start_ms, end_ms,
+                                                             3600000):
+        ...
+"""
+import argparse
+import bisect
+import itertools
+import json
+import mmap
+import os
+import sys
+import time
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from psgadget_ingest import parse_record  # noqa: E402
+
+FIELDS = ("temp", "battery", "count", "temp_min", "temp_max", "temp_mean", "heartbeat_s")
+# Strings kept per device in the index, the last value seen
+TAGS = ("gadget", "machine", "port")
+SEGMENT_ROWS = 1 << 20
+FLUSH_ROWS = 65536  # rows buffered before the import command writes them
+INDEX = "index.json"
+NAN = float("nan")
+TIME_UNITS = {"s": 1000, "m": 60000, "h": 3600000, "d": 86400000}
+
+
+def record_time(record):
+    """ms since the epoch a record is filed under."""
+    for key in ("taken_ms", "sent_ms"):
+        value = record.get(key)
+        if isinstance(value, int):
+            return value
+    return int(record.get("received", time.time()) * 1000)
+
+
+def _valid_serial(serial):
+    return isinstance(serial, str) and 0 < len(serial) <= 64 and serial.replace("-", "").replace("_", "").isalnum()
+
+
+class _Segment:
+    """Column files of one segment, mapped when first read."""
+
+    def __init__(self, path):
+        self.path = path
+        self._maps = {}
+
+    def column(self, name, rows):
+        """memoryview of the first rows values of a column, None if it has no file."""
+        typecode = "q" if name == "t" else "d"
+        mapped = self._maps.get(name)
+        if mapped is None or len(mapped[1]) < rows:
+            self._unmap(name)
+            try:
+                with open(os.path.join(self.path, "{}.{}".format(name, typecode)), "rb") as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (FileNotFoundError, ValueError):  # ValueError: empty file
+                return None
+            mapped = self._maps[name] = (mm, memoryview(mm).cast(typecode))
+        return mapped[1][:rows]
+
+    def _unmap(self, name):
+        mapped = self._maps.pop(name, None)
+        if mapped is not None:
+            mapped[1].release()
+            mapped[0].close()
+
+    def close(self):
+        for name in list(self._maps):
+            self._unmap(name)
+
+
+class _Pending:
+    """Rows of one device buffered until the next flush."""
+
+    def __init__(self):
+        self.times = []
+        self.values = {}  # field -> list, NaN where a record had none
+
+    def add(self, t, record):
+        n = len(self.times)
+        self.times.append(t)
+        for field in FIELDS:
+            value = record.get(field)
+            if value is None or isinstance(value, str):
+                continue
+            column = self.values.get(field)
+            if column is None:
+                column = self.values[field] = [NAN] * n
+            column.append(float(value))
+        for column in self.values.values():
+            if len(column) <= n:
+                column.append(NAN)
+
+    def sorted(self):
+        """(times, values) in time order."""
+        times = self.times
+        order = sorted(range(len(times)), key=times.__getitem__)
+        if all(i == k for i, k in enumerate(order)):
+            return times, self.values
+        return [times[i] for i in order], {f: [c[i] for i in order] for f, c in self.values.items()}
+
+
+class ColumnStore:
+    def __init__(self, path, segment_rows=SEGMENT_ROWS):
+        self.path = path
+        self.segment_rows = segment_rows
+        os.makedirs(path, exist_ok=True)
+        self._index = None
+        self._index_mtime = None
+        self._pending = {}   # serial -> _Pending
+        self._checked = set()  # devices whose last segment was checked against the index
+        self._segments = {}  # segment path -> _Segment
+        self._writing = False
+        self.pending = 0  # rows buffered since the last flush
+        # Counters
+        self.records = 0
+        self.skipped = 0
+        self.flushes = 0
+        self.refresh()
+
+    # Index
+
+    def refresh(self):
+        """Read index.json again if another process replaced it."""
+        if self._writing:
+            return
+        path = os.path.join(self.path, INDEX)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            if self._index is None:
+                self._index = {"version": 1, "byteorder": sys.byteorder, "devices": {}}
+            return
+        if mtime == self._index_mtime:
+            return
+        with open(path, encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("byteorder", sys.byteorder) != sys.byteorder:
+            raise ValueError("{} was written on a {} endian machine".format(self.path, index["byteorder"]))
+        self._index = index
+        self._index_mtime = mtime
+
+    def _write_index(self):
+        path = os.path.join(self.path, INDEX)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self._index, f, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+
+    # Writing
+
+    def append(self, record):
+        """Buffer one record, returns False if it has no usable serial."""
+        serial = record.get("serial")
+        if not _valid_serial(serial):
+            self.skipped += 1
+            return False
+        if not self._writing:
+            # From here on this process's index is the one on disk
+            self.refresh()
+            self._writing = True
+        pending = self._pending.get(serial)
+        if pending is None:
+            pending = self._pending[serial] = _Pending()
+        pending.add(record_time(record), record)
+        self.pending += 1
+        device = self._index["devices"].get(serial)
+        if device is None:
+            device = self._index["devices"][serial] = {"tags": {}, "segments": []}
+        tags = device["tags"]
+        for tag in TAGS:
+            value = record.get(tag)
+            if value is not None and tags.get(tag) != value:
+                tags[tag] = value
+        self.records += 1
+        return True
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def flush(self):
+        """Write the buffered rows, then the index."""
+        if not self._pending:
+            return
+        for serial, pending in self._pending.items():
+            segments = self._index["devices"][serial]["segments"]
+            if serial not in self._checked:
+                if segments:
+                    self._truncate(serial, segments[-1])
+                self._checked.add(serial)
+            times, values = pending.sorted()
+            start = 0
+            while start < len(times):
+                if not segments or segments[-1]["rows"] >= self.segment_rows:
+                    segments.append({"name": "{:06d}".format(len(segments)), "rows": 0, "t_min": None,
+                                     "t_max": None, "sorted": True, "missing": {}})
+                segment = segments[-1]
+                end = min(len(times), start + self.segment_rows - segment["rows"])
+                self._write_rows(serial, segment, times[start:end],
+                                 {f: c[start:end] for f, c in values.items()})
+                start = end
+        self._pending = {}
+        self.pending = 0
+        self._write_index()
+        self.flushes += 1
+
+    def _segment_path(self, serial, segment):
+        return os.path.join(self.path, serial, segment["name"])
+
+    def _truncate(self, serial, segment):
+        # Rows past the index are from a flush that didn't finish
+        path = self._segment_path(serial, segment)
+        if not os.path.isdir(path):
+            return
+        for name in os.listdir(path):
+            field = name.partition(".")[0]
+            full = os.path.join(path, name)
+            if field != "t" and field not in segment["missing"]:
+                os.remove(full)
+            elif os.path.getsize(full) > segment["rows"] * 8:
+                os.truncate(full, segment["rows"] * 8)
+
+    def _write_rows(self, serial, segment, times, values):
+        path = self._segment_path(serial, segment)
+        os.makedirs(path, exist_ok=True)
+        rows, count = segment["rows"], len(times)
+        missing = segment["missing"]
+        with open(os.path.join(path, "t.q"), "ab") as f:
+            array("q", times).tofile(f)
+        for field in FIELDS:
+            column = values.get(field)
+            if column is None and field not in missing:
+                continue
+            with open(os.path.join(path, field + ".d"), "ab") as f:
+                if field not in missing:
+                    # First rows of the segment with this field
+                    array("d", [NAN] * rows).tofile(f)
+                    missing[field] = rows
+                if column is None:
+                    column = [NAN] * count
+                array("d", column).tofile(f)
+            missing[field] += sum(1 for v in column if v != v)
+        if rows and times[0] < segment["t_max"]:
+            segment["sorted"] = False
+        segment["t_min"] = times[0] if segment["t_min"] is None else min(segment["t_min"], times[0])
+        segment["t_max"] = times[-1] if segment["t_max"] is None else max(segment["t_max"], times[-1])
+        segment["rows"] = rows + count
+
+    # Reading
+
+    def devices(self):
+        """serial -> {tags..., rows, t_min, t_max}."""
+        self.refresh()
+        out = {}
+        for serial, device in self._index["devices"].items():
+            segments = [s for s in device["segments"] if s["rows"]]
+            if not segments:
+                continue
+            out[serial] = dict(device["tags"], rows=sum(s["rows"] for s in segments),
+                               t_min=min(s["t_min"] for s in segments), t_max=max(s["t_max"] for s in segments))
+        return out
+
+    def _segment(self, serial, segment):
+        path = self._segment_path(serial, segment)
+        mapped = self._segments.get(path)
+        if mapped is None:
+            mapped = self._segments[path] = _Segment(path)
+        return mapped
+
+    def _ranges(self, serial, start, end):
+        """(segment entry, mapped segment, times, rows) for the rows of serial in
+        [start, end): rows is a (first, last) pair on sorted segments, a list of
+        row numbers in time order on unsorted ones."""
+        self.refresh()
+        device = self._index["devices"].get(serial)
+        if device is None:
+            return
+        for segment in device["segments"]:
+            if not segment["rows"] or segment["t_max"] < start or segment["t_min"] >= end:
+                continue
+            mapped = self._segment(serial, segment)
+            times = mapped.column("t", segment["rows"])
+            if times is None:
+                continue
+            if segment["sorted"]:
+                first = bisect.bisect_left(times, start) if start > segment["t_min"] else 0
+                last = bisect.bisect_left(times, end) if end <= segment["t_max"] else len(times)
+                if first < last:
+                    yield segment, mapped, times, (first, last)
+            else:
+                rows = sorted((i for i in range(len(times)) if start <= times[i] < end), key=times.__getitem__)
+                if rows:
+                    yield segment, mapped, times, rows
+
+    def scan(self, serial, start=None, end=None, fields=("temp",)):
+        """(t, value per field) of serial's rows in [start, end), NaN where a
+        record had no value for a field."""
+        start = -1 << 63 if start is None else start
+        end = 1 << 63 if end is None else end
+        for segment, mapped, times, rows in self._ranges(serial, start, end):
+            columns = [mapped.column(field, segment["rows"]) for field in fields]
+            if isinstance(rows, tuple):
+                first, last = rows
+                yield from zip(times[first:last], *(itertools.repeat(NAN) if c is None else c[first:last]
+                                                     for c in columns))
+            else:
+                for i in rows:
+                    yield (times[i],) + tuple(NAN if c is None else c[i] for c in columns)
+
+    def columns(self, serial, start=None, end=None, fields=("temp",)):
+        """{"t": array, field: array} of serial's rows in [start, end)."""
+        out = {"t": array("q")}
+        out.update((field, array("d")) for field in fields)
+        start = -1 << 63 if start is None else start
+        end = 1 << 63 if end is None else end
+        for segment, mapped, times, rows in self._ranges(serial, start, end):
+            if isinstance(rows, tuple):
+                first, last = rows
+                out["t"].frombytes(times[first:last].cast("B"))
+                for field in fields:
+                    column = mapped.column(field, segment["rows"])
+                    if column is None:
+                        out[field].extend(itertools.repeat(NAN, last - first))
+                    else:
+                        out[field].frombytes(column[first:last].cast("B"))
+            else:
+                out["t"].extend(times[i] for i in rows)
+                for field in fields:
+                    column = mapped.column(field, segment["rows"])
+                    out[field].extend(NAN if column is None else column[i] for i in rows)
+        return out
+
+    def aggregate(self, serial, field, start=None, end=None, every_ms=3600000):
+        """[(bucket start ms, count, min, max, mean)] of field over buckets of
+        every_ms (aligned to the epoch) in [start, end), empty buckets left
+        out. serial None aggregates all devices."""
+        start = -1 << 63 if start is None else start
+        end = 1 << 63 if end is None else end
+        self.refresh()
+        serials = list(self._index["devices"]) if serial is None else [serial]
+        buckets = {}  # bucket -> [count, min, max, sum]
+
+        def add(key, values):
+            count = len(values)
+            if not count:
+                return
+            low, high, total = min(values), max(values), sum(values)
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = [count, low, high, total]
+            else:
+                bucket[0] += count
+                bucket[1] = min(bucket[1], low)
+                bucket[2] = max(bucket[2], high)
+                bucket[3] += total
+
+        for name in serials:
+            for segment, mapped, times, rows in self._ranges(name, start, end):
+                column = mapped.column(field, segment["rows"])
+                if column is None:
+                    continue
+                complete = not segment["missing"].get(field)
+                if isinstance(rows, tuple):
+                    # One bisect per bucket, buckets without rows cost nothing
+                    first, last = rows
+                    while first < last:
+                        key = times[first] // every_ms * every_ms
+                        stop = bisect.bisect_left(times, key + every_ms, first, last)
+                        values = column[first:stop]
+                        add(key, values if complete else [v for v in values if v == v])
+                        first = stop
+                else:
+                    for key, group in itertools.groupby(rows, lambda i: times[i] // every_ms * every_ms):
+                        add(key, [v for v in (column[i] for i in group) if v == v])
+        return [(key, b[0], b[1], b[2], b[3] / b[0]) for key, b in sorted(buckets.items())]
+
+    def close(self):
+        self.flush()
+        for mapped in self._segments.values():
+            mapped.close()
+        self._segments = {}
+
+    def stats(self):
+        devices = self._index["devices"].values()
+        return {"devices": len(self._index["devices"]),
+                "rows": sum(s["rows"] for d in devices for s in d["segments"]),
+                "segments": sum(len(d["segments"]) for d in devices), "records": self.records,
+                "skipped": self.skipped, "flushes": self.flushes}
+
+
+def read_log(path):
+    """Records of a psgadget_ingest JSON lines log or a Log-Message text log
+    ("yyyy-MM-dd HH:mm:ss - <line>")."""
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if line[:1] == "{":
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict) and "event" not in record:
+                    yield record
+                continue
+            stamp, sep, message = line.partition(" - ")
+            if not sep:
+                continue
+            try:
+                received = time.mktime(time.strptime(stamp, "%Y-%m-%d %H:%M:%S"))
+            except ValueError:
+                continue
+            record = parse_record(message)
+            if record is not None:
+                record["received"] = received
+                yield record
+
+
+def parse_time(text, now_ms=None):
+    """ms since the epoch from "now", "-7d"/"-12h"/"-30m"/"-10s", ms, or a local
+    "yyyy-mm-dd[THH:MM[:SS]]"."""
+    now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+    if text == "now":
+        return now_ms
+    if text[:1] == "-" and text[-1:] in TIME_UNITS:
+        return now_ms - int(float(text[1:-1]) * TIME_UNITS[text[-1]])
+    if text.isdigit():
+        return int(text)
+    for layout in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return int(time.mktime(time.strptime(text, layout)) * 1000)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError("not a time: {!r}".format(text))
+
+
+def format_time(ms):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ms / 1000)) + ".{:03d}".format(ms % 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("store", help="store directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    load = commands.add_parser("import", help="add the records of ingest (.jsonl) or Log-Message logs")
+    load.add_argument("logs", nargs="+")
+    commands.add_parser("devices", help="list devices with row counts and time spans")
+    for name, help in (("scan", "print rows"), ("agg", "print count/min/max/mean per bucket")):
+        command = commands.add_parser(name, help=help)
+        command.add_argument("serial", help="device serial, 'all' for agg over every device")
+        command.add_argument("--from", dest="start", type=parse_time, help="start (e.g. -7d, 2025-01-31)")
+        command.add_argument("--to", dest="end", type=parse_time, help="end (default: no end)")
+        if name == "scan":
+            command.add_argument("--fields", default="temp,battery")
+        else:
+            command.add_argument("--field", default="temp")
+            command.add_argument("--every", type=float, default=3600.0, help="bucket seconds (default 3600)")
+    args = parser.parse_args()
+
+    store = ColumnStore(args.store)
+    if args.command == "import":
+        started = time.monotonic()
+        for path in args.logs:
+            for record in read_log(path):
+                store.append(record)
+                if store.pending >= FLUSH_ROWS:
+                    store.flush()
+        store.flush()
+        elapsed = time.monotonic() - started
+        print("{} records in {:.1f} s ({:.0f}/s), {} skipped".format(
+            store.records, elapsed, store.records / max(elapsed, 1e-9), store.skipped))
+    elif args.command == "devices":
+        for serial, device in sorted(store.devices().items()):
+            print("{}  {:>9} rows  {} .. {}  {}".format(serial, device["rows"], format_time(device["t_min"]),
+                                                        format_time(device["t_max"]), device.get("machine", "")))
+    elif args.command == "scan":
+        fields = tuple(args.fields.split(","))
+        print("time\t" + "\t".join(fields))
+        for row in store.scan(args.serial, args.start, args.end, fields):
+            print(format_time(row[0]) + "\t" + "\t".join("" if v != v else "{:g}".format(v) for v in row[1:]))
+    else:
+        print("time\tcount\tmin\tmax\tmean")
+        for key, count, low, high, mean in store.aggregate(None if args.serial == "all" else args.serial,
+                                                          args.field, args.start, args.end,
+                                                          int(args.every * 1000)):
+            print("{}\t{}\t{:g}\t{:g}\t{:.2f}".format(format_time(key), count, low, high, mean))
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Minimal serial port access for the host tools.
+
+Uses pyserial when it is installed (Windows, macOS, Linux). On POSIX systems
+without pyserial the port is opened directly with termios, which also works
+for pty-backed fake receivers in tests and benchmarks.
+"""
+import os
+
+try:
+    import serial  # pyserial
+except ImportError:
+    serial = None
+
+
+class PosixSerial:
+    """Raw, non-blocking termios serial port."""
+
+    def __init__(self, port, baud):
+        import termios
+        self.port = port
+        self.fd = os.open(port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        attrs = termios.tcgetattr(self.fd)
+        attrs[0] = 0                                          # iflag
+        attrs[1] = 0                                          # oflag
+        attrs[2] = termios.CS8 | termios.CREAD | termios.CLOCAL  # cflag
+        attrs[3] = 0                                          # lflag
+        attrs[6][termios.VMIN] = 0
+        attrs[6][termios.VTIME] = 0
+        termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+        self.set_baud(baud)
+
+    def set_baud(self, baud):
+        import termios
+        speed = getattr(termios, "B{}".format(baud))
+        attrs = termios.tcgetattr(self.fd)
+        attrs[4] = attrs[5] = speed
+        termios.tcsetattr(self.fd, termios.TCSADRAIN, attrs)
+        self.baud = baud
+
+    def fileno(self):
+        return self.fd
+
+    def read(self, size=4096):
+        try:
+            return os.read(self.fd, size)
+        except BlockingIOError:
+            return b""
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            try:
+                n = os.write(self.fd, view)
+            except BlockingIOError:
+                import select
+                select.select([], [self.fd], [])
+                continue
+            view = view[n:]
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PySerial:
+    """pyserial wrapper with the same interface as PosixSerial."""
+
+    def __init__(self, port, baud):
+        self.port = port
+        self.ser = serial.Serial(port, baud, timeout=0)
+        self.baud = baud
+
+    def set_baud(self, baud):
+        self.ser.flush()
+        self.ser.baudrate = baud
+        self.baud = baud
+
+    def fileno(self):
+        return self.ser.fileno()
+
+    def read(self, size=4096):
+        return self.ser.read(size)
+
+    def write(self, data):
+        self.ser.write(data)
+
+    def close(self):
+        self.ser.close()
+
+
+def open_serial(port, baud=9600):
+    """Open port at baud with whichever backend is available."""
+    if serial is not None:
+        return PySerial(port, baud)
+    return PosixSerial(port, baud)
@@ -3,132 +3,206 @@ import network
 import espnow
 import ubinascii
 import time
+import uasyncio as asyncio
 from machine import Pin, UART
+from micropython import const
 import neopixel
 import uos
+import psgframe
+from devtable import DeviceTable
+from rxpipe import RxPipeline
+from ledfx import LedFx
+from discovery import OfferResponder
+from peers import PeerTable
+from beacon import BeaconScheduler
+from reliable import ReliableReceiver
+from session import SessionTable
+from ratelimit import RateLimiter, TokenBucket
+from egress import EgressQueue, DROP_OLDEST, P_DATA, P_STATS
+from uartlink import UartLink, K_REPLY
 
 # Constants
 CTSSID = "PsGadget-CT"
 MACFILE = "known_devices.txt"
+MACFILE_FLUSH_INTERVAL_MS = 60000  # Write known devices to flash at most this often
+MACFILE_MAX_DIRTY = 16             # ...or as soon as this many devices changed
 BROADCAST_MAC = b'\xFF\xFF\xFF\xFF\xFF\xFF'
+RX_RING_SLOTS = 32  # Frames buffered between the radio and processing
+RX_BATCH = 8        # Frames drained/processed before yielding to other tasks
+UART_BAUD = 9600    # Starting baud rate, the host can negotiate a faster framed link
+ESPNOW_PEERS = 20       # Driver peer limit, least recently used transmitters are evicted
+BEACON_MIN_MS = 500     # Beacon interval after boot or when a new transmitter shows up
+BEACON_MAX_MS = 15000   # ...doubling up to this while the set of transmitters is stable
+SOURCE_STATS_MS = 60000  # Per-transmitter delivery and rate limit counts go to the host this often
+RATE_LIMIT_PER_S = 10   # Frames per second accepted from one transmitter...
+RATE_LIMIT_BURST = 20   # ...with bursts up to this, the rest is shed
+UART_QUEUE_LINES = 64   # Lines waiting for the UART, forwarded round robin between transmitters
+UART_QUEUE_POLICY = DROP_OLDEST  # ...and which to drop when full: DROP_OLDEST, DROP_NEWEST or COALESCE
+DEBUG = const(0)        # 1 prints every frame; the prints allocate, with 0 they aren't even compiled
 
 # Initialize UART, NeoPixel, and Wi-Fi in station mode
-uart = UART(1, baudrate=9600, tx=Pin(5), rx=Pin(6))
+uart = UART(1, baudrate=UART_BAUD, tx=Pin(5), rx=Pin(6))
+# Batches records per uart.write, text lines until the host negotiates framing
+link = UartLink(uart, UART_BAUD)
 wlan = network.WLAN(network.STA_IF)
 wlan.active(True)
 esp_now = espnow.ESPNow()
 esp_now.active(True)
 np = neopixel.NeoPixel(Pin(21, Pin.OUT), 1)
+led_fx = LedFx(np)
 
 # Ensure LED is off at the start
 np[0] = (0, 0, 0)
 np.write()
 
-# Add the broadcast MAC address as a peer
-try:
-    esp_now.add_peer(BROADCAST_MAC)
-except Exception as e:
-    print("Failed to add broadcast peer:", e)
+# Unicast peers are added on demand, the broadcast address is pinned
+peers = PeerTable(esp_now, ESPNOW_PEERS, (BROADCAST_MAC,))
 
-# Helper functions
-def current_datetime():
-    dt = time.localtime()
-    return "{:02d}{:02d}{:02d}T{:02d}{:02d}{:02d}".format(*dt[:6])
-
-def read_known_devices():
-    devices = {}
-    try:
-        with open(MACFILE, "r") as f:
-            for line in f:
-                parts = line.strip().split('|')
-                if len(parts) == 2:  # Only process lines with exactly two parts
-                    mac, timestamp = parts
-                    devices[mac] = timestamp
-                else:
-                    print(f"Skipping malformed line in {MACFILE}: {line.strip()}")
-    except OSError:
-        print(f"Could not open {MACFILE}. It may not exist yet.")
-    return devices
-
-def write_known_devices(devices):
-    with open(MACFILE, "w") as f:
-        for mac, timestamp in devices.items():
-            f.write(f"{mac}|{timestamp}\n")
-
-def update_known_device(mac_address):
-    devices = read_known_devices()
-    new_device = mac_address not in devices
-    devices[mac_address] = current_datetime()
-    write_known_devices(devices)
-    print(f"Device {'added' if new_device else 'updated'} in known devices.")
-
-def send_message_to_ft232h(message):
-    try:
-        uart.write(message)
-    except Exception as e:
-        print(f"UART message sending failed: {e}")
+# Per-transmitter token buckets. Everything for the UART goes through one
+# bounded queue written by one task, no faster than the UART can send
+limiter = RateLimiter(RATE_LIMIT_PER_S, RATE_LIMIT_BURST)
+egress = EgressQueue(UART_QUEUE_LINES, UART_QUEUE_POLICY,
+                     TokenBucket(UART_BAUD // 10, 256),  # bytes, ~10 bits per byte on the wire
+                     limiter)
 
-def broadcast_message():
-    try:
-        mac = ubinascii.hexlify(wlan.config("mac"), ":").decode()
-        message = f"{mac}:{wlan.config('essid') or CTSSID}"
-        esp_now.send(BROADCAST_MAC, message.encode('utf-8'))
-    except Exception as e:
-        print("Failed to send broadcast message:", e)
+# Helper functions
+_datetime = [None, ""]  # second, its string
 
-def blink_led(message):
-    try:
-        # Extract RGB values from message
-        # Example message: rgb(0,0,0)
-        rgb_str = message[3:-1]
-        # remove parentheses
-        rgb_str = rgb_str.replace('(', '').replace(')', '')
-        rgb = tuple(map(int, rgb_str.split(',')))
+def current_datetime():
+    # Formatted once per second, not per frame
+    second = int(time.time())
+    if second != _datetime[0]:
+        dt = time.localtime(second)
+        _datetime[1] = "{:02d}{:02d}{:02d}T{:02d}{:02d}{:02d}".format(*dt[:6])
+        _datetime[0] = second
+    return _datetime[1]
+
+# Known devices stay in RAM, flash is only written from the housekeeping task
+known_devices = DeviceTable(MACFILE, MACFILE_FLUSH_INTERVAL_MS, MACFILE_MAX_DIRTY)
+
+# Beacon bytes are built once, the interval adapts to new transmitters
+beacons = BeaconScheduler(esp_now, wlan.config("mac"), wlan.config("essid") or CTSSID,
+                          lambda: len(known_devices), BEACON_MIN_MS, BEACON_MAX_MS)
+
+# Answers transmitters probing for a receiver, load is the number of known devices;
+# a probe from an unknown transmitter speeds the beacons up
+responder = OfferResponder(esp_now, wlan, lambda: len(known_devices), peers,
+                           known_devices.__contains__, beacons.kick)
+
+# Per-transmitter dedup window, frames asking for it are acked
+delivery = ReliableReceiver(peers.send)
+
+# Session ids for registered transmitters, their frames are rebuilt in full
+sessions = SessionTable(peers.send)
+
+def update_known_device(mac):
+    new_device = known_devices.touch(mac, current_datetime())
+    if new_device:
+        beacons.kick()  # other new transmitters may be looking too
+    if DEBUG:
+        print(f"Device {'added' if new_device else 'updated'} in known devices.")
+
+def send_message_to_ft232h(mac, message):
+    # Queued per transmitter (mac is interned by the pipeline), the writer task sends it
+    egress.put(message, mac, P_DATA)
+
+def blink_led(rgb):
+    # Non-blocking, the LED task turns it off again after a second
+    if DEBUG:
         print(f"Blinking LED with RGB: {rgb}")
-        np[0] = rgb
-        np.write()
-        time.sleep(1)
-        np[0] = (0, 0, 0)
-        np.write()
-    except ValueError:
-        print("Invalid RGB format in message.")
-
-# Callback to handle received messages from the transmitter
-def espnow_callback(_):
+    led_fx.flash(rgb, 1000)
+
+# Handle a frame from the transmitter, runs in the receive pipeline task
+# rather than the ESP-NOW IRQ callback. Binary frames are forwarded without
+# building records or strings, what's left on the heap per frame is the copy
+# of each line the UART queue keeps and the LED colour
+def handle_frame(mac, espnowmsg):
     try:
-        mac, espnowmsg = esp_now.recv()
-        mac_str = ubinascii.hexlify(mac, ":").decode()
-        print(f"Received message from {mac_str}: {espnowmsg}")
-        
-        # Decode message and parse components
-        message_str = espnowmsg.decode('utf-8').split('|')
-        if len(message_str) < 6:
-            print("Malformed message received.")
+        if DEBUG:
+            print(f"Received message from {ubinascii.hexlify(mac, ':').decode()}: {bytes(espnowmsg)}")
+        if responder.handle(mac, espnowmsg) or sessions.handle(mac, espnowmsg):
+            return
+        # Frames with a session id become full frames again
+        espnowmsg = sessions.rehydrate(mac, espnowmsg)
+        if espnowmsg is None:
+            return
+        # Retransmits of frames already forwarded are dropped (but acked again)
+        if not delivery.accept(mac, espnowmsg):
+            if DEBUG:
+                print("Duplicate frame")
             return
 
-        gadget_type, serial_number, machine_type, cpu_temperature, battery_status, message = message_str
-        print(f"Decoded message: {message_str}")
-        
-        # Add special character to indicate end of message
-        espnowmsg += b'\n'
-        # Send message to FT232H
-        send_message_to_ft232h(espnowmsg)
+        # Forward as pipe text, the link adds the end of message marker.
+        # Batch frames give one line per sample
+        count = lines.count(espnowmsg)
+        rgb = None
+        if count:
+            for i in range(count):
+                send_message_to_ft232h(mac, bytes(lines.render(espnowmsg, i)))
+            at = lines.rgb(espnowmsg, count - 1)
+            if at >= 0:
+                rgb = (espnowmsg[at], espnowmsg[at + 1], espnowmsg[at + 2])
+        else:
+            # Legacy pipe text frame
+            records = psgframe.decode_records(espnowmsg)
+            if not records:
+                print("Malformed message received.")
+                return
+            for record in records:
+                if DEBUG:
+                    print(f"Decoded message: {record}")
+                send_message_to_ft232h(mac, psgframe.to_text(record))
+            rgb = records[-1]["rgb"]
 
         # Update or add device in known_devices.txt
-        update_known_device(mac_str)
+        update_known_device(mac)
 
         # Blink LED if RGB message is received
-        if message.startswith('rgb'):
-            blink_led(message)
-            
+        if rgb:
+            blink_led(rgb)
+
     except Exception as e:
         print("Failed to process message:", e)
 
-# Register callback for ESP-NOW
-esp_now.irq(espnow_callback)
+# Receive pipeline: the IRQ only signals, frames are drained and handled in
+# tasks, frames over a transmitter's rate limit never take a ring slot
+pipeline = RxPipeline(esp_now, handle_frame, RX_RING_SLOTS, RX_BATCH, admit=limiter.allow)
+# Pipe text lines rendered from binary frames into one reused buffer
+lines = psgframe.LineRenderer(pipeline.macs)
+
+async def housekeeping_task():
+    while True:
+        known_devices.maybe_flush()
+        await asyncio.sleep(5)
+
+async def source_stats_task():
+    while True:
+        await asyncio.sleep_ms(SOURCE_STATS_MS)
+        for line in delivery.report() + limiter.report():
+            egress.put(line.encode(), prio=P_STATS, kind=K_REPLY)
+
+# Only the link handshake is read from the host, the link's reader task
+# sleeps until the host sends something
+def ignore_command(line):
+    print(f"Ignoring UART command: {line}")
+
+def follow_baud(baud):
+    egress.budget.rate = baud // 10  # the UART budget follows the negotiated baud rate
+    egress.overhead = link.overhead()  # and counts the frame around each line
+
+link.on_baud = follow_baud
+
+async def main():
+    print("Receiver is active, broadcasting and waiting for messages...")
+    await asyncio.gather(beacons.run(), housekeeping_task(), pipeline.start(), led_fx.run(),
+                         link.run(ignore_command), source_stats_task(),
+                         egress.run(link.send, link.flush, wait=link.drain))
 
 # Main loop to broadcast and wait for incoming messages
-print("Receiver is active, broadcasting and waiting for messages...")
-while True:
-    broadcast_message()
-    time.sleep(5)
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("Program interrupted", pipeline.stats(), link.stats(), beacons.stats(), peers.stats(),
+              limiter.stats(), egress.stats())
+        known_devices.flush()
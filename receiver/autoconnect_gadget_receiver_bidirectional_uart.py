@@ -3,110 +3,326 @@ import espnow
 import ubinascii
 import time
 import uasyncio as asyncio  # For async support
-from machine import Pin, UART
+from machine import Pin, UART, RTC
+from micropython import const
 import neopixel
+import psgframe
+from rxpipe import RxPipeline
+from ledfx import LedFx
+from discovery import OfferResponder
+from peers import PeerTable
+from beacon import BeaconScheduler
+from reliable import ReliableReceiver
+from ratelimit import RateLimiter, TokenBucket
+from egress import EgressQueue, DROP_OLDEST, POLICIES, P_CONTROL, P_DATA, P_STATS
+from uartlink import UartLink, K_REPLY
+from commands import CommandTable
+from downlink import Downlink
+from clocksync import SyncClock
+from liveness import Liveness
+from session import SessionTable
+from metrics import Registry, DURATION_US_BOUNDS, gc_collect, mem_free
 
 # Constants
 CTSSID = "PsGadget-CT"
-MACFILE = "known_devices.txt"
 BROADCAST_MAC = b'\xFF\xFF\xFF\xFF\xFF\xFF'
+RX_RING_SLOTS = 32  # Frames buffered between the radio and processing
+RX_BATCH = 8        # Frames drained/processed before yielding to other tasks
+UART_BAUD = 9600    # Starting baud rate, the host can negotiate a faster framed link
+ESPNOW_PEERS = 20       # Driver peer limit, least recently used transmitters are evicted
+BEACON_MIN_MS = 500     # Beacon interval after boot or when a new transmitter shows up
+BEACON_MAX_MS = 15000   # ...doubling up to this while the set of transmitters is stable
+SOURCE_STATS_MS = 60000  # Per-transmitter delivery and rate limit counts go to the host this often
+RATE_LIMIT_PER_S = 10   # Frames per second accepted from one transmitter...
+RATE_LIMIT_BURST = 20   # ...with bursts up to this, the rest is shed
+UART_QUEUE_LINES = 64   # Lines waiting for the UART, forwarded round robin between transmitters
+UART_QUEUE_POLICY = DROP_OLDEST  # ...and which to drop when full: DROP_OLDEST, DROP_NEWEST or COALESCE
+SESSION_SLOTS = 64      # Transmitters registered at once (1-byte session ids instead of serial and types)
+HEARTBEAT_MISSES = 3    # Transmitters with a heartbeat (deadband mode) are gone after missing this many
+METRICS_ENABLED = True  # Counters and latency histograms for the "stats" command
+GC_INTERVAL_MS = 5000   # Collect garbage (and time it) this often instead of whenever the heap fills
+DEBUG = const(0)        # 1 prints every frame; the prints allocate, with 0 they aren't even compiled
 
 # Initialize UART, NeoPixel, and Wi-Fi in station mode
-uart = UART(1, baudrate=9600, tx=Pin(5), rx=Pin(6))
+uart = UART(1, baudrate=UART_BAUD, tx=Pin(5), rx=Pin(6))
+# Batches records per uart.write, text lines until the host negotiates framing
+link = UartLink(uart, UART_BAUD)
 wlan = network.WLAN(network.STA_IF)
 wlan.active(True)
 esp_now = espnow.ESPNow()
 esp_now.active(True)
 np = neopixel.NeoPixel(Pin(21, Pin.OUT), 1)
+led_fx = LedFx(np)
+
+# Runtime metrics, dumped with the "stats" UART command (no-ops when disabled)
+metrics = Registry(METRICS_ENABLED)
+m_frames = metrics.counter("rx.frames")
+m_records = metrics.counter("rx.records")
+m_parse_errors = metrics.counter("rx.parse_errors")
+m_duplicates = metrics.counter("rx.duplicates")
+m_probes = metrics.counter("rx.probes")
+m_cmdacks = metrics.counter("rx.cmdacks")
+m_registers = metrics.counter("rx.registers")
+m_unknown_sessions = metrics.counter("rx.unknown_sessions")
+m_handle_us = metrics.histogram("rx.handle_us", DURATION_US_BOUNDS)
+m_latency = metrics.histogram("uart.latency_ms")  # radio to UART write
+m_air = metrics.histogram("rx.air_ms")  # transmitter send to radio, needs synced clocks
+m_gc_us = metrics.histogram("gc.us", DURATION_US_BOUNDS)
+
+# Transmitter MACs heard since boot
+transmitters = set()
+
+# Transmitters in deadband mode may be silent for up to their heartbeat,
+# "gone <mac> silent_ms=N" goes to the host once they miss it, "back ..."
+# when they are heard again
+alive = Liveness(HEARTBEAT_MISSES)
 
 # Ensure LED is off at the start
 np[0] = (0, 0, 0)
 np.write()
 
-# Add the broadcast MAC address as a peer
-try:
-    esp_now.add_peer(BROADCAST_MAC)
-except Exception as e:
-    print("Failed to add broadcast peer:", e)
+# Unicast peers are added on demand, the broadcast address is pinned
+peers = PeerTable(esp_now, ESPNOW_PEERS, (BROADCAST_MAC,))
 
-# Function to broadcast message periodically
-async def broadcast_task():
-    while True:
-        try:
-            mac = ubinascii.hexlify(wlan.config("mac"), ":").decode()
-            message = f"{mac}:{wlan.config('essid') or CTSSID}"
-            esp_now.send(BROADCAST_MAC, message.encode('utf-8'))
-        except Exception as e:
-            print("Failed to send broadcast message:", e)
-        await asyncio.sleep(5)
-
-# Function to handle UART receiving
-async def uart_receive_task():
-    while True:
-        if uart.any():  # Check if data is available on UART
-            message = uart.readline().decode('utf-8').strip()
-            print(f"Received over UART: {message}")
-            if message == "status":
-                # Respond with some status if requested
-                uart.write("ESP32 status: Active\n")
-            # Handle other commands or logic as needed
-        await asyncio.sleep(0.1)  # Small delay to prevent busy waiting
-
-# Function to send message over UART
-async def uart_send_task(message):
-    try:
-        uart.write(message + "\n")
-    except Exception as e:
-        print(f"Failed to send message over UART: {e}")
+# Reference time (Unix ms) set by the host with the "time" command, passed
+# on to the transmitters in the beacons
+clock = SyncClock(RTC())
+
+# Beacon bytes are built once, the interval adapts to new transmitters
+beacons = BeaconScheduler(esp_now, wlan.config("mac"), wlan.config("essid") or CTSSID,
+                          lambda: len(transmitters), BEACON_MIN_MS, BEACON_MAX_MS, clock)
+
+# Answers transmitters probing for a receiver, load is the number of transmitters heard;
+# a probe from an unknown transmitter speeds the beacons up
+responder = OfferResponder(esp_now, wlan, lambda: len(transmitters), peers,
+                           transmitters.__contains__, beacons.kick)
+
+# Per-transmitter dedup window, frames asking for it are acked
+delivery = ReliableReceiver(peers.send)
+
+# Session ids for registered transmitters, their frames are rebuilt in full
+sessions = SessionTable(peers.send, SESSION_SLOTS)
+
+# Per-transmitter token buckets. Everything for the UART goes through one
+# bounded queue written by one task, no faster than the UART can send
+limiter = RateLimiter(RATE_LIMIT_PER_S, RATE_LIMIT_BURST)
+egress = EgressQueue(UART_QUEUE_LINES, UART_QUEUE_POLICY,
+                     TokenBucket(UART_BAUD // 10, 256),  # bytes, ~10 bits per byte on the wire
+                     limiter, latency=m_latency)
+
+def reply(text, prio=P_CONTROL):
+    # Command replies go ahead of queued telemetry
+    egress.put(text.encode(), prio=prio, kind=K_REPLY)
+
+def follow_baud(baud):
+    egress.budget.rate = baud // 10  # the UART budget follows the negotiated baud rate
+    egress.overhead = link.overhead()  # and counts the frame around each line
+
+link.on_baud = follow_baud
+
+# Settings the "config" command shows and changes (until the next reboot):
+# name -> (read, write from the value string)
+def set_global(name):
+    def write(value):
+        globals()[name] = int(value)
+    return write
+
+def set_policy(value):
+    if value not in POLICIES:
+        raise ValueError(f"policy is one of {', '.join(POLICIES)}")
+    egress.policy = value
+
+settings = {
+    "rate_limit": (lambda: limiter.rate, lambda value: setattr(limiter, "rate", int(value))),
+    "rate_burst": (lambda: limiter.burst, lambda value: setattr(limiter, "burst", int(value))),
+    "queue_policy": (lambda: egress.policy, set_policy),
+    "beacon_max_ms": (lambda: beacons.max_ms, lambda value: setattr(beacons, "max_ms", int(value))),
+    "gc_ms": (lambda: GC_INTERVAL_MS, set_global("GC_INTERVAL_MS")),
+    "source_stats_ms": (lambda: SOURCE_STATS_MS, set_global("SOURCE_STATS_MS")),
+}
+
+def config_command(args):
+    name, _, value = args.partition(" ")
+    if not name:
+        return [f"config {key}={read()}" for key, (read, _) in settings.items()]
+    if name not in settings:
+        raise ValueError(f"unknown setting {name}")
+    read, write = settings[name]
+    if value.strip():
+        write(value.strip())
+    return f"config {name}={read()}"
+
+def time_command(args):
+    # "time <unix ms>" sets the clock, the reply is the time after it either way
+    if args:
+        clock.set(int(args))
+        beacons.kick()  # get the time to the transmitters soon
+    now = clock.now()
+    return f"time {now}" if now is not None else "time unsynced"
 
-# Function to handle received ESP-NOW messages
-def espnow_callback(_):
+def stats_command(args):
+    # One line "stats name=value ..." snapshot, see metrics.py
+    if args == "reset":
+        metrics.reset()
+        return "stats reset"
+    return metrics.dump()
+
+# Commands for transmitters: one MAC, a group or all of them, broadcast or
+# unicast depending on the count. The acks come back as one summary line
+downlink = Downlink(peers, reply, lambda: transmitters)
+
+# UART commands from the host, see commands.py
+commands = CommandTable(reply)
+commands.add("status", lambda args: "ESP32 status: Active", "receiver status")
+commands.add("ping", lambda args: f"pong {args}".strip(), "ping [token] - replies pong [token]")
+commands.add("peers", lambda args: f"peers {peers.stats()}", "ESP-NOW peer table counters")
+commands.add("delivery", lambda args: delivery.report(False), "received/duplicate/lost counts per transmitter")
+commands.add("limits", lambda args: limiter.report(), "accepted/shed frame counts per transmitter")
+commands.add("sessions", lambda args: f"sessions {sessions.stats()}", "registered transmitters")
+commands.add("egress", lambda args: f"egress {egress.stats()}", "UART queue depth, waits and drops")
+commands.add("stats", stats_command, "stats [reset] - metrics snapshot")
+commands.add("send", downlink.command, "send <mac|@group|all> <command> - run a command on transmitters")
+commands.add("group", downlink.group, "group [name [mac ...|-]] - list, show, set or delete a group")
+commands.add("config", config_command, "config [name [value]] - show or change a setting")
+commands.add("time", time_command, "time [unix_ms] - show or set the reference clock")
+commands.add("alive", lambda args: [f"alive {ubinascii.hexlify(mac, ':').decode()} {state}"
+                                    for mac, state in alive.states().items()] or "alive none",
+             "transmitters with a heartbeat, alive or gone")
+
+# Called by the link's reader task, which sleeps until the host sends
+# something (the link handles its own baud rate handshake)
+def on_command(line):
+    print(f"Received over UART: {line}")
+    commands.dispatch(line)
+
+# Function to handle received ESP-NOW messages, runs in the receive
+# pipeline task rather than the ESP-NOW IRQ callback. mac is interned by the
+# pipeline; binary frames are forwarded without building records or
+# strings, what's left on the heap per frame is the copy of each line the
+# UART queue keeps and the LED colour
+def handle_frame(mac, espnowmsg):
     try:
-        mac, espnowmsg = esp_now.recv()
-        mac_str = ubinascii.hexlify(mac, ":").decode()
-        print(f"Received ESP-NOW message from {mac_str}: {espnowmsg}")
-        
-        message_str = espnowmsg.decode('utf-8').split('|')
-        if len(message_str) < 6:
-            print("Malformed ESP-NOW message received.")
+        if DEBUG:
+            print(f"Received ESP-NOW message from {ubinascii.hexlify(mac, ':').decode()}: {bytes(espnowmsg)}")
+        m_frames.inc()
+        if responder.handle(mac, espnowmsg):
+            m_probes.inc()
+            return
+        if sessions.handle(mac, espnowmsg):
+            m_registers.inc()
+            return
+        if downlink.ack(mac, espnowmsg):
+            m_cmdacks.inc()
+            return
+        # Frames with a session id become full frames again, an unknown id
+        # (we restarted or evicted it) makes the transmitter register again
+        espnowmsg = sessions.rehydrate(mac, espnowmsg)
+        if espnowmsg is None:
+            m_unknown_sessions.inc()
+            return
+        # Retransmits of frames already forwarded are dropped (but acked again)
+        if not delivery.accept(mac, espnowmsg):
+            m_duplicates.inc()
             return
 
-        gadget_type, serial_number, machine_type, cpu_temperature, battery_status, message = message_str
-        print(f"Decoded ESP-NOW message: {message_str}")
-
-        # Send message over UART with a newline to mark the end of the message
-        asyncio.create_task(uart_send_task(espnowmsg.decode('utf-8')))
+        # Batch frames give one line per sample. The UART wait counts from
+        # when the frame came off the radio, lines of frames with a send
+        # time get it and the reference time of that moment
+        count = lines.count(espnowmsg)
+        rgb = None
+        heartbeat = None
+        if count:
+            rx_ms = clock.now(pipeline.frame_ms)
+            for i in range(count):
+                egress.put(bytes(lines.render(espnowmsg, i, rx_ms)), mac, P_DATA, now=pipeline.frame_ms)
+            if lines.sent is not None:
+                m_air.observe(rx_ms - lines.sent)
+            heartbeat = lines.heartbeat
+            at = lines.rgb(espnowmsg, count - 1)
+            if at >= 0:
+                rgb = (espnowmsg[at], espnowmsg[at + 1], espnowmsg[at + 2])
+        else:
+            # Legacy pipe text frame
+            records = psgframe.decode_records(espnowmsg)
+            if not records:
+                m_parse_errors.inc()
+                print("Malformed ESP-NOW message received.")
+                return
+            for record in records:
+                if DEBUG:
+                    print(f"Decoded ESP-NOW message: {record}")
+                egress.put(psgframe.to_text(record), mac, P_DATA, now=pipeline.frame_ms)
+            count = len(records)
+            rgb = records[-1]["rgb"]
+        m_records.inc(count)
+        if mac not in transmitters:
+            transmitters.add(mac)
+            beacons.kick()  # other new transmitters may be looking too
+        silent = alive.heard(mac, heartbeat * 1000 if heartbeat else None, pipeline.frame_ms)
+        if silent is not None:
+            reply(f"back {ubinascii.hexlify(mac, ':').decode()} silent_ms={silent}")
 
         # Blink LED if RGB message is received
-        if message.startswith('rgb'):
-            blink_led(message)
-            
+        if rgb:
+            blink_led(rgb)
+
     except Exception as e:
         print("Failed to process ESP-NOW message:", e)
 
-# Helper function to blink LED
-def blink_led(message):
-    try:
-        rgb_str = message[3:].strip("()")
-        rgb = tuple(map(int, rgb_str.split(',')))
-        np[0] = rgb
-        np.write()
-        time.sleep(1)
-        np[0] = (0, 0, 0)
-        np.write()
-    except ValueError:
-        print("Invalid RGB format in message.")
-
-# Register callback for ESP-NOW
-esp_now.irq(espnow_callback)
+# Helper function to blink LED, the LED task turns it off again after a second
+def blink_led(rgb):
+    led_fx.flash(rgb, 1000)
+
+# Receive pipeline: the IRQ only signals, frames are drained and handled in
+# tasks, frames over a transmitter's rate limit never take a ring slot
+pipeline = RxPipeline(esp_now, handle_frame, RX_RING_SLOTS, RX_BATCH, admit=limiter.allow,
+                      handle_us=m_handle_us)
+# Pipe text lines rendered from binary frames into one reused buffer
+lines = psgframe.LineRenderer(pipeline.macs)
+
+# Live values, read when the metrics are dumped
+metrics.gauge("rx.shed", lambda: pipeline.shed)
+metrics.gauge("rx.ring_dropped", lambda: pipeline.ring.dropped)
+metrics.gauge("uart.depth", lambda: egress.pending)
+metrics.gauge("uart.lines", lambda: egress.sent)
+metrics.gauge("uart.dropped", lambda: egress.dropped_oldest + egress.dropped_newest)
+metrics.gauge("uart.bytes", lambda: link.bytes_written)
+metrics.gauge("uart.commands", lambda: commands.handled)
+metrics.gauge("downlink.frames", lambda: downlink.frames)
+metrics.gauge("downlink.missing", lambda: downlink.missing)
+metrics.gauge("tx.gone", lambda: alive.gone)
+metrics.gauge("tx.sessions", lambda: len(sessions))
+metrics.gauge("heap.free", mem_free)
+
+async def gc_task():
+    while True:
+        await asyncio.sleep_ms(GC_INTERVAL_MS)
+        gc_collect(m_gc_us)
+
+async def liveness_task():
+    while True:
+        await asyncio.sleep_ms(1000)
+        for mac, silent in alive.expired():
+            reply(f"gone {ubinascii.hexlify(mac, ':').decode()} silent_ms={silent}")
+
+async def source_stats_task():
+    while True:
+        await asyncio.sleep_ms(SOURCE_STATS_MS)
+        for line in delivery.report() + limiter.report():
+            reply(line, P_STATS)
 
 # Main function to start tasks
 async def main():
     print("Starting UART and ESP-NOW tasks...")
-    await asyncio.gather(broadcast_task(), uart_receive_task())
+    await asyncio.gather(beacons.run(), link.run(on_command), pipeline.start(), led_fx.run(),
+                         source_stats_task(), egress.run(link.send, link.flush, wait=link.drain),
+                         downlink.run(), gc_task(), liveness_task())
 
 # Run main event loop
-try:
-    asyncio.run(main())
-except KeyboardInterrupt:
-    print("Program interrupted")
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("Program interrupted", pipeline.stats(), link.stats(), beacons.stats(), peers.stats(),
+              limiter.stats(), egress.stats(), commands.stats(), downlink.stats(), clock.stats(),
+              alive.stats(), sessions.stats())
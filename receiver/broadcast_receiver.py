@@ -4,10 +4,23 @@ import network
 import espnow
 import ubinascii
 import time
+import uasyncio as asyncio
 from machine import Pin, UART
+from micropython import const
 import neopixel
 import esp32
 import uos
+import psgframe
+from devtable import DeviceTable
+from rxpipe import RxPipeline
+from ledfx import LedFx
+from discovery import OfferResponder
+from peers import PeerTable
+from beacon import BeaconScheduler
+from reliable import ReliableReceiver
+from session import SessionTable
+from ratelimit import RateLimiter, TokenBucket
+from egress import EgressQueue, DROP_OLDEST, P_DATA, P_STATS
 
 # PsGadgets SSID for controller
 ctssid = "PsGadget-CT"
@@ -15,8 +28,39 @@ ctssid = "PsGadget-CT"
 # file to store known devices mac addresses
 # file should store mac|last connection datetime
 macfile = "known_devices.txt"
+macfile_flush_interval_ms = 60000  # write known devices to flash at most this often
+macfile_max_dirty = 16             # ...or as soon as this many devices changed
 
-uart = UART(1, baudrate=9600, tx=Pin(5), rx=Pin(6))
+# frames buffered between the radio and processing, and drained per batch
+rx_ring_slots = 32
+rx_batch = 8
+
+# beacon every beacon_min_ms after boot or when a new transmitter shows up,
+# doubling up to beacon_max_ms while the set of transmitters is stable
+beacon_min_ms = 500
+beacon_max_ms = 15000
+
+# driver peer limit, least recently used transmitters are evicted
+espnow_peers = 20
+
+# per-transmitter delivery and rate limit counts go to the FT232H this often
+source_stats_ms = 60000
+
+# frames per second accepted from one transmitter, with bursts up to
+# rate_limit_burst, the rest is shed; lines waiting for the uart are
+# forwarded round robin between transmitters, uart_queue_policy picks what
+# to drop when the queue is full (DROP_OLDEST, DROP_NEWEST or COALESCE)
+rate_limit_per_s = 10
+rate_limit_burst = 20
+uart_queue_lines = 64
+uart_queue_policy = DROP_OLDEST
+uart_baud = 9600
+
+# 1 prints every frame and uart write; the prints allocate, with 0 they
+# aren't even compiled
+debug = const(0)
+
+uart = UART(1, baudrate=uart_baud, tx=Pin(5), rx=Pin(6))
 
 # Broadcast address for ESP-NOW
 mac_broadcast = b'\xFF\xFF\xFF\xFF\xFF\xFF'
@@ -38,122 +82,159 @@ np = neopixel.NeoPixel(nppin, 1)
 np[0] = (0, 0, 0)
 np.write()
 
-# Add the broadcast address as a peer
-try:
-    esp_now.add_peer(mac_broadcast)
-except Exception as e:
-    print("Failed to add broadcast peer:", e)
+# unicast peers are added on demand, the broadcast address is pinned
+peers = PeerTable(esp_now, espnow_peers, (mac_broadcast,))
     
 def send_message_to_ft232h(message):
     try:
-        print("Sending message to FT232H via UART:", message)  # Debug print
-        uart.write(message + b'\n')  # Send the message over UART, adding newline for end of message
-        print("Message sent successfully.")
+        if debug:
+            print("Sending message to FT232H via UART:", bytes(message))
+        uart.write(message)  # newline terminated lines, one write per batch
     except Exception as e:
         print(f"UART message sending failed: {type(e).__name__} - {e}")
 
+# the egress writer collects a batch of lines here and writes it in one go
+uart_batch = bytearray()
+
+def batch_line(line):
+    uart_batch.extend(line)
+    uart_batch.extend(b'\n')  # newline for end of message
+
+def flush_batch():
+    send_message_to_ft232h(uart_batch)
+    uart_batch[:] = b''
+
 # Set up WS2812 LED on pin 21 for visual feedback
 nppin = Pin(21, Pin.OUT)
 np = neopixel.NeoPixel(nppin, 1)
 np[0] = (0, 0, 0)
 np.write()
+led_fx = LedFx(np)
 
-def cdt(): # current date time
-    dt = time.localtime()
-    return "{:02d}{:02d}{:02d}T{:02d}{:02d}{:02d}".format(dt[0], dt[1], dt[2], dt[3], dt[4], dt[5])
+cdt_cache = [None, ""]  # second, its string
 
-# function to add mac address to known_devices.txt
-def add_mac(mac):
-    with open(macfile, "a") as f:
-        f.write(f"{mac}|{cdt()}\n")
-        
-# function to check if mac address is in known_devices.txt
-def check_mac(mac):
-    with open(macfile, "r") as f:
-        for line in f:
-            if mac in line:
-                return True
-    return False
-    
-# Function to broadcast MAC and SSID as a simple string
-def broadcast_message():
-    try:
-        mac_raw = wlan.config("mac")
-        mac = ubinascii.hexlify(mac_raw, ":").decode()
-        ssid = wlan.config("essid") or ctssid
-        message = f"{mac}:{ssid}"
-        # print("Broadcasting:", message)
-        esp_now.send(mac_broadcast, message.encode('utf-8'))
-    except Exception as e:
-        print("Failed to send broadcast message:", e)
+def cdt(): # current date time, formatted once per second rather than per frame
+    second = int(time.time())
+    if second != cdt_cache[0]:
+        dt = time.localtime(second)
+        cdt_cache[1] = "{:02d}{:02d}{:02d}T{:02d}{:02d}{:02d}".format(dt[0], dt[1], dt[2], dt[3], dt[4], dt[5])
+        cdt_cache[0] = second
+    return cdt_cache[1]
+
+# known devices stay in RAM (keyed on the raw mac), flash is only written from the housekeeping task
+known_devices = DeviceTable(macfile, macfile_flush_interval_ms, macfile_max_dirty)
+
+# beacon with MAC, SSID and load as a simple string, the bytes are built once
+beacons = BeaconScheduler(esp_now, wlan.config("mac"), wlan.config("essid") or ctssid,
+                          lambda: len(known_devices), beacon_min_ms, beacon_max_ms)
+
+# answers transmitters probing for a receiver, load is the number of known devices;
+# a probe from an unknown transmitter speeds the beacons up
+responder = OfferResponder(esp_now, wlan, lambda: len(known_devices), peers,
+                           known_devices.__contains__, beacons.kick)
         
-def blink_led(msg):
-    if msg.startswith('rgb'):
-        rgb = msg.replace('rgb', '') # remove the rgb prefix
-        rgb = msg[1:-1] # remove the parenthesis
-        rgb = rgb.split(',') # split the rgb values
-        r = int(rgb[0])
-        g = int(rgb[1])
-        b = int(rgb[2])
-        np[0] = (r, g, b)
-        np.write()
-        time.sleep(1)
-        np[0] = (0, 0, 0)
-        np.write()
-
-# Callback to handle received messages from the transmitter
-def espnow_callback(_):  # `_` is used to ignore the event parameter from irq
+# per-transmitter token buckets; everything for the uart goes through one
+# bounded queue written by one task, no faster than the uart can send
+limiter = RateLimiter(rate_limit_per_s, rate_limit_burst)
+egress = EgressQueue(uart_queue_lines, uart_queue_policy,
+                     TokenBucket(uart_baud // 10, 256),  # bytes, ~10 bits per byte on the wire
+                     limiter)
+
+# per-transmitter dedup window, frames asking for it are acked
+delivery = ReliableReceiver(peers.send)
+
+# session ids for registered transmitters, their frames are rebuilt in full
+sessions = SessionTable(peers.send)
+
+# non-blocking, the led task turns it off again after a second
+def blink_led(rgb):
+    led_fx.flash(rgb, 1000)
+
+# Handle a message from the transmitter
+# runs in the receive pipeline task, the ESP-NOW irq only wakes the pipeline;
+# mac is interned by the pipeline and binary frames are rendered into one
+# reused buffer, only the line queued for the uart is copied
+def handle_frame(mac, message):
     try:
-        # Receive the message directly from ESP-NOW
-        mac, message = esp_now.recv()
-        print("Received message from:", ubinascii.hexlify(mac, ":").decode(), "Message:", message)
-        
-        # Expected message Format/Contents:
-        # gadget type | serial number | machine type | cpu temperature | message
-        # [0] = gadget type
-        # [1] = serial number
-        # [2] = machine type
-        # [3] = cpu temperature
-        # [4] = battery status
-        # [5] = message
+        if debug:
+            print("Received message from:", ubinascii.hexlify(mac, ":").decode(), "Message:", bytes(message))
+        # probes get an offer and registers a session id, they aren't forwarded
+        if responder.handle(mac, message) or sessions.handle(mac, message):
+            return
+        # frames with a session id become full frames again
+        message = sessions.rehydrate(mac, message)
+        if message is None:
+            return
+        # retransmits of frames already forwarded are dropped (but acked again)
+        if not delivery.accept(mac, message):
+            if debug:
+                print("Duplicate frame dropped.")
+            return
         
-        # Decode and print the received message
-        message_decode = message.decode('utf-8')
-        print("Decoded message:", message_decode)
-        message_str = message_decode.split('|') # split the message
-        
-        # send msg to FT232H
-        send_message_to_ft232h(message_decode)
-        
-        # check if mac address is in known_devices.txt
-        if not check_mac(mac):
-            # add mac and current datetime to known_devices.txt
-            add_mac(mac)
-            print("New device added to known devices.")
+        # Expected message Format/Contents (see psgframe.py):
+        # binary frame, or legacy pipe text
+        # gadget type | serial number | machine type | cpu temperature | battery status | message
+        # batch frames give one line per sample
+        rgb = None
+        count = lines.count(message)
+        if count:
+            for i in range(count):
+                # queue msg for the FT232H, the writer task sends it
+                egress.put(bytes(lines.render(message, i)), mac, P_DATA)
+            at = lines.rgb(message, count - 1)
+            if at >= 0:
+                rgb = (message[at], message[at + 1], message[at + 2])
         else:
-            print("Device already known.")
-            # update last connection datetime
-            with open(macfile, "r") as f:
-                lines = f.readlines()
-            with open(macfile, "w") as f:
-                for line in lines:
-                    if mac in line:
-                        f.write(f"{mac}|{cdt()}\n")
-                    else:
-                        f.write(line)    
-        # if msg_string[5] like 'rgb(n,n,n)', blink the led 
-        if message_str[5].startswith('rgb'):
-            blink_led(message_str[5]) # send the rgb message portion to blink_led function
+            records = psgframe.decode_records(message)
+            if not records:
+                print("Malformed message received.")
+                return
+            for record in records:
+                if debug:
+                    print("Decoded message:", record)
+                egress.put(psgframe.to_text(record), mac, P_DATA)
+            rgb = records[-1]["rgb"]
+        
+        # add or update mac and current datetime in known devices
+        if known_devices.touch(mac, cdt()):
+            beacons.kick()  # other new transmitters may be looking too
+            if debug:
+                print("New device added to known devices.")
+        # if the message carries an rgb colour, blink the led 
+        if rgb:
+            blink_led(rgb) # send the rgb tuple to blink_led function
                     
     except Exception as e:
         print("Failed to process message:", e)
 
-# Register callback for ESP-NOW
-esp_now.irq(espnow_callback)
+# receive pipeline, registers the ESP-NOW irq when started; frames over a
+# transmitter's rate limit never take a ring slot
+pipeline = RxPipeline(esp_now, handle_frame, rx_ring_slots, rx_batch, admit=limiter.allow)
+# pipe text lines for binary frames, the machine type cache is keyed on the
+# pipeline's interned serials
+lines = psgframe.LineRenderer(pipeline.macs)
+
+async def housekeeping_task():
+    while True:
+        known_devices.maybe_flush()
+        await asyncio.sleep(5)
+
+async def source_stats_task():
+    while True:
+        await asyncio.sleep_ms(source_stats_ms)
+        for line in delivery.report() + limiter.report():
+            egress.put(line.encode(), prio=P_STATS)
+
+async def main():
+    print("Receiver is active, broadcasting and waiting for messages...")
+    await asyncio.gather(beacons.run(), housekeeping_task(), pipeline.start(), led_fx.run(),
+                         source_stats_task(), egress.run(batch_line, flush_batch))
 
 # Main loop to broadcast and wait for incoming messages
-print("Receiver is active, broadcasting and waiting for messages...")
-while True:
-    broadcast_message()
-    time.sleep(5)  # Broadcast every 5 seconds
-
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("Program interrupted", pipeline.stats(), beacons.stats(), peers.stats(),
+              limiter.stats(), egress.stats())
+        known_devices.flush()
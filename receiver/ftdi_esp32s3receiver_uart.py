@@ -4,20 +4,46 @@ import espnow
 import ubinascii
 import machine
 from machine import Pin, UART
+from micropython import const
 import time
+import uasyncio as asyncio
 import neopixel
 import uos
 import esp32
+import psgframe
+from rxpipe import RxPipeline
+from ledfx import LedFx
+from jsonenv import JsonEnvelope
+from discovery import OfferResponder
+from peers import PeerTable
+from reliable import ReliableReceiver
+from session import SessionTable
+from ratelimit import RateLimiter, TokenBucket
+from egress import EgressQueue, DROP_OLDEST, P_DATA
 
 # Get machine type for reference
 machinetype = uos.uname().machine
 
+# JSON output options
+COMPACT_JSON = False     # short keys ("dt", "a", "x", ...) to save UART bandwidth
+TEMP_SAMPLE_MS = 10000   # CPU temperature is sampled on this interval, not per message
+
+# Flood protection
+RATE_LIMIT_PER_S = 10    # frames per second accepted from one transmitter...
+RATE_LIMIT_BURST = 20    # ...with bursts up to this, the rest is shed
+UART_QUEUE_LINES = 32    # JSON lines waiting for the UART
+UART_QUEUE_POLICY = DROP_OLDEST  # what to drop when it is full: DROP_OLDEST, DROP_NEWEST or COALESCE
+
+# 1 prints every frame and uart write; the prints allocate, with 0 they aren't even compiled
+DEBUG = const(0)
+
 
 # WS2812 LED Setup
 # Define NeoPixel LED on pin 21
 # nppin = Pin(21, Pin.OUT)
 # np = neopixel.NeoPixel(nppin, 1)
 np = neopixel.NeoPixel(Pin(21,Pin.OUT), 1)
+led_fx = LedFx(np)
 
 # Ensure LED is off at the start
 np[0] = (0, 0, 0)
@@ -31,19 +57,22 @@ uart = UART(1, baudrate=9600, tx=Pin(5), rx=Pin(6))
 
 def send_message_to_ft232h(message):
     try:
-        print("Sending message to FT232H via UART:", message)  # Debug print
-        uart.write(message + b'\n')  # Send the message over UART, adding newline for end of message
-        print("Message sent successfully.")
+        if DEBUG:
+            print("Sending message to FT232H via UART:", bytes(message))
+        uart.write(message)  # Send the message over UART, the envelopes end with a newline
     except Exception as e:
         print(f"UART message sending failed: {type(e).__name__} - {e}")
 
-# Flash LED with specified color and duration
+# the egress writer collects a batch of JSON lines here and writes it in one go
+uart_batch = bytearray()
+
+def flush_batch():
+    send_message_to_ft232h(uart_batch)
+    uart_batch[:] = b''
+
+# Flash LED with specified color and duration, returns immediately
 def flash_led(color, duration=0.5):
-    np[0] = color
-    np.write()
-    time.sleep(duration)
-    np[0] = (0, 0, 0)  # Turn off LED after flash
-    np.write()
+    led_fx.flash(color, int(duration * 1000))
 
 # Initialize Wi-Fi in station mode for ESP-NOW
 wlan = network.WLAN(network.STA_IF)
@@ -53,59 +82,102 @@ wlan.active(True)
 esp_now = espnow.ESPNow()
 esp_now.active(True)
 
-# broadcast mac address to nearby transmitters
+# broadcast mac address to nearby transmitters, unicast peers are added
+# on demand and the least recently used evicted
 mac_broadcast = b'\xff' * 6
-esp_now.add_peer(mac_broadcast)
+peers = PeerTable(esp_now, pinned=(mac_broadcast,))
+
+# answers transmitters probing for a receiver
+responder = OfferResponder(esp_now, wlan, peers=peers)
+
+# per-transmitter token buckets, frames over the limit are shed
+limiter = RateLimiter(RATE_LIMIT_PER_S, RATE_LIMIT_BURST)
+
+# one bounded queue for the uart, written by one task no faster than 9600 baud
+egress = EgressQueue(UART_QUEUE_LINES, UART_QUEUE_POLICY, TokenBucket(960, 256), limiter)
+
+# per-transmitter dedup window, frames asking for it are acked
+delivery = ReliableReceiver(peers.send)
+
+# session ids for registered transmitters, their frames are rebuilt in full
+sessions = SessionTable(peers.send)
 
-# format message as json
+# JSON envelope, the accessory (this esp32) part is built once
+envelope = JsonEnvelope(wlan.config("mac"), machinetype, COMPACT_JSON)
+envelope.set_temperature(esp32.mcu_temperature())
+
+# format message as json, returns a view into the envelope buffer
+# that is only valid until the next call
 def format_jsonmessage(mac, message):
-    # datetime, format as string
-    dt = time.localtime()
-    cdt = "{:04d}{:02d}{:02d}T{:02d}{:02d}{:02d}".format(dt[0], dt[1], dt[2], dt[3], dt[4], dt[5])
-    # accessory esp32
-    machinetype = uos.uname().machine
-    macraw = wlan.config("mac")
-    mac = ubinascii.hexlify(wlan.config("mac"), ":").decode()
-    cputemp = esp32.mcu_temperature()
-    accessoryJson = '{{"macraw":"{}","mac":"{}","type":"{}","cputemp":{}}}'.format(macraw, mac, machinetype, cputemp)
-    # transmitter esp32
-    transmitterJson = '{{"mac":"{}","message":"{}"}}'.format(mac, message)
-    # json message
-    jsonmessage = '{{"datetime":"{}, "accessory":{}, "transmitter":{}}}'.format(cdt, accessoryJson, transmitterJson)
-    return jsonmessage
-
-# Define a callback function for receiving messages
-def espnow_callback(_):
+    return envelope.build(mac, message)
+
+# Handle a received message, called from the receive pipeline task
+# (the ESP-NOW irq only wakes the pipeline)
+def handle_frame(mac, msg):
     try:
-        mac, msg = esp_now.irecv()  # Get the received message
-        if mac:
-            flash_led((0, 0, 20))  # Flash blue for message received
-            print("Message received from", ubinascii.hexlify(mac, ":").decode(), ":", msg)
-            # get json message
-            jsonmsg = format_jsonmessage(mac, msg)
-            print("Formatted JSON message:", jsonmsg)
-            # send message to FT232H
-            send_message_to_ft232h(jsonmsg)
-        else:
-            print("No message received.")
+        # probes get an offer and registers a session id, they aren't forwarded
+        if responder.handle(mac, msg) or sessions.handle(mac, msg):
+            return
+        # frames with a session id become full frames again
+        msg = sessions.rehydrate(mac, msg)
+        if msg is None:
+            return
+        # retransmits of frames already forwarded are dropped (but acked again)
+        if not delivery.accept(mac, msg):
+            return
+        flash_led((0, 0, 20))  # Flash blue for message received
+        if DEBUG:
+            print("Message received from", ubinascii.hexlify(mac, ":").decode(), ":", bytes(msg))
+        # binary frames are rendered to pipe text (one line per sample for
+        # batch frames) in the renderer's buffer, other payloads pass through
+        count = lines.count(msg)
+        if not count:
+            forward(mac, msg)
+        for i in range(count):
+            forward(mac, lines.render(msg, i))
     except Exception as e:
         flash_led((20, 0, 0))  # Flash red for error
         print(f"Failed to receive or send message: {type(e).__name__} - {e}")
 
-# Register the callback function with ESP-NOW
-esp_now.irq(espnow_callback)
+def forward(mac, message):
+    # get json message
+    jsonmsg = format_jsonmessage(mac, message)
+    if DEBUG:
+        print("Formatted JSON message:", bytes(jsonmsg))
+    # queue message for the FT232H (the envelope buffer is reused, so copy)
+    egress.put(bytes(jsonmsg), mac, P_DATA)
+
+# Receive pipeline, registers the ESP-NOW irq when started
+pipeline = RxPipeline(esp_now, handle_frame, admit=limiter.allow)
+# pipe text for binary frames, one reused buffer
+lines = psgframe.LineRenderer(pipeline.macs)
 
 # Print device information
 print(f"MachineType: {machinetype}")
 print("My MAC address is:", ubinascii.hexlify(wlan.config("mac"), ":").decode())
 
-# Main loop to keep the program running and listen for messages
-try:
+async def heartbeat_task():
     while True:
         # Flash green briefly to show program is running
         flash_led((0, 50, 0), duration=0.3)  # Short green flash for readiness
-        time.sleep(5)  # Check LED every 5 seconds
-except KeyboardInterrupt:
-    print("Program stopped by user.")
-    np[0] = (0, 0, 0)  # Ensure LED is off on exit
-    np.write()
+        await asyncio.sleep(5)  # Check LED every 5 seconds
+
+async def temperature_task():
+    while True:
+        await asyncio.sleep_ms(TEMP_SAMPLE_MS)
+        envelope.set_temperature(esp32.mcu_temperature())
+
+async def main():
+    await asyncio.gather(heartbeat_task(), temperature_task(), pipeline.start(), led_fx.run(),
+                         egress.run(uart_batch.extend, flush_batch))
+
+# Main loop to keep the program running and listen for messages
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("Program stopped by user.", pipeline.stats(), peers.stats(), egress.stats())
+        for line in delivery.report(False) + limiter.report():
+            print(line)
+        np[0] = (0, 0, 0)  # Ensure LED is off on exit
+        np.write()
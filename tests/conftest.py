@@ -0,0 +1,12 @@
+# Off-device test setup: common/ and host/ importable, and the MicroPython
+# hardware stand-ins from bench/stubs/ in front of them (machine, espnow, ...).
+#
+#   python3 -m pytest -q tests
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in ("host", "common", os.path.join("bench", "stubs")):
+    path = os.path.join(ROOT, path)
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,81 @@
+import espnow
+import pytest
+from beacon import BROADCAST_MAC, BeaconScheduler, airtime_us
+
+MAC = b"\x24\x0a\xc4\x00\x00\x06"
+
+
+class Clock:
+    def __init__(self, ms):
+        self.ms = ms
+
+    def now(self):
+        return self.ms
+
+
+@pytest.fixture
+def esp(monkeypatch):
+    monkeypatch.setattr(espnow, "sent", [])
+    monkeypatch.setattr(espnow, "on_send", None)
+    monkeypatch.setattr(espnow, "ack", True)
+    esp = espnow.ESPNow()
+    esp.add_peer(BROADCAST_MAC)
+    return esp
+
+
+def test_payload_and_load(esp):
+    load = [3]
+    beacons = BeaconScheduler(esp, MAC, "PsGadget-CT", lambda: load[0])
+    beacons.send()
+    load[0] = 999
+    beacons.send()
+    assert [(mac, msg) for _, mac, msg in espnow.sent] == [
+        (BROADCAST_MAC, b"24:0a:c4:00:00:06:PsGadget-CT|3"),
+        (BROADCAST_MAC, b"24:0a:c4:00:00:06:PsGadget-CT|255"),
+    ]
+    assert beacons.stats()["load"] == 255
+    assert beacons.airtime_us == airtime_us(31) + airtime_us(33)
+
+
+def test_clock_is_appended(esp):
+    beacons = BeaconScheduler(esp, MAC, "PsGadget-CT", clock=Clock(None))
+    beacons.send()
+    beacons.clock = Clock(1700000000123)
+    beacons.send()
+    assert [msg for _, _, msg in espnow.sent] == [b"24:0a:c4:00:00:06:PsGadget-CT|0",
+                                                 b"24:0a:c4:00:00:06:PsGadget-CT|0|1700000000123"]
+    assert beacons.payload == b"24:0a:c4:00:00:06:PsGadget-CT|0"
+
+
+def test_interval_doubles_and_kick_resets(esp):
+    beacons = BeaconScheduler(esp, MAC, "PsGadget-CT", min_ms=500, max_ms=4000)
+    now = beacons._next
+    intervals = []
+    for _ in range(6):
+        intervals.append(beacons.step(now))
+        assert beacons.step(now) == intervals[-1]  # not due yet
+        now += intervals[-1]
+    assert intervals == [500, 1000, 2000, 4000, 4000, 4000]
+    now -= 3000  # a second into the 4 s wait
+    beacons.kick(now)
+    assert beacons.step(now) == 500  # next beacon min_ms after the kick
+    assert beacons.step(now + 500) == 500
+    assert beacons.step(now + 1000) == 1000
+    stats = beacons.stats()
+    assert (stats["sent"], stats["kicks"], stats["interval_ms"]) == (8, 1, 2000)
+    assert stats["mean_latency_ms"] > 0
+
+
+def test_kick_does_not_delay_a_due_beacon(esp):
+    beacons = BeaconScheduler(esp, MAC, "PsGadget-CT", min_ms=500, max_ms=4000)
+    now = beacons._next
+    beacons.step(now)
+    beacons.kick(now + 100)  # next one was due at now + 500 already
+    assert beacons.step(now + 100) == 400
+
+
+def test_send_errors_are_counted(esp):
+    esp.del_peer(BROADCAST_MAC)
+    beacons = BeaconScheduler(esp, MAC, "PsGadget-CT")
+    beacons.send()
+    assert (beacons.sent, beacons.errors, beacons.airtime_us) == (0, 1, 0)
@@ -0,0 +1,61 @@
+import psgframe
+from clocksync import ClockEstimator, SyncClock, beacon_time
+
+T0 = 1700000000000  # Unix ms
+
+
+class Rtc:
+    def datetime(self, dt):
+        self.dt = dt
+
+
+def test_beacon_time():
+    assert beacon_time(b"24:0a:c4:00:00:06:PsGadget-CT|3|1700000000123") == 1700000000123
+    assert beacon_time(memoryview(b"24:0a:c4:00:00:06:PsGadget-CT|3")) is None
+    assert beacon_time(b"24:0a:c4:00:00:06:PsGadget-CT") is None
+    assert beacon_time(b"24:0a:c4:00:00:06:PsGadget-CT|3|soon") is None
+
+
+def test_sync_clock():
+    rtc = Rtc()
+    clock = SyncClock(rtc)
+    assert clock.now(0) is None and not clock.synced
+    clock.set(T0, now=1000)
+    assert rtc.dt == (2023, 11, 14, 1, 22, 13, 20, 0)
+    assert clock.now(1500) == T0 + 500 and clock.now(900) == T0 - 100
+    clock.set(T0 + 520, now=1500)  # the host's clock was 20 ms ahead
+    assert clock.stats() == {"synced": True, "sets": 2, "last_step_ms": 20}
+
+
+def test_estimator_fits_offset_and_drift():
+    estimator = ClockEstimator(delay_ms=0)
+    assert estimator.now(0) is None
+    # Local ticks run 200 ppm fast against the reference
+    for i in range(8):
+        ticks = 5000 + i * 10000
+        estimator.add(T0 + int(i * 10000 / 1.0002), now=ticks)
+    assert estimator.synced and 190 <= estimator.drift_ppm() <= 210
+    ahead = 5000 + 7 * 10000 + 60000
+    expected = T0 + int((7 * 10000 + 60000) / 1.0002)
+    assert abs(estimator.now(ahead) - expected) <= 2
+    assert abs(estimator.last_error_ms) <= 2 and estimator.steps == 0
+
+
+def test_estimator_restarts_on_a_step_and_goes_stale():
+    estimator = ClockEstimator(stale_ms=60000)
+    assert estimator.beacon(b"rx:PsGadget-CT|0|%d" % T0, now=1000)
+    assert not estimator.beacon(b"rx:PsGadget-CT|0", now=2000)
+    assert estimator.now(2000) == T0 + 1 + 1000  # delay_ms on top
+    estimator.add(T0 + 3600000, now=3000)  # the host set the receiver's clock
+    assert estimator.steps == 1 and estimator.now(3000) == T0 + 3600000
+    assert estimator.offset_ms() == T0 + 3600000 - 3000
+    assert estimator.now(3000 + 60001) is None
+
+
+def test_frames_carry_the_low_bits():
+    frame = psgframe.encode_telemetry(1, b"\x34\xb7\xda\x11\x22\x33", 1, 20, 50,
+                                      ext=[psgframe.time_tlv(T0 + 5)])
+    sent = psgframe.decode(frame)["sent"]
+    assert sent == (T0 + 5) & 0xFFFFFFFF
+    assert psgframe.unwrap_time(sent, T0 + 2000) == T0 + 5
+    assert psgframe.unwrap_time(0xFFFFFFF0, 0x100000010) == 0xFFFFFFF0
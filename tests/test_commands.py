@@ -0,0 +1,38 @@
+from commands import CommandTable
+
+
+def table():
+    replies = []
+    commands = CommandTable(replies.append)
+    return commands, replies
+
+
+def test_dispatch_replies():
+    commands, replies = table()
+    commands.add("status", lambda args: "ESP32 status: Active", "receiver status")
+    commands.add("echo", lambda args: [args, args.upper()], "say it twice")
+    commands.add("quiet", lambda args: None)
+    assert commands.dispatch("status\r\n")
+    assert commands.dispatch("echo   hi there ")
+    assert commands.dispatch("quiet")
+    assert replies == ["ESP32 status: Active", "hi there", "HI THERE"]
+    assert commands.stats() == {"handled": 3, "unknown": 0, "errors": 0}
+
+
+def test_unknown_and_failing_commands_are_answered():
+    commands, replies = table()
+    commands.add("led", lambda args: "led {}".format(tuple(int(v) for v in args.split())))
+    assert not commands.dispatch("nope 1")
+    assert not commands.dispatch("led red")
+    assert commands.dispatch("led 1 2 3")
+    assert replies == ["error unknown command nope",
+                       "error led: invalid literal for int() with base 10: 'red'",
+                       "led (1, 2, 3)"]
+    assert commands.stats() == {"handled": 1, "unknown": 1, "errors": 1}
+
+
+def test_help_lists_commands():
+    commands, replies = table()
+    commands.add("status", lambda args: "ok", "receiver status")
+    commands.dispatch("help")
+    assert replies == ["help - list commands", "status - receiver status"]
@@ -0,0 +1,35 @@
+import psgframe
+from deadband import CHANGE, HEARTBEAT, Deadband
+
+SERIAL = b"\x34\xb7\xda\x11\x22\x33"
+
+
+def test_only_changes_and_heartbeats_are_sent():
+    band = Deadband(temp=0.5, battery=2, heartbeat_ms=60000)
+    assert band.add(20.0, 80, now=0) == CHANGE  # nothing sent yet
+    band.sent(20.0, 80, now=0)
+    assert band.add(20.4, 79, now=1000) is None
+    assert band.add(19.6, 82, now=2000) is None
+    assert band.add(20.6, 80, now=3000) == CHANGE
+    band.sent(20.6, 80, now=3000)
+    assert band.add(20.6, 77, now=4000) == CHANGE  # battery moved out of its band
+    band.sent(20.6, 77, now=4000)
+    assert band.add(20.6, 77, now=63999) is None
+    assert band.add(20.6, 77, now=64000) == HEARTBEAT
+    assert band.stats() == {"readings": 7, "changes": 3, "heartbeats": 1, "suppressed": 3}
+
+
+def test_readings_in_between_are_summed_up():
+    band = Deadband(temp=5)
+    band.sent(20, 80, now=0)
+    for temp in (20.0, 24.5, 15.5, 20.0):
+        band.add(temp, 80, now=0)
+    frame = psgframe.encode_telemetry(1, SERIAL, 1, 20, 80, ext=[
+        band.agg_tlv(), psgframe.heartbeat_tlv(band.heartbeat_ms // 1000)])
+    record = psgframe.decode(frame)
+    assert record["agg"] == (4, 15.5, 24.5, 20.0)
+    assert record["heartbeat"] == 60
+    band.sent(20, 80, now=0)
+    band.add(21.25, 80, now=0)
+    assert psgframe.decode(psgframe.encode_telemetry(2, SERIAL, 1, 21.25, 80, ext=[band.agg_tlv()]))["agg"] \
+        == (1, 21.25, 21.25, 21.25)
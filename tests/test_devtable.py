@@ -0,0 +1,56 @@
+import os
+
+import devtable
+from devtable import DeviceTable
+
+MACS = [bytes((0x34, 0xB7, 0xDA, 0, 0, n)) for n in range(8)]
+
+
+def test_write_behind_and_reload(tmp_path):
+    path = str(tmp_path / "known_devices.txt")
+    table = DeviceTable(path, flush_interval_ms=1000, max_dirty=4)
+    assert table.touch(MACS[0], "t0") and not table.touch(MACS[0], "t1")
+    assert not os.path.exists(path)  # RAM only until a flush
+    assert not table.maybe_flush(now=0)
+    for mac in MACS[1:4]:
+        table.touch(mac, "t2")
+    assert table.maybe_flush(now=0) and table.dirty() == 0
+    table.touch(MACS[1], "t3")
+    assert table.maybe_flush(now=table._last_flush + 1000)
+    reloaded = DeviceTable(path)
+    assert len(reloaded) == 4
+    assert reloaded.last_seen(MACS[0]) == "t1" and reloaded.last_seen(MACS[1]) == "t3"
+    assert MACS[3] in reloaded and MACS[5] not in reloaded
+
+
+def test_journal_is_compacted(tmp_path):
+    path = str(tmp_path / "known_devices.txt")
+    table = DeviceTable(path, max_dirty=1)
+    for n in range(4 * devtable.COMPACT_FACTOR + 1):
+        table.touch(MACS[n % 2], "t{}".format(n))
+        table.flush()
+    assert table.compactions >= 1
+    assert not os.path.exists(path + ".tmp")
+    with open(path) as f:
+        assert len(f.readlines()) <= devtable.COMPACT_FACTOR * 2
+    assert DeviceTable(path).last_seen(MACS[0]) == "t{}".format(4 * devtable.COMPACT_FACTOR)
+
+
+def test_load_recovers_interrupted_compaction(tmp_path):
+    path = str(tmp_path / "known_devices.txt")
+    table = DeviceTable(path)
+    for mac in MACS:
+        table.touch(mac, "seen")
+    table.compact()
+    os.rename(path, path + ".tmp")  # reset after the old journal was removed
+    reloaded = DeviceTable(path)
+    assert len(reloaded) == len(MACS)
+    assert os.path.exists(path) and not os.path.exists(path + ".tmp")
+
+
+def test_malformed_lines_are_skipped(tmp_path):
+    path = str(tmp_path / "known_devices.txt")
+    with open(path, "w") as f:
+        f.write("34:b7:da:00:00:01|a\nnot a line\nzz:zz|b\n34:b7:da:00:00:02|c\n")
+    table = DeviceTable(path)
+    assert len(table) == 2 and table.last_seen(MACS[2]) == "c"
@@ -0,0 +1,115 @@
+import espnow
+import network
+import psgframe
+import pytest
+from discovery import BROADCAST_MAC, OfferResponder, Prober, beacon_load
+
+SERIAL = b"\x34\xb7\xda\x11\x22\x33"
+RECEIVER = b"\x24\x0a\xc4\x00\x00\x06"
+GADGET = psgframe.gadget_code("PsGadget-IO")
+
+
+@pytest.fixture
+def radio(monkeypatch):
+    monkeypatch.setattr(espnow, "sent", [])
+    monkeypatch.setattr(espnow, "beacons", [])
+    monkeypatch.setattr(espnow, "on_send", None)
+    monkeypatch.setattr(espnow, "ack", True)
+    monkeypatch.setattr(network, "channel", 1)
+    return espnow
+
+
+def receivers(radio, loads):
+    """Answer broadcast probes with an offer from each (mac, channel, load)."""
+    def on_send(esp, mac, msg):
+        probe = psgframe.decode_probe(msg)
+        if probe is None or mac != BROADCAST_MAC:
+            return None
+        for rx, channel, load in loads:
+            if channel == network.channel:
+                esp.deliver(rx, psgframe.encode_offer(probe[0], rx, channel, load))
+        return None
+    radio.on_send = on_send
+
+
+def test_probe_and_offer_round_trip():
+    frame = psgframe.encode_probe(513, SERIAL, GADGET, 11)
+    assert psgframe.decode_probe(frame) == (513, SERIAL, GADGET, 11)
+    assert psgframe.decode_offer(frame) is None
+    frame = psgframe.encode_offer(513, RECEIVER, 6, 300)
+    assert psgframe.decode_offer(frame) == (513, RECEIVER, 6, 255)
+    assert psgframe.decode_probe(frame) is None
+    assert psgframe.decode_offer(frame[:-1]) is None
+
+
+def test_beacon_load():
+    assert beacon_load(b"24:0a:c4:00:00:06:PsGadget-CT|17") == 17
+    assert beacon_load(b"24:0a:c4:00:00:06:PsGadget-CT|999|12:00") == 255
+    assert beacon_load(b"24:0a:c4:00:00:06:PsGadget-CT") == 255
+    assert beacon_load(b"24:0a:c4:00:00:06:PsGadget-CT|busy") == 255
+
+
+def test_scan_picks_least_loaded_on_first_channel(radio, tmp_path):
+    other = b"\x24\x0a\xc4\x00\x00\x07"
+    receivers(radio, [(RECEIVER, 6, 40), (other, 6, 10), (b"\x24\x0a\xc4\x00\x00\x09", 9, 0)])
+    prober = Prober(radio.ESPNow(), network.WLAN(), SERIAL, GADGET, channels=(3, 6, 9),
+                    cache=str(tmp_path / "receiver.txt"))
+    assert prober.find(max_scans=1) == (other, 6, 10)
+    assert network.channel == 6
+    assert prober.load_cache() == (other, 6)
+    stats = prober.stats()
+    assert (stats["probes"], stats["offers"], stats["scans"], stats["cache_hits"]) == (2, 2, 1, 0)
+
+
+def test_cached_receiver_is_probed_first(radio, monkeypatch, tmp_path):
+    prober = Prober(radio.ESPNow(), network.WLAN(), SERIAL, GADGET, cache=str(tmp_path / "receiver.txt"))
+    prober.save_cache(RECEIVER, 6)
+    assert prober.find(max_scans=1) == (RECEIVER, 6, None)
+    assert prober.stats()["cache_hits"] == 1 and prober.stats()["scans"] == 0
+    assert [mac for _, mac, _ in radio.sent] == [RECEIVER]
+    # Unanswered: the peer is dropped again and a scan that finds nothing gives up
+    monkeypatch.setattr(radio, "ack", False)
+    prober.esp_now.del_peer(RECEIVER)
+    assert prober.find(max_scans=1) is None
+    assert RECEIVER not in [peer[0] for peer in prober.esp_now.get_peers()]
+    prober.forget()
+    assert prober.load_cache() is None
+
+
+def test_text_beacons_count_as_offers(radio, monkeypatch, tmp_path):
+    def on_send(esp, mac, msg):
+        esp.deliver(RECEIVER, b"24:0a:c4:00:00:06:PsGadget-CT")
+    monkeypatch.setattr(radio, "on_send", on_send)
+    prober = Prober(radio.ESPNow(), network.WLAN(), SERIAL, GADGET, channels=(1,),
+                    cache=str(tmp_path / "receiver.txt"))
+    assert prober.find(max_scans=1) == (RECEIVER, 1, 255)
+
+
+def test_offer_responder(radio, monkeypatch):
+    monkeypatch.setattr(network, "channel", 6)
+    esp = radio.ESPNow()
+    wlan = network.WLAN()
+    responder = OfferResponder(esp, wlan, load=lambda: 3)
+    assert not responder.handle(SERIAL, psgframe.encode_telemetry(1, SERIAL, GADGET, 20, 50))
+    assert responder.handle(SERIAL, psgframe.encode_probe(42, SERIAL, GADGET, 6))
+    _, mac, frame = radio.sent[-1]
+    assert mac == SERIAL
+    assert psgframe.decode_offer(frame) == (42, wlan.config("mac"), 6, 3)
+    assert esp.get_peers() == ()  # added for the offer only
+    assert (responder.probes, responder.offers) == (1, 1)
+
+
+def test_probe_from_unknown_mac_kicks(radio):
+    from peers import PeerTable
+    esp = radio.ESPNow()
+    wlan = network.WLAN()
+    peers = PeerTable(esp, 20)
+    known = {RECEIVER}
+    kicks = []
+    responder = OfferResponder(esp, wlan, peers=peers, known=known.__contains__,
+                               on_unknown=lambda: kicks.append(1))
+    responder.handle(RECEIVER, psgframe.encode_probe(1, RECEIVER, GADGET, 1))  # known device
+    responder.handle(SERIAL, psgframe.encode_probe(2, SERIAL, GADGET, 1))      # new one
+    responder.handle(SERIAL, psgframe.encode_probe(3, SERIAL, GADGET, 1))      # a peer by now
+    assert len(kicks) == responder.unknown == 1
+    assert responder.offers == 3
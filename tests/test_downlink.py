@@ -0,0 +1,119 @@
+import asyncio
+
+import psgframe
+import pytest
+from downlink import BROADCAST_MAC, Downlink, Listener, parse_mac
+
+RX = b"\x24\x0a\xc4\x00\x00\x06"
+
+
+def mac(n):
+    return bytes((0x34, 0xb7, 0xda, 0, 0, n))
+
+
+class Radio:
+    """Peers for the receiver, acks come back from the Listeners right away."""
+
+    def __init__(self, downlink=None):
+        self.downlink = downlink
+        self.listeners = {}
+        self.frames = []
+        self.down = set()  # MACs that hear nothing
+
+    def add(self, n, dispatch=lambda text: True):
+        listener = Listener(self, mac(n), dispatch, receivers=(RX,))
+        self.listeners[mac(n)] = listener
+        return listener
+
+    def send(self, to, frame, sync=True):
+        self.frames.append((to, bytes(frame)))
+        for address, listener in self.listeners.items():
+            if (to == BROADCAST_MAC or to == address) and address not in self.down:
+                listener.esp_now = _Back(self, address)
+                listener.handle(RX, frame)
+        return True
+
+
+class _Back:
+    def __init__(self, radio, mac):
+        self.radio, self.mac = radio, mac
+
+    def send(self, to, frame, sync=True):
+        assert to == RX
+        self.radio.downlink.ack(self.mac, frame)
+
+
+def run(downlink, ms=200):
+    async def go():
+        try:
+            await asyncio.wait_for(downlink.run(tick_ms=5), ms / 1000)
+        except asyncio.TimeoutError:
+            pass
+    asyncio.run(go())
+
+
+def test_command_frames_round_trip():
+    frame = psgframe.encode_command(7, b"led 0 0 64", (mac(1), mac(2)), psgframe.F_RETX)
+    cid, flags, targets, text = psgframe.decode_command(frame)
+    assert (cid, flags, list(targets), text) == (7, psgframe.F_RETX, [mac(1), mac(2)], "led 0 0 64")
+    assert psgframe.decode_cmdack(psgframe.encode_cmdack(7, psgframe.CMD_FAILED)) == (7, psgframe.CMD_FAILED)
+    assert psgframe.decode_command(psgframe.encode_cmdack(7)) is None
+
+
+def test_unicast_command_is_acked():
+    replies = []
+    radio = Radio()
+    ran = []
+    radio.add(1, lambda text: ran.append(text) or True)
+    radio.add(2, lambda text: False)
+    downlink = radio.downlink = Downlink(radio, replies.append, lambda: radio.listeners)
+    assert downlink.command("all led 0 0 64") == "downlink 1 sending targets=2 via=unicast"
+    run(downlink, 50)
+    assert ran == ["led 0 0 64"]
+    assert [to for to, _ in radio.frames] == [mac(1), mac(2)]
+    assert replies[0].startswith("downlink 1 done targets=2 acked=1 failed=1 missing=0 ms=")
+    assert replies[0].endswith(" 34:b7:da:00:00:02")
+    assert downlink.stats()["in_flight"] == 0
+
+
+def test_broadcast_lists_targets_and_resends_to_the_missing():
+    replies = []
+    radio = Radio()
+    for n in range(1, 7):
+        radio.add(n)
+    radio.down = {mac(5)}
+    downlink = radio.downlink = Downlink(radio, replies.append, lambda: radio.listeners,
+                                         timeout_ms=20, retries=2)
+    downlink.group("lab " + " ".join(":".join("{:02x}".format(b) for b in mac(n)) for n in (1, 2, 3, 5)))
+    assert downlink.command("@lab status").endswith("targets=4 via=broadcast")
+    run(downlink)
+    assert radio.frames[0][0] == BROADCAST_MAC
+    assert [to for to, _ in radio.frames[1:]] == [mac(5), mac(5)]
+    assert radio.listeners[mac(4)].ignored == 1  # heard it, wasn't listed
+    assert replies[0].startswith("downlink 1 done targets=4 acked=3 failed=0 missing=1")
+    assert downlink.stats()["resends"] == 2
+
+
+def test_bad_commands():
+    downlink = Downlink(Radio(), print, lambda: ())
+    for args in ("", "all", "all   ", "@nobody x", "12:34 x"):
+        with pytest.raises(ValueError):
+            downlink.command(args)
+    assert downlink.group("") == "group none"
+    with pytest.raises(ValueError):
+        parse_mac("zz:zz:zz:zz:zz:zz")
+
+
+def test_listener_runs_a_resend_once():
+    radio = Radio()
+    ran = []
+    listener = radio.add(1, lambda text: ran.append(text) or True)
+    acks = []
+    radio.downlink = type("Acks", (), {"ack": lambda self, m, f: acks.append(psgframe.decode_cmdack(f))})()
+    frame = psgframe.encode_command(9, b"led 1 2 3")
+    radio.send(mac(1), frame)
+    radio.send(mac(1), psgframe.encode_command(9, b"led 1 2 3", (), psgframe.F_RETX))
+    assert ran == ["led 1 2 3"] and acks == [(9, 0), (9, 0)]
+    listener.receivers = set()  # someone else's receiver
+    radio.send(mac(1), psgframe.encode_command(10, b"led 0 0 0"))
+    assert listener.stats() == {"applied": 1, "duplicates": 1, "ignored": 1, "ack_errors": 0}
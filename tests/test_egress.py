@@ -0,0 +1,96 @@
+import pytest
+from egress import COALESCE, DROP_NEWEST, DROP_OLDEST, P_CONTROL, P_DATA, P_STATS, EgressQueue
+from ratelimit import RateLimiter, TokenBucket
+from uartlink import OVERHEAD
+
+A = b"\x34\xb7\xda\x11\x22\x33"
+B = b"\x34\xb7\xda\x11\x22\x34"
+
+
+def drain(queue, now=0, limit=1000):
+    sent = []
+    queue.drain(lambda line, kind=None: sent.append(line), now, limit)
+    return sent
+
+
+def test_priority_then_round_robin():
+    queue = EgressQueue(16)
+    for n in range(3):
+        queue.put(b"a%d" % n, A, now=0)
+    queue.put(b"b0", B, now=0)
+    queue.put(b"stats", None, P_STATS, now=0)
+    queue.put(b"reply", None, P_CONTROL, now=0)
+    assert drain(queue) == [b"reply", b"a0", b"b0", b"a1", b"a2", b"stats"]
+    assert len(queue) == 0
+
+
+def test_kind_and_wait_times():
+    queue = EgressQueue(4)
+    queue.put(b"reply", None, P_CONTROL, kind=2, now=100)
+    queue.put(b"line", A, now=120)
+    sent = []
+    queue.drain(lambda *args: sent.append(args), now=150)
+    assert sent == [(b"reply", 2), (b"line",)]
+    stats = queue.stats()
+    assert (stats["wait_ms_mean"], stats["wait_ms_max"], stats["bytes"]) == (40, 50, 11)
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        EgressQueue(4, "drop-everything")
+
+
+def test_drop_oldest_takes_the_lowest_class():
+    queue = EgressQueue(3, DROP_OLDEST)
+    queue.put(b"stats", None, P_STATS, now=0)
+    queue.put(b"a0", A, now=1)
+    queue.put(b"b0", B, now=2)
+    assert queue.put(b"a1", A, now=3)  # stats go first
+    assert queue.put(b"b1", B, now=4)  # then the oldest data line
+    assert drain(queue) == [b"a1", b"b0", b"b1"]  # A keeps its place in the round
+    assert queue.stats()["dropped_oldest"] == 2
+
+
+def test_drop_newest_counts_against_the_device():
+    limiter = RateLimiter()
+    limiter.allow(A, now=0)
+    queue = EgressQueue(1, DROP_NEWEST, limiter=limiter)
+    queue.put(b"a0", A, now=0)
+    assert not queue.put(b"a1", A, now=0)
+    assert queue.put(b"reply", None, P_CONTROL, now=0)  # a higher class still makes room
+    assert drain(queue) == [b"reply"]
+    assert limiter.stats(A) == {"accepted": 1, "shed": 2}
+
+
+def test_coalesce_replaces_a_device_line():
+    queue = EgressQueue(3, COALESCE)
+    queue.put(b"a0", A, now=0)
+    queue.put(b"a1", A, now=0)
+    queue.put(b"b0", B, now=0)
+    assert queue.put(b"a2", A, now=0)  # replaces a1
+    assert queue.put(b"c0", b"\x00" * 6, now=0)  # A has the most waiting, its oldest goes
+    assert drain(queue) == [b"a2", b"b0", b"c0"]
+    assert (queue.coalesced, queue.dropped_oldest) == (1, 1)
+
+
+def test_coalesce_never_replaces_replies():
+    queue = EgressQueue(2, COALESCE)
+    for n in range(4):
+        assert queue.put(b"reply%d" % n, None, P_CONTROL, now=n)
+    for n in range(2):
+        queue.put(b"data%d" % n, None, P_DATA, now=10 + n)  # no device: nothing to merge with
+    assert drain(queue) == [b"reply2", b"reply3"]
+    assert queue.coalesced == 0
+
+
+def test_budget_counts_the_wire_size():
+    line = b"x" * 20
+    queue = EgressQueue(16, budget=TokenBucket(0, 100, now=0))
+    for _ in range(8):
+        queue.put(line, A, now=0)
+    assert len(drain(queue)) == 5  # 21 bytes each with the newline
+    queue = EgressQueue(16, budget=TokenBucket(0, 100, now=0), overhead=OVERHEAD)
+    for _ in range(8):
+        queue.put(line, A, now=0)
+    assert len(drain(queue)) == 4  # 29 bytes each framed
+    assert queue.stats()["bytes"] == 4 * (20 + OVERHEAD)
@@ -0,0 +1,136 @@
+# IngestDaemon against pty-backed fake receivers (POSIX only)
+import asyncio
+import json
+import os
+import sys
+import time
+
+import pytest
+
+from liveness import Liveness
+from psgadget_ingest import IngestDaemon, RotatingLog, parse_record
+from serialport import PosixSerial
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "openpty") or sys.platform == "win32",
+                                reason="needs pseudo-terminals")
+
+RECORD = b"PsGadget-IO|34b7da59d620|Generic ESP32S3 module with ESP32S3|46|99|rgb(12, 200, 34)\n"
+
+
+def test_parse_record():
+    assert parse_record(RECORD.decode())["temp"] == 46
+    record = parse_record("PsGadget-IO|4827e2100001|m|36.5|98|hi|250|n=5|min=36|max=37|mean=36.5"
+                          "|hb=60|idle=1|t=1000|rx=1020")
+    assert record["age_ms"] == 250 and record["taken_ms"] == 750
+    assert (record["count"], record["temp_min"], record["temp_mean"]) == (5, 36, 36.5)
+    assert record["heartbeat_s"] == 60 and record["idle"] is True and record["rx_ms"] == 1020
+    assert parse_record('{"datetime":"20241109T123924","transmitter":{"mac":"x"}}')["datetime"]
+    for line in ("", "  ", "only|three|fields", "{not json", "[1, 2]"):
+        assert parse_record(line) is None
+
+
+def test_rotating_log(tmp_path):
+    log = RotatingLog(str(tmp_path), max_bytes=250)  # batches of ~100 bytes, 3 to a file
+    for n in range(5):
+        log.write_batch(['{"n":%d,"pad":"%s"}\n' % (n, "x" * 40)] * 2)
+    log.close()
+    files = sorted(os.listdir(str(tmp_path)))
+    assert len(files) == 2 and all(name.endswith(".jsonl") and "_PsGadgets_" in name for name in files)
+    lines = [json.loads(line) for name in files for line in open(os.path.join(str(tmp_path), name))]
+    assert [line["n"] for line in lines] == [0, 0, 1, 1, 2, 2, 3, 3, 4, 4]
+    # A new run today carries on in the first file that isn't full
+    log = RotatingLog(str(tmp_path), max_bytes=250)
+    log.write_batch(["{}\n"])
+    log.close()
+    assert sorted(os.listdir(str(tmp_path))) == files
+    assert open(os.path.join(str(tmp_path), files[1])).read().endswith("}\n{}\n")
+
+
+def ingest(tmp_path, writes, until, wait=5.0, setup=None, **kw):
+    """Run a daemon on two ptys, writes = [(port index, bytes) or (None, seconds to sleep)],
+    until(daemon, records, events) -> True to stop. Returns (daemon, names,
+    records, events, logged lines)."""
+    ptys = [os.openpty() for _ in range(2)]
+    names = [os.ttyname(slave) for _, slave in ptys]
+    log_dir = str(tmp_path / "logs")
+    kw.setdefault("flush_interval", 60)  # only the stop flushes
+    daemon = IngestDaemon(names, log_dir, opener=PosixSerial, **kw)
+    records, events = [], []
+    daemon.subscribe(records.append)
+    daemon.subscribe_events(events.append)
+    if setup is not None:
+        setup(daemon, names)
+
+    async def main():
+        task = asyncio.ensure_future(daemon.run())
+        await asyncio.sleep(0.2)  # let the readers open their ports
+        for port, data in writes:
+            if isinstance(data, bytes):
+                os.write(ptys[port][0], data)
+            else:
+                await asyncio.sleep(data)
+        deadline = time.monotonic() + wait
+        while not until(daemon, records, events) and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        daemon.stop()
+        await asyncio.wait_for(task, 10)
+
+    try:
+        asyncio.run(main())
+    finally:
+        for master, slave in ptys:
+            os.close(master)
+            os.close(slave)
+    logged = [json.loads(line) for path in sorted(os.listdir(log_dir))
+              for line in open(os.path.join(log_dir, path))]
+    return daemon, names, records, events, logged
+
+
+def test_records_from_several_ports_are_logged(tmp_path):
+    writes = [(0, RECORD * 3), (1, b"garbage\n" + RECORD[:20]), (1, RECORD[20:]),
+              (0, b"delivery 34:b7:da:59:d6:20 received=5 duplicates=1 lost=0 retransmits=2\n"),
+              (0, b'{"transmitter":{"mac":"34:b7:da:59:d6:20","message":"hi"}}\n')]
+    daemon, names, records, events, logged = ingest(
+        tmp_path, writes, lambda d, records, e: len(records) == 5 and d.stats[d.ports[0]].delivery,
+        batch_size=1000)
+    assert [r["port"] for r in records].count(names[0]) == 4
+    # Nothing is flushed before stop() with this batch size and interval,
+    # stopping flushes the batch
+    assert [(r["port"], r.get("serial")) for r in logged] == [(r["port"], r.get("serial")) for r in records]
+    assert logged[0]["temp"] == 46 and logged[0]["message"] == "rgb(12, 200, 34)"
+    assert isinstance(logged[0]["received"], float)
+    summary = daemon.summary()
+    assert summary[names[0]]["records"] == 4 and summary[names[0]]["unparsed"] == 0
+    assert summary[names[1]]["records"] == 1 and summary[names[1]]["unparsed"] == 1
+    assert summary[names[0]]["delivery"] == {
+        "34:b7:da:59:d6:20": {"received": 5, "duplicates": 1, "lost": 0, "retransmits": 2}}
+    assert summary[names[0]]["bytes"] > 3 * len(RECORD)
+    assert not events
+
+
+def test_gone_and_back_events(tmp_path):
+    hb = b"PsGadget-IO|4827e2100001|m|36.5|98||hb=1\n"
+
+    def setup(daemon, names):
+        for stats in daemon.stats.values():
+            stats.alive = Liveness(1, grace_ms=0)  # gone after one missed 1 s heartbeat
+
+    writes = [(0, hb), (1, b"gone 34:b7:da:00:00:01 silent_ms=9000\n"), (None, 1.3), (0, hb),
+              (1, b"back 34:b7:da:00:00:01 silent_ms=12000\n")]
+    daemon, names, records, events, logged = ingest(
+        tmp_path, writes, lambda d, r, events: len(events) == 4, setup=setup, liveness_interval=0.05)
+    got = sorted((e["event"], e["by"], e.get("serial") or e.get("mac")) for e in events)
+    assert got == [("back", "host", "4827e2100001"), ("back", "receiver", "34:b7:da:00:00:01"),
+                   ("gone", "host", "4827e2100001"), ("gone", "receiver", "34:b7:da:00:00:01")]
+    assert sorted(e["event"] for e in logged if "event" in e) == ["back", "back", "gone", "gone"]
+    gone = [e for e in events if e["event"] == "gone" and e["by"] == "host"][0]
+    assert gone["port"] == names[0] and gone["silent_ms"] > 1000
+    summary = daemon.summary()
+    assert summary[names[0]]["alive"] == {"devices": 1, "missing": 0, "gone": 1, "back": 1}
+    assert summary[names[1]]["reported"] == {"34:b7:da:00:00:01": "back"}
+
+
+def test_full_batches_are_written_while_running(tmp_path):
+    daemon, names, records, events, logged = ingest(
+        tmp_path, [(0, RECORD * 10)], lambda d, records, e: len(records) == 10, batch_size=4)
+    assert len(logged) == 10
@@ -0,0 +1,74 @@
+import json
+
+import psgframe
+from jsonenv import MAX_MESSAGE, JsonEnvelope, escape
+
+MACRAW = b"4\xb7\xdaY\xd6 "
+TX_MAC = b"\x34\xb7\xda\x44\x55\x66"
+MACHINE = "Generic ESP32S3 module with ESP32S3"
+
+
+def message(env, msg, compact=False):
+    doc = json.loads(bytes(env.build(TX_MAC, msg)))
+    tx = doc["x" if compact else "transmitter"]
+    assert tx["m" if compact else "mac"] == "34:b7:da:44:55:66"
+    return doc, tx["msg" if compact else "message"]
+
+
+def test_envelope_parses():
+    for compact in (False, True):
+        env = JsonEnvelope(MACRAW, MACHINE, compact)
+        env.set_temperature(46)
+        doc, text = message(env, b"PsGadget-IO|34b7da112233|x|46|99|rgb(12, 200, 34)", compact)
+        assert text == "PsGadget-IO|34b7da112233|x|46|99|rgb(12, 200, 34)"
+        accessory = doc["a" if compact else "accessory"]
+        assert accessory["r" if compact else "macraw"] == "34b7da59d620"
+        assert accessory["m" if compact else "mac"] == "34:b7:da:59:d6:20"
+        assert accessory["t" if compact else "type"] == MACHINE
+        assert accessory["c" if compact else "cputemp"] == 46
+        assert len(doc["dt" if compact else "datetime"]) == 15
+
+
+def test_control_characters_and_quotes():
+    env = JsonEnvelope(MACRAW, MACHINE)
+    nasty = b'quote " backslash \\ newline \n tab \t nul \x00 del \x7f'
+    assert message(env, nasty)[1] == nasty.decode()
+    assert bytes(env.build(TX_MAC, nasty)).count(b"\n") == 1  # the line end only
+
+
+def test_utf8_text_stays_text():
+    env = JsonEnvelope(MACRAW, MACHINE)
+    text = "temp 36.5 °C, naïve ✓ 🌡"
+    raw = bytes(env.build(TX_MAC, text.encode()))
+    assert text.encode() in raw  # copied, not escaped byte by byte
+    assert message(env, text.encode())[1] == text
+
+
+def test_binary_bytes_stay_valid_json():
+    env = JsonEnvelope(MACRAW, MACHINE)
+    # Bytes that aren't valid UTF-8 come out as U+0080..U+00FF, one per byte
+    # (overlong forms, surrogates and code points over U+10FFFF included)
+    for msg in (bytes(range(256)), b"\xff\xfe", b"\xc3", b"\xed\xa0\x80", b"\xe0\x80\x80",
+                b"\xf4\x90\x80\x80", b"\xc0\xaf"):
+        assert message(env, msg)[1].encode("latin-1") == msg
+    assert message(env, b"\xc3\xa9\xc3")[1] == "éÃ"
+    assert message(env, b"ok \xe2\x82")[1] == "ok â\u0082"
+    assert message(env, b"\xe2\x82x")[1] == "â\u0082x"
+    assert message(env, psgframe.encode_telemetry(1, b"123456", 1, 20, 50))[1].encode("latin-1") == \
+        psgframe.encode_telemetry(1, b"123456", 1, 20, 50)
+
+
+def test_rendered_lines_fit():
+    assert MAX_MESSAGE >= psgframe.LINE_MAX
+    env = JsonEnvelope(MACRAW, MACHINE)
+    line = b"|".join([b"x" * 255, b"\"" * 255, b"\xff" * 170])
+    assert len(line) <= psgframe.LINE_MAX
+    assert message(env, line)[1].encode("latin-1") == line
+    assert env.truncated == 0
+    assert len(message(env, b"y" * (MAX_MESSAGE + 10))[1]) == MAX_MESSAGE
+    assert env.truncated == 1
+
+
+def test_escape():
+    assert escape('a "b" é\n') == b'a \\"b\\" \xc3\xa9\\n'
+    assert escape(b"\xff") == b"\\u00ff"
@@ -0,0 +1,74 @@
+import ledfx
+from ledfx import OFF, LedFx, PinLed
+
+RED = (20, 0, 0)
+BLUE = (0, 0, 20)
+
+
+class Pixel:
+    def __init__(self):
+        self.pixels = [OFF]
+        self.shown = []
+
+    def __setitem__(self, index, color):
+        self.pixels[index] = color
+
+    def write(self):
+        self.shown.append(self.pixels[0])
+
+
+def start(fx):
+    return fx._effect[3]
+
+
+def test_flash_turns_off_after_its_time():
+    np = Pixel()
+    fx = LedFx(np)
+    fx.flash(RED, 500)
+    t = start(fx)
+    assert fx.step(t + 100) == 400 and np.shown == [RED]
+    assert fx.step(t + 200) == 300 and np.shown == [RED]  # unchanged colour isn't written again
+    assert fx.step(t + 500) is None and np.shown == [RED, OFF]
+    assert not fx.busy() and fx.writes == 2
+
+
+def test_pulse_and_solid():
+    np = Pixel()
+    fx = LedFx(np)
+    fx.pulse(BLUE, 1000)
+    t = start(fx)
+    assert fx.step(t) == 500 and np.shown[-1] == BLUE
+    assert fx.step(t + 600) == 400 and np.shown[-1] == OFF
+    assert fx.step(t + 1000) == 500 and np.shown[-1] == BLUE
+    fx.set(RED)
+    assert fx.step() is None and np.shown[-1] == RED
+    fx.clear()
+    assert fx.step() is None and np.shown[-1] == OFF
+
+
+def test_busy_policies():
+    fx = LedFx(Pixel())
+    fx.flash(RED)
+    fx.flash(BLUE)
+    assert fx._effect[1] == BLUE and fx.coalesced == 1
+    fx = LedFx(Pixel(), policy=ledfx.DROP)
+    fx.flash(RED)
+    fx.flash(BLUE)
+    assert fx._effect[1] == RED and fx.dropped == 1 and fx.requests == 2
+
+
+def test_pin_led():
+    class Pin:
+        level = None
+
+        def value(self, v):
+            self.level = v
+
+    pin = Pin()
+    fx = LedFx(PinLed(pin))
+    fx.set(RED)
+    fx.step()
+    assert pin.level == 1
+    fx.clear()
+    fx.step()
+    assert pin.level == 0
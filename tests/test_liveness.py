@@ -0,0 +1,31 @@
+from liveness import Liveness
+
+A = b"\x34\xb7\xda\x11\x22\x33"
+B = b"\x34\xb7\xda\x11\x22\x34"
+
+
+def test_gone_after_missed_heartbeats_and_back():
+    alive = Liveness(misses=3, grace_ms=2000)
+    assert alive.heard(A, 10000, now=0) is None
+    assert alive.heard(B, None, now=0) is None  # no heartbeat: not tracked
+    assert alive.state(B) is None and len(alive) == 1
+    assert alive.expired(now=32000) == []
+    assert alive.expired(now=32001) == [(A, 32001)]
+    assert alive.expired(now=40000) == []  # reported once
+    assert alive.state(A) == "gone"
+    assert alive.heard(A, None, now=45000) == 45000
+    assert alive.heard(A, None, now=46000) is None
+    assert alive.states() == {A: "alive"}
+    assert alive.stats() == {"devices": 1, "missing": 0, "gone": 1, "back": 1}
+
+
+def test_heartbeat_changes_and_defaults():
+    alive = Liveness(misses=2, grace_ms=0, default_ms=1000, max_devices=1)
+    alive.heard(A, None, now=0)  # tracked with the default
+    alive.heard(B, 5000, now=0)  # table full
+    assert alive.states() == {A: "alive"}
+    alive.heard(A, 10000, now=1000)  # promised a longer heartbeat
+    assert alive.expired(now=15000) == []
+    assert alive.expired(now=21001) == [(A, 20001)]
+    alive.forget(A)
+    assert len(alive) == 0 and alive.stats()["missing"] == 0
@@ -0,0 +1,39 @@
+import machine
+from lowpower import LAYOUT_SIZE, BootTimer, RtcPairing
+
+RECEIVER = b"\x34\xb7\xda\x59\xd6\x20"
+
+
+def test_pairing_survives_in_rtc_memory():
+    machine.power_on()
+    pairing = RtcPairing(machine.RTC())
+    assert pairing.load() is None
+    pairing.save(bytearray(RECEIVER), 6, seq=0x1FFFF, misses=300)
+    # A new object after a wake reads the same memory
+    assert RtcPairing(machine.RTC()).load() == (RECEIVER, 6, 0xFFFF, 255)
+    pairing.clear()
+    assert pairing.load() is None
+
+
+def test_stale_or_foreign_rtc_memory_is_ignored():
+    rtc = machine.RTC()
+    pairing = RtcPairing(rtc)
+    pairing.save(RECEIVER, 1)
+    data = bytearray(rtc.memory())
+    rtc.memory(data[:LAYOUT_SIZE - 1])
+    assert pairing.load() is None
+    data[4] += 1  # another layout version
+    rtc.memory(data)
+    assert pairing.load() is None
+    rtc.memory(b"XXXX" + bytes(data[4:]))
+    assert pairing.load() is None
+    machine.power_on()
+    assert pairing.load() is None
+
+
+def test_boot_timer():
+    timer = BootTimer(start=100)
+    assert timer.mark("wifi", now=130) == 30
+    assert timer.mark("sent", now=175) == 75
+    assert timer.get("sent") == 75 and timer.get("acked") is None
+    assert timer.report() == "wifi 30ms, sent 75ms"
@@ -0,0 +1,81 @@
+from metrics import NULL, Registry
+from psgadget_stats import Histogram, StatsPoller, parse_stats, sparkline
+
+
+def test_dump_and_parse_round_trip():
+    metrics = Registry()
+    frames = metrics.counter("rx.frames")
+    metrics.gauge("heap.free", lambda: 48112)
+    depth = metrics.gauge("uart.depth")
+    latency = metrics.histogram("uart.latency_ms", (5, 20, 100, 500))
+    frames.inc()
+    frames.inc(2)
+    depth.set(7)
+    for value in (3, 5, 12, 800):
+        latency.observe(value)
+    line = metrics.dump(now=81234)
+    assert line == ("stats t=81234 rx.frames=3 heap.free=48112 uart.depth=7 "
+                    "uart.latency_ms=5,20,100,500:2/1/0/0/1:820")
+    stats = parse_stats(line)
+    assert stats["t"] == 81234 and stats["rx.frames"] == 3
+    hist = stats["uart.latency_ms"]
+    assert (hist.bounds, hist.counts, hist.sum, hist.count) == ([5, 20, 100, 500], [2, 1, 0, 0, 1], 820, 4)
+    metrics.reset()
+    assert metrics.dump(now=1) == "stats t=1 rx.frames=0 heap.free=48112 uart.depth=7 " \
+                                  "uart.latency_ms=5,20,100,500:0/0/0/0/0:0"
+
+
+def test_failing_gauge_is_left_out():
+    metrics = Registry()
+    metrics.gauge("broken", lambda: 1 // 0)
+    metrics.counter("ok").inc()
+    assert metrics.dump(now=5) == "stats t=5 ok=1"
+
+
+def test_disabled_registry_hands_out_the_no_op():
+    metrics = Registry(enabled=False)
+    histogram = metrics.histogram("x")
+    assert histogram is NULL and metrics.counter("y") is NULL and not histogram
+    histogram.observe(5)
+    metrics.counter("y").inc()
+    assert metrics.dump(now=0) == "stats t=0"
+
+
+def test_parse_rejects_other_lines():
+    assert parse_stats("") is None
+    assert parse_stats("stats reset ok") is None
+    assert parse_stats("delivery 00:11 received=1") is None
+
+
+def test_percentiles_and_deltas():
+    before = Histogram([1, 10, 100], [5, 0, 0, 0], 5)
+    after = Histogram([1, 10, 100], [5, 8, 1, 1], 1200)
+    recent = after.minus(before)
+    assert recent.counts == [0, 8, 1, 1] and recent.sum == 1195
+    assert (recent.percentile(0.5), recent.percentile(0.9), recent.percentile(0.99)) == (10, 100, float("inf"))
+    assert after.minus(Histogram([1, 2], [0, 0, 0], 0)) is after  # bounds changed: all of it
+    assert Histogram([1], [0, 0], 0).percentile(0.5) is None
+
+
+class FakeLink:
+    def __init__(self, replies):
+        self.replies = replies
+
+    def command(self, command, prefix, timeout):
+        assert command == "stats" and prefix == "stats t="
+        return self.replies.pop(0)
+
+
+def test_poller_rates():
+    poller = StatsPoller(FakeLink(["stats t=1000 rx.frames=10 heap.free=500 lat=5,50:1/0/0:3",
+                                   None,
+                                   "stats t=3000 rx.frames=30 heap.free=400 lat=5,50:1/2/1:200"]))
+    rows = poller.poll()
+    assert rows["rx.frames"] == ("10", 10) and rows["lat"][0] == "n=1 p50<=5 p99<=5"
+    assert poller.poll() is None
+    rows = poller.poll()
+    assert rows["rx.frames"] == ("30 (10.0/s)", 10.0)
+    assert rows["heap.free"] == ("400", 400)  # went down: shown as is
+    assert rows["lat"] == ("n=3 p50<=50 p99<=inf", None)
+    assert poller.history["rx.frames"] == [10, 10.0]
+    assert sparkline([0, 5, 10, None]) == " ▄█"
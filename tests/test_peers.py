@@ -0,0 +1,68 @@
+import espnow
+import pytest
+from peers import BROADCAST_MAC, PeerTable
+
+
+def mac(n):
+    return bytes((0x24, 0x0a, 0xc4, 0, 0, n))
+
+
+@pytest.fixture
+def esp(monkeypatch):
+    monkeypatch.setattr(espnow, "sent", [])
+    monkeypatch.setattr(espnow, "on_send", None)
+    monkeypatch.setattr(espnow, "ack", True)
+    return espnow.ESPNow()
+
+
+def driver_peers(esp):
+    return [peer[0] for peer in esp.get_peers()]
+
+
+def test_least_recently_used_is_evicted(esp):
+    peers = PeerTable(esp, 4)  # the pinned broadcast address takes one slot
+    for n in (1, 2, 3):
+        assert peers.send(mac(n), b"x")
+    peers.send(mac(1), b"x")  # 2 is now least recently used
+    peers.send(mac(4), b"x")
+    assert mac(2) not in peers and mac(1) in peers and BROADCAST_MAC in peers
+    assert sorted(driver_peers(esp)) == sorted([BROADCAST_MAC, mac(1), mac(3), mac(4)])
+    stats = peers.stats()
+    assert (stats["peers"], stats["hits"], stats["misses"], stats["evictions"]) == (3, 1, 4, 1)
+
+
+def test_pinned_peer_is_never_evicted(esp):
+    peers = PeerTable(esp, 2)
+    for n in range(1, 6):
+        peers.send(mac(n), b"x")
+        peers.send(BROADCAST_MAC, b"x")
+    assert driver_peers(esp) == [BROADCAST_MAC, mac(5)]
+    assert len(peers) == 1
+
+
+def test_lost_peer_is_added_again(esp):
+    peers = PeerTable(esp)
+    peers.send(mac(1), b"x")
+    esp.del_peer(mac(1))
+    assert peers.send(mac(1), b"y", False)
+    assert peers.stats()["readds"] == 1 and mac(1) in driver_peers(esp)
+    assert [msg for _, _, msg in espnow.sent] == [b"x", b"y"]
+
+
+def test_driver_full_of_foreign_peers(esp, monkeypatch):
+    monkeypatch.setattr(espnow, "MAX_PEERS", 3)
+    peers = PeerTable(esp, 20)
+    peers.send(mac(1), b"x")
+    esp.add_peer(mac(9))  # added behind the table's back
+    peers.send(mac(2), b"x")
+    assert mac(1) not in peers and mac(2) in peers
+    assert peers.stats()["evictions"] == 1
+
+
+def test_remove(esp):
+    peers = PeerTable(esp)
+    peers.send(mac(1), b"x")
+    peers.remove(mac(1))
+    peers.remove(mac(1))
+    peers.remove(BROADCAST_MAC)  # pinned, stays
+    assert driver_peers(esp) == [BROADCAST_MAC]
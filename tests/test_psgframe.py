@@ -0,0 +1,90 @@
+import psgframe
+from rxpipe import MacCache
+
+SERIAL = b"\x34\xb7\xda\x11\x22\x33"
+MACHINE = "Generic ESP32S3 module with ESP32S3"
+GADGET = psgframe.gadget_code("PsGadget-IO")
+
+
+def telemetry(seq=7, text="hello", machine=MACHINE, **kw):
+    ext = [(psgframe.T_MACHINE, machine), (psgframe.T_TEXT, text)]
+    return psgframe.encode_telemetry(seq, SERIAL, GADGET, 36.61, 99, (12, 200, 34), ext, **kw)
+
+
+def test_telemetry_round_trip():
+    record = psgframe.decode(telemetry())
+    assert record["gadget"] == "PsGadget-IO"
+    assert record["serial"] == "34b7da112233"
+    assert record["machine"] == MACHINE
+    assert (record["temp"], record["battery"], record["rgb"]) == (36.61, 99, (12, 200, 34))
+    assert (record["message"], record["seq"]) == ("hello", 7)
+    assert not record["legacy"]
+
+
+def test_negative_and_whole_temperatures():
+    for temp in (-4.25, 0, 20, -0.5, 327.67):
+        frame = psgframe.encode_telemetry(1, SERIAL, GADGET, temp, 50)
+        assert psgframe.decode(frame)["temp"] == temp
+
+
+def test_legacy_text():
+    record = psgframe.decode(b"PsGadget-IO|34b7da112233|" + MACHINE.encode() + b"|46|99|rgb(1, 2, 3)")
+    assert record["legacy"] and record["rgb"] == (1, 2, 3) and record["machine"] == MACHINE
+    assert psgframe.decode(b"too|few|fields") is None
+
+
+def test_truncated_frames():
+    frame = telemetry()
+    for n in range(len(frame)):
+        for record in psgframe.decode_records(frame[:n]):
+            assert record["serial"] == "34b7da112233"
+    # A TLV cut short is ignored, the rest of the frame still decodes
+    record = psgframe.decode(telemetry()[:-3])
+    assert record["temp"] == 36.61 and record["message"] == "rgb(12, 200, 34)"
+
+
+def test_malformed_frames():
+    frame = bytearray(telemetry())
+    frame[1] = psgframe.VERSION + 1
+    assert not psgframe.is_binary(frame)
+    assert psgframe.decode(frame) is None
+    assert psgframe.decode_records(b"") == []
+    assert psgframe.decode_records(b"\xa7\x01") == []
+    for msgtype in range(256):
+        psgframe.decode_records(psgframe.encode_header(msgtype, 1) + bytes(20))
+
+
+def test_bad_utf8_text():
+    frame = psgframe.encode_telemetry(1, SERIAL, GADGET, 20, 50, (1, 2, 3),
+                                      [(psgframe.T_TEXT, b"\xff\xfe"), (psgframe.T_MACHINE, b"\xc3")])
+    record = psgframe.decode(frame)
+    assert record["message"] == "rgb(1, 2, 3)" and record["machine"] is None
+
+
+def test_tlv_cut_on_character_boundary():
+    tlv = psgframe.encode_tlv(psgframe.T_TEXT, "é" * 200)  # 2 bytes each, 255 is half of one
+    assert tlv[1] == 254 and len(tlv) == 2 + 254
+    assert tlv[2:].decode("utf-8") == "é" * 127
+
+
+def test_to_text_keeps_one_line():
+    record = psgframe.decode(telemetry(text="a|b\nc\rd", machine="x|y"))
+    assert psgframe.to_text(record) == b"PsGadget-IO|34b7da112233|x y|36.61|99|a b c d"
+
+
+def test_line_renderer_matches_to_text():
+    lines = psgframe.LineRenderer(MacCache())
+    for frame in (telemetry(), telemetry(text="a|b\nc"), telemetry(text="", machine="")):
+        records = psgframe.decode_records(frame)
+        assert lines.count(frame) == len(records) == 1
+        assert bytes(lines.render(frame)) == psgframe.to_text(records[0], MACHINE)
+
+
+def test_line_renderer_machine_cache():
+    lines = psgframe.LineRenderer(MacCache())
+    bare = psgframe.encode_telemetry(2, SERIAL, GADGET, 20, 50)
+    assert bytes(lines.render(bare)).split(b"|")[2] == b""
+    for machine in ("ESP32 one", "ESP32 two", "ESP32 three!"):  # same length, then longer
+        assert bytes(lines.render(telemetry(machine=machine))).split(b"|")[2] == machine.encode()
+        assert bytes(lines.render(bare)).split(b"|")[2] == machine.encode()
+    assert len(lines.machines) == 1
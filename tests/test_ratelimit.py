@@ -0,0 +1,45 @@
+from ratelimit import RateLimiter, TokenBucket
+
+A = b"\x34\xb7\xda\x11\x22\x33"
+B = b"\x34\xb7\xda\x11\x22\x34"
+
+
+def test_token_bucket():
+    bucket = TokenBucket(100, 10, now=0)  # 100 units/s, bursts of 10
+    assert bucket.take(10, now=0)
+    assert not bucket.take(1, now=0)
+    assert bucket.available(now=50) == 5
+    assert bucket.available(now=10000) == 10  # capped at burst
+    bucket.consume(15)
+    assert bucket.available(now=10000) == -5 and not bucket.take(1, now=10000)
+    assert bucket.available(now=10100) == 5  # the debt is paid back first
+
+
+def test_burst_then_rate():
+    limiter = RateLimiter(rate=10, burst=3)
+    assert [limiter.allow(A, now=0) for _ in range(4)] == [True, True, True, False]
+    assert not limiter.allow(A, now=99)
+    assert limiter.allow(A, now=100)  # one token every 100 ms
+    assert limiter.allow(B, now=100)  # other sources have their own bucket
+    assert limiter.stats(A) == {"accepted": 4, "shed": 2}
+    assert limiter.stats() == {"sources": 2, "accepted": 5, "shed": 2, "forgotten": 0}
+
+
+def test_shed_later_and_report():
+    limiter = RateLimiter()
+    limiter.allow(memoryview(A), now=0)
+    limiter.shed(A)
+    limiter.shed(B)  # not heard, only the total counts
+    assert limiter.report() == ["limit 34:b7:da:11:22:33 accepted=1 shed=1"]
+    assert limiter.stats()["shed"] == 2 and limiter.stats(B) is None
+
+
+def test_quietest_source_is_forgotten():
+    limiter = RateLimiter(rate=1, burst=1, max_sources=2)
+    limiter.allow(A, now=0)
+    limiter.allow(B, now=0)
+    limiter.allow(A, now=0)
+    limiter.allow(b"\x00" * 6, now=0)
+    assert len(limiter) == 2 and limiter.stats(B) is None
+    assert limiter.stats()["forgotten"] == 1
+    assert limiter.allow(B, now=0)  # comes back with a full bucket
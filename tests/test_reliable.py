@@ -0,0 +1,104 @@
+import espnow
+import psgframe
+import pytest
+from reliable import MASK, ReliableReceiver, ReliableSender
+
+TX = b"\x34\xb7\xda\x11\x22\x33"
+RX = b"\x24\x0a\xc4\x00\x00\x06"
+GADGET = psgframe.gadget_code("PsGadget-IO")
+
+
+def frame(seq, flags=0):
+    return psgframe.with_flags(psgframe.encode_telemetry(seq, TX, GADGET, 20, 50), flags)
+
+
+@pytest.fixture
+def esp(monkeypatch):
+    monkeypatch.setattr(espnow, "sent", [])
+    monkeypatch.setattr(espnow, "on_send", None)
+    monkeypatch.setattr(espnow, "ack", True)
+    esp = espnow.ESPNow()
+    esp.add_peer(RX)
+    return esp
+
+
+def test_duplicates_are_dropped_and_acked_without_waiting():
+    acks = []
+    receiver = ReliableReceiver(lambda mac, msg, sync: acks.append((mac, msg, sync)))
+    assert receiver.accept(TX, frame(10, psgframe.F_ACKREQ))
+    assert not receiver.accept(TX, frame(10, psgframe.F_ACKREQ | psgframe.F_RETX))
+    assert receiver.accept(TX, frame(11))
+    assert [(mac, sync) for mac, _, sync in acks] == [(TX, False), (TX, False)]
+    assert psgframe.decode_ack(acks[-1][1]) == (10, MASK)
+    assert receiver.stats(TX) == {"received": 2, "duplicates": 1, "lost": 0, "retransmits": 0}
+    assert receiver.accept(TX, b"PsGadget-IO|34b7da112233|x|20|50|hi")  # legacy text
+
+
+def test_gaps_late_frames_and_restarts():
+    receiver = ReliableReceiver()
+    for seq in (100, 101, 104):
+        assert receiver.accept(TX, frame(seq))
+    assert receiver.accept(TX, frame(102))  # late, still in the window
+    assert not receiver.accept(TX, frame(102))
+    assert receiver.accept(TX, frame(104 + 31))  # 103 leaves the window unseen
+    assert receiver.stats(TX)["lost"] == 1
+    # Restarted: the 30 unseen in the old window are lost, not the whole jump
+    assert receiver.accept(TX, frame(5000))
+    assert receiver.stats(TX)["lost"] == 1 + 30
+    assert receiver.accept(TX, frame(7))  # far behind, restarted again
+    assert receiver.accept(TX, frame(8))
+    assert receiver.stats(TX)["lost"] == 31
+
+
+def test_sequence_numbers_wrap():
+    receiver = ReliableReceiver()
+    for seq in (0xFFFE, 0xFFFF, 0, 1):
+        assert receiver.accept(TX, frame(seq))
+    assert not receiver.accept(TX, frame(0xFFFF))
+    assert receiver.stats(TX)["lost"] == 0
+
+
+def test_quietest_source_is_dropped():
+    receiver = ReliableReceiver(max_sources=2)
+    macs = [bytes((0, 0, 0, 0, 0, n)) for n in range(3)]
+    receiver.accept(macs[0], frame(1))
+    receiver.accept(macs[1], frame(1))
+    receiver.accept(macs[0], frame(2))
+    receiver.accept(macs[2], frame(1))
+    assert receiver.stats(macs[1]) is None and receiver.stats(macs[0])["received"] == 2
+    assert receiver.report() == [
+        "delivery 00:00:00:00:00:00 received=2 duplicates=0 lost=0 retransmits=0",
+        "delivery 00:00:00:00:00:02 received=1 duplicates=0 lost=0 retransmits=0",
+    ]
+    assert receiver.report() == []
+
+
+def test_sender_retransmits_until_acked(esp):
+    sender = ReliableSender(esp, window=4, timeout_ms=100, retries=2)
+    sender.send(RX, 1, frame(1), now=0)
+    sender.send(RX, 2, frame(2), now=10)
+    assert all(msg[3] & psgframe.F_ACKREQ for _, _, msg in espnow.sent)
+    sender.poll(now=105)  # only frame 1 timed out
+    assert len(espnow.sent) == 3 and espnow.sent[-1][2][3] & psgframe.F_RETX
+    esp.deliver(RX, psgframe.encode_ack(1, 1))
+    sender.poll(now=120)  # 2 resent, 1 acked
+    assert len(sender) == 1
+    sender.poll(now=220)
+    sender.poll(now=330)  # out of retries
+    assert sender.stats() == {"sent": 2, "acked": 1, "retransmits": 3, "lost": 1,
+                              "window_full": 0, "in_flight": 0}
+
+
+def test_sender_window_and_rewrite(esp):
+    frames = []
+    sender = ReliableSender(esp, window=2, on_frame=lambda mac, msg: frames.append(msg))
+    for seq in (1, 2, 3):
+        sender.push(RX, seq, frame(seq), now=0)
+    sender.push(RX, 3, frame(3), now=0)  # same seq replaces, no drop
+    assert sender.stats()["window_full"] == 1 and sender.stats()["lost"] == 1
+    sender.rewrite(lambda msg: frame(msg[4]) if msg[4] == 3 else msg)
+    assert [entry[1][3] for entry in sender._frames.values()] == [psgframe.F_ACKREQ] * 2
+    esp.deliver(RX, b"not an ack")
+    esp.deliver(RX, psgframe.encode_ack(3, 0b11))
+    sender.poll(now=1)
+    assert frames == [b"not an ack"] and len(sender) == 0
@@ -0,0 +1,87 @@
+import asyncio
+
+from espnow import ESPNow
+from rxpipe import MacCache, RxPipeline, RxRing
+
+MAC = b"\x34\xb7\xda\x00\x00\x01"
+
+
+def test_ring_copies_frames_and_drops_when_full():
+    ring = RxRing(slots=2, size=8)
+    frame = bytearray(b"abc")
+    assert ring.push(MAC, frame, 5)
+    frame[0] = ord("x")  # the slot holds a copy
+    assert ring.push(bytearray(MAC), b"0123456789")  # cut to the slot size
+    assert not ring.push(MAC, b"full")
+    assert (len(ring), ring.dropped, ring.high_water) == (2, 1, 2)
+    i = ring.peek()
+    assert bytes(ring.bufs[i][:ring.lens[i]]) == b"abc" and ring.times[i] == 5
+    ring.pop()
+    i = ring.peek()
+    assert bytes(ring.bufs[i][:ring.lens[i]]) == b"01234567" and type(ring.macs[i]) is bytes
+    ring.pop()
+    assert ring.push(MAC, b"again") and len(ring) == 1
+
+
+def run_pipeline(frames, **kw):
+    esp = ESPNow()
+    got = []
+    batches = []
+
+    def handler(mac, msg):
+        if msg == b"boom":
+            raise ValueError("bad frame")
+        got.append((mac, bytes(msg)))
+
+    async def main():
+        pipeline = RxPipeline(esp, handler, slots=4, batch=2, on_batch=lambda: batches.append(len(got)), **kw)
+        task = asyncio.ensure_future(pipeline.start())
+        for mac, msg in frames:
+            esp._queue.append((mac, msg))
+            pipeline.irq(esp)
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(0.01)
+        task.cancel()
+        return pipeline
+
+    return asyncio.run(main()), got, batches
+
+
+def test_pipeline_hands_frames_to_the_handler():
+    other = b"\x34\xb7\xda\x00\x00\x02"
+    frames = [(MAC, b"one"), (other, b"two"), (MAC, b"boom"), (bytearray(MAC), b"three")]
+    pipeline, got, batches = run_pipeline(frames)
+    assert [msg for _, msg in got] == [b"one", b"two", b"three"]
+    assert got[0][0] is got[2][0]  # interned, the same object for every frame
+    assert pipeline.stats()["received"] == 4 and pipeline.handler_errors == 1
+    assert batches
+
+
+def test_pipeline_sheds_frames_admit_refuses():
+    frames = [(MAC, b"one"), (b"\x00" * 6, b"two")]
+    pipeline, got, _ = run_pipeline(frames, admit=lambda mac: mac == MAC)
+    assert [msg for _, msg in got] == [b"one"] and pipeline.shed == 1
+
+
+def test_mac_cache_interns_and_formats():
+    macs = MacCache(4)
+    frame = b"xx" + MAC
+    assert macs.intern(frame, 2) is macs.intern(bytearray(MAC))
+    assert macs.hex(MAC) == b"34b7da000001" and macs.name(memoryview(MAC)) == b"34:b7:da:00:00:01"
+    assert (len(macs), macs.misses) == (1, 1)
+
+
+def test_mac_cache_keeps_colliding_macs():
+    macs = MacCache(4)
+    other = b"\x24\x0a\xc4\x00\x00\x01"  # same last three bytes
+    first = macs.intern(MAC)
+    second = macs.intern(other)
+    for _ in range(3):  # no thrashing between the two
+        assert macs.intern(MAC) is first and macs.intern(other) is second
+    assert (len(macs), macs.misses, macs.collisions, macs.evictions) == (2, 2, 1, 0)
+    for n in range(2, 5):
+        macs.intern(bytes((0, 0, 0, 0, 0, n)))
+    # Full: the oldest key goes with its chain
+    assert (len(macs), macs.evictions) == (3, 2)
+    macs.intern(MAC)
+    assert macs.misses == 6
@@ -0,0 +1,68 @@
+import pytest
+
+import psgframe
+from rxpipe import MacCache
+from sampler import SampleBuffer
+
+SERIAL = b"\x34\xb7\xda\x11\x22\x33"
+
+
+def test_batch_frame_round_trip():
+    samples = [(0, 36.5, 99, (1, 2, 3)), (1000, -4.25, 98, (4, 5, 6)), (70000, 20, 97, None)]
+    ext = [(psgframe.T_MACHINE, "ESP32"), (psgframe.T_TEXT, "hi")]
+    frame = psgframe.encode_batch(8, SERIAL, 1, samples, ext, rgb=True)
+    records = psgframe.decode_records(frame)
+    assert [(r["temp"], r["battery"], r["rgb"], r["age_ms"]) for r in records] == [
+        (36.5, 99, (1, 2, 3), 0), (-4.25, 98, (4, 5, 6), 1000), (20, 97, (0, 0, 0), psgframe.MAX_AGE_MS)]
+    assert all(r["machine"] == "ESP32" and r["message"] == "hi" and r["seq"] == 8 for r in records)
+    # decode() alone doesn't take batches
+    assert psgframe.decode(frame) is None
+
+
+def test_truncated_and_oversized_batches():
+    frame = psgframe.encode_batch(1, SERIAL, 1, [(0, 20, 50, None)] * 3)
+    for n in range(len(frame)):
+        assert psgframe.decode_records(frame[:n]) == []
+    bad = bytearray(frame)
+    bad[psgframe.HEADER_SIZE + 7] = 200  # more samples than the frame holds
+    assert psgframe.decode_records(bad) == []
+    fits = psgframe.batch_capacity()
+    assert len(psgframe.encode_batch(1, SERIAL, 1, [(0, 20, 50, None)] * fits)) <= psgframe.MAX_FRAME
+    with pytest.raises(ValueError):
+        psgframe.encode_batch(1, SERIAL, 1, [(0, 20, 50, None)] * (fits + 1))
+
+
+def test_line_renderer_batch_lines():
+    frame = psgframe.encode_batch(3, SERIAL, 1, [(0, 36.5, 99, (1, 2, 3)), (500, 36.25, 99, (4, 5, 6))],
+                                  [(psgframe.T_MACHINE, "ESP32")], rgb=True)
+    lines = psgframe.LineRenderer(MacCache())
+    records = psgframe.decode_records(frame)
+    assert lines.count(frame) == 2
+    for i, record in enumerate(records):
+        assert bytes(lines.render(frame, i)) == psgframe.to_text(record)
+    assert psgframe.to_text(records[1]).endswith(b"|rgb(4, 5, 6)|500")
+
+
+def test_sample_buffer_due_when_full_or_old():
+    buf = SampleBuffer(capacity=3, max_age_ms=1000)
+    assert not buf.add(20, 50, now=0) and not buf.due(500)
+    assert buf.due(1000)
+    assert not buf.add(21, 50, now=100)
+    assert buf.add(22, 50, now=200)  # full
+    assert buf.add(23, 50, now=300) and len(buf) == 3  # not taken, the older ones are kept
+    frame = buf.encode(5, SERIAL, 1, now=1200)
+    assert len(buf) == 0 and buf.frames == 1 and buf.samples == 3
+    records = psgframe.decode_records(frame)
+    assert [(r["temp"], r["age_ms"], r["rgb"]) for r in records] == [(20, 1200, None), (21, 1100, None),
+                                                                       (22, 1000, None)]
+
+
+def test_sample_buffer_capacity_leaves_room_for_tlvs():
+    ext = [(psgframe.T_MACHINE, "x" * 40)]
+    buf = SampleBuffer(capacity=1000, ext_len=42)
+    assert buf.capacity == psgframe.batch_capacity(42)
+    for n in range(buf.capacity):
+        buf.add(20, 50, (1, 2, 3), now=n)
+    frame = buf.encode(1, SERIAL, 1, ext, now=buf.capacity)
+    assert len(frame) <= psgframe.MAX_FRAME
+    assert all(r["rgb"] == (1, 2, 3) for r in psgframe.decode_records(frame))
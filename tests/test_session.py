@@ -0,0 +1,111 @@
+import psgframe
+from session import SessionClient, SessionTable
+
+TX = b"\x24\x0a\xc4\x00\x00\x01"
+RX = b"\x24\x0a\xc4\x00\x00\x06"
+SERIAL = b"\x34\xb7\xda\x11\x22\x33"
+GADGET = psgframe.gadget_code("PsGadget-IO")
+MACHINE = "Generic ESP32S3 module with ESP32S3"
+
+
+def telemetry(seq, text="hi"):
+    return psgframe.encode_telemetry(seq, SERIAL, GADGET, 20.5, 80, (1, 2, 3), [(psgframe.T_TEXT, text)])
+
+
+class Radio:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, mac, frame, sync=True):
+        self.sent.append((mac, bytes(frame)))
+        return True
+
+
+def answers(radio):
+    return [psgframe.decode_session(frame) for _, frame in radio.sent]
+
+
+def test_frames_round_trip():
+    frame = telemetry(3)
+    compact = psgframe.to_session(frame, 9)
+    assert compact[2] == psgframe.MT_STELEMETRY and len(compact) == len(frame) - 6
+    assert bytes(psgframe.from_session(compact, SERIAL, GADGET)) == frame
+    register = psgframe.encode_register(4, SERIAL, GADGET, MACHINE)
+    assert psgframe.decode_register(register) == (4, SERIAL, GADGET, psgframe.encode_tlv(psgframe.T_MACHINE, MACHINE))
+    assert psgframe.decode_register(psgframe.encode_register(5, SERIAL, GADGET))[3] == b""
+    assert psgframe.decode_session(psgframe.encode_session(4, 9, psgframe.S_FULL)) == (4, 9, psgframe.S_FULL)
+
+
+def test_register_and_rehydrate():
+    radio = Radio()
+    table = SessionTable(radio.send)
+    assert not table.handle(TX, telemetry(1))
+    assert table.handle(TX, psgframe.encode_register(7, SERIAL, GADGET, MACHINE), now=0)
+    assert answers(radio) == [(7, 1, psgframe.S_GRANTED)]
+    full = table.rehydrate(TX, psgframe.to_session(telemetry(8), 1), now=0)
+    record = psgframe.decode(full)
+    assert (record["serial"], record["machine"], record["message"], record["seq"]) == \
+        ("34b7da112233", MACHINE, "hi", 8)
+    legacy = b"PsGadget-IO|34b7da112233|x|20|80|hi"
+    assert table.rehydrate(TX, legacy) is legacy
+    # Someone else's id, or an id that was never given out
+    assert table.rehydrate(RX, psgframe.to_session(telemetry(9), 1)) is None
+    assert table.rehydrate(TX, psgframe.to_session(telemetry(10), 2)) is None
+    assert answers(radio)[1:] == [(9, 1, psgframe.S_UNKNOWN), (10, 2, psgframe.S_UNKNOWN)]
+    assert table.stats()["unknown"] == 2 and table.stats()["rehydrated"] == 1
+
+
+def test_full_table_and_idle_eviction():
+    radio = Radio()
+    table = SessionTable(radio.send, slots=1, idle_ms=1000)
+    table.handle(TX, psgframe.encode_register(1, SERIAL, GADGET), now=0)
+    table.handle(RX, psgframe.encode_register(1, SERIAL, GADGET), now=500)
+    table.handle(TX, psgframe.encode_register(2, SERIAL, GADGET), now=600)  # again: same id
+    table.handle(RX, psgframe.encode_register(2, SERIAL, GADGET), now=1600)
+    assert answers(radio) == [(1, 1, psgframe.S_GRANTED), (1, 0, psgframe.S_FULL),
+                              (2, 1, psgframe.S_GRANTED), (2, 1, psgframe.S_GRANTED)]
+    assert table.stats()["evictions"] == 1 and len(table) == 1
+
+
+def client(**kw):
+    radio = Radio()
+    session = SessionClient(radio, SERIAL, GADGET, MACHINE, **kw)
+    session.reset(RX)
+    session.poll(now=0)
+    seq = psgframe.decode_register(radio.sent[-1][1])[0]
+    assert session.handle(RX, psgframe.encode_session(seq, 5))
+    return session, radio
+
+
+def test_client_registers_and_compacts():
+    radio = Radio()
+    session = SessionClient(radio, SERIAL, GADGET, MACHINE, retry_ms=100)
+    session.poll(now=0)
+    assert radio.sent == []  # no receiver yet
+    session.reset(RX)
+    session.poll(now=0)
+    session.poll(now=50)
+    session.poll(now=100)
+    assert len(radio.sent) == 2
+    assert session.compact(telemetry(1)) == telemetry(1)
+    assert not session.handle(TX, psgframe.encode_session(2, 5))  # not our receiver
+    session.handle(RX, psgframe.encode_session(1, 5))  # answer to the first try, too late
+    assert session.sid is None
+    session.handle(RX, psgframe.encode_session(2, 5))
+    assert session.sid == 5 and session.compact(telemetry(3))[psgframe.HEADER_SIZE] == 5
+
+
+def test_rejected_frames_are_resent_in_full():
+    session, radio = client(history=2)
+    frames = [telemetry(seq) for seq in (10, 11, 12)]
+    for frame in frames:
+        session.compact(frame)
+    del radio.sent[:]
+    session.handle(RX, psgframe.encode_session(11, 5, psgframe.S_UNKNOWN))
+    session.handle(RX, psgframe.encode_session(12, 5, psgframe.S_UNKNOWN))
+    session.handle(RX, psgframe.encode_session(10, 5, psgframe.S_UNKNOWN))  # out of the history
+    resent = [frame for _, frame in radio.sent if psgframe.is_binary(frame) and frame[2] == psgframe.MT_TELEMETRY]
+    assert resent == [bytes(psgframe.with_flags(frames[i], psgframe.F_RETX)) for i in (1, 2)]
+    assert session.sid is None and session.registers == 2  # registers again, once
+    assert session.stats() == {"sid": None, "registers": 2, "grants": 1, "rejects": 3,
+                               "resent": 2, "unrecoverable": 1}
@@ -0,0 +1,79 @@
+import json
+import math
+import os
+
+from psgadget_store import ColumnStore, parse_time, read_log, record_time
+
+SERIAL = "34b7da112233"
+T0 = 1700000000000
+
+
+def records(n, start=T0, step=1000, serial=SERIAL):
+    return [{"serial": serial, "gadget": "PsGadget-IO", "temp": 20 + i % 10, "battery": 80,
+             "sent_ms": start + i * step} for i in range(n)]
+
+
+def test_write_scan_and_reopen(tmp_path):
+    store = ColumnStore(str(tmp_path), segment_rows=4)
+    store.extend(records(10))
+    store.append({"serial": SERIAL, "temp": 99.0, "count": 3, "sent_ms": T0 + 10000})
+    assert not store.append({"serial": "../etc", "temp": 1})
+    store.flush()
+    assert store.stats() == {"devices": 1, "rows": 11, "segments": 3, "records": 11,
+                             "skipped": 1, "flushes": 1}
+    rows = list(store.scan(SERIAL, T0 + 2000, T0 + 6000, ("temp", "count")))
+    assert [(t - T0, temp) for t, temp, _ in rows] == [(2000, 22), (3000, 23), (4000, 24), (5000, 25)]
+    assert all(math.isnan(count) for _, _, count in rows)
+    store.close()
+    again = ColumnStore(str(tmp_path))
+    assert again.devices() == {SERIAL: {"gadget": "PsGadget-IO", "rows": 11, "t_min": T0, "t_max": T0 + 10000}}
+    columns = again.columns(SERIAL, T0 + 9000, None, ("temp", "count"))
+    assert list(columns["t"]) == [T0 + 9000, T0 + 10000]
+    assert list(columns["temp"]) == [29, 99] and math.isnan(columns["count"][0]) and columns["count"][1] == 3
+    again.close()
+
+
+def test_aggregate_and_unsorted_rows(tmp_path):
+    store = ColumnStore(str(tmp_path))
+    store.extend(records(6, start=T0 + 3600000, step=600000))  # an hour ahead
+    store.flush()
+    store.extend(records(2, start=T0 + 60000))  # older rows arrive later
+    store.flush()
+    times = list(store.columns(SERIAL, fields=())["t"])
+    assert times == sorted(times) and len(times) == 8
+    hour = 3600000
+    first = T0 // hour * hour  # T0 is 13:20 into its hour
+    assert store.aggregate(SERIAL, "temp", every_ms=hour) == [
+        (first, 2, 20, 21, 20.5),
+        (first + hour, 5, 20, 24, 22),
+        (first + 2 * hour, 1, 25, 25, 25),
+    ]
+    assert store.aggregate(None, "battery", T0 + hour, every_ms=100 * hour) == \
+        [(T0 // (100 * hour) * 100 * hour, 6, 80, 80, 80)]
+    store.close()
+
+
+def test_unfinished_flush_is_cut_back(tmp_path):
+    store = ColumnStore(str(tmp_path))
+    store.extend(records(3))
+    store.close()
+    segment = os.path.join(str(tmp_path), SERIAL, "000000")
+    with open(os.path.join(segment, "t.q"), "ab") as f:
+        f.write(b"\x00" * 16)  # rows written, index not replaced
+    store = ColumnStore(str(tmp_path))
+    store.extend(records(1, start=T0 + 5000))
+    store.close()
+    assert [t - T0 for t, _ in ColumnStore(str(tmp_path)).scan(SERIAL)] == [0, 1000, 2000, 5000]
+
+
+def test_read_logs_and_times(tmp_path):
+    jsonl = tmp_path / "ingest.jsonl"
+    jsonl.write_text(json.dumps({"serial": SERIAL, "temp": 20.5}) + "\n{\"event\": \"gone\"}\nnot json\n")
+    text = tmp_path / "SerialPortLog.txt"
+    text.write_text("2024-01-02 03:04:05 - PsGadget-IO|34b7da112233|x|20.5|80|hi\nnoise\n")
+    assert [r["serial"] for r in read_log(str(jsonl))] == [SERIAL]
+    record, = read_log(str(text))
+    assert record["temp"] == 20.5 and record_time(record) == int(record["received"] * 1000)
+    assert record_time({"taken_ms": 5, "sent_ms": 7}) == 5
+    assert parse_time("-1d", now_ms=T0) == T0 - 86400000
+    assert parse_time("now", now_ms=T0) == T0 and parse_time("12345") == 12345
@@ -0,0 +1,118 @@
+import uartlink
+from psgadget_link import HostLink
+
+
+def test_frames_round_trip():
+    decoder = uartlink.FrameDecoder()
+    payloads = [b"", b"x", bytes(range(256)) * 4, "ünïcode".encode()]
+    stream = b"".join(uartlink.encode_frame(uartlink.K_RECORD, p) for p in payloads)
+    got = []
+    for i in range(0, len(stream), 7):  # as it comes off the UART, a few bytes at a time
+        got += decoder.feed(stream[i:i + 7])
+    assert got == [(uartlink.K_RECORD, p) for p in payloads]
+    assert decoder.crc_errors == 0
+
+
+def test_corrupt_and_truncated_frames():
+    decoder = uartlink.FrameDecoder()
+    good = uartlink.encode_frame(uartlink.K_COMMAND, b"status")
+    bad = bytearray(good)
+    bad[-1] ^= 1
+    assert decoder.feed(b"noise" + bytes(bad) + good[:-2]) == []
+    assert decoder.crc_errors == 1 and decoder.resyncs >= 1
+    assert decoder.feed(good[-2:]) == [(uartlink.K_COMMAND, b"status")]
+    # A length over max_payload is skipped, not waited for
+    assert decoder.feed(uartlink.SYNC + b"\xff\xff\x01" + good) == [(uartlink.K_COMMAND, b"status")]
+    # Half a sync byte at the end is kept for the next read
+    assert decoder.feed(good + good[:1]) == [(uartlink.K_COMMAND, b"status")]
+    assert decoder.feed(good[1:]) == [(uartlink.K_COMMAND, b"status")]
+
+
+class Uart:
+    """machine.UART stand-in, written bytes go to `written`."""
+
+    def __init__(self):
+        self.written = b""
+        self.baud = uartlink.DEFAULT_BAUD
+
+    def write(self, data):
+        self.written += bytes(data)
+        return len(data)
+
+    def init(self, baudrate):
+        self.baud = baudrate
+
+    def flush(self):
+        pass
+
+
+def test_text_mode_records_and_commands():
+    uart = Uart()
+    link = uartlink.UartLink(uart, batch_size=16)
+    link.send(b"one")
+    link.send(b"two")
+    assert uart.written == b""  # batched until flush() or a full buffer
+    link.send(b"x" * 20)  # bigger than the batch, written straight away
+    link.flush()
+    assert uart.written == b"one\ntwo\n" + b"x" * 20 + b"\n"
+    assert link.feed(b"stat", 0) == []
+    assert link.feed(b"us\r\n\nled 1\n", 0) == ["status", "led 1"]
+
+
+class Bridge:
+    """Host serial port wired straight to a receiver UartLink."""
+
+    def __init__(self, link, uart):
+        self.link = link
+        self.uart = uart
+        self.commands = []
+        self.baud = uartlink.DEFAULT_BAUD
+
+    def write(self, data):
+        self.commands += self.link.feed(data, 0)
+
+    def read(self):
+        data, self.uart.written = self.uart.written, b""
+        return data
+
+    def set_baud(self, baud):
+        self.baud = baud
+
+
+def test_handshake_and_framed_records():
+    uart = Uart()
+    link = uartlink.UartLink(uart)
+    port = Bridge(link, uart)
+    host = HostLink(port)
+    link.send(b"before")
+    link.flush()
+    assert host.handshake(921600, timeout=0.5)
+    assert link.framed and link.confirmed and uart.baud == port.baud == 921600
+    link.send(b"rec|1")
+    link.reply("status ok")
+    assert host.read() == [(uartlink.K_RECORD, b"before"), (uartlink.K_RECORD, b"rec|1"),
+                           (uartlink.K_REPLY, b"status ok")]
+    host.send_command("led 1 2 3")
+    assert port.commands == ["led 1 2 3"]
+
+
+def test_unconfirmed_link_falls_back_to_text():
+    uart = Uart()
+    link = uartlink.UartLink(uart)
+    assert link.feed(b"link 921600\n", 0) == []
+    assert uart.written == b"link ok 921600\n" and link.framed
+    link.feed(None, uartlink.CONFIRM_MS + 1)
+    assert not link.framed and uart.baud == uartlink.DEFAULT_BAUD
+    assert link.feed(b"link 1234\n", 0) == [] and b"link error 1234" in uart.written
+
+
+def test_bad_and_overlong_command_lines():
+    link = uartlink.UartLink(Uart())
+    assert link.feed(b"\xff\xfe\nstatus\n", 0) == ["status"]
+    assert link.feed(b"x" * (uartlink.MAX_LINE + 1), 0) == []
+    assert link.feed(b"still the long line\nhelp\n", 0) == ["help"]
+    assert link.stats()["bad_commands"] == 2
+    link.framed = link.confirmed = True
+    bad = uartlink.encode_frame(uartlink.K_COMMAND, b"\xc3")
+    assert link.feed(bad + uartlink.encode_frame(uartlink.K_COMMAND, b" peers \n"), 0) == ["peers"]
+    assert link.stats()["bad_commands"] == 3
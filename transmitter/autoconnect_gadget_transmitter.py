@@ -4,22 +4,59 @@
 import network
 import espnow
 import ubinascii
-import time
 import esp32
 import uos
 import urandom
 import machine
 import neopixel
+import psgframe
+from ledfx import LedFx
+from sampler import SampleBuffer
+from lowpower import RtcPairing, BootTimer
+from discovery import Prober
+from reliable import ReliableSender
+from commands import CommandTable
+from downlink import Listener
+from clocksync import ClockEstimator
+from deadband import Deadband, HEARTBEAT
+from session import SessionClient
+
+boot = BootTimer()  # boot-to-first-send timing
 
 # Constants and Initialization
 PSGADGET_TYPE = "PsGadget-IO"  # simple input-output device
 CTSSID = "PsGadget-CT"
-RECEIVER_CHECK_INTERVAL = 1  # Interval to check for receiver in seconds
+RECEIVER_CACHE = "receiver.txt"  # Receiver found last time, tried first after a reboot
+DISCOVERY_WINDOW_MS = 40     # Time to wait for offers after probing a channel
 MESSAGE_SEND_INTERVAL = 5    # Interval to send messages to receiver in seconds
+BINARY_FRAMES = True         # False sends the legacy pipe text format
+MACHINE_TYPE_EVERY = 16      # Include the machine type string every N frames
+SESSIONS = True              # Register serial and types once, frames carry a 1-byte session id instead
+                             # (needs BINARY_FRAMES, not in LOW_POWER_MODE: asleep it can't hear
+                             # the receiver ask it to register again)
+BATCH_MODE = False           # Sample often and send several samples per frame (needs BINARY_FRAMES)
+SAMPLE_INTERVAL_MS = 1000    # Batch mode: time between samples
+BATCH_MAX_SAMPLES = 0        # Batch mode: samples per frame, 0 = as many as fit in one frame
+BATCH_MAX_AGE_MS = 30000     # Batch mode: send once the oldest sample is this old
+DEADBAND_MODE = False        # Read often, send only on change or heartbeat (needs BINARY_FRAMES, not BATCH_MODE)
+DEADBAND_SAMPLE_MS = 200     # Deadband mode: time between readings
+DEADBAND_TEMP = 0.5          # Deadband mode: send when the temperature moves this far (C)...
+DEADBAND_BATTERY = 2         # ...or the battery level this far (%)...
+HEARTBEAT_S = 60             # ...or nothing was sent for this long
+LOW_POWER_MODE = False       # Sleep between sends, the receiver is kept in RTC memory across sleeps
+DEEP_SLEEP = False           # Low power mode: deepsleep (reboots on wake) instead of lightsleep
+                             # (not in BATCH_MODE or DEADBAND_MODE, those keep state in RAM and lightsleep)
+PAIRING_MAX_MISSES = 3       # Low power mode: look for a receiver again after this many unacked sends
+RELIABLE_DELIVERY = False    # Receiver acks frames, unacked ones are resent (needs BINARY_FRAMES)
+RETRANSMIT_WINDOW = 8        # Reliable delivery: frames kept for resending until acked
+RETRANSMIT_TIMEOUT_MS = 250  # Reliable delivery: resend a frame not acked within this time
+RETRANSMIT_RETRIES = 3       # Reliable delivery: give a frame up after this many resends
 
 # Retrieve ESP32 details
 MACHINE_TYPE = uos.uname().machine
-SERIAL_NUMBER = ubinascii.hexlify(machine.unique_id()).decode()
+SERIAL_RAW = machine.unique_id()
+SERIAL_NUMBER = ubinascii.hexlify(SERIAL_RAW).decode()
+GADGET_CODE = psgframe.gadget_code(PSGADGET_TYPE)
 print("Machine Type:", MACHINE_TYPE)
 print("Serial Number:", SERIAL_NUMBER)
 
@@ -27,21 +64,62 @@ print("Serial Number:", SERIAL_NUMBER)
 power_pin = machine.Pin(38, machine.Pin.OUT)
 power_pin.value(1)  # Enable power to the NeoPixel
 np = neopixel.NeoPixel(machine.Pin(39), 1)
+# LED effects run from a timer so blinking never delays sending
+led_fx = LedFx(np)
+led_fx.start_timer(0)
 
 # Initialize Wi-Fi and ESP-NOW
 wlan = network.WLAN(network.STA_IF)
 wlan.active(True)
 esp_now = espnow.ESPNow()
 esp_now.active(True)
+boot.mark("radio up")
+# Active discovery: probe the cached receiver, else every channel in turn
+prober = Prober(esp_now, wlan, SERIAL_RAW, GADGET_CODE, window_ms=DISCOVERY_WINDOW_MS,
+                beacon=CTSSID.encode(), cache=RECEIVER_CACHE)
 
 # Global variables
 receiver_mac = None
-message_received = False
+sequence = 0
+misses = 0
+rtc_pairing = RtcPairing(machine.RTC())
+
+# Commands the host sends through the receiver ("send <mac|@group|all> <command>"
+# there), run between sends and acked, see downlink.py. Not in low power mode,
+# the radio is off while sleeping
+commands = CommandTable(print)
+
+# Reference time from the receiver's beacons (once the host has set its
+# clock), frames carry their send time so latency can be measured per hop
+clock = ClockEstimator()
+
+# Deadband mode: readings since the last frame are summed up in it
+deadband = Deadband(DEADBAND_TEMP, DEADBAND_BATTERY, HEARTBEAT_S * 1000)
+
+# Session with the receiver, frames go out in full until it is granted
+session = SessionClient(esp_now, SERIAL_RAW, GADGET_CODE, MACHINE_TYPE)
 
-# ESP-NOW Callback
-def espnow_callback(_):
-    global message_received
-    message_received = True  # Set flag when any message is received
+def other_frame(mac, msg):
+    if mac != receiver_mac:
+        return
+    if not psgframe.is_binary(msg):
+        clock.beacon(msg)
+    else:
+        session.handle(mac, msg)
+
+listener = Listener(esp_now, wlan.config("mac"), commands.dispatch, other_frame)
+
+sender = None
+if RELIABLE_DELIVERY and BINARY_FRAMES:
+    sender = ReliableSender(esp_now, RETRANSMIT_WINDOW, RETRANSMIT_TIMEOUT_MS, RETRANSMIT_RETRIES,
+                            on_frame=listener.handle)
+    session.sender = sender  # rejected session frames are resent through its window
+
+def pair(mac):
+    """Talk to this receiver from now on, and only run its commands."""
+    global receiver_mac
+    receiver_mac = mac
+    listener.receivers = {bytes(mac)}
 
 # Utility Functions
 def random_neopixel_color():
@@ -49,60 +127,248 @@ def random_neopixel_color():
     return (urandom.getrandbits(8), urandom.getrandbits(8), urandom.getrandbits(8))
 
 def blink(color, delay=0.5):
-    """Blink the NeoPixel with the given color."""
-    np[0] = color
-    np.write()
-    time.sleep(delay)
-    np[0] = (0, 0, 0)  # Turn off
-    np.write()
-    time.sleep(delay)
+    """Blink the NeoPixel with the given color, returns immediately."""
+    led_fx.flash(color, int(delay * 1000))
 
 def battery_status():
     """Placeholder for battery status, returns a fixed value."""
     return "99"
 
-def send_message():
-    """Send a randomized message to the receiver."""
+def frame_ext():
+    """TLV extensions for the next frame: machine type every few frames
+    (without a session), the deadband summary and heartbeat, send time once synced."""
+    ext = []
+    if session.sid is None and sequence % MACHINE_TYPE_EVERY == 0:
+        ext.append((psgframe.T_MACHINE, MACHINE_TYPE))
+    if DEADBAND_MODE and BINARY_FRAMES:
+        if deadband.count > 1:
+            ext.append(deadband.agg_tlv())
+        ext.append(psgframe.heartbeat_tlv(deadband.heartbeat_ms // 1000))
+    now = clock.now()
+    if now is not None:
+        ext.append(psgframe.time_tlv(now))
+    return ext
+
+def build_message(cputemp, battery, neopixel_color, flags=0):
+    """Build the telemetry frame for one reading."""
+    if not BINARY_FRAMES:
+        return f"{PSGADGET_TYPE}|{SERIAL_NUMBER}|{MACHINE_TYPE}|{cputemp}|{battery}|rgb{neopixel_color}".encode('utf-8')
+    session.poll()
+    return session.compact(psgframe.encode_telemetry(sequence, SERIAL_RAW, GADGET_CODE, cputemp,
+                                                     int(battery), neopixel_color, frame_ext(), flags))
+
+def send_batch():
+    """Send the buffered samples as one batch frame."""
+    global sequence
+    if not len(samples):
+        return
+    try:
+        count = len(samples)
+        session.poll()
+        message = session.compact(samples.encode(sequence, SERIAL_RAW, GADGET_CODE, frame_ext()))
+        radio_send(message)
+        first_send_done()
+        if not LOW_POWER_MODE:
+            blink(samples.colors[count - 1])
+        print("Batch sent:", count, "samples,", len(message), "bytes")
+    except Exception as e:
+        print(f"Failed to send batch: {e}")
+
+def take_sample():
+    """Store one reading, send the batch when it is full or old enough."""
     try:
-        cputemp = esp32.mcu_temperature()
-        battery = battery_status()
+        if samples.add(esp32.mcu_temperature(), int(battery_status()), random_neopixel_color()):
+            send_batch()
+    except Exception as e:
+        print(f"Failed to take sample: {e}")
+
+def radio_send(message):
+    """Send a frame to the receiver and step the sequence number, returns the ack."""
+    global sequence
+    seq = sequence
+    sequence = (sequence + 1) & 0xFFFF
+    if sender is None:
+        return esp_now.send(receiver_mac, message)
+    sender.send(receiver_mac, seq, message)
+    if LOW_POWER_MODE:
+        # Wait for the receiver's ack before going to sleep
+        return sender.flush(RETRANSMIT_TIMEOUT_MS * (RETRANSMIT_RETRIES + 1))
+    return True
+
+def first_send_done():
+    if boot.get("first send") is None:
+        boot.mark("first send")
+        print("Boot timing:", boot.report())
+
+def send_message(reading=None, flags=0):
+    """Send a randomized message (or reading, a (cputemp, battery) pair) to
+    the receiver, returns True if it was acknowledged."""
+    try:
+        cputemp, battery = reading or (esp32.mcu_temperature(), battery_status())
         neopixel_color = random_neopixel_color()
         
         # Construct the message
-        message = f"{PSGADGET_TYPE}|{SERIAL_NUMBER}|{MACHINE_TYPE}|{cputemp}|{battery}|rgb{neopixel_color}"
-        esp_now.send(receiver_mac, message.encode('utf-8'))
+        message = build_message(cputemp, battery, neopixel_color, flags)
+        acked = radio_send(message)
+        first_send_done()
+        deadband.sent(cputemp, int(battery))
         
-        # Blink to indicate message sent
-        blink(neopixel_color)
+        # Blink to indicate message sent (not in low power mode, the LED
+        # timer stops while sleeping)
+        if not LOW_POWER_MODE:
+            blink(neopixel_color)
         print("Message sent:", message)
+        return acked
     except Exception as e:
         print(f"Failed to send message: {e}")
+        return False
+
+def watch_reading():
+    """Deadband mode: take a reading, send it if it moved or the heartbeat is due."""
+    try:
+        reading = (esp32.mcu_temperature(), int(battery_status()))
+        why = deadband.add(*reading)
+        if why:
+            send_message(reading, psgframe.F_HEARTBEAT if why == HEARTBEAT else 0)
+    except Exception as e:
+        print(f"Failed to take reading: {e}")
+
+def led_command(args):
+    """Show a colour, for 2 s unless given."""
+    values = [int(v) for v in args.split()]
+    if len(values) not in (3, 4):
+        raise ValueError("usage: led <r> <g> <b> [ms]")
+    led_fx.flash(tuple(values[:3]), values[3] if len(values) == 4 else 2000)
+
+def interval_command(args):
+    """Change the send interval."""
+    global MESSAGE_SEND_INTERVAL
+    MESSAGE_SEND_INTERVAL = max(1, int(args))
+
+commands.add("led", led_command, "led <r> <g> <b> [ms] - show a colour")
+commands.add("interval", interval_command, "interval <seconds> - change the send interval")
+commands.add("report", lambda args: f"report acked={send_message()}", "send a reading now")
+commands.add("ping", lambda args: "pong", "just ack")
+commands.add("clock", lambda args: f"clock {clock.stats()}", "clock sync state")
+commands.add("session", lambda args: f"session {session.stats()}", "session with the receiver")
+
+def deadband_command(args):
+    """Show or change the deadband: deadband [temp battery heartbeat_s]."""
+    if args:
+        temp, battery, heartbeat = args.split()
+        deadband.temp = float(temp)
+        deadband.battery = int(battery)
+        deadband.heartbeat_ms = max(1, int(heartbeat)) * 1000
+    return (f"deadband temp={deadband.temp} battery={deadband.battery} "
+            f"heartbeat_s={deadband.heartbeat_ms // 1000} {deadband.stats()}")
 
-# Register ESP-NOW callback
-esp_now.irq(espnow_callback)
+commands.add("deadband", deadband_command, "deadband [temp battery heartbeat_s] - show or change the deadband")
 
-# Receiver Detection Loop
-print("Listening for receiver broadcasts...")
-while receiver_mac is None:
-    if message_received:
-        message_received = False
+def discover_receiver():
+    """Find a receiver (the one cached in flash first), returns its MAC (added as a peer)."""
+    print("Looking for a receiver...")
+    mac, channel, load = prober.find()
+    load = "cached" if load is None else load
+    print(f"Receiver found: {ubinascii.hexlify(mac, ':').decode()} on channel {channel}, load {load}")
+    print(f"Pairing took {prober.last_pairing_ms} ms")
+    return mac
+
+def nap(ms):
+    """Wait ms between sends, sleeping the CPU in low power mode."""
+    if sender is not None:
+        if not LOW_POWER_MODE:
+            sender.wait(ms)  # keeps handling acks, retransmits and commands
+            return
+        sender.flush(RETRANSMIT_TIMEOUT_MS * (RETRANSMIT_RETRIES + 1))
+    if not LOW_POWER_MODE:
+        listener.listen(ms)  # runs commands from the receiver meanwhile
+    elif DEEP_SLEEP:
+        # Execution restarts from the top on wake, receiver and sequence
+        # number come back from RTC memory
+        machine.deepsleep(ms)
+    else:
+        machine.lightsleep(ms)
+
+def low_power_loop():
+    """Send, sleep, repeat. Looks for a receiver again if sends stop being acknowledged."""
+    global misses
+    print(f"Low power mode: {'deepsleep' if DEEP_SLEEP else 'lightsleep'} between sends.")
+    while True:
+        misses = 0 if send_message() else misses + 1
+        if misses >= PAIRING_MAX_MISSES:
+            print("Receiver is not acknowledging, looking for a receiver again.")
+            rtc_pairing.clear()
+            prober.forget()
+            esp_now.del_peer(receiver_mac)
+            pair(discover_receiver())
+            misses = 0
+        rtc_pairing.save(receiver_mac, wlan.config("channel"), sequence, misses)
+        nap(MESSAGE_SEND_INTERVAL * 1000)
+
+# Pairing and the send loop only run as the main script, importing it (the
+# benchmarks do) just defines the functions above
+if __name__ == "__main__":
+    # Receiver Detection, skipped when waking from sleep with the receiver
+    # still in RTC memory
+    cached = rtc_pairing.load() if LOW_POWER_MODE else None
+    if cached:
+        receiver_mac, channel, sequence, misses = cached
+        pair(receiver_mac)
+        wlan.config(channel=channel)
+        esp_now.add_peer(receiver_mac)
+        print(f"Receiver {ubinascii.hexlify(receiver_mac, ':').decode()} on channel {channel} from RTC memory")
+    else:
+        pair(discover_receiver())
+        # Random start after a cold boot so the receiver doesn't take the first
+        # frames for duplicates of the ones sent before the reboot
+        sequence = urandom.getrandbits(16) // MACHINE_TYPE_EVERY * MACHINE_TYPE_EVERY
+    boot.mark("paired")
+    if SESSIONS and BINARY_FRAMES and not LOW_POWER_MODE:
+        session.reset(receiver_mac)
+
+    # Main Messaging Loop
+    if BATCH_MODE and BINARY_FRAMES:
+        # Leave room for the machine type TLV that goes out every few frames
+        # and the send time
+        samples = SampleBuffer(BATCH_MAX_SAMPLES, BATCH_MAX_AGE_MS,
+                               len(psgframe.encode_tlv(psgframe.T_MACHINE, MACHINE_TYPE))
+                               + len(psgframe.encode_tlv(*psgframe.time_tlv(0))))
+        print(f"Batch mode: up to {samples.capacity} samples per frame.")
+        # Low power mode only lightsleeps here, deepsleep would lose the buffer
+        if LOW_POWER_MODE and DEEP_SLEEP:
+            print("Batch mode: lightsleep instead of DEEP_SLEEP, deepsleep would lose the buffered samples.")
+        DEEP_SLEEP = False
         try:
-            # Attempt to receive message from ESP-NOW
-            mac, ssid = esp_now.recv()
-            mac_address = ubinascii.hexlify(mac, ":").decode()
-            
-            # Verify SSID
-            if CTSSID in ssid:
-                receiver_mac = mac
-                esp_now.add_peer(receiver_mac)
-                print(f"Receiver found: {mac_address} with SSID '{ssid}'")
-                print("Receiver added as a peer for communication.")
-        except Exception as e:
-            print("Failed to process broadcast message:", e)
-    time.sleep(RECEIVER_CHECK_INTERVAL)
-
-# Main Messaging Loop
-print("Transmitter is now actively sending messages to the receiver.")
-while True:
-    send_message()
-    time.sleep(MESSAGE_SEND_INTERVAL)
+            while True:
+                take_sample()
+                nap(SAMPLE_INTERVAL_MS)
+        finally:
+            send_batch()  # don't lose buffered samples on shutdown
+            if sender is not None:
+                sender.flush()
+
+    if DEADBAND_MODE and BINARY_FRAMES:
+        print(f"Deadband mode: reading every {DEADBAND_SAMPLE_MS} ms, heartbeat every {HEARTBEAT_S} s.")
+        # Low power mode only lightsleeps here, deepsleep would lose the last values sent
+        if LOW_POWER_MODE and DEEP_SLEEP:
+            print("Deadband mode: lightsleep instead of DEEP_SLEEP, deepsleep would lose the last values sent.")
+        DEEP_SLEEP = False
+        try:
+            while True:
+                watch_reading()
+                nap(DEADBAND_SAMPLE_MS)
+        finally:
+            if sender is not None:
+                sender.flush()
+
+    print("Transmitter is now actively sending messages to the receiver.")
+    if LOW_POWER_MODE:
+        low_power_loop()
+    try:
+        while True:
+            send_message()
+            nap(MESSAGE_SEND_INTERVAL * 1000)
+    finally:
+        if sender is not None:
+            sender.flush()
+            print("Delivery:", sender.stats())
@@ -7,6 +7,7 @@ import esp32
 import uos
 import neopixel
 import machine
+from ledfx import LedFx
 
 # TRANSMITTER CODE
 # this code is for Adafruit QtPy ESP32-S2
@@ -18,6 +19,9 @@ power_pin.value(1)  # Enable power to the NeoPixel
 
 # Initialize NeoPixel on GPIO39
 np = neopixel.NeoPixel(machine.Pin(39), 1)
+# LED effects run from a timer so blinking never delays sending
+led_fx = LedFx(np)
+led_fx.start_timer(0)
 
 # Initialize the Wi-Fi interface in station mode
 wlan = network.WLAN(network.STA_IF)
@@ -41,23 +45,17 @@ def cdt():
     # Format date-time with milliseconds
     return "{:02d}{:02d}{:02d}T{:02d}{:02d}{:02d}".format(dt[0], dt[1], dt[2], dt[3], dt[4], dt[5])
 
-# Blink function 
+# Blink function, returns immediately
 def blink(color, delay=0.5):
-    np[0] = color  # Set color
-    np.write()     # Update NeoPixel
-    time.sleep(delay)
-    np[0] = (0, 0, 0)  # Turn off
-    np.write()
-    time.sleep(delay)
+    led_fx.flash(color, int(delay * 1000))
     
 # error led blink
 def errorblink():
-    for i in range(2):
-        blink((20, 0, 0), 0.2)
+    blink((20, 0, 0), 0.4)
         
+# blink yellow until a receiver is found (led_fx.clear() stops it)
 def no_receiver():
-    for i in range(3):
-        blink((20, 20, 0), 0.3)
+    led_fx.pulse((20, 20, 0), 600)
         
 # Function to send a message to the receiver
 def send_message(message):
@@ -69,14 +67,14 @@ def send_message(message):
         errorblink()
         print(f"Failed to send message: {e}")
 
-# Main loop to send messages periodically
-while True:
+if __name__ == "__main__":
+    # Main loop to send messages periodically
+    while True:
     
-    # currenttime
-    time = cdt()
-    temp = esp32.mcu_temperature()
-    # format message with | as delimiter
-    message = '{}|{}|{}'.format(cdt, temp, rand)
-    send_message(message)
-    time.sleep(5)  # Send a message every 5 seconds (adjust as needed)
-
+        # currenttime
+        time = cdt()
+        temp = esp32.mcu_temperature()
+        # format message with | as delimiter
+        message = '{}|{}|{}'.format(cdt, temp, rand)
+        send_message(message)
+        time.sleep(5)  # Send a message every 5 seconds (adjust as needed)
@@ -11,6 +11,7 @@ import uos
 import neopixel
 import machine
 import json
+from ledfx import LedFx
 
 # Power pin setup (GPIO38)
 power_pin = machine.Pin(38, machine.Pin.OUT)
@@ -18,6 +19,9 @@ power_pin.value(1)  # Enable power to the NeoPixel
 
 # Initialize NeoPixel on GPIO39
 np = neopixel.NeoPixel(machine.Pin(39), 1)
+# LED effects run from a timer so blinking never delays sending
+led_fx = LedFx(np)
+led_fx.start_timer(0)
 
 # Initialize the Wi-Fi interface in station mode
 wlan = network.WLAN(network.STA_IF)
@@ -35,14 +39,9 @@ machinetype = uos.uname().machine
 macraw = wlan.config("mac")
 mac = ubinascii.hexlify(macraw, ":").decode()
 
-# Blink function
+# Blink function, returns immediately
 def blink(color, delay=0.5):
-    np[0] = color  # Set color
-    np.write()     # Update NeoPixel
-    time.sleep(delay)
-    np[0] = (0, 0, 0)  # Turn off
-    np.write()
-    time.sleep(delay)
+    led_fx.flash(color, int(delay * 1000))
 
 # Function to send a message to the receiver
 # format the espnow message as json
@@ -54,8 +53,8 @@ def send_message(message):
     except Exception as e:
         print(f"Failed to send message: {e}")
 
-# Main loop to send messages periodically
-while True:
+# Build the message for one reading
+def build_message():
     # currenttime
     dt = time.localtime()
     cdt = "{:04d}{:02d}{:02d}T{:02d}{:02d}{:02d}".format(dt[0], dt[1], dt[2], dt[3], dt[4], dt[5])
@@ -63,7 +62,11 @@ while True:
     temp = esp32.mcu_temperature()
     rand = urandom.getrandbits(32)
     # format msg into json string
-    message = '{{"transmitter",""datetime":"{}", "macraw":"{}", "mac":"{}", "type":"{}", "cputemp":{}, "rand":{}}}'.format(cdt, macraw, mac, machinetype, temp, rand)
-    send_message(message)
-    time.sleep(5)  # Send a message every 5 seconds (adjust as needed)
+    return '{{"transmitter",""datetime":"{}", "macraw":"{}", "mac":"{}", "type":"{}", "cputemp":{}, "rand":{}}}'.format(cdt, macraw, mac, machinetype, temp, rand)
+
+# Main loop to send messages periodically
+if __name__ == "__main__":
+    while True:
+        send_message(build_message())
+        time.sleep(5)  # Send a message every 5 seconds (adjust as needed)
 
@@ -11,16 +11,42 @@ import uos
 import urandom
 import machine
 import neopixel
+import psgframe
+from ledfx import LedFx, PinLed
+from sampler import SampleBuffer
+from lowpower import RtcPairing, BootTimer
+from discovery import Prober
+from reliable import ReliableSender
+
+boot = BootTimer()  # boot-to-first-send timing
 
 # Constants and Initialization
 PSGADGET_TYPE = "PsGadget-IO"  # simple input-output device
 CTSSID = "PsGadget-CT"
-RECEIVER_CHECK_INTERVAL = 1  # Interval to check for receiver in seconds
+RECEIVER_CACHE = "receiver.txt"  # Receiver found last time, tried first after a reboot
+DISCOVERY_WINDOW_MS = 40     # Time to wait for offers after probing a channel
 MESSAGE_SEND_INTERVAL = 5    # Interval to send messages to receiver in seconds
+BINARY_FRAMES = True         # False sends the legacy pipe text format
+MACHINE_TYPE_EVERY = 16      # Include the machine type string every N frames
+BATCH_MODE = False           # Sample often and send several samples per frame (needs BINARY_FRAMES)
+SAMPLE_INTERVAL_MS = 1000    # Batch mode: time between samples
+BATCH_MAX_SAMPLES = 0        # Batch mode: samples per frame, 0 = as many as fit in one frame
+BATCH_MAX_AGE_MS = 30000     # Batch mode: send once the oldest sample is this old
+BATCH_MESSAGE = "its working!"
+LOW_POWER_MODE = False       # Sleep between sends, the receiver is kept in RTC memory across sleeps
+DEEP_SLEEP = False           # Low power mode: deepsleep (reboots on wake) instead of lightsleep
+                             # (not in BATCH_MODE, the buffered samples are kept in RAM so it lightsleeps)
+PAIRING_MAX_MISSES = 3       # Low power mode: look for a receiver again after this many unacked sends
+RELIABLE_DELIVERY = False    # Receiver acks frames, unacked ones are resent (needs BINARY_FRAMES)
+RETRANSMIT_WINDOW = 8        # Reliable delivery: frames kept for resending until acked
+RETRANSMIT_TIMEOUT_MS = 250  # Reliable delivery: resend a frame not acked within this time
+RETRANSMIT_RETRIES = 3       # Reliable delivery: give a frame up after this many resends
 
 # Retrieve ESP32 details
 MACHINE_TYPE = uos.uname().machine
-SERIAL_NUMBER = ubinascii.hexlify(machine.unique_id()).decode()
+SERIAL_RAW = machine.unique_id()
+SERIAL_NUMBER = ubinascii.hexlify(SERIAL_RAW).decode()
+GADGET_CODE = psgframe.gadget_code(PSGADGET_TYPE)
 print("Machine Type:", MACHINE_TYPE)
 print("Serial Number:", SERIAL_NUMBER)
 
@@ -28,21 +54,28 @@ print("Serial Number:", SERIAL_NUMBER)
 # GPIO2		must be LOW during boot and also connected to the on-board LED
 led = machine.Pin(2, machine.Pin.OUT)
 led.value(0)
+# LED effects run from a timer so blinking never delays sending
+led_fx = LedFx(PinLed(led))
+led_fx.start_timer(0)
 
 # Initialize Wi-Fi and ESP-NOW
 wlan = network.WLAN(network.STA_IF)
 wlan.active(True)
 esp_now = espnow.ESPNow()
 esp_now.active(True)
+boot.mark("radio up")
+# Active discovery: probe the cached receiver, else every channel in turn
+prober = Prober(esp_now, wlan, SERIAL_RAW, GADGET_CODE, window_ms=DISCOVERY_WINDOW_MS,
+                beacon=CTSSID.encode(), cache=RECEIVER_CACHE)
 
 # Global variables
 receiver_mac = None
-message_received = False
-
-# ESP-NOW Callback
-def espnow_callback(_):
-    global message_received
-    message_received = True  # Set flag when any message is received
+sequence = 0
+misses = 0
+rtc_pairing = RtcPairing(machine.RTC())
+sender = None
+if RELIABLE_DELIVERY and BINARY_FRAMES:
+    sender = ReliableSender(esp_now, RETRANSMIT_WINDOW, RETRANSMIT_TIMEOUT_MS, RETRANSMIT_RETRIES)
 
 # Utility Functions
 def random_neopixel_color():
@@ -50,17 +83,73 @@ def random_neopixel_color():
     return (urandom.getrandbits(8), urandom.getrandbits(8), urandom.getrandbits(8))
 
 def blink():
-    """ Blink LED"""
-    led.value(1)
-    time.sleep(0.5)
-    led.value(0)
+    """ Blink LED, returns immediately"""
+    led_fx.flash((1, 1, 1), 500)
 
 def battery_status():
     """Placeholder for battery status, returns a fixed value."""
     return "99"
 
+def build_message(cputemp, battery, message):
+    """Build the telemetry frame for one reading."""
+    if not BINARY_FRAMES:
+        return f"{PSGADGET_TYPE}|{SERIAL_NUMBER}|{MACHINE_TYPE}|{cputemp}|{battery}|{message}".encode('utf-8')
+    ext = [(psgframe.T_TEXT, message)]
+    if sequence % MACHINE_TYPE_EVERY == 0:
+        ext.append((psgframe.T_MACHINE, MACHINE_TYPE))
+    return psgframe.encode_telemetry(sequence, SERIAL_RAW, GADGET_CODE, cputemp,
+                                     int(battery), None, ext)
+
+def batch_ext():
+    ext = [(psgframe.T_TEXT, BATCH_MESSAGE)]
+    if sequence % MACHINE_TYPE_EVERY == 0:
+        ext.append((psgframe.T_MACHINE, MACHINE_TYPE))
+    return ext
+
+def send_batch():
+    """Send the buffered samples as one batch frame."""
+    if not len(samples):
+        return
+    try:
+        count = len(samples)
+        message_package = samples.encode(sequence, SERIAL_RAW, GADGET_CODE, batch_ext())
+        radio_send(message_package)
+        first_send_done()
+        if not LOW_POWER_MODE:
+            blink()
+        print("Batch sent:", count, "samples,", len(message_package), "bytes")
+    except Exception as e:
+        print(f"Failed to send batch: {e}")
+
+def take_sample():
+    """Store one reading, send the batch when it is full or old enough."""
+    try:
+        cputemp = (esp32.raw_temperature() - 32) / 1.8
+        if samples.add(cputemp, int(battery_status())):
+            send_batch()
+    except Exception as e:
+        print(f"Failed to take sample: {e}")
+
+def radio_send(message):
+    """Send a frame to the receiver and step the sequence number, returns the ack."""
+    global sequence
+    seq = sequence
+    sequence = (sequence + 1) & 0xFFFF
+    if sender is None:
+        return esp_now.send(receiver_mac, message)
+    sender.send(receiver_mac, seq, message)
+    if LOW_POWER_MODE:
+        # Wait for the receiver's ack before going to sleep
+        return sender.flush(RETRANSMIT_TIMEOUT_MS * (RETRANSMIT_RETRIES + 1))
+    return True
+
+def first_send_done():
+    if boot.get("first send") is None:
+        boot.mark("first send")
+        print("Boot timing:", boot.report())
+
 def send_message():
-    """Send a randomized message to the receiver."""
+    """Send a randomized message to the receiver, returns True if it was acknowledged."""
     try:
         cputempf = esp32.raw_temperature()
         cputemp = (cputempf - 32) / 1.8
@@ -70,40 +159,107 @@ def send_message():
         
         
         # Construct the message
-        message_package = f"{PSGADGET_TYPE}|{SERIAL_NUMBER}|{MACHINE_TYPE}|{cputemp}|{battery}|{message}"
-        esp_now.send(receiver_mac, message_package.encode('utf-8'))
+        message_package = build_message(cputemp, battery, message)
+        acked = radio_send(message_package)
+        first_send_done()
         
-        # Blink to indicate message sent
-        blink()
+        # Blink to indicate message sent (not in low power mode, the LED
+        # timer stops while sleeping)
+        if not LOW_POWER_MODE:
+            blink()
         print("Message sent:", message_package)
+        return acked
     except Exception as e:
         print(f"Failed to send message: {e}")
+        return False
+
+def discover_receiver():
+    """Find a receiver (the one cached in flash first), returns its MAC (added as a peer)."""
+    print("Looking for a receiver...")
+    mac, channel, load = prober.find()
+    load = "cached" if load is None else load
+    print(f"Receiver found: {ubinascii.hexlify(mac, ':').decode()} on channel {channel}, load {load}")
+    print(f"Pairing took {prober.last_pairing_ms} ms")
+    return mac
 
-# Register ESP-NOW callback
-esp_now.irq(espnow_callback)
+def nap(ms):
+    """Wait ms between sends, sleeping the CPU in low power mode."""
+    if sender is not None:
+        if not LOW_POWER_MODE:
+            sender.wait(ms)  # keeps handling acks and retransmits
+            return
+        sender.flush(RETRANSMIT_TIMEOUT_MS * (RETRANSMIT_RETRIES + 1))
+    if not LOW_POWER_MODE:
+        time.sleep_ms(ms)
+    elif DEEP_SLEEP:
+        # Execution restarts from the top on wake, receiver and sequence
+        # number come back from RTC memory
+        machine.deepsleep(ms)
+    else:
+        machine.lightsleep(ms)
 
-# Receiver Detection Loop
-print("Listening for receiver broadcasts...")
-while receiver_mac is None:
-    if message_received:
-        message_received = False
+def low_power_loop():
+    """Send, sleep, repeat. Looks for a receiver again if sends stop being acknowledged."""
+    global receiver_mac, misses
+    print(f"Low power mode: {'deepsleep' if DEEP_SLEEP else 'lightsleep'} between sends.")
+    while True:
+        misses = 0 if send_message() else misses + 1
+        if misses >= PAIRING_MAX_MISSES:
+            print("Receiver is not acknowledging, looking for a receiver again.")
+            rtc_pairing.clear()
+            prober.forget()
+            esp_now.del_peer(receiver_mac)
+            receiver_mac = discover_receiver()
+            misses = 0
+        rtc_pairing.save(receiver_mac, wlan.config("channel"), sequence, misses)
+        nap(MESSAGE_SEND_INTERVAL * 1000)
+
+# Pairing and the send loop only run as the main script, importing it (the
+# benchmarks do) just defines the functions above
+if __name__ == "__main__":
+    # Receiver Detection, skipped when waking from sleep with the receiver
+    # still in RTC memory
+    cached = rtc_pairing.load() if LOW_POWER_MODE else None
+    if cached:
+        receiver_mac, channel, sequence, misses = cached
+        wlan.config(channel=channel)
+        esp_now.add_peer(receiver_mac)
+        print(f"Receiver {ubinascii.hexlify(receiver_mac, ':').decode()} on channel {channel} from RTC memory")
+    else:
+        receiver_mac = discover_receiver()
+        # Random start after a cold boot so the receiver doesn't take the first
+        # frames for duplicates of the ones sent before the reboot
+        sequence = urandom.getrandbits(16) // MACHINE_TYPE_EVERY * MACHINE_TYPE_EVERY
+    boot.mark("paired")
+
+    # Main Messaging Loop
+    if BATCH_MODE and BINARY_FRAMES:
+        # Leave room for the text and machine type TLVs
+        samples = SampleBuffer(BATCH_MAX_SAMPLES, BATCH_MAX_AGE_MS,
+                               len(psgframe.encode_tlv(psgframe.T_TEXT, BATCH_MESSAGE))
+                               + len(psgframe.encode_tlv(psgframe.T_MACHINE, MACHINE_TYPE)))
+        print(f"Batch mode: up to {samples.capacity} samples per frame.")
+        # Low power mode only lightsleeps here, deepsleep would lose the buffer
+        if LOW_POWER_MODE and DEEP_SLEEP:
+            print("Batch mode: lightsleep instead of DEEP_SLEEP, deepsleep would lose the buffered samples.")
+        DEEP_SLEEP = False
         try:
-            # Attempt to receive message from ESP-NOW
-            mac, ssid = esp_now.recv()
-            mac_address = ubinascii.hexlify(mac, ":").decode()
-            
-            # Verify SSID
-            if CTSSID in ssid:
-                receiver_mac = mac
-                esp_now.add_peer(receiver_mac)
-                print(f"Receiver found: {mac_address} with SSID '{ssid}'")
-                print("Receiver added as a peer for communication.")
-        except Exception as e:
-            print("Failed to process broadcast message:", e)
-    time.sleep(RECEIVER_CHECK_INTERVAL)
-
-# Main Messaging Loop
-print("Transmitter is now actively sending messages to the receiver.")
-while True:
-    send_message()
-    time.sleep(MESSAGE_SEND_INTERVAL)
+            while True:
+                take_sample()
+                nap(SAMPLE_INTERVAL_MS)
+        finally:
+            send_batch()  # don't lose buffered samples on shutdown
+            if sender is not None:
+                sender.flush()
+
+    print("Transmitter is now actively sending messages to the receiver.")
+    if LOW_POWER_MODE:
+        low_power_loop()
+    try:
+        while True:
+            send_message()
+            nap(MESSAGE_SEND_INTERVAL * 1000)
+    finally:
+        if sender is not None:
+            sender.flush()
+            print("Delivery:", sender.stats())